@@ -0,0 +1,265 @@
+"""Bounded caches with expiring entries."""
+
+from __future__ import absolute_import
+
+from builtins import object
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+import collections
+
+import pad.stats
+
+
+def get_body_key(msg):
+    """Get a key that identifies the body of the message, for caching
+    the results that depend only on it, like the Pyzor digest or the
+    Razor signatures.
+
+    The key covers the body and the headers used to decode it.
+    """
+    key = hashlib.sha1()
+    for header in ("Content-Type", "Content-Transfer-Encoding"):
+        key.update(str(msg.msg.get(header, "")).encode("utf8", "ignore"))
+    body = msg.raw_msg.partition("\n\n")[2]
+    key.update(body.encode("utf8", "ignore"))
+    return key.hexdigest()
+
+
+class TTLCache(object):
+    """A bounded cache where every entry expires after a number
+    of seconds. When the cache is full the least recently used
+    entry is discarded.
+
+    Hits and misses are recorded in `pad.stats` under the name
+    of the cache.
+    """
+
+    def __init__(self, name, max_size=10000, ttl=None):
+        """
+        :param name: The name used when recording the statistics.
+        :param max_size: The maximum number of entries stored, if
+          set to 0 the cache is disabled.
+        :param ttl: Default number of seconds the entries are kept,
+          None for no expiration.
+        """
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._get(key, time.time()) is not None
+
+    def _get(self, key, now):
+        """Get the (expiration, value) for this key. Expired entries
+        are removed and None is returned.
+        """
+        try:
+            expires, value = self._data.pop(key)
+        except KeyError:
+            return None
+        if expires is not None and expires <= now:
+            return None
+        # Move the key at the end to mark it as recently used.
+        self._data[key] = (expires, value)
+        return expires, value
+
+    def get(self, key, default=None):
+        """Return the value stored for this key, or the default
+        if it's not found or it has expired.
+        """
+        with self._lock:
+            entry = self._get(key, time.time())
+        if entry is None:
+            pad.stats.incr("cache_requests_total", cache=self.name,
+                           result="miss")
+            return default
+        pad.stats.incr("cache_requests_total", cache=self.name, result="hit")
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """Store the value for this key. If the `ttl` is not
+        specified then the default one is used.
+        """
+        if self.max_size <= 0:
+            return
+        if ttl is None:
+            ttl = self.ttl
+        if ttl is not None and ttl <= 0:
+            return
+        expires = None if ttl is None else time.time() + ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (expires, value)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                pad.stats.incr("cache_evictions_total", cache=self.name)
+
+    def invalidate(self, key):
+        """Remove the entry for this key, if any."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all the entries."""
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteCache(object):
+    """A cache stored in a SQLite database in WAL mode, that can be
+    shared by multiple processes on the same machine.
+
+    Keys and values must be JSON serializable. Entries expire the
+    same way as in `TTLCache`, and when the cache grows over the
+    maximum size the entries closest to expiring are discarded.
+
+    Any error from the database is logged and handled as a miss, so
+    the cache never breaks the callers.
+    """
+    # Remove the expired entries after this many writes.
+    prune_interval = 1000
+
+    def __init__(self, name, path, max_size=100000, ttl=None, timeout=0.1):
+        """
+        :param name: The name used when recording the statistics.
+        :param path: The path to the database file.
+        :param max_size: The maximum number of entries stored, if
+          set to 0 the cache is disabled.
+        :param ttl: Default number of seconds the entries are kept,
+          None for no expiration.
+        :param timeout: Seconds to wait for a locked database.
+        """
+        self.log = logging.getLogger("pad-logger")
+        self.name = name
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timeout = timeout
+        self._conn = None
+        self._conn_pid = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Get the connection for the current process. Connections
+        cannot be shared after fork.
+        """
+        pid = os.getpid()
+        if self._conn is not None and self._conn_pid == pid:
+            return self._conn
+        conn = sqlite3.connect(self.path, timeout=self.timeout,
+                               isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache ("
+                     "key TEXT PRIMARY KEY, expires REAL, value TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires "
+                     "ON cache (expires)")
+        self._conn = conn
+        self._conn_pid = pid
+        return conn
+
+    def _execute(self, *statements):
+        """Execute the (query, args) statements and return the rows
+        of the last one.
+        """
+        with self._lock:
+            conn = self._connect()
+            for query, args in statements:
+                cursor = conn.execute(query, args)
+            return cursor.fetchall()
+
+    def __len__(self):
+        try:
+            return self._execute(("SELECT COUNT(*) FROM cache", ()))[0][0]
+        except sqlite3.Error as e:
+            self.log.warning("Unable to read cache %s: %s", self.path, e)
+            return 0
+
+    def __contains__(self, key):
+        return self._get(key) is not None
+
+    def _get(self, key):
+        """Get the value stored for this key, or None."""
+        try:
+            rows = self._execute(("SELECT value FROM cache WHERE key = ? AND "
+                                  "(expires IS NULL OR expires > ?)",
+                                  (json.dumps(key), time.time())))
+        except sqlite3.Error as e:
+            self.log.warning("Unable to read cache %s: %s", self.path, e)
+            return None
+        if not rows:
+            return None
+        return json.loads(rows[0][0])
+
+    def get(self, key, default=None):
+        """Return the value stored for this key, or the default
+        if it's not found or it has expired.
+        """
+        value = self._get(key)
+        if value is None:
+            pad.stats.incr("cache_requests_total", cache=self.name,
+                           result="miss")
+            return default
+        pad.stats.incr("cache_requests_total", cache=self.name, result="hit")
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store the value for this key. If the `ttl` is not
+        specified then the default one is used.
+        """
+        if self.max_size <= 0:
+            return
+        if ttl is None:
+            ttl = self.ttl
+        if ttl is not None and ttl <= 0:
+            return
+        expires = None if ttl is None else time.time() + ttl
+        try:
+            self._execute(("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)",
+                           (json.dumps(key), expires, json.dumps(value))))
+            self._writes += 1
+            if self._writes >= self.prune_interval:
+                self._writes = 0
+                self.prune()
+        except sqlite3.Error as e:
+            self.log.warning("Unable to write cache %s: %s", self.path, e)
+
+    def prune(self):
+        """Remove the expired entries and enforce the maximum
+        size of the cache.
+        """
+        self._execute(
+            ("DELETE FROM cache WHERE expires <= ?", (time.time(),)),
+            ("DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+             "ORDER BY expires IS NULL, expires LIMIT MAX(0, "
+             "(SELECT COUNT(*) FROM cache) - ?))", (self.max_size,)),
+        )
+
+    def invalidate(self, key):
+        """Remove the entry for this key, if any."""
+        try:
+            self._execute(("DELETE FROM cache WHERE key = ?",
+                           (json.dumps(key),)))
+        except sqlite3.Error as e:
+            self.log.warning("Unable to write cache %s: %s", self.path, e)
+
+    def clear(self):
+        """Remove all the entries."""
+        try:
+            self._execute(("DELETE FROM cache", ()))
+        except sqlite3.Error as e:
+            self.log.warning("Unable to write cache %s: %s", self.path, e)
@@ -182,7 +182,19 @@ class PADConf(Conf):
         "dns_test_interval": ("str", "600"),
         "dns_options": ("str", "norotate, nodns0x20, edns=4096"),
         "dns_query_restriction": ("append", []),
+        "dns_cache_size": ("int", 10000),
+        "dns_cache_min_ttl": ("int", 0),
+        "dns_cache_max_ttl": ("int", 3600),
+        "dns_cache_negative_ttl": ("int", 300),
+        "dns_shared_cache_path": ("str", ""),
+        "dns_shared_cache_size": ("int", 100000),
         "autolearn": ("bool", False),
         "training": ("bool", False),
+        "report_spool_path": ("str", ""),
+        "report_spool_batch_size": ("int", 50),
+        "report_spool_max_attempts": ("int", 5),
+        "report_spool_retry_delay": ("float", 30.0),
         "user_config": ("bool", True),
+        "compile_match": ("bool", False),
+        "compile_match_path": ("str", ""),
     }
@@ -21,6 +21,7 @@ import collections
 
 
 import pad.conf
+import pad.cache
 import pad.errors
 import pad.networks
 import pad.rules.base
@@ -39,6 +40,10 @@ DSN_SERVER_RE = re.compile(r"""
 )?$
 """, re.I | re.S | re.M | re.X)
 
+# The hooks called for every message.
+MESSAGE_HOOKS = ("check_start", "extract_metadata", "parsed_metadata",
+                 "match_start", "check_end")
+
 
 class _Context(object):
     """Base class for all context types."""
@@ -108,6 +113,8 @@ class GlobalContext(_Context):
      * plugins - the actual code loaded
      * eval_rules - the methods for the "eval" rules currently
        defined
+     * eval_rule_args - the converters for the arguments of the
+       "eval" rules, see `pad.rules.eval_.EvalRule.convert_args`
      * cmds - additional RULES that are handled by plugins.
        This maps the rule type (e.g. "body") to the Rule class.
        These must inherit from pad.rules.base.BaseRule.
@@ -120,11 +127,15 @@ class GlobalContext(_Context):
         self.paranoid = paranoid
         self.ignore_unknown = ignore_unknown
         self.eval_rules = dict()
+        self.eval_rule_args = dict()
         self.cmds = dict()
         self.dns = pad.dns_interface.DNSInterface()
         self.networks = pad.networks.NetworkList()
         self.conf = pad.conf.PADConf(self)
         self.username = getpass.getuser()
+        # Maps the message hooks to the methods of the plugins that
+        # implement them, see `_build_hooks`.
+        self.hooks = dict()
 
     def err(self, *args, **kwargs):
         """Log a error according to the paranoid and
@@ -178,6 +189,7 @@ class GlobalContext(_Context):
         self.log.info("Plugin %s loaded", name)
         # Store the plugin instance in the dictionary
         self.plugins[class_name] = plugin
+        self.hooks.clear()
 
     def _load_eval_rules(self, plugin, class_name):
         """Get all the eval rules defined by this plugin and store
@@ -192,6 +204,9 @@ class GlobalContext(_Context):
                 raise pad.errors.PluginLoadError("Undefined eval rule %s in "
                                                  "%s" % (rule, class_name))
             self.eval_rules[rule] = eval_rule
+            self.eval_rule_args.pop(rule, None)
+            if plugin.eval_rule_args and rule in plugin.eval_rule_args:
+                self.eval_rule_args[rule] = plugin.eval_rule_args[rule]
 
     def _load_cmds(self, plugin, class_name):
         """Load any new RULES that are handled by this plugin. These
@@ -217,13 +232,87 @@ class GlobalContext(_Context):
             raise pad.errors.PluginLoadError("Plugin %s not loaded." % name)
 
         plugin = self.plugins[name]
+        plugin.finish()
         # Delete any defined rules
         for rule in plugin.eval_rules:
             self.eval_rules.pop(rule, None)
+            self.eval_rule_args.pop(rule, None)
         for rule_type in plugin.cmds or ():
             self.cmds.pop(rule_type, None)
         self.pop_plugin_data(name)
         del self.plugins[name]
+        self.hooks.clear()
+
+    @staticmethod
+    def get_used_eval_rules(ruleset):
+        """Get the names of the eval rules used by the checked rules,
+        directly or in meta rules.
+        """
+        used = set()
+        seen = set()
+        rules = list(ruleset.checked.values())
+        while rules:
+            rule = rules.pop()
+            if rule.name in seen:
+                continue
+            seen.add(rule.name)
+            eval_rule_name = getattr(rule, "eval_rule_name", None)
+            if eval_rule_name is not None:
+                used.add(eval_rule_name)
+            for subrule_name in getattr(rule, "subrules", ()):
+                try:
+                    rules.append(ruleset.get_rule(subrule_name))
+                except KeyError:
+                    continue
+        return used
+
+    @staticmethod
+    def _overrides_hook(plugin, hook_name):
+        """Check if the plugin does anything in this hook, most plugins
+        keep the no-op methods from `BasePlugin`.
+        """
+        method = getattr(type(plugin), hook_name, None)
+        if method is None:
+            return True
+        base_method = getattr(pad.plugins.base.BasePlugin, hook_name)
+        if (getattr(method, "__func__", method) is not
+                getattr(base_method, "__func__", base_method)):
+            return True
+        # The default check_end closes the database sessions.
+        return hook_name == "check_end" and bool(plugin.dsn_name)
+
+    def _build_hooks(self, ruleset):
+        """Store for every message hook the methods of the plugins
+        that implement it. The plugins whose `hook_eval_rules` are not
+        used by any rule in the ruleset are skipped.
+        """
+        used_eval_rules = self.get_used_eval_rules(ruleset)
+        hooks = dict((hook_name, []) for hook_name in MESSAGE_HOOKS)
+        for name, plugin in self.plugins.items():
+            hook_eval_rules = getattr(type(plugin), "hook_eval_rules", None)
+            unused = (hook_eval_rules is not None and
+                      used_eval_rules.isdisjoint(hook_eval_rules))
+            if unused:
+                self.log.debug("Skipping message hooks of %s, no rule "
+                               "uses them", name)
+            for hook_name in MESSAGE_HOOKS:
+                if unused and hook_name != "check_end":
+                    continue
+                if self._overrides_hook(plugin, hook_name):
+                    hooks[hook_name].append(getattr(plugin, hook_name))
+        self.hooks = dict((hook_name, tuple(methods))
+                          for hook_name, methods in hooks.items())
+
+    def get_hooks(self, hook_name):
+        """Get the methods of the plugins to call for this message
+        hook. All the plugins are used until the ruleset has been
+        initialized.
+        """
+        try:
+            return self.hooks[hook_name]
+        except KeyError:
+            return tuple(getattr(plugin, hook_name)
+                         for plugin in self.plugins.values())
 
     @staticmethod
     def _load_module_py3(path):
@@ -294,6 +383,15 @@ class GlobalContext(_Context):
             self.dns.namerservers = nameservers
             self.dns.port = int(cport)
         self.dns.available = self.conf['dns_available']
+        self.dns.cache.max_size = self.conf["dns_cache_size"]
+        self.dns.cache_min_ttl = self.conf["dns_cache_min_ttl"]
+        self.dns.cache_max_ttl = self.conf["dns_cache_max_ttl"]
+        self.dns.cache_negative_ttl = self.conf["dns_cache_negative_ttl"]
+        if self.conf["dns_shared_cache_path"]:
+            self.dns.shared_cache = pad.cache.SQLiteCache(
+                "dns_shared", self.conf["dns_shared_cache_path"],
+                max_size=self.conf["dns_shared_cache_size"]
+            )
 
     def _add_networks(self):
         for network in self.conf['trusted_networks']:
@@ -313,12 +411,19 @@ class GlobalContext(_Context):
         self.skip_rbl_checks = bool(self.conf['skip_rbl_checks'])
         for plugin in self.plugins.values():
             plugin.finish_parsing_end(ruleset)
+        self._build_hooks(ruleset)
+
+    @_callback_chain
+    def hook_match_start(self, ruleset, msg):
+        """Hook before the message is matched against the rules."""
+        for match_start in self.get_hooks("match_start"):
+            match_start(ruleset, msg)
 
     @_callback_chain
     def hook_check_end(self, ruleset, msg):
         """Hook after the message is checked."""
-        for plugin in self.plugins.values():
-            plugin.check_end(ruleset, msg)
+        for check_end in self.get_hooks("check_end"):
+            check_end(ruleset, msg)
 
     @_callback_chain
     def hook_report(self, msg, spam=True, local=True, remote=True):
@@ -332,6 +437,12 @@ class GlobalContext(_Context):
         for plugin in self.plugins.values():
             plugin.plugin_revoke(msg)
 
+    @_callback_chain
+    def hook_finish(self):
+        """Hook when the plugins are about to be discarded."""
+        for plugin in self.plugins.values():
+            plugin.finish()
+
 
 class MessageContext(_Context):
     """Per-message context."""
@@ -343,17 +454,17 @@ class MessageContext(_Context):
     @_callback_chain
     def _hook_check_start(self):
         """Hook before the message is checked."""
-        for plugin in self.ctxt.plugins.values():
-            plugin.check_start(self)
+        for check_start in self.ctxt.get_hooks("check_start"):
+            check_start(self)
 
     @_callback_chain
     def _hook_extract_metadata(self, payload, text, part):
         """Hook before the message is checked."""
-        for plugin in self.ctxt.plugins.values():
-            plugin.extract_metadata(self, payload, text, part)
+        for extract_metadata in self.ctxt.get_hooks("extract_metadata"):
+            extract_metadata(self, payload, text, part)
 
     @_callback_chain
     def _hook_parsed_metadata(self):
         """Hook before the message is checked."""
-        for plugin in self.ctxt.plugins.values():
-            plugin.parsed_metadata(self)
+        for parsed_metadata in self.ctxt.get_hooks("parsed_metadata"):
+            parsed_metadata(self)
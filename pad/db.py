@@ -0,0 +1,144 @@
+"""Database access shared by the plugins that use SQL storage.
+
+Every process gets its own SQLAlchemy engine, created the first time
+it is used. Engines (and their pooled connections) are never shared
+with the children of a pre-forked server.
+"""
+
+from __future__ import absolute_import
+
+from builtins import object
+
+import os
+import time
+import logging
+
+import pad.lazy
+import pad.stats
+
+# SQLAlchemy is only imported when the first engine is created.
+sqlalchemy = pad.lazy.LazyModule("sqlalchemy", "sqlalchemy.orm",
+                                 "sqlalchemy.util", "sqlalchemy.event")
+
+
+class Database(object):
+    """The engine and sessions of a process for one database.
+
+    Sessions are scoped to the current thread, the same session is
+    returned until `remove_session` is called at the end of the
+    request.
+
+    Connection and query latencies are recorded in `pad.stats` under
+    the `name` of the database.
+    """
+
+    # Number of compiled statements kept by every engine.
+    compiled_cache_size = 100
+
+    def __init__(self, name, connect_string, pool_size=5, max_overflow=10,
+                 pool_recycle=3600, pool_timeout=30.0):
+        """
+        :param name: The name used when recording the statistics.
+        :param connect_string: The SQLAlchemy connection URL.
+        :param pool_size: The number of connections kept open by
+          every process.
+        :param max_overflow: The number of connections that can be
+          opened over the `pool_size` when all are in use.
+        :param pool_recycle: Replace the connections older than this
+          number of seconds, -1 to never replace them.
+        :param pool_timeout: The number of seconds to wait for a free
+          connection.
+        """
+        self.log = logging.getLogger("pad-logger")
+        self.name = name
+        self.connect_string = connect_string
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.pool_recycle = pool_recycle
+        self.pool_timeout = pool_timeout
+        self._engine = None
+        self._sessions = None
+        self._pid = None
+
+    def _create_engine(self):
+        """Create a new engine and register the listeners for the
+        statistics.
+        """
+        try:
+            engine = sqlalchemy.create_engine(
+                self.connect_string, pool_size=self.pool_size,
+                max_overflow=self.max_overflow,
+                pool_recycle=self.pool_recycle,
+                pool_timeout=self.pool_timeout)
+        except TypeError:
+            # Some dialects (e.g. sqlite) don't use a QueuePool and
+            # reject the size options.
+            self.log.debug("Connection pool options not supported for %s",
+                           self.name)
+            engine = sqlalchemy.create_engine(self.connect_string,
+                                              pool_recycle=self.pool_recycle)
+        listen = sqlalchemy.event.listen
+        listen(engine, "do_connect", self._on_connect)
+        listen(engine, "before_cursor_execute", self._before_execute)
+        listen(engine, "after_cursor_execute", self._after_execute)
+        listen(engine, "handle_error", self._on_error)
+        # Statements that are built once (like baked queries) are only
+        # compiled once.
+        return engine.execution_options(
+            compiled_cache=sqlalchemy.util.LRUCache(self.compiled_cache_size))
+
+    def _check_process(self):
+        """Create the engine if this process doesn't have one yet."""
+        pid = os.getpid()
+        if self._engine is None or self._pid != pid:
+            # Engines inherited from the parent process are dropped
+            # without being disposed, the connections still belong to
+            # the parent.
+            self._engine = self._create_engine()
+            self._sessions = sqlalchemy.orm.scoped_session(
+                sqlalchemy.orm.sessionmaker(bind=self._engine))
+            self._pid = pid
+
+    @property
+    def engine(self):
+        """The engine of the current process."""
+        self._check_process()
+        return self._engine
+
+    def get_session(self):
+        """Get the SQLAlchemy session for the current request."""
+        self._check_process()
+        return self._sessions()
+
+    def remove_session(self):
+        """Close the session of the current request, the connection
+        is returned to the pool.
+        """
+        if self._sessions is not None and self._pid == os.getpid():
+            self._sessions.remove()
+
+    def _on_connect(self, dialect, conn_rec, cargs, cparams):
+        start = time.time()
+        connection = dialect.connect(*cargs, **cparams)
+        pad.stats.incr("db_connections_total", dsn=self.name)
+        pad.stats.observe("db_connect_seconds", time.time() - start,
+                          dsn=self.name)
+        return connection
+
+    @staticmethod
+    def _before_execute(conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info.setdefault("query_start", []).append(time.time())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        start = conn.info["query_start"].pop()
+        pad.stats.observe("db_query_seconds", time.time() - start,
+                          dsn=self.name)
+
+    def _on_error(self, context):
+        if context.connection is not None:
+            starts = context.connection.info.get("query_start")
+            if starts:
+                starts.pop()
+        pad.stats.incr("db_errors_total", dsn=self.name)
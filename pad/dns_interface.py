@@ -1,18 +1,46 @@
 """ DNS wrapper that takes the user options into consideration
 when performing queries"""
 
+import os
+import time
 import random
 import struct
 import logging
+import weakref
 import datetime
+import threading
+import multiprocessing
 
 import dns
+import dns.rdata
 import dns.resolver
+import dns.rdatatype
 import dns.reversename
 
+import pad.cache
+import pad.stats
+import pad.errors
+
+
+def _probe_loop(ref):
+    """Periodically test the DNS availability until the interface
+    is no longer used.
+    """
+    while True:
+        dns_interface = ref()
+        if dns_interface is None:
+            return
+        dns_interface.probe_if_due()
+        interval = dns_interface.probe_check_interval
+        del dns_interface
+        time.sleep(interval)
+
 
 class DNSInterface(object):
     """Interface for various dns related actions"""
+    # Number of seconds between two checks of whether a new
+    # availability test is due.
+    probe_check_interval = 1.0
 
     test_qnames = [
         "adelphia.net",
@@ -41,12 +69,28 @@ class DNSInterface(object):
         self.log = logging.getLogger("pad-logger")
         self._resolver = dns.resolver.Resolver()
         self.query_restrictions = {}
-        self.next_test = datetime.datetime.now()
         self._test_interval = datetime.timedelta(seconds=600)
         self.test = False
         self._resolver.edns = 0
         self._resolver.rotate = False
-        self._available = True
+        # The availability is tested in a background thread, the
+        # result and the time of the next test are shared with any
+        # process forked after this.
+        self._available = multiprocessing.Value("b", True)
+        self._next_test = multiprocessing.Value("d", 0.0)
+        self._unavailable_since = multiprocessing.Value("d", 0.0)
+        self._prober_pid = None
+        self._prober_lock = threading.Lock()
+        # Answers are cached by (qname, qtype) for their TTL, clamped
+        # between these values. The negative TTL is used for
+        # NXDOMAIN and NoAnswer results when no SOA record is found.
+        self.cache = pad.cache.TTLCache("dns")
+        # Optional cache shared with the other processes, see
+        # pad.cache.SQLiteCache.
+        self.shared_cache = None
+        self.cache_min_ttl = 0
+        self.cache_max_ttl = 3600
+        self.cache_negative_ttl = 300
 
     @property
     def port(self):
@@ -108,28 +152,85 @@ class DNSInterface(object):
     @property
     def available(self):
         """Checks whether the dns is available. Depending on how it is
-        configured a test may be performed to determine the result"""
-        if self.test and self.next_test <= datetime.datetime.now():
-            for qname in random.sample(
-                    set(self.test_qnames), min(3, len(self.test_qnames))):
-                if self._query(qname, "A"):
-                    self._available = True
-                    break
-            else:
-                self._available = False
-            self.next_test = datetime.datetime.now() + self.test_interval
-
-        return self._available
+        configured a test is periodically performed in the background
+        to determine the result"""
+        if self.test:
+            self._start_prober()
+        return bool(self._available.value)
 
     @available.setter
     def available(self, value):
-        self._available = value == "yes"
+        # Consider the DNS available until the first test fails.
+        self._available.value = value == "yes" or value.startswith("test")
         if value.startswith("test"):
             self.test = True
             if ":" in value:
                 test_servers = value.split(":")[1].split()
                 self.test_qnames = test_servers
 
+    def _start_prober(self):
+        """Start the thread that tests the availability for the
+        current process, if it's not already running.
+        """
+        pid = os.getpid()
+        if self._prober_pid == pid:
+            return
+        with self._prober_lock:
+            if self._prober_pid == pid:
+                return
+            self._prober_pid = pid
+            thread = threading.Thread(target=_probe_loop,
+                                      args=(weakref.ref(self),),
+                                      name="dns-probe")
+            thread.daemon = True
+            thread.start()
+
+    def probe_if_due(self):
+        """Test the availability if the `test_interval` has passed
+        since the last test performed by any process.
+
+        :return: True if the test was performed.
+        """
+        with self._next_test.get_lock():
+            now = time.time()
+            if self._next_test.value > now:
+                return False
+            self._next_test.value = (now +
+                                     self.test_interval.total_seconds())
+        self.probe()
+        return True
+
+    def probe(self):
+        """Test the availability by querying up to three of the
+        test domains. If any of them gives a response then the DNS
+        is considered available.
+
+        :return: True if the DNS is available.
+        """
+        start = time.time()
+        qnames = sorted(set(self.test_qnames))
+        for qname in random.sample(qnames, min(3, len(qnames))):
+            if self._query(qname, "A"):
+                available = True
+                break
+        else:
+            available = False
+        now = time.time()
+        pad.stats.observe("dns_probe_seconds", now - start)
+        pad.stats.incr("dns_probes_total",
+                       result="available" if available else "unavailable")
+        with self._unavailable_since.get_lock():
+            since = self._unavailable_since.value
+            if since:
+                pad.stats.incr("dns_unavailable_seconds_total", now - since)
+            elif not available:
+                self.log.warning("DNS is not available")
+            if available and since:
+                self.log.info("DNS is available again")
+            self._unavailable_since.value = 0.0 if available else now
+            self._available.value = available
+        return available
+
     def is_query_restricted(self, qname):
         """Checks whether the qname is restricted by the dns_query_restriction
         option if the qname or one of it's parent domains matches an entry in
@@ -152,40 +253,140 @@ class DNSInterface(object):
             except IndexError:
                 return False
 
-    def query(self, qname, qtype="A"):
+    def query(self, qname, qtype="A", strict=False):
         """This method should be used for any DNS queries.
 
         :param qname: The DNS question.
         :param qtype: The DNS query type.
+        :param strict: If True, raise `pad.errors.DNSError` when the
+          query is restricted, the DNS is not available or the query
+          fails (timeout, no nameservers) instead of returning an empty
+          result.
         :return: The result of the DNS query.
         """
 
         if self.is_query_restricted(qname):
             self.log.debug("Querying %s is restricted", qname)
+            pad.stats.incr("dns_queries_total", result="restricted")
+            if strict:
+                raise pad.errors.DNSError("Querying %s is restricted" %
+                                          qname)
             return []
 
         if not self.available:
             self.log.debug("DNS querying is not available")
+            pad.stats.incr("dns_queries_total", result="unavailable")
+            if strict:
+                raise pad.errors.DNSError("DNS querying is not available")
             return []
 
+        key = (qname, qtype)
+        result = self.cache.get(key)
+        if result is not None:
+            self.log.debug("Got cached result for %s %s", qname, qtype)
+            return result
+        result = self._get_shared(key)
+        if result is not None:
+            self.log.debug("Got shared cached result for %s %s", qname,
+                           qtype)
+            return result
+
         self.log.debug("Querying %s for %s record", qname, qtype)
-        return self._query(qname, qtype)
+        result, ttl = self._resolve(qname, qtype)
+        if result is None:
+            if strict:
+                raise pad.errors.DNSError("Failed to resolve %s (%s)" %
+                                          (qname, qtype))
+            return []
+        if ttl is not None:
+            ttl = max(self.cache_min_ttl, min(ttl, self.cache_max_ttl))
+            self.cache.set(key, result, ttl)
+            self._set_shared(key, result, ttl)
+        return result
+
+    def _get_shared(self, key):
+        """Get the result from the shared cache and store it in
+        the local cache for the remaining TTL.
+        """
+        if self.shared_cache is None:
+            return None
+        entry = self.shared_cache.get(list(key))
+        if entry is None:
+            return None
+        try:
+            result = [dns.rdata.from_text(rdclass, rdtype, text)
+                      for rdclass, rdtype, text in entry["records"]]
+        except (dns.exception.DNSException, ValueError, KeyError) as e:
+            self.log.info("Invalid shared cache entry for %s: %s", key, e)
+            return None
+        self.cache.set(key, result, entry["expires"] - time.time())
+        return result
+
+    def _set_shared(self, key, result, ttl):
+        """Store the result in the shared cache."""
+        if self.shared_cache is None:
+            return
+        records = [(rdata.rdclass, rdata.rdtype, rdata.to_text())
+                   for rdata in result]
+        self.shared_cache.set(list(key), {"expires": time.time() + ttl,
+                                          "records": records}, ttl)
 
     def _query(self, qname, qtype):
+        result = self._resolve(qname, qtype)[0]
+        return [] if result is None else result
+
+    def _resolve(self, qname, qtype):
+        """Perform the DNS query.
+
+        :return: A tuple with the result and the number of seconds
+          the result can be cached for, or None if the result should
+          not be cached. The result is None if the query failed.
+        """
         self.log.debug("Querying %s %s", qname, qtype)
         if qtype == "PTR":
             qname = dns.reversename.from_address(qname)
         try:
             result = self._resolver.query(qname, qtype)
             self.log.debug("Got %s for %s %s", result, qname, qtype)
-            return result
-        except (dns.resolver.NoAnswer, dns.resolver.NoNameservers,
-                dns.resolver.NXDOMAIN, dns.exception.Timeout) as e:
+            pad.stats.incr("dns_queries_total", result="answer")
+            try:
+                ttl = int(result.rrset.ttl)
+            except (AttributeError, TypeError, ValueError):
+                ttl = None
+            return result, ttl
+        except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN) as e:
             self.log.warn("Failed to resolve %s (%s): %s", qname, qtype, e)
-            return []
+            pad.stats.incr("dns_queries_total", result="failed")
+            return [], self._get_negative_ttl(e)
+        except (dns.resolver.NoNameservers, dns.exception.Timeout) as e:
+            self.log.warn("Failed to resolve %s (%s): %s", qname, qtype, e)
+            pad.stats.incr("dns_queries_total", result="failed")
+            return None, None
         except (ValueError, IndexError, struct.error) as e:
             self.log.info("Invalid DNS entry %s (%s): %s", qname, qtype, e)
-            return []
+            pad.stats.incr("dns_queries_total", result="invalid")
+            return [], None
+
+    def _get_negative_ttl(self, error):
+        """Get the number of seconds a NXDOMAIN or NoAnswer result
+        can be cached for from the SOA record in the authority
+        section of the response (RFC 2308).
+        """
+        kwargs = getattr(error, "kwargs", None) or {}
+        responses = []
+        if kwargs.get("response") is not None:
+            responses.append(kwargs["response"])
+        if kwargs.get("responses"):
+            responses.extend(kwargs["responses"].values())
+        for response in responses:
+            for rrset in getattr(response, "authority", ()):
+                if rrset.rdtype != dns.rdatatype.SOA:
+                    continue
+                try:
+                    return min(rrset.ttl, rrset[0].minimum)
+                except (IndexError, AttributeError):
+                    continue
+        return self.cache_negative_ttl
 
     def reverse_ip(self, ip):
         reversed_ip = str(dns.reversename.from_address(ip.exploded))
@@ -82,6 +82,12 @@ class StopProcessing(Exception):
     """Stop processing the current message."""
 
 
+class DNSError(PADError):
+    """The DNS query could not be performed, its result is
+    unknown.
+    """
+
+
 class ProtocolError(PADError):
     """Something went wrong in the communication
     protocol.
@@ -0,0 +1,75 @@
+"""Import the third-party modules only when they are first used.
+
+Most dependencies are only needed by a few rules, importing them when
+the plugins are loaded slows down the startup of every command, even
+when none of these rules are used.
+"""
+
+from __future__ import absolute_import
+
+from builtins import object
+
+import sys
+import importlib
+
+try:
+    from importlib.util import find_spec
+except ImportError:
+    find_spec = None
+
+
+def is_available(name):
+    """Check if the top-level module can be imported, without
+    actually importing it.
+    """
+    if name in sys.modules:
+        return True
+    if find_spec is None:
+        import imp
+        try:
+            imp.find_module(name)
+        except ImportError:
+            return False
+        return True
+    try:
+        return find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class LazyModule(object):
+    """Proxy for a module that is imported the first time one of its
+    attributes is used. The `submodules` are imported with it, so
+    they are available as attributes::
+
+        PyPDF2 = pad.lazy.LazyModule("PyPDF2", "PyPDF2.utils")
+        PyPDF2.utils.PdfReadError
+    """
+
+    def __init__(self, name, *submodules):
+        self.__dict__["_name"] = name
+        self.__dict__["_submodules"] = submodules
+        self.__dict__["_module"] = None
+
+    @property
+    def loaded(self):
+        """True if the module has already been imported."""
+        return self._module is not None
+
+    def load(self):
+        """Import the module now and return it."""
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            for submodule in self._submodules:
+                importlib.import_module(submodule)
+            self.__dict__["_module"] = module
+        return self._module
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return "<LazyModule %r%s>" % (self._name,
+                                      "" if self.loaded else " (not loaded)")
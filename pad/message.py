@@ -7,6 +7,7 @@ from builtins import dict
 from builtins import object
 
 import re
+import sys
 import email
 import functools
 import ipaddress
@@ -18,12 +19,12 @@ import email.mime.base
 import email.mime.text
 import email.mime.multipart
 
-from future.utils import PY3
-
 import pad
 import pad.context
 from pad.received_parser import ReceivedParser
 
+PY3 = sys.version_info[0] == 3
+
 URL_RE = re.compile(r"""
 (
     \b                      # the preceding character must not be alphanumeric
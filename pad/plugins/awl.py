@@ -16,19 +16,28 @@ CREATE TABLE `awl` (
 from __future__ import absolute_import
 
 from builtins import str
+from builtins import dict
+from builtins import object
 
 import re
+import time
 import email
 import getpass
+import threading
 import ipaddress
 
 from sqlalchemy import Column
+from sqlalchemy import bindparam
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext import baked
 from sqlalchemy.types import Float
 from sqlalchemy.types import String
 from sqlalchemy.types import Integer
 from sqlalchemy.sql.schema import PrimaryKeyConstraint
 from sqlalchemy.ext.declarative.api import declarative_base
 
+import pad.stats
+import pad.cache
 import pad.plugins.base
 
 Base = declarative_base()
@@ -52,6 +61,146 @@ class AWL(Base):
         PrimaryKeyConstraint("username", "email", "signedby", "ip"),)
 
 
+# The queries used for every message are only built once.
+bakery = baked.bakery()
+
+ENTRY_QUERY = bakery(lambda session: session.query(AWL))
+ENTRY_QUERY += lambda query: query.filter(
+    AWL.username == bindparam("username"),
+    AWL.email == bindparam("email"),
+    AWL.signedby == bindparam("signedby"),
+    AWL.ip.in_([bindparam("ip"), "none"]))
+
+UPDATE_ENTRY = AWL.__table__.update().where(
+    (AWL.__table__.c.username == bindparam("b_username")) &
+    (AWL.__table__.c.email == bindparam("b_email")) &
+    (AWL.__table__.c.signedby == bindparam("b_signedby")) &
+    (AWL.__table__.c.ip == bindparam("b_ip"))
+).values(count=AWL.__table__.c.count + bindparam("b_count"),
+         totscore=AWL.__table__.c.totscore + bindparam("b_totscore"))
+
+
+class UpdateBuffer(object):
+    """Hold the AWL updates in memory until they are written to the
+    database. The updates for the same entry are coalesced in a single
+    (count, totscore) increment.
+    """
+
+    def __init__(self, max_size=100, interval=10.0, max_attempts=3,
+                 max_pending=10000):
+        """
+        :param max_size: Flush after this many entries are updated, if
+          set to 0 or less every update is written immediately.
+        :param interval: Maximum number of seconds the updates are
+          kept in memory.
+        :param max_attempts: Drop the updates of an entry after they
+          could not be written this many times.
+        :param max_pending: Maximum number of entries kept in memory,
+          the updates for other entries are dropped until the buffer
+          is flushed.
+        """
+        self.max_size = max_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.max_pending = max_pending
+        self._updates = dict()
+        self._attempts = dict()
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def __len__(self):
+        return len(self._updates)
+
+    def add(self, key, count, totscore):
+        """Add the increments for the entry with this key.
+
+        :return: False if the buffer is full and the increments were
+          dropped, True otherwise.
+        """
+        with self._lock:
+            try:
+                update = self._updates[key]
+            except KeyError:
+                if len(self._updates) >= self.max_pending:
+                    return False
+                update = self._updates[key] = [0, 0.0]
+            update[0] += count
+            update[1] += totscore
+        return True
+
+    def retry(self, key, count, totscore):
+        """Add back the increments that could not be written for
+        the entry with this key.
+
+        :return: False if the increments were dropped, because the
+          entry already failed `max_attempts` times or the buffer is
+          full, True otherwise.
+        """
+        with self._lock:
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts >= self.max_attempts:
+                self._attempts.pop(key, None)
+                return False
+            self._attempts[key] = attempts
+        if self.add(key, count, totscore):
+            return True
+        with self._lock:
+            self._attempts.pop(key, None)
+        return False
+
+    def written(self, keys):
+        """Forget the failed attempts of the entries that were
+        written.
+        """
+        with self._lock:
+            for key in keys:
+                self._attempts.pop(key, None)
+
+    def get(self, key):
+        """Get the (count, totscore) increments not yet written for
+        this key.
+        """
+        with self._lock:
+            return tuple(self._updates.get(key, (0, 0.0)))
+
+    def is_due(self):
+        """Check if the updates should be written now."""
+        if not self._updates:
+            return False
+        return (len(self._updates) >= self.max_size or
+                time.time() - self._last_flush >= self.interval)
+
+    def schedule(self, flush):
+        """Call `flush` in a background thread after `interval`
+        seconds, unless it's already scheduled. This makes sure the
+        updates are written even if no other entry is updated.
+        """
+        with self._lock:
+            timer = self._timer
+            if (timer is not None and timer.is_alive() and
+                    timer is not threading.current_thread()):
+                return
+            self._timer = threading.Timer(self.interval, flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self):
+        """Cancel the scheduled flush, if any."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+
+    def pop_all(self):
+        """Remove and return all the updates."""
+        with self._lock:
+            updates = self._updates
+            self._updates = dict()
+            self._last_flush = time.time()
+        return updates
+
+
 class AutoWhiteListPlugin(pad.plugins.base.BasePlugin):
     """Reimplementation of the awl spamassassin plugin"""
 
@@ -63,8 +212,45 @@ class AutoWhiteListPlugin(pad.plugins.base.BasePlugin):
         "auto_whitelist_factor": ("float", 0.5),
         "auto_whitelist_ipv4_mask_len": ("int", 16),
         "auto_whitelist_ipv6_mask_len": ("int", 48),
+        "auto_whitelist_cache_size": ("int", 10000),
+        "auto_whitelist_cache_ttl": ("float", 60.0),
+        "auto_whitelist_flush_size": ("int", 100),
+        "auto_whitelist_flush_interval": ("float", 10.0),
+        "auto_whitelist_flush_max_attempts": ("int", 3),
+        "auto_whitelist_max_pending": ("int", 10000),
     }
 
+    def finish_parsing_end(self, ruleset):
+        super(AutoWhiteListPlugin, self).finish_parsing_end(ruleset)
+        self["cache"] = pad.cache.TTLCache(
+            "awl", self["auto_whitelist_cache_size"],
+            self["auto_whitelist_cache_ttl"])
+        self["buffer"] = self._new_buffer()
+
+    def _new_buffer(self):
+        return UpdateBuffer(self["auto_whitelist_flush_size"],
+                            self["auto_whitelist_flush_interval"],
+                            self["auto_whitelist_flush_max_attempts"],
+                            self["auto_whitelist_max_pending"])
+
+    def get_cache(self):
+        """Get the cache of the AWL scores."""
+        try:
+            return self["cache"]
+        except KeyError:
+            self["cache"] = pad.cache.TTLCache(
+                "awl", self["auto_whitelist_cache_size"],
+                self["auto_whitelist_cache_ttl"])
+            return self["cache"]
+
+    def get_buffer(self):
+        """Get the buffer of the AWL updates."""
+        try:
+            return self["buffer"]
+        except KeyError:
+            self["buffer"] = self._new_buffer()
+            return self["buffer"]
+
     def _get_origin_ip(self, msg):
         relays = []
         relays.extend(msg.trusted_relays)
@@ -111,25 +297,27 @@ class AutoWhiteListPlugin(pad.plugins.base.BasePlugin):
         return IPV4SUFFIXRE.sub("", str(network))
 
     def get_entry(self, address, ip, signed_by):
+        """Get the AWL entry for this address. If there is no entry
+        for this IP then the values are taken from the one without an
+        IP, if any.
+        """
         session = self.get_session()
-        result = session.query(AWL).filter(
-                AWL.username == self.ctxt.username,
-                AWL.email == address,
-                AWL.signedby == signed_by,
-                AWL.ip == ip).first()
-
-        if not result:
-            result = session.query(AWL).filter(
-                    AWL.username == self.ctxt.username,
-                    AWL.email == address,
-                    AWL.signedby == signed_by,
-                    AWL.ip == "none").first()
-            if result:
-                result.ip = ip
-
-        session.close()
-
-        if not result:
+        try:
+            results = ENTRY_QUERY(session).params(
+                username=self.ctxt.username, email=address,
+                signedby=signed_by, ip=ip).all()
+        finally:
+            session.close()
+
+        result = None
+        for entry in results:
+            if entry.ip == ip:
+                result = entry
+                break
+            result = entry
+        if result:
+            result.ip = ip
+        else:
             result = AWL()
             result.count = 0
             result.totscore = 0
@@ -139,6 +327,151 @@ class AutoWhiteListPlugin(pad.plugins.base.BasePlugin):
             result.ip = ip
         return result
 
+    def get_scores(self, address, ip, signed_by):
+        """Get the (count, totscore) of the AWL entry.
+
+        The values are cached for `auto_whitelist_cache_ttl` seconds,
+        and include the updates of this process that were not yet
+        written to the database.
+        """
+        key = (self.ctxt.username, address, signed_by, ip)
+        cache = self.get_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            return cached[0], cached[1]
+        entry = self.get_entry(address, ip, signed_by)
+        count, totscore = self.get_buffer().get(key)
+        count += entry.count
+        totscore += entry.totscore
+        expires = None if cache.ttl is None else time.time() + cache.ttl
+        cache.set(key, (count, totscore, expires))
+        return count, totscore
+
+    def update_scores(self, address, ip, signed_by, score):
+        """Add the score to the AWL entry. The update is written to the
+        database later, see `flush`.
+        """
+        key = (self.ctxt.username, address, signed_by, ip)
+        cache = self.get_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            count, totscore, expires = cached
+            # Keep the original expiration, so that the updates of
+            # the other processes are seen within the TTL.
+            ttl = None if expires is None else expires - time.time()
+            if ttl is None or ttl > 0:
+                cache.set(key, (count + 1, totscore + score, expires), ttl)
+        update_buffer = self.get_buffer()
+        if not update_buffer.add(key, 1, score):
+            self.ctxt.log.debug("auto-whitelist: too many pending updates, "
+                                "dropping update for %s", key)
+            pad.stats.incr("awl_dropped_updates_total", reason="full")
+        if update_buffer.is_due():
+            self.flush()
+        else:
+            update_buffer.schedule(self.flush)
+
+    def _write(self, session, key, count, totscore):
+        """Add the increments to the entry with this key. If the
+        entry doesn't exist for this IP it's created from the entry
+        of the address without IP, if any.
+        """
+        username, address, signed_by, ip = key
+        updated = session.execute(UPDATE_ENTRY, {
+            "b_username": username, "b_email": address,
+            "b_signedby": signed_by, "b_ip": ip,
+            "b_count": count, "b_totscore": totscore,
+        }).rowcount
+        if updated:
+            return
+        base = ENTRY_QUERY(session).params(
+            username=username, email=address, signedby=signed_by,
+            ip="none").first()
+        if base:
+            count += base.count
+            totscore += base.totscore
+        session.add(AWL(username=username, email=address,
+                        signedby=signed_by, ip=ip, count=count,
+                        totscore=totscore))
+
+    def flush(self):
+        """Write all the pending updates to the database, in a single
+        transaction.
+
+        If the transaction fails, every entry is written in its own
+        transaction so that a single failing entry doesn't hold back
+        the others. The entries that still fail are kept for the next
+        flush, and dropped after `auto_whitelist_flush_max_attempts`
+        attempts.
+        """
+        update_buffer = self.get_buffer()
+        updates = update_buffer.pop_all()
+        if not updates:
+            return
+        start = time.time()
+        session = self.get_session()
+        try:
+            try:
+                for key, (count, totscore) in updates.items():
+                    self._write(session, key, count, totscore)
+                session.commit()
+            except SQLAlchemyError as e:
+                session.rollback()
+                self.ctxt.log.error("auto-whitelist: unable to write %s "
+                                    "updates: %s", len(updates), e)
+                pad.stats.incr("awl_flushes_total", result="error")
+                if len(updates) > 1:
+                    self._flush_entries(session, updates)
+                else:
+                    self._retry(updates, e)
+                return
+            update_buffer.written(updates)
+        finally:
+            session.close()
+        pad.stats.incr("awl_flushes_total", result="ok")
+        pad.stats.incr("awl_flushed_updates_total", len(updates))
+        pad.stats.observe("awl_flush_seconds", time.time() - start)
+
+    def _flush_entries(self, session, updates):
+        """Write every update in its own transaction."""
+        update_buffer = self.get_buffer()
+        written = 0
+        for key, (count, totscore) in updates.items():
+            try:
+                self._write(session, key, count, totscore)
+                session.commit()
+            except SQLAlchemyError as e:
+                session.rollback()
+                self._retry({key: (count, totscore)}, e)
+                continue
+            update_buffer.written((key,))
+            written += 1
+        pad.stats.incr("awl_flushed_updates_total", written)
+
+    def _retry(self, updates, error):
+        """Keep the updates that could not be written for the next
+        attempt, or drop them if they failed too many times.
+        """
+        update_buffer = self.get_buffer()
+        for key, (count, totscore) in updates.items():
+            if update_buffer.retry(key, count, totscore):
+                continue
+            self.ctxt.log.error("auto-whitelist: dropping update for %s "
+                                "(count %s, totscore %s): %s", key, count,
+                                totscore, error)
+            pad.stats.incr("awl_dropped_updates_total", reason="error")
+        if len(update_buffer):
+            update_buffer.schedule(self.flush)
+
+    def finish(self):
+        """Write the pending updates, any update received after
+        this is written immediately.
+        """
+        update_buffer = self.get_buffer()
+        update_buffer.max_size = 0
+        update_buffer.cancel()
+        self.flush()
+
     def check_from_in_auto_whitelist(self, msg, target=None):
         score = msg.score
         factor = self["auto_whitelist_factor"]
@@ -150,10 +483,10 @@ class AutoWhiteListPlugin(pad.plugins.base.BasePlugin):
         addr = self.get_local(msg, "from")
         signed_by = self.get_local(msg, "signedby")
 
-        entry = self.get_entry(addr, awl_key_ip, signed_by)
+        count, totscore = self.get_scores(addr, awl_key_ip, signed_by)
 
         try:
-            mean = entry.totscore / entry.count
+            mean = totscore / count
         except ZeroDivisionError:
             mean = None
 
@@ -173,18 +506,12 @@ class AutoWhiteListPlugin(pad.plugins.base.BasePlugin):
             delta *= factor
             msg.plugin_tags["AWL"] = "%2.1f" % delta
             msg.plugin_tags["AWLMEAN"] = "%2.1f" % mean
-            msg.plugin_tags["AWLCOUNT"] = "%2.1f" % entry.count
+            msg.plugin_tags["AWLCOUNT"] = "%2.1f" % count
             msg.plugin_tags["AWLPRESCORE"] = "%2.1f" % msg.score
 
             msg.score += delta
 
-        entry.count += 1
-        entry.totscore += score
-
-        session = self.get_session()
-        session.merge(entry)
-        session.commit()
-        session.close()
+        self.update_scores(addr, awl_key_ip, signed_by, score)
 
         self.ctxt.log.debug("auto-whitelist: post auto-whitelist score %.3f",
                             msg.score)
@@ -5,13 +5,7 @@ from __future__ import absolute_import
 from builtins import tuple
 from builtins import object
 
-try:
-    from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
-except ImportError:
-    create_engine = None
-    sessionmaker = None
-
+import pad.db
 import pad.conf
 
 
@@ -59,18 +53,31 @@ class BasePlugin(pad.conf.Conf, object):
     been initialized.
     """
     eval_rules = tuple()
+    # Maps eval rules to a tuple with a converter for every argument
+    # (e.g. `pad.rules.eval_.regex_arg`), or None to leave it
+    # unchanged. The arguments are converted once when the ruleset
+    # is loaded.
+    eval_rule_args = None
     # Defines any new rules that the plugins implements.
     cmds = None
     # See pad.conf.Conf for details on options.
     options = None
     # The name of the DSN options
     dsn_name = None
+    # The eval rules that use the data collected by the message hooks
+    # (check_start, extract_metadata and parsed_metadata). If set, the
+    # hooks are not called when none of these rules are used.
+    hook_eval_rules = None
 
     def __init__(self, ctxt):
         if self.dsn_name:
             self.options[self.dsn_name + "_dsn"] = ("str", "")
             self.options[self.dsn_name + "_sql_username"] = ("str", "")
             self.options[self.dsn_name + "_sql_password"] = ("str", "")
+            self.options[self.dsn_name + "_pool_size"] = ("int", 5)
+            self.options[self.dsn_name + "_pool_max_overflow"] = ("int", 10)
+            self.options[self.dsn_name + "_pool_recycle"] = ("int", 3600)
+            self.options[self.dsn_name + "_pool_timeout"] = ("float", 30.0)
         super(BasePlugin, self).__init__(ctxt)
 
     def finish_parsing_start(self, results):
@@ -93,8 +100,9 @@ class BasePlugin(pad.conf.Conf, object):
         post-parsing. This hook can be used for e.g. to add rules to the
         ruleset.
 
-        By default this prepares the SQLAlchemy engine if the plugin has any
-        set.
+        By default this prepares the database access if the plugin has
+        a DSN set. The engine is only created when the database is first
+        used, so every process gets its own connections.
         """
         connect_string = None
         if self.dsn_name:
@@ -108,12 +116,29 @@ class BasePlugin(pad.conf.Conf, object):
                 # The connect string is already in the correct format
                 connect_string = dsn
         if connect_string is not None:
-            self["engine"] = create_engine(connect_string)
+            self["database"] = pad.db.Database(
+                self.dsn_name, connect_string,
+                pool_size=self[self.dsn_name + "_pool_size"],
+                max_overflow=self[self.dsn_name + "_pool_max_overflow"],
+                pool_recycle=self[self.dsn_name + "_pool_recycle"],
+                pool_timeout=self[self.dsn_name + "_pool_timeout"],
+            )
+
+    def eval_rules_used(self, ruleset, eval_rules=None):
+        """Check if any of these eval rules (by default all the eval
+        rules of the plugin) are used by the rules in the ruleset.
+
+        Plugins can use this in `finish_parsing_end` to only load
+        their dependencies when they are needed.
+        """
+        if eval_rules is None:
+            eval_rules = self.eval_rules
+        used = self.ctxt.get_used_eval_rules(ruleset)
+        return not used.isdisjoint(eval_rules)
 
     def get_session(self):
-        """Open a new SQLAlchemy session."""
-        engine = self["engine"]
-        return sessionmaker(bind=engine)()
+        """Get the SQLAlchemy session for the current request."""
+        return self["database"].get_session()
 
     def check_start(self, msg):
         """Called before the metadata is extracted from the message. The
@@ -137,12 +162,28 @@ class BasePlugin(pad.conf.Conf, object):
         May be overridden.
         """
 
+    def match_start(self, ruleset, msg):
+        """The message is about to be matched against the rules of the
+        ruleset. This is not called for messages that are only reported
+        or revoked, so any work whose result is only used by the rules
+        should be started here.
+
+        May be overridden.
+        """
+
     def check_end(self, ruleset, msg):
         """The message check operation has just finished, and the results are
         about to be returned to the caller
 
-        May be overridden.
+        By default this closes the database session used for this
+        message, if any. May be overridden.
         """
+        if self.dsn_name:
+            try:
+                database = self["database"]
+            except KeyError:
+                return
+            database.remove_session()
 
     def plugin_report(self, msg):
         """Called when a message should be reported as spam.
@@ -156,6 +197,14 @@ class BasePlugin(pad.conf.Conf, object):
         May be overridden.
         """
 
+    def finish(self):
+        """Called before the plugin is discarded, when the server shuts
+        down or the configuration is reloaded. Any data still held in
+        memory should be saved here.
+
+        May be overridden.
+        """
+
     def parse_config(self, key, value):
         """Parse a config line that the normal parses doesn't know how to
         interpret.
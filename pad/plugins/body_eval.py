@@ -35,6 +35,11 @@ class BodyEval(pad.plugins.base.BasePlugin):
         "tvd_vertical_words",
         "check_stock_info",
     )
+    hook_eval_rules = (
+        "multipart_alternative_difference",
+        "multipart_alternative_difference_count",
+        "check_blank_line_ratio",
+    )
 
     def check_start(self, msg):
         """Initialize a empty list that will contain all
@@ -4,15 +4,41 @@ from __future__ import division
 from __future__ import absolute_import
 
 import re
+import time
 import ipaddress
+import multiprocessing
 
 from builtins import str
 
+import pad.pool
+import pad.stats
+import pad.rbldnsd
 import pad.rules.eval_
 import pad.plugins.base
 
 ACCREDITOR_RE = re.compile(r"[@.]a--([a-z0-9]{3,})\.", re.I)
 
+# Maps the eval rules to the target and type of the DNS
+# queries they perform.
+PREFETCH_LOOKUPS = {
+    "check_rbl": ("ip", "A"),
+    "check_rbl_txt": ("ip", "TXT"),
+    "check_rbl_accreditor": ("ip", "A"),
+    "check_rbl_envfrom": ("envfrom", "A"),
+    "check_rbl_from_host": ("from", "A"),
+    "check_rbl_from_domain": ("from", "A"),
+}
+
+
+def mask_arg(value):
+    """Argument converter for the `check_rbl_sub` masks, these are
+    either an integer or an IP address.
+    """
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return int(ipaddress.ip_address(str(value)))
+
 
 class DNSEval(pad.plugins.base.BasePlugin):
     eval_rules = (
@@ -27,6 +53,20 @@ class DNSEval(pad.plugins.base.BasePlugin):
         # Deprecated in SA
         # "check_rbl_results_for",
     )
+    eval_rule_args = {
+        "check_rbl": (None, None, pad.rules.eval_.regex_arg),
+        "check_rbl_txt": (None, None, pad.rules.eval_.regex_arg),
+        "check_rbl_sub": (None, mask_arg),
+        "check_rbl_envfrom": (None, None, pad.rules.eval_.regex_arg),
+        "check_rbl_from_host": (None, None, pad.rules.eval_.regex_arg),
+        "check_rbl_from_domain": (None, None, pad.rules.eval_.regex_arg),
+        "check_rbl_accreditor": (None, None, pad.rules.eval_.regex_arg),
+    }
+    options = {
+        "rbl_timeout": ("int", 15),
+        "rbl_prefetch_workers": ("int", 16),
+        "rbl_local_zone": ("append", []),
+    }
 
     def finish_parsing_end(self, ruleset):
         """Configure any multi results RBL checks."""
@@ -46,11 +86,21 @@ class DNSEval(pad.plugins.base.BasePlugin):
             "check_rbl_sub",
         )
         zones = {}
+        # Store the (target, rbl_server, qtype) of all the
+        # lookups required, these are prefetched for every
+        # message.
+        lookups = set()
         for rule_list in (ruleset.checked, ruleset.not_checked):
             for rule in rule_list.values():
                 if not isinstance(rule, pad.rules.eval_.EvalRule):
                     continue
                 name = rule.eval_rule_name
+                if name == "check_dns_sender":
+                    lookups.add(("sender", None, "A"))
+                    lookups.add(("sender", None, "MX"))
+                if name in PREFETCH_LOOKUPS:
+                    target, qtype = PREFETCH_LOOKUPS[name]
+                    lookups.add((target, rule.eval_args[1], qtype))
                 if name in ignore_evals or name not in self.eval_rules:
                     continue
                 # This eval rule actually check one rbl servers
@@ -59,6 +109,175 @@ class DNSEval(pad.plugins.base.BasePlugin):
                 rbl_server = rule.eval_args[1]
                 zones[zone_id] = rbl_server
         self["zones"] = zones
+        self["lookups"] = lookups
+        self["local_zones"] = self._load_local_zones()
+
+    def _load_local_zones(self):
+        """Load the zone files configured with the `rbl_local_zone`
+        option. These are used to answer the queries for those lists
+        instead of the DNS.
+        """
+        local_zones = {}
+        for option in self["rbl_local_zone"]:
+            try:
+                name, source = option.split(None, 1)
+                dataset_type, path = source.strip().split(":", 1)
+            except ValueError:
+                self.ctxt.err("Invalid rbl_local_zone %s", option)
+                continue
+            name = name.lower().strip(".")
+            try:
+                zone = local_zones[name]
+            except KeyError:
+                zone = local_zones[name] = pad.rbldnsd.Zone(name)
+            try:
+                zone.add_dataset(dataset_type, path)
+            except ValueError as e:
+                self.ctxt.err("Invalid rbl_local_zone %s: %s", option, e)
+        return local_zones
+
+    def _get_local_zones(self):
+        """Get the local zones by name."""
+        try:
+            return self["local_zones"]
+        except KeyError:
+            return {}
+
+    def _query_local(self, qname, qtype):
+        """Answer the query from the local zones, returns None if
+        the query isn't for any of them.
+        """
+        for zone in self._get_local_zones().values():
+            prefix = zone.get_prefix(qname)
+            if prefix is not None:
+                return zone.query(prefix, qtype)
+        return None
+
+    def _get_subtest(self, subtest):
+        """Get the compiled subtest regex, returns None if it's
+        invalid. The subtests of the rules are already compiled
+        when the ruleset is loaded.
+        """
+        try:
+            return pad.rules.eval_.regex_arg(subtest)
+        except (re.error, TypeError) as e:
+            self.ctxt.err("Invalid regex %s: %s", subtest, e)
+            return None
+
+    def _get_mask(self, mask):
+        """Get the mask as an integer, returns None if it's
+        invalid. The masks of the rules are already converted
+        when the ruleset is loaded.
+        """
+        try:
+            return mask_arg(mask)
+        except ValueError as e:
+            self.ctxt.err("Invalid mask %s: %s", mask, e)
+            return None
+
+    def _get_reversed_ips(self, msg):
+        """Get the reversed untrusted IPs of this message, these
+        are computed only once per message.
+        """
+        try:
+            return self.get_local(msg, "reversed_ips")
+        except KeyError:
+            pass
+        reversed_ips = [self.ctxt.dns.reverse_ip(ip)
+                        for ip in msg.get_untrusted_ips()]
+        self.set_local(msg, "reversed_ips", reversed_ips)
+        return reversed_ips
+
+    @staticmethod
+    def _get_domain(addr):
+        """Get the domain from the address."""
+        if "@" in addr:
+            return addr.rsplit("@", 1)[1].strip()
+        return addr.strip()
+
+    def _get_qnames(self, msg, target, rbl_server):
+        """Get the names that are queried for this target and
+        list.
+        """
+        if target == "ip":
+            return ["%s.%s" % (rev, rbl_server)
+                    for rev in self._get_reversed_ips(msg)]
+        if target == "envfrom":
+            addresses = [msg.sender_address] if msg.sender_address else []
+        elif target == "from":
+            addresses = msg.get_addr_header("From")
+        else:
+            addresses = [msg.sender_address] if msg.sender_address else []
+            return [self._get_domain(addr) for addr in addresses]
+        return ["%s.%s" % (self._get_domain(addr), rbl_server)
+                for addr in addresses]
+
+    def match_start(self, ruleset, msg):
+        """Perform all the DNS lookups required by the eval rules
+        for this message in parallel, and wait for them to finish
+        or for the `rbl_timeout` to expire.
+
+        The results are then used by the eval rules.
+        """
+        super(DNSEval, self).match_start(ruleset, msg)
+        for zone in self._get_local_zones().values():
+            zone.check_reload()
+        queries = set()
+        results = {}
+        for target, rbl_server, qtype in self["lookups"]:
+            if self.ctxt.skip_rbl_checks and target != "sender":
+                continue
+            for qname in self._get_qnames(msg, target, rbl_server):
+                result = self._query_local(qname, qtype)
+                if result is None:
+                    queries.add((qname, qtype))
+                else:
+                    results[(qname, qtype)] = result
+        if not queries:
+            if results:
+                self.set_local(msg, "results", results)
+            return
+
+        start = time.time()
+        pool = pad.pool.get_pool("dns_eval", self["rbl_prefetch_workers"])
+        pending = [(query, pool.apply_async(self.ctxt.dns.query, query))
+                   for query in queries]
+        deadline = start + self["rbl_timeout"]
+        for query, pending_result in pending:
+            try:
+                results[query] = pending_result.get(
+                    max(0, deadline - time.time()))
+            except multiprocessing.TimeoutError:
+                self.ctxt.log.info("Timed out while querying %s (%s)",
+                                   *query)
+                pad.stats.incr("rbl_prefetch_timeouts_total")
+                results[query] = []
+            except Exception as e:
+                self.ctxt.log.warning("Error while querying %s (%s): %s",
+                                      query[0], query[1], e)
+        pad.stats.observe("rbl_prefetch_seconds", time.time() - start)
+        self.set_local(msg, "results", results)
+
+    def _query(self, msg, qname, qtype):
+        """Get the prefetched result for this query or perform
+        the query if it's not available. The result is then
+        shared with every other rule that performs the same
+        query for this message.
+        """
+        try:
+            results = self.get_local(msg, "results")
+        except KeyError:
+            results = {}
+            self.set_local(msg, "results", results)
+        try:
+            return results[(qname, qtype)]
+        except KeyError:
+            pass
+        result = self._query_local(qname, qtype)
+        if result is None:
+            result = self.ctxt.dns.query(qname, qtype)
+        results[(qname, qtype)] = result
+        return result
 
     def _check_rbl(self, msg, rbl_server, qtype="A", subtest=None):
         """Checks all the IPs of this message on the specified
@@ -77,15 +296,12 @@ class DNSEval(pad.plugins.base.BasePlugin):
             return False
 
         if subtest is not None:
-            try:
-                subtest = re.compile(subtest)
-            except re.error as e:
-                self.ctxt.err("Invalid regex %s: %s", subtest, e)
+            subtest = self._get_subtest(subtest)
+            if subtest is None:
                 return False
 
-        for ip in msg.get_untrusted_ips():
-            rev = self.ctxt.dns.reverse_ip(ip)
-            results = self.ctxt.dns.query("%s.%s" % (rev, rbl_server), qtype)
+        for rev in self._get_reversed_ips(msg):
+            results = self._query(msg, "%s.%s" % (rev, rbl_server), qtype)
 
             if results and not subtest:
                 return True
@@ -110,18 +326,12 @@ class DNSEval(pad.plugins.base.BasePlugin):
             return False
 
         if mask is not None:
-            try:
-                mask = int(mask)
-            except (ValueError, TypeError):
-                try:
-                    mask = int(ipaddress.ip_address(str(mask)))
-                except ValueError as e:
-                    self.ctxt.err("Invalid mask %s: %s", mask, e)
-                    return False
-
-        for ip in msg.get_untrusted_ips():
-            rev = self.ctxt.dns.reverse_ip(ip)
-            results = self.ctxt.dns.query("%s.%s" % (rev, rbl_server), "A")
+            mask = self._get_mask(mask)
+            if mask is None:
+                return False
+
+        for rev in self._get_reversed_ips(msg):
+            results = self._query(msg, "%s.%s" % (rev, rbl_server), "A")
 
             if results and not mask:
                 return True
@@ -132,9 +342,10 @@ class DNSEval(pad.plugins.base.BasePlugin):
                     return True
         return False
 
-    def _check_rbl_addr(self, addresses, rbl_server, subtest=None):
+    def _check_rbl_addr(self, msg, addresses, rbl_server, subtest=None):
         """Checks the specified addresses on the specified list.
 
+        :param msg: The message that we perform the check on.
         :param addresses: A list of addresses to check
         :param rbl_server: The RBL list to check
         :param subtest: If specified then an additional check
@@ -148,18 +359,13 @@ class DNSEval(pad.plugins.base.BasePlugin):
             return False
 
         if subtest is not None:
-            try:
-                subtest = re.compile(subtest)
-            except re.error as e:
-                self.ctxt.err("Invalid regex %s: %s", subtest, e)
+            subtest = self._get_subtest(subtest)
+            if subtest is None:
                 return False
 
         for addr in addresses:
-            if "@" in addr:
-                domain = addr.rsplit("@", 1)[1].strip()
-            else:
-                domain = addr.strip()
-            results = self.ctxt.dns.query("%s.%s" % (domain, rbl_server), "A")
+            domain = self._get_domain(addr)
+            results = self._query(msg, "%s.%s" % (domain, rbl_server), "A")
 
             if results and not subtest:
                 return True
@@ -267,14 +473,10 @@ class DNSEval(pad.plugins.base.BasePlugin):
             self.ctxt.log.debug("Message has no envelope sender")
             return False
 
-        if "@" in msg.sender_address:
-            domain = msg.sender_address.rsplit("@", 1)[1]
-        else:
-            domain = msg.sender_address
-
-        if self.ctxt.dns.query(domain, "A"):
+        domain = self._get_domain(msg.sender_address)
+        if self._query(msg, domain, "A"):
             return False
-        if self.ctxt.dns.query(domain, "MX"):
+        if self._query(msg, domain, "MX"):
             return False
         self.ctxt.log.debug("Sending domain %s has no MX or A records",
                             domain)
@@ -299,7 +501,8 @@ class DNSEval(pad.plugins.base.BasePlugin):
         if not msg.sender_address:
             self.ctxt.log.debug("Message has no envelope sender")
             return False
-        return self._check_rbl_addr([msg.sender_address], rbl_server, subtest)
+        return self._check_rbl_addr(msg, [msg.sender_address], rbl_server,
+                                    subtest)
 
     def check_rbl_from_domain(self, msg, zone_set, rbl_server, subtest=None,
                               target=None):
@@ -318,7 +521,7 @@ class DNSEval(pad.plugins.base.BasePlugin):
         if not from_addrs:
             self.ctxt.log.debug("Message has no From header")
             return False
-        return self._check_rbl_addr(from_addrs, rbl_server, subtest)
+        return self._check_rbl_addr(msg, from_addrs, rbl_server, subtest)
 
     # This two do the same thing
     check_rbl_from_host = check_rbl_from_domain
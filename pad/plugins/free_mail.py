@@ -5,6 +5,8 @@ that sender's domain is that of a site offering free email services.
 """
 
 import re
+
+import pad.rules.eval_
 import pad.plugins.base
 
 
@@ -38,6 +40,12 @@ class FreeMail(pad.plugins.base.BasePlugin):
         "check_freemail_header",
         "check_freemail_body"
     )
+    hook_eval_rules = ("check_freemail_replyto", "check_freemail_body")
+    eval_rule_args = {
+        "check_freemail_from": (pad.rules.eval_.regex_arg,),
+        "check_freemail_header": (None, pad.rules.eval_.regex_arg),
+        "check_freemail_body": (pad.rules.eval_.regex_arg,),
+    }
     options = {
         "freemail_max_body_emails": ("int", 5),
         "freemail_max_body_freemails": ("int", 3),
@@ -51,25 +59,42 @@ class FreeMail(pad.plugins.base.BasePlugin):
         "util_rb_3tld": ("append_split", [])
     }
 
-    def check_start(self, msg):
-        """Verify if the domains are valid and
-        separate wildcard domains from the rest"""
+    def finish_parsing_end(self, ruleset):
+        """Verify if the domains are valid, index them and compile
+        the regular expressions used when checking the messages."""
+        super(FreeMail, self).finish_parsing_end(ruleset)
         domain_re = re.compile(r'^[a-z0-9.*?-]+$')
-        freemail_domains = self.get_global('freemail_domains')
+        freemail_domains = list()
+        # Domains without wildcards
+        exact_domains = set()
+        # Parents of the domains listed as *.parent
+        wildcard_parents = set()
         freemail_temp_wc = list()
-        for index, domain in enumerate(freemail_domains):
+        for domain in self.get_global('freemail_domains'):
             if not domain_re.search(domain):
-                freemail_domains.remove(domain)
                 self.ctxt.log.warn("FreeMail::Plugin Invalid freemail domain: %s", domain)
-            if '*' in domain:
-                temp = domain.replace('.', '\.')
+                continue
+            freemail_domains.append(domain)
+            if '*' not in domain and '?' not in domain:
+                exact_domains.add(domain)
+            elif (domain.startswith('*.') and '*' not in domain[2:] and
+                    '?' not in domain):
+                wildcard_parents.add(domain[2:])
+            else:
+                temp = domain.replace('.', '\\.')
                 temp = temp.replace('?', '.')
                 temp = temp.replace('*', '[^.]*')
                 freemail_temp_wc.append(temp)
         if freemail_temp_wc:
             wild_doms = r'\@(?:{0})$'.format('|'.join(freemail_temp_wc))
             self.set_global('freemail_domains_re', re.compile(wild_doms))
+        else:
+            self.set_global('freemail_domains_re', None)
         self.set_global('freemail_domains', freemail_domains)
+        self.set_global('freemail_exact_domains', exact_domains)
+        self.set_global('freemail_wildcard_parents', wildcard_parents)
+        self.set_global('freemail_whitelist_set',
+                        set(self.get_global('freemail_whitelist')))
         valid_tlds = (self.get_global('util_rb_tld') +
                       self.get_global('util_rb_2tld') +
                       self.get_global('util_rb_3tld'))
@@ -87,17 +112,28 @@ class FreeMail(pad.plugins.base.BasePlugin):
               (?!(?:[a-z0-9-]|\.[a-z0-9]))		# make sure domain ends here
         """.format(tld=tlds_re), re.X|re.I)
         self.set_global('email_re', email_re)
-        self.set_global('body_emails', set())
-        self.set_global("check_if_parsed", False)
+
+    def check_start(self, msg):
+        """Prepare the storage for the emails found in the body
+        of this message."""
+        self.set_local(msg, 'body_emails', set())
+        self.set_local(msg, "check_if_parsed", False)
 
     def extract_metadata(self, msg, payload, text, part):
-        """Parse all emails from text/plain and text/html parts
+        """Parse all emails from text/plain and text/html parts.
+
+        At most `freemail_max_body_emails` unique emails are
+        collected, any other emails are ignored.
         """
         if part.get_content_type() in ("text/plain", "text/html"):
-            body_emails = self.get_global('body_emails')
-            for email in self.get_global('email_re').findall(part.get_payload()):
-                body_emails.add(email)
-            self.set_global('body_emails', body_emails)
+            body_emails = self.get_local(msg, 'body_emails')
+            max_emails = self.get_global('freemail_max_body_emails')
+            if len(body_emails) >= max_emails:
+                return
+            for match in self.get_global('email_re').finditer(part.get_payload()):
+                body_emails.add(match.group(1))
+                if len(body_emails) >= max_emails:
+                    break
 
     def check_freemail_replyto(self, msg, option=None, target=None):
         """Checks/compares freemail addresses found from headers and body
@@ -152,11 +188,11 @@ class FreeMail(pad.plugins.base.BasePlugin):
                                    " No Reply-To and From is not freemail, "
                                    "skipping check")
                 return False
-        if not self._parse_body():
+        if not self._parse_body(msg):
             return False
         reply = reply_to if reply_to_frm else from_email
         check = reply_to if option == 'replyto' else reply
-        for email in self.get_global("freemail_body_emails"):
+        for email in self.get_local(msg, "freemail_body_emails"):
             if email != check:
                 self.ctxt.log.warn("FreeMail::Plugin check_freemail_replyto"
                                    " HIT! %s and %s are different freemails",
@@ -172,14 +208,14 @@ class FreeMail(pad.plugins.base.BasePlugin):
         Returns True if it is or False otherwise
         """
         self.ctxt.log.debug("FreeMail::Plugin Eval rule check_freemail_from"
-                            " %s", 'with regex: ' + regex if regex else '')
+                            " %s", 'with regex: %s' % regex if regex else '')
         all_from_headers = ['From', 'Envelope-Sender',
                             'Resent-Sender', 'X-Envelope-From',
                             'EnvelopeFrom', 'Resent-From']
         header_emails = []
         if regex:
             try:
-                check_re = re.compile(regex)
+                check_re = pad.rules.eval_.regex_arg(regex)
             except re.error:
                 self.ctxt.log.warn("FreeMail::Plugin check_freemail_from"
                                    " regex error")
@@ -216,14 +252,14 @@ class FreeMail(pad.plugins.base.BasePlugin):
         Returns True if it is or False otherwise
         """
         self.ctxt.log.debug("FreeMail::Plugin check_freemail_header"
-                            " %s", 'with regex: ' + regex if regex else '')
+                            " %s", 'with regex: %s' % regex if regex else '')
         if not header:
             self.ctxt.log.warn("FreeMail::Plugin check_freemail_header"
                                " requires an argument")
             return False
         if regex:
             try:
-                check_re = re.compile(regex)
+                check_re = pad.rules.eval_.regex_arg(regex)
             except re.error:
                 self.ctxt.log.warn("FreeMail::Plugin check_freemail_header"
                                    " regex error")
@@ -258,44 +294,44 @@ class FreeMail(pad.plugins.base.BasePlugin):
         of the message
         """
         self.ctxt.log.debug("FreeMail::Plugin check_freemail_body"
-                            " %s", 'with regex: ' + regex if regex else '')
-        body_emails = self.get_global('body_emails')
+                            " %s", 'with regex: %s' % regex if regex else '')
+        body_emails = self.get_local(msg, 'body_emails')
         if not len(body_emails):
             self.ctxt.log.debug("FreeMail::Plugin check_freemail_body "
                                 "No emails found in body of the message")
             return False
         if regex:
             try:
-                check_re = re.compile(regex)
+                check_re = pad.rules.eval_.regex_arg(regex)
             except re.error:
                 self.ctxt.log.warn("FreeMail::Plugin check_freemail_from"
                                    " regex error")
                 return False
         else:
             check_re = None
-        if not self._parse_body():
+        if not self._parse_body(msg):
             return False
         if check_re:
-            for email in self.get_global("freemail_body_emails"):
+            for email in self.get_local(msg, "freemail_body_emails"):
                 if check_re.search(email):
                     self.ctxt.log.debug("FreeMail::Plugin check_freemail_body"
                                         " HIT! %s is freemail and matches regex", email)
                     return True
         else:
-            if len(self.get_global("freemail_body_emails")):
-                emails = " ,".join(self.get_global("freemail_body_emails"))
+            if len(self.get_local(msg, "freemail_body_emails")):
+                emails = " ,".join(self.get_local(msg, "freemail_body_emails"))
                 self.ctxt.log.debug("FreeMail::Plugin check_freemail_body"
                                     " HIT! body has freemails: %s", emails)
                 return True
         return False
 
-    def _parse_body(self):
+    def _parse_body(self, msg):
         """Parse all the emails from body and check
         if all conditions are accepted
         """
-        if self.get_global("check_if_parsed"):
+        if self.get_local(msg, "check_if_parsed"):
             return True
-        body_emails = self.get_global('body_emails')
+        body_emails = self.get_local(msg, 'body_emails')
         freemail_body_emails = []
         if (len(body_emails) >= self.get_global("freemail_max_body_emails") and
                 self.get_global("freemail_skip_when_over_max")):
@@ -311,8 +347,8 @@ class FreeMail(pad.plugins.base.BasePlugin):
                 self.ctxt.log.debug("FreeMail::Plugin check_freemail_body "
                                     "too many unique free emails found in body")
                 return False
-        self.set_global("freemail_body_emails", freemail_body_emails)
-        self.set_global("check_if_parsed", True)
+        self.set_local(msg, "freemail_body_emails", freemail_body_emails)
+        self.set_local(msg, "check_if_parsed", True)
         return True
 
     def _is_freemail(self, email):
@@ -322,12 +358,7 @@ class FreeMail(pad.plugins.base.BasePlugin):
         if not email:
             return False
         email_domain = email.rsplit('@')[1]
-        try:
-            freemail_re = self.get_global('freemail_domains_re')
-        except KeyError:
-            freemail_re = None
-        freemail_whitelist = self.get_global('freemail_whitelist')
-        freemail_domains = self.get_global('freemail_domains')
+        freemail_whitelist = self.get_global('freemail_whitelist_set')
 
         if email in freemail_whitelist:
             self.ctxt.log.warn("FreeMail::Plugin whitelisted email: %s", email)
@@ -338,7 +369,12 @@ class FreeMail(pad.plugins.base.BasePlugin):
         if EMAIL_WHITELIST.search(email):
             self.ctxt.log.warn("FreeMail::Plugin whitelisted domain, default: %s", email_domain)
             return False
-        if (email_domain in freemail_domains or
-                (freemail_re and freemail_re.search(email))):
+        if email_domain in self.get_global('freemail_exact_domains'):
+            return True
+        parent = email_domain.partition('.')[2]
+        if parent in self.get_global('freemail_wildcard_parents'):
+            return True
+        freemail_re = self.get_global('freemail_domains_re')
+        if freemail_re and freemail_re.search(email):
             return True
         return False
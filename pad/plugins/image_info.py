@@ -3,28 +3,142 @@
 from __future__ import absolute_import
 
 import re
+import struct
 import warnings
 from io import BytesIO
 from hashlib import md5
 from collections import defaultdict
 
-import pad.errors
+import pad.cache
+import pad.rules.eval_
+import pad.plugins.base
 
-try:
-    import PIL.Image
-except ImportError:
-    raise pad.errors.PluginLoadError(
-            "ImageInfoPlugin not loaded. You must install Pillow to use this "
-            "plugin")
+# Images with more pixels than this are considered invalid, this is
+# the same limit used by Pillow for decompression bombs.
+MAX_IMAGE_PIXELS = 89478485
 
-import pad.regex
-import pad.plugins.base
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# JPEG start of frame markers, they contain the image dimensions.
+JPEG_SOF_MARKERS = frozenset((0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                              0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF))
+# JPEG markers without a length field.
+JPEG_STANDALONE_MARKERS = frozenset([0x01] + list(range(0xD0, 0xD9)))
 
 
 class BadImageFile(Exception):
     """Error while trying to open image file"""
 
 
+def _get_gif_size(data):
+    return struct.unpack_from("<HH", data, 6)
+
+
+def _get_png_size(data):
+    if data[12:16] != b"IHDR":
+        raise ValueError("Missing PNG IHDR chunk")
+    return struct.unpack_from(">II", data, 16)
+
+
+def _get_jpeg_size(data):
+    """Scan the JPEG segments until the start of frame."""
+    pos = 2
+    while True:
+        marker, = struct.unpack_from("B", data, pos)
+        if marker != 0xFF:
+            raise ValueError("Invalid JPEG marker at %s" % pos)
+        # Skip any fill bytes.
+        while marker == 0xFF:
+            pos += 1
+            marker, = struct.unpack_from("B", data, pos)
+        pos += 1
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack_from(">HH", data, pos + 3)
+            return width, height
+        if marker in (0xD9, 0xDA):
+            # End of image or start of scan before the frame header.
+            raise ValueError("Missing JPEG start of frame")
+        length, = struct.unpack_from(">H", data, pos)
+        pos += length
+
+
+def _get_bmp_size(data):
+    header_size, = struct.unpack_from("<I", data, 14)
+    if header_size == 12:
+        return struct.unpack_from("<HH", data, 18)
+    width, height = struct.unpack_from("<ii", data, 18)
+    # The height is negative for top-down images.
+    return width, abs(height)
+
+
+def _get_webp_size(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        if data[23:26] != b"\x9d\x01\x2a":
+            raise ValueError("Invalid VP8 frame")
+        width, height = struct.unpack_from("<HH", data, 26)
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        if data[20:21] != b"\x2f":
+            raise ValueError("Invalid VP8L signature")
+        bits, = struct.unpack_from("<I", data, 21)
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        # The canvas size is stored in 24 bits, minus one.
+        w_low, w_high, h_low, h_high = struct.unpack_from("<HBHB", data, 24)
+        return (w_low | w_high << 16) + 1, (h_low | h_high << 16) + 1
+    raise ValueError("Unknown WebP chunk %r" % chunk)
+
+
+def get_image_size(data):
+    """Read the (width, height) of the image from its header.
+
+    GIF, PNG, JPEG, BMP and WebP images are supported.
+
+    :return: The size of the image, or None if the format is
+      not known.
+    :raises ValueError: If the image header is not valid.
+    """
+    try:
+        if data[:6] in (b"GIF87a", b"GIF89a"):
+            return _get_gif_size(data)
+        if data[:8] == PNG_SIGNATURE:
+            return _get_png_size(data)
+        if data[:2] == b"\xff\xd8":
+            return _get_jpeg_size(data)
+        if data[:2] == b"BM":
+            return _get_bmp_size(data)
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return _get_webp_size(data)
+    except struct.error as e:
+        raise ValueError("Truncated image: %s" % e)
+    return None
+
+
+def _get_pil_size(data):
+    """Open the image with Pillow to get its size, this is only
+    used for the formats not supported by `get_image_size`.
+    """
+    try:
+        import PIL.Image
+    except ImportError:
+        raise ValueError("Unknown image format, install Pillow to "
+                         "support more formats")
+    img_io = BytesIO(data)
+    with warnings.catch_warnings():
+        warnings.filterwarnings(
+                "error", category=PIL.Image.DecompressionBombWarning)
+        try:
+            image = PIL.Image.open(img_io)
+        except (PIL.Image.DecompressionBombWarning, IOError,
+                TypeError) as e:
+            raise ValueError(str(e))
+    size = image.size
+    img_io.close()
+    return size
+
+
 class ImageInfoPlugin(pad.plugins.base.BasePlugin):
     eval_rules = ("image_count",
                   "image_named",
@@ -32,24 +146,42 @@ class ImageInfoPlugin(pad.plugins.base.BasePlugin):
                   "image_size_exact",
                   "image_size_range",
                   "image_to_text_ratio")
-    options = {}
+    hook_eval_rules = eval_rules
+    options = {"image_info_cache_size": ("int", 10000)}
+
+    def finish_parsing_end(self, ruleset):
+        """Create the cache of the image sizes."""
+        super(ImageInfoPlugin, self).finish_parsing_end(ruleset)
+        self["cache"] = pad.cache.TTLCache("image_info",
+                                           self["image_info_cache_size"])
+
+    def _get_cache(self):
+        """Get the cache of the image sizes, by the MD5 of the image."""
+        try:
+            return self["cache"]
+        except KeyError:
+            self["cache"] = pad.cache.TTLCache("image_info",
+                                               self["image_info_cache_size"])
+            return self["cache"]
 
     def _get_image_sizes(self, payload):
-        imginfo = {}
-        img_io = BytesIO(payload)
-        with warnings.catch_warnings():
-            warnings.filterwarnings(
-                    "error", category=PIL.Image.DecompressionBombWarning)
-            try:
-                image = PIL.Image.open(img_io)
-            except (PIL.Image.DecompressionBombWarning, IOError, ValueError,
-                    TypeError) as e:
-                self.ctxt.log.debug("Unable to process image: %s", e)
-                raise BadImageFile
-
-        imginfo['width'], imginfo['height'] = image.size
-        img_io.close()
-        return imginfo
+        """Get the width and height of the image. The size is read
+        from the image header for the common formats, and Pillow is
+        only used for the other ones.
+        """
+        try:
+            size = get_image_size(payload)
+            if size is None:
+                size = _get_pil_size(payload)
+        except ValueError as e:
+            self.ctxt.log.debug("Unable to process image: %s", e)
+            raise BadImageFile
+        width, height = size
+        if width * height > MAX_IMAGE_PIXELS:
+            self.ctxt.log.debug("Unable to process image: too many "
+                                "pixels (%sx%s)", width, height)
+            raise BadImageFile
+        return {"width": width, "height": height}
 
     def _get_image_names(self, msg):
 
@@ -140,9 +272,18 @@ class ImageInfoPlugin(pad.plugins.base.BasePlugin):
             self._update_coverage(msg, subtype, area)
 
         else:
-            try:
-                img = self._get_image_sizes(payload)
-            except BadImageFile:
+            # The same images are often sent in many messages, the
+            # size is only read once. Invalid images are cached as
+            # False.
+            cache = self._get_cache()
+            img = cache.get(image_id)
+            if img is None:
+                try:
+                    img = self._get_image_sizes(payload)
+                except BadImageFile:
+                    img = False
+                cache.set(image_id, img)
+            if img is False:
                 self._update_invalid_counts(msg, subtype, 1)
             else:
                 sizes['all'][image_id] = img
@@ -177,7 +318,7 @@ class ImageInfoPlugin(pad.plugins.base.BasePlugin):
 
     def image_name_regex(self, msg, regex, target=None):
         """Match if the name matches a regular expression."""
-        name_re = pad.regex.perl2re(regex)
+        name_re = pad.rules.eval_.perl_regex_arg(regex)
         names = self._get_image_names(msg)
         for name in names:
             if name_re.match(name):
@@ -2,22 +2,31 @@
 
 from __future__ import absolute_import
 
+import time
 import collections
 from io import BytesIO
 from hashlib import md5
 
+import pad.lazy
 import pad.errors
 
-try:
-    import PyPDF2
-except ImportError:
+if not pad.lazy.is_available("PyPDF2"):
     raise pad.errors.PluginLoadError(
         "PDFInfoPlugin not loaded. You must install PyPDF2 to use this "
         "plugin")
 
-import pad.regex
+import pad.stats
+import pad.cache
+import pad.rules.eval_
 import pad.plugins.base
 
+# The details that are extracted from the PDF files, each only when a
+# rule needs it.
+KINDS = ("details", "text", "images")
+
+# PyPDF2 is only imported if the PDF rules are used.
+PyPDF2 = pad.lazy.LazyModule("PyPDF2", "PyPDF2.utils")
+
 
 class PDFInfoPlugin(pad.plugins.base.BasePlugin):
     """PDFInfoPlugin"""
@@ -29,11 +38,39 @@ class PDFInfoPlugin(pad.plugins.base.BasePlugin):
         "pdf_named",
         "pdf_name_regex",
         "pdf_match_md5",
+        "pdf_match_fuzzy_md5",
         "pdf_match_details",
         "pdf_is_encrypted",
         "pdf_is_empty_body",
     )
-    options = {}
+    hook_eval_rules = eval_rules
+    eval_rule_args = {
+        "pdf_name_regex": (pad.rules.eval_.perl_regex_arg,),
+        "pdf_match_details": (None, pad.rules.eval_.perl_regex_arg),
+    }
+    options = {"pdf_max_pages": ("int", 50),
+               "pdf_timeout": ("float", 2.0),
+               "pdf_cache_size": ("int", 1000)}
+
+    def finish_parsing_end(self, ruleset):
+        """Create the cache of the PDF analysis results, and import
+        PyPDF2 if any rule needs it.
+        """
+        super(PDFInfoPlugin, self).finish_parsing_end(ruleset)
+        self["cache"] = pad.cache.TTLCache("pdf_info", self["pdf_cache_size"])
+        if self.eval_rules_used(ruleset):
+            PyPDF2.load()
+
+    def _get_cache(self):
+        """Get the cache of the analysis results, by the MD5 of the
+        PDF file.
+        """
+        try:
+            return self["cache"]
+        except KeyError:
+            self["cache"] = pad.cache.TTLCache("pdf_info",
+                                               self["pdf_cache_size"])
+            return self["cache"]
 
     def _get_count(self, msg):
         """Get the number of PDF files in the message"""
@@ -66,6 +103,7 @@ class PDFInfoPlugin(pad.plugins.base.BasePlugin):
 
     def _get_image_count(self, msg):
         """Get the number of Images in PDF attachments"""
+        self._analyze(msg, "images")
         try:
             return self.get_local(msg, "image_counts")
         except KeyError:
@@ -96,6 +134,7 @@ class PDFInfoPlugin(pad.plugins.base.BasePlugin):
 
     def _get_pixel_coverage(self, msg):
         """Return the cumulative pixel coverage"""
+        self._analyze(msg, "images")
         try:
             return self.get_local(msg, "pixel_coverage")
         except KeyError:
@@ -160,7 +199,7 @@ class PDFInfoPlugin(pad.plugins.base.BasePlugin):
         :return: True if there is a PDF file name that matches that regular
         expression.
         """
-        name_re = pad.regex.perl2re(regex)
+        name_re = pad.rules.eval_.perl_regex_arg(regex)
         names = self._get_pdf_names(msg)
         for name in names:
             if name_re.match(name):
@@ -192,12 +231,16 @@ class PDFInfoPlugin(pad.plugins.base.BasePlugin):
 
     def _update_fuzzy_md5(self, msg, texthash):
         """Add a md5 hash for text in a PDF"""
-        hashes = self._get_fuzzy_md5(msg)
+        try:
+            hashes = self.get_local(msg, "fuzzy_md5_hashes")
+        except KeyError:
+            hashes = set()
         hashes.add(texthash.lower())
         self.set_local(msg, "fuzzy_md5_hashes", hashes)
 
     def _get_fuzzy_md5(self, msg):
         """Return the set with the md5 hashes for fuzzy text"""
+        self._analyze(msg, "text")
         try:
             return self.get_local(msg, "fuzzy_md5_hashes")
         except KeyError:
@@ -240,11 +283,12 @@ class PDFInfoPlugin(pad.plugins.base.BasePlugin):
 
         :return: True if the detail matches in at least one PDF file.
         """
+        self._analyze(msg, "details")
         try:
             details = self.get_local(msg, "details")
         except KeyError:
             details = []
-        detail_re = pad.regex.perl2re(regex)
+        detail_re = pad.rules.eval_.perl_regex_arg(regex)
         # There might be several pdf files, dig in all of them
         for pdfid in details:
             allpdfs = details[pdfid]
@@ -267,6 +311,7 @@ class PDFInfoPlugin(pad.plugins.base.BasePlugin):
 
         :return: True if at least one PDF file is encrypted
         """
+        self._analyze(msg, "details")
         try:
             return True in self.get_local(msg, "pdf_encrypted")
         except KeyError:
@@ -295,30 +340,144 @@ class PDFInfoPlugin(pad.plugins.base.BasePlugin):
         return pdfbytes <= byts
 
     def _save_stats(self, msg, payload):
-        """Extracts and saves the PDF stats once per unique file"""
+        """Saves the PDF stats once per unique file. Only the hash and
+        the size are computed here, the file is kept for the other
+        details that are extracted when a rule needs them.
+        """
         # Use the md5 as ID to avoid duplicated PDFs
         pdf_id = md5(payload).hexdigest()
         self._update_pdf_hashes(msg, pdf_id)
-        pdffobject = BytesIO(payload)
-        self._update_pdf_size(msg, incr=len(pdffobject.getvalue()))
-        pdfobject = PyPDF2.PdfFileReader(pdffobject)
-        self._update_is_encrypted(msg, pdfobject.isEncrypted)
-        if pdfobject.isEncrypted:
-            # Can't get any of the other data, the document is encrypted
+        self._update_pdf_size(msg, incr=len(payload))
+        try:
+            pdfs = self.get_local(msg, "pdfs")
+        except KeyError:
+            pdfs = collections.OrderedDict()
+        pdfs[pdf_id] = payload
+        self.set_local(msg, "pdfs", pdfs)
+
+    def _analyze(self, msg, kind=None):
+        """Extract this kind of details (or all of them) from the PDF
+        files of the message, if this wasn't already done.
+
+        The results are cached by the MD5 of the file, so the same
+        PDF is only parsed once.
+        """
+        try:
+            pdfs = self.get_local(msg, "pdfs")
+        except KeyError:
             return
-        document_info = pdfobject.getDocumentInfo()
-        if document_info is not None:
-            self._update_details(msg, pdf_id, "author", document_info.author)
-            self._update_details(msg, pdf_id, "creator", document_info.creator)
-            self._update_details(
-                msg, pdf_id, "producer", document_info.producer)
-            self._update_details(msg, pdf_id, "title", document_info.title)
-        for page in pdfobject.pages:
+        try:
+            analyzed = self.get_local(msg, "analyzed")
+        except KeyError:
+            analyzed = set()
+            self.set_local(msg, "analyzed", analyzed)
+        cache = self._get_cache()
+        for current_kind in (KINDS if kind is None else (kind,)):
+            if current_kind in analyzed:
+                continue
+            analyzed.add(current_kind)
+            for pdf_id, payload in pdfs.items():
+                results = cache.get(pdf_id)
+                if results is None:
+                    results = {}
+                    cache.set(pdf_id, results)
+                if current_kind not in results:
+                    results[current_kind] = self._get_results(
+                        msg, pdf_id, payload, current_kind)
+                self._apply_results(msg, pdf_id, current_kind,
+                                    results[current_kind])
+
+    def _get_reader(self, msg, pdf_id, payload):
+        """Get the PDF reader for this file, it's created once per
+        message. None is returned if the file can't be read.
+        """
+        try:
+            readers = self.get_local(msg, "readers")
+        except KeyError:
+            readers = {}
+            self.set_local(msg, "readers", readers)
+        try:
+            return readers[pdf_id]
+        except KeyError:
+            pass
+        try:
+            reader = PyPDF2.PdfFileReader(BytesIO(payload))
+        except (PyPDF2.utils.PdfReadError, ValueError, TypeError) as e:
+            self.ctxt.log.debug("Unable to read PDF %s: %s", pdf_id, e)
+            reader = None
+        readers[pdf_id] = reader
+        return reader
+
+    def _get_pages(self, pdf_id, reader, kind):
+        """Iterate over the pages of the PDF file, stopping after
+        `pdf_max_pages` pages or `pdf_timeout` seconds.
+        """
+        deadline = time.time() + self["pdf_timeout"]
+        for i, page in enumerate(reader.pages):
+            if i >= self["pdf_max_pages"]:
+                reason = "pages"
+            elif time.time() > deadline:
+                reason = "time"
+            else:
+                yield page
+                continue
+            self.ctxt.log.debug("Stopped reading %s from PDF %s after %s "
+                                "pages (%s limit)", kind, pdf_id, i, reason)
+            pad.stats.incr("pdf_truncated_total", kind=kind, reason=reason)
+            return
+
+    def _get_results(self, msg, pdf_id, payload, kind):
+        """Extract this kind of details from the PDF file."""
+        start = time.time()
+        reader = self._get_reader(msg, pdf_id, payload)
+        try:
+            if kind == "details":
+                return self._get_details(reader)
+            if reader is None or reader.isEncrypted:
+                # Can't get any of the other data, the document is
+                # encrypted
+                return []
+            if kind == "text":
+                return self._get_text_hashes(pdf_id, reader)
+            return self._get_image_areas(pdf_id, reader)
+        except (PyPDF2.utils.PdfReadError, ValueError, TypeError,
+                KeyError) as e:
+            self.ctxt.log.debug("Unable to read %s from PDF %s: %s", kind,
+                                pdf_id, e)
+            return [] if kind != "details" else (False, None)
+        finally:
+            pad.stats.observe("pdf_analysis_seconds", time.time() - start,
+                              kind=kind)
+
+    @staticmethod
+    def _get_details(reader):
+        """Get (encrypted, details) for the PDF file."""
+        if reader is None:
+            return False, None
+        if reader.isEncrypted:
+            return True, None
+        document_info = reader.getDocumentInfo()
+        if document_info is None:
+            return False, None
+        return False, (("author", document_info.author),
+                       ("creator", document_info.creator),
+                       ("producer", document_info.producer),
+                       ("title", document_info.title))
+
+    def _get_text_hashes(self, pdf_id, reader):
+        """Get the md5 hashes of the text of every page."""
+        hashes = []
+        for page in self._get_pages(pdf_id, reader, "text"):
             # Get the text for the corrent page, get the md5 for fuzzy md5
             text = page.extractText().encode("utf8")
             if text:
-                fuzzy_md5 = md5(text).hexdigest()
-                self._update_fuzzy_md5(msg, fuzzy_md5)
+                hashes.append(md5(text).hexdigest())
+        return hashes
+
+    def _get_image_areas(self, pdf_id, reader):
+        """Get the area in pixels of every image."""
+        areas = []
+        for page in self._get_pages(pdf_id, reader, "images"):
             try:
                 resources = page["/Resources"]
             except KeyError:
@@ -330,10 +489,23 @@ class PDFInfoPlugin(pad.plugins.base.BasePlugin):
                 typ = obj["/Subtype"]
                 if typ != "/Image":
                     continue
+                areas.append(obj["/Width"] * obj["/Height"])
+        return areas
+
+    def _apply_results(self, msg, pdf_id, kind, results):
+        """Update the message data with the details of a PDF file."""
+        if kind == "details":
+            encrypted, details = results
+            self._update_is_encrypted(msg, encrypted)
+            for detail, value in details or ():
+                self._update_details(msg, pdf_id, detail, value)
+        elif kind == "text":
+            for fuzzy_md5 in results:
+                self._update_fuzzy_md5(msg, fuzzy_md5)
+        else:
+            for area in results:
                 self._update_image_counts(msg, incr=1)
-                width = obj["/Width"]
-                height = obj["/Height"]
-                self._update_pixel_coverage(msg, incr=width * height)
+                self._update_pixel_coverage(msg, incr=area)
 
     def extract_metadata(self, msg, payload, text, part):
         """Extend to extract the PDF metadata"""
@@ -2,49 +2,141 @@
 
 from __future__ import absolute_import
 
-import pyzor.client
-import pyzor.digest
+import time
+import multiprocessing
 
+import pad.pool
+import pad.lazy
+import pad.cache
 import pad.plugins.base
 
+# Pyzor is imported when the check_pyzor rule is used or when the
+# first message is reported.
+pyzor = pad.lazy.LazyModule("pyzor", "pyzor.client", "pyzor.digest")
+
 
 class PyzorPlugin(pad.plugins.base.BasePlugin):
     eval_rules = ("check_pyzor",)
     options = {"use_pyzor": ("bool", True),
                "pyzor_max": ("int", 5),
                "pyzor_timeout": ("float", 3.5),
-               "pyzor_servers": ("list", ["public.pyzor.org:24441"])}
+               "pyzor_servers": ("list", ["public.pyzor.org:24441"]),
+               "pyzor_cache_size": ("int", 10000),
+               "pyzor_cache_ttl": ("float", 60.0)}
 
     def finish_parsing_end(self, ruleset):
-        """Create and store globally a pyzor client."""
+        """Create and store globally a pyzor client, if the
+        check_pyzor rule is used.
+        """
         super(PyzorPlugin, self).finish_parsing_end(ruleset)
         # Store a single Pyzor client in the global context at plugin
         # initialization, rather than creating a new one for every message
-        self["client"] = pyzor.client.BatchClient(
-            timeout=self["pyzor_timeout"]
-        )
+        if self.eval_rules_used(ruleset):
+            self["client"] = pyzor.client.BatchClient(
+                timeout=self["pyzor_timeout"]
+            )
+        self["cache"] = pad.cache.TTLCache("pyzor", self["pyzor_cache_size"],
+                                           self["pyzor_cache_ttl"])
+        # The digest of a body never changes, these entries don't
+        # need to expire.
+        self["digest_cache"] = pad.cache.TTLCache(
+            "pyzor_digest", self["pyzor_cache_size"])
+
+    def _get_client(self):
+        """Get the Pyzor client, it's only created here when messages
+        are reported without any rule using it.
+        """
+        try:
+            return self["client"]
+        except KeyError:
+            self["client"] = pyzor.client.BatchClient(
+                timeout=self["pyzor_timeout"])
+            return self["client"]
+
+    def _get_cache(self):
+        """Get the cache of the Pyzor responses."""
+        try:
+            return self["cache"]
+        except KeyError:
+            self["cache"] = pad.cache.TTLCache(
+                "pyzor", self["pyzor_cache_size"], self["pyzor_cache_ttl"])
+            return self["cache"]
+
+    def _get_digest_cache(self):
+        """Get the cache of the digests."""
+        try:
+            return self["digest_cache"]
+        except KeyError:
+            self["digest_cache"] = pad.cache.TTLCache(
+                "pyzor_digest", self["pyzor_cache_size"])
+            return self["digest_cache"]
+
+    def _get_digest(self, msg):
+        """Compute the Pyzor digest of the message. Digests are cached,
+        so it's not computed again when the same body was just seen.
+        """
+        cache = self._get_digest_cache()
+        body_key = pad.cache.get_body_key(msg)
+        digest = cache.get(body_key)
+        if digest is None:
+            digest = pyzor.digest.DataDigester(msg.msg).value
+            cache.set(body_key, digest)
+        return digest
+
+    def _check_server(self, server, digest):
+        """Get the (count, wl_count) for this digest from the server.
+        The results are cached for `pyzor_cache_ttl` seconds.
+        """
+        response = self._get_client().check(digest, server.rsplit(":", 1))
+        result = (int(response["Count"]), int(response["WL-Count"]))
+        self._get_cache().set((server, digest), result)
+        return result
 
     def check_pyzor(self, msg, target=None):
         """Check the message with the defined pyzor servers.
         Stores the digest so it can be later used for reporting.
 
+        The servers without a cached response for this digest are
+        queried concurrently, and the check waits at most `pyzor_timeout`
+        seconds for all of them.
+
         :return: True if the message is listed on Pyzor at least
           `pyzor_max` times and was never whitelisted.
         """
         if not self["use_pyzor"]:
             return False
-        digest = pyzor.digest.DataDigester(msg.msg).value
+        digest = self._get_digest(msg)
         # Store the digest data in the local message context, so it can be
         # used for reporting later.
         self.set_local(msg, "digest", digest)
         msg.plugin_tags["PYZOR_DIGEST"] = digest
 
-        client = self["client"]
+        servers = self["pyzor_servers"]
+        if not servers:
+            return False
         self.ctxt.log.debug("Checking digest %s with Pyzor", digest)
-        for server in self["pyzor_servers"]:
-            response = client.check(digest, server.rsplit(":", 1))
-            r_count = int(response["Count"])
-            wl_count = int(response["WL-Count"])
+        cache = self._get_cache()
+        results = []
+        for server in servers:
+            result = cache.get((server, digest))
+            if result is None:
+                result = pad.pool.get_pool("pyzor", len(servers)).apply_async(
+                    self._check_server, (server, digest))
+            results.append((server, result))
+        deadline = time.time() + self["pyzor_timeout"]
+        for server, result in results:
+            try:
+                if not isinstance(result, tuple):
+                    result = result.get(max(0, deadline - time.time()))
+                r_count, wl_count = result
+            except multiprocessing.TimeoutError:
+                self.ctxt.log.info("Timeout while checking digest with "
+                                   "Pyzor server %s", server)
+                continue
+            except (pyzor.CommError, IOError) as e:
+                self.ctxt.log.info("Error while checking digest with "
+                                   "Pyzor server %s: %s", server, e)
+                continue
             self.ctxt.log.debug("Response from %s: (%s, %s)", server, r_count,
                                 wl_count)
             msg.plugin_tags["PYZOR_COUNT"] = r_count
@@ -70,12 +162,15 @@ class PyzorPlugin(pad.plugins.base.BasePlugin):
         try:
             digest = self.get_local(msg, "digest")
         except KeyError:
-            digest = pyzor.digest.DataDigester(msg.msg).value
+            digest = self._get_digest(msg)
             self.set_local(msg, "digest", digest)
-        client = self["client"]
+        client = self._get_client()
+        cache = self._get_cache()
         self.ctxt.log.debug("Reporting digest %s with Pyzor (%s)", digest,
                             spam)
         for server in self["pyzor_servers"]:
+            # The counts for this digest are about to change.
+            cache.invalidate((server, digest))
             if spam:
                 client.report(digest, server.rsplit(":", 1))
             else:
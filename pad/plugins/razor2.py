@@ -1,10 +1,36 @@
 """Razor2 check plugin."""
 
+import os
+import time
 import threading
 import subprocess
+import multiprocessing
 
+import pad.pool
+import pad.stats
+import pad.cache
+import pad.rules.eval_
 import pad.plugins.base
 
+# The semaphore limiting the number of razor processes started by the
+# current process at the same time.
+_processes = None
+_processes_key = None
+
+
+def _get_processes(limit):
+    """Get the semaphore of the current process, with the specified
+    limit. The limit is per process: a semaphore shared by the
+    workers of a pre-forked server would lose a slot every time a
+    worker is killed while running razor.
+    """
+    global _processes, _processes_key
+    key = (os.getpid(), limit)
+    if _processes is None or _processes_key != key:
+        _processes = threading.BoundedSemaphore(limit)
+        _processes_key = key
+    return _processes
+
 
 def kill_process(process, log):
     log.debug("Razor timed out")
@@ -17,9 +43,64 @@ class Razor2Plugin(pad.plugins.base.BasePlugin):
 
     options = {"use_razor2": ("bool", True),
                "razor_timeout": ("int", 5),
-               "razor_config": ("str", "")
+               "razor_config": ("str", ""),
+               "razor_max_processes": ("int", 4),
+               "razor_cache_size": ("int", 10000),
+               "razor_cache_ttl": ("float", 300.0),
                }
 
+    def finish_parsing_end(self, ruleset):
+        """Check if razor-check should be started for every message,
+        and prepare the cache.
+        """
+        super(Razor2Plugin, self).finish_parsing_end(ruleset)
+        prefetch = False
+        for rule_list in (ruleset.checked, ruleset.not_checked):
+            for rule in rule_list.values():
+                if (isinstance(rule, pad.rules.eval_.EvalRule) and
+                        rule.eval_rule_name == "check_razor2"):
+                    prefetch = True
+        self["prefetch"] = prefetch
+        self["cache"] = pad.cache.TTLCache("razor2", self["razor_cache_size"],
+                                           self["razor_cache_ttl"])
+
+    def _get_cache(self):
+        """Get the cache of the razor-check results."""
+        try:
+            return self["cache"]
+        except KeyError:
+            self["cache"] = pad.cache.TTLCache(
+                "razor2", self["razor_cache_size"], self["razor_cache_ttl"])
+            return self["cache"]
+
+    def _get_processes(self):
+        """Get the semaphore that limits the number of razor
+        processes running at the same time in this process.
+        """
+        return _get_processes(max(1, self["razor_max_processes"]))
+
+    def match_start(self, ruleset, msg):
+        """Start razor-check in the background, so that it runs while
+        the other rules are checked.
+        """
+        super(Razor2Plugin, self).match_start(ruleset, msg)
+        try:
+            prefetch = self["prefetch"]
+        except KeyError:
+            return
+        if not prefetch or not self["use_razor2"]:
+            return
+        body_key = pad.cache.get_body_key(msg)
+        cached = self._get_cache().get(body_key)
+        if cached is not None:
+            self.set_local(msg, "razor2_result", cached)
+            return
+        deadline = time.time() + self["razor_timeout"]
+        workers = max(1, self["razor_max_processes"])
+        pending = pad.pool.get_pool("razor2", workers).apply_async(
+            self.launch_subprocess, (msg, "razor-check", deadline))
+        self.set_local(msg, "razor2_pending", (pending, deadline))
+
     def check_razor2_range(self, msg, engine, min, max, target=None):
         """
         Not implemented. Use pyzor in order to check range conditions.
@@ -37,6 +118,10 @@ class Razor2Plugin(pad.plugins.base.BasePlugin):
         by communicating with a Razor Catalogue Server.
             If we have returncode = 1 => it's not a spam
             If we have returncode = 0 => it's a spam
+
+        The results are cached by the content of the message for
+        `razor_cache_ttl` seconds.
+
         :param msg: Message to be check
         :param full: Not used
         :param target: "None" by default
@@ -49,68 +134,93 @@ class Razor2Plugin(pad.plugins.base.BasePlugin):
             return self.get_local(msg, "razor2_result")
         except KeyError:
             pass
-        self.set_local(msg, "razor2_result", 0)
 
-        if not self["razor_config"]:
-            args = ["razor-check"]
-        else:
-            conf_arg = "-conf=" + self["razor_config"]
-            args = ["razor-check", conf_arg]
-        try:
-            proc = subprocess.Popen(args, stderr=subprocess.PIPE,
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE)
-        except OSError as e:
-            self.ctxt.log.error("Unable to run razor-check: %s", e)
-            return
+        body_key = pad.cache.get_body_key(msg)
+        cache = self._get_cache()
+        result = cache.get(body_key)
+        if result is not None:
+            self.set_local(msg, "razor2_result", result)
+            return result
 
-        my_timer = threading.Timer(self["razor_timeout"], kill_process,
-                                   [proc, self.ctxt.log])
         try:
-            my_timer.start()
-            proc.communicate(input=str.encode(msg.raw_msg))
-        finally:
-            my_timer.cancel()
-
-        if proc.returncode in (1, 0):
-            self.set_local(msg, "razor2_result", proc.returncode)
-        self.ctxt.log.debug(proc.returncode)
-        return not proc.returncode
-
-    def launch_subprocess(self, msg, name):
+            pending, deadline = self.get_local(msg, "razor2_pending")
+        except KeyError:
+            returncode = self.launch_subprocess(msg, "razor-check")
+        else:
+            try:
+                returncode = pending.get(max(0, deadline - time.time()))
+            except multiprocessing.TimeoutError:
+                self.ctxt.log.debug("Razor timed out")
+                returncode = False
+        self.ctxt.log.debug(returncode)
+
+        if returncode is None:
+            self.set_local(msg, "razor2_result", 0)
+            return None
+        # False is returned on errors, and it's equal to 0.
+        if returncode is False or returncode not in (1, 0):
+            self.set_local(msg, "razor2_result", 0)
+            return False
+        result = not returncode
+        self.set_local(msg, "razor2_result", result)
+        cache.set(body_key, result)
+        return result
+
+    def launch_subprocess(self, msg, name, deadline=None):
+        """Run the razor command with the message as input. At most
+        `razor_max_processes` commands are run at the same time, and
+        they are killed after `razor_timeout` seconds.
+
+        :return: The return code of the command, None if it could not
+          be started or False if it failed.
+        """
+        if deadline is None:
+            deadline = time.time() + self["razor_timeout"]
         if not self["razor_config"]:
             args = [name]
         else:
             conf_arg = "-conf=" + self["razor_config"]
             args = [name, conf_arg]
 
+        processes = self._get_processes()
+        if not processes.acquire(True, max(0, deadline - time.time())):
+            self.ctxt.log.warning("Too many razor processes running, "
+                                  "unable to run %s", name)
+            pad.stats.incr("razor_busy_total", command=name)
+            return False
+        start = time.time()
         try:
-            proc = subprocess.Popen(args, stderr=subprocess.PIPE,
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE)
-        except OSError:
-            self.ctxt.log.warning("Unable to run " + name)
-            return
-
-        my_timer = threading.Timer(self["razor_timeout"], kill_process,
-                                   [proc, self.ctxt.log])
-        my_timer.start()
-        try:
-            proc.communicate(input=str.encode(msg.raw_msg))
-            return proc.returncode
-        except (IOError, OSError):
-            self.ctxt.log.warning("Unable to communicate to " + name)
+            try:
+                proc = subprocess.Popen(args, stderr=subprocess.PIPE,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE)
+            except OSError:
+                self.ctxt.log.warning("Unable to run " + name)
+                return
+
+            my_timer = threading.Timer(max(0, deadline - time.time()),
+                                       kill_process, [proc, self.ctxt.log])
+            my_timer.start()
+            try:
+                proc.communicate(input=str.encode(msg.raw_msg))
+                return proc.returncode
+            except (IOError, OSError):
+                self.ctxt.log.warning("Unable to communicate to " + name)
+            finally:
+                my_timer.cancel()
         finally:
-            my_timer.cancel()
+            processes.release()
+            pad.stats.observe("razor_process_seconds", time.time() - start,
+                              command=name)
 
         return False
 
     def plugin_report(self, msg):
         """Report the message to razor server as spam."""
-
+        self._get_cache().invalidate(pad.cache.get_body_key(msg))
         self.launch_subprocess(msg, "razor-report")
 
     def plugin_revoke(self, msg):
         """Report the message to razor server as ham."""
-
-        self.launch_subprocess(msg, "razor-revoke")
\ No newline at end of file
+        self._get_cache().invalidate(pad.cache.get_body_key(msg))
+        self.launch_subprocess(msg, "razor-revoke")
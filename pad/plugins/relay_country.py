@@ -22,8 +22,28 @@ except ImportError:
             "RelayCountryPlugin not loaded. You must install py2-ipaddress to "
             "use this plugin")
 
+import pad.cache
 import pad.plugins.base
 
+# The values of the "geodb_mode" option.
+GEODB_MODES = {
+    # Read the database file for every lookup.
+    "standard": pygeoip.STANDARD,
+    # Map the database file in memory.
+    "mmap": pygeoip.MMAP_CACHE,
+    # Load the whole database in memory.
+    "memory": pygeoip.MEMORY_CACHE,
+}
+
+
+def is_reserved(ipaddr):
+    """Check if the IP address is not public and so can't be found
+    in the database.
+    """
+    return (ipaddr.is_private or ipaddr.is_reserved or ipaddr.is_loopback or
+            ipaddr.is_link_local or ipaddr.is_multicast or
+            ipaddr.is_unspecified)
+
 
 class RelayCountryPlugin(pad.plugins.base.BasePlugin):
     """This plugin exposes the countries that a mail was relayed from.
@@ -36,7 +56,9 @@ class RelayCountryPlugin(pad.plugins.base.BasePlugin):
     .dat.gz
     """
     options = {"geodb": ("str", "GeoIP.dat"),
-               "geodb-ipv6": ("str", "GeoIPv6.dat")}
+               "geodb-ipv6": ("str", "GeoIPv6.dat"),
+               "geodb_mode": ("str", "memory"),
+               "geodb_cache_size": ("int", 10000)}
 
     def finish_parsing_end(self, ruleset):
         super(RelayCountryPlugin, self).finish_parsing_end(ruleset)
@@ -44,12 +66,32 @@ class RelayCountryPlugin(pad.plugins.base.BasePlugin):
         reader_ipv6 = self.load_database("-ipv6")
         self["ipv4"] = reader_ipv4
         self["ipv6"] = reader_ipv6
+        self["cache"] = pad.cache.TTLCache("relay_country",
+                                           self["geodb_cache_size"])
+
+    def _get_cache(self):
+        """Get the cache of the countries, by IP address."""
+        try:
+            return self["cache"]
+        except KeyError:
+            self["cache"] = pad.cache.TTLCache("relay_country",
+                                               self["geodb_cache_size"])
+            return self["cache"]
 
     def load_database(self, which=""):
         """Load the csv file and create a list of items where to search the IP.
+
+        The database is accessed as set by `geodb_mode`.
         """
+        mode = self["geodb_mode"]
+        try:
+            flags = GEODB_MODES[mode.lower()]
+        except KeyError:
+            self.ctxt.log.warning("Invalid geodb_mode %r, using 'standard'",
+                                  mode)
+            flags = pygeoip.STANDARD
         try:
-            return pygeoip.GeoIP(self["geodb" + which])
+            return pygeoip.GeoIP(self["geodb" + which], flags)
         except IOError as exc:
             self.ctxt.log.warning("Unable to open geo database file: %r", exc)
         return None
@@ -57,16 +99,32 @@ class RelayCountryPlugin(pad.plugins.base.BasePlugin):
     def get_country(self, ipaddr):
         """Return the country corresponding to an IP based on the
         network range database.
+
+        The results are cached by IP address. Reserved addresses are
+        not searched in the database.
+        """
+        cache = self._get_cache()
+        country = cache.get(ipaddr)
+        if country is None:
+            if is_reserved(ipaddr):
+                country = "**"
+            else:
+                country = self._lookup_country(ipaddr)
+            if country is not None:
+                cache.set(ipaddr, country)
+        return country or "XX"
+
+    def _lookup_country(self, ipaddr):
+        """Search the IP address in the database, None is returned if
+        the database is not loaded.
         """
-        if ipaddr.is_private:
-            return "**"
         if ipaddr.version == 4:
             reader = self["ipv4"]
         else:
             reader = self["ipv6"]
         if not reader:
             self.ctxt.log.warning("Database not loaded.")
-            return "XX"
+            return None
         response = reader.country_code_by_addr(str(ipaddr))
         if not response:
             self.ctxt.log.info("Can't locate IP '%s' in database", ipaddr)
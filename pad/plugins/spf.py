@@ -3,7 +3,17 @@
 from __future__ import absolute_import
 
 import re
+import time
+import multiprocessing
+
 import spf
+import dns.name
+import dns.exception
+import dns.reversename
+
+import pad.pool
+import pad.cache
+import pad.errors
 import pad.plugins.base
 
 RECEIVED_RE = re.compile(r"""
@@ -18,6 +28,87 @@ AUTHRES_RE = re.compile(r"""
     \bsmtp\.(\S+)\s*=[^;]+)?
 """, re.I | re.S | re.X | re.M)
 
+# The number of SPF checks that can run at the same time in a
+# process.
+WORKERS = 4
+
+
+class SPFQuery(spf.query):
+    """SPF query that uses the DNS interface of PAD, so the answers
+    are cached and shared with the other plugins. The SPF records of
+    the domains are also cached.
+    """
+
+    def __init__(self, resolver, policies, *args, **kwargs):
+        """
+        :param resolver: The `pad.dns_interface.DNSInterface`.
+        :param policies: The `pad.cache.TTLCache` for the SPF records.
+        """
+        spf.query.__init__(self, *args, **kwargs)
+        self.resolver = resolver
+        self.policies = policies
+
+    @staticmethod
+    def _convert(qtype, rdata):
+        """Convert the record to the value expected by `spf.query`."""
+        if qtype in ("A", "AAAA"):
+            return rdata.address
+        if qtype == "MX":
+            return rdata.preference, rdata.exchange.to_text(True)
+        if qtype == "PTR":
+            return rdata.target.to_text(True)
+        return rdata.strings
+
+    def dns(self, name, qtype, cnames=None, ignore_void=False):
+        """Get the records from the DNS interface. CNAMEs are already
+        followed by the resolver.
+
+        Raises `spf.TempError` if the query failed, so it's not taken
+        as an empty answer.
+        """
+        name = str(name).rstrip(".").lower()
+        if not name:
+            raise spf.PermError("Invalid query")
+        if not all(0 < len(label) < 64 for label in name.split(".")):
+            return []
+        key = (name, qtype)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        qname = name
+        if qtype == "PTR":
+            # The DNS interface expects the address for PTR queries.
+            try:
+                qname = dns.reversename.to_address(dns.name.from_text(name))
+            except (dns.exception.DNSException, ValueError):
+                return []
+        try:
+            answer = self.resolver.query(qname, qtype, strict=True)
+        except pad.errors.DNSError as e:
+            raise spf.TempError("DNS %s" % e)
+        result = [self._convert(qtype, rdata) for rdata in answer]
+        self.cache[key] = result
+        if not result and not ignore_void:
+            self.void_lookups += 1
+            if self.void_lookups > spf.MAX_VOID_LOOKUPS:
+                raise spf.PermError("Void lookup limit of %d exceeded" %
+                                    spf.MAX_VOID_LOOKUPS)
+        return result
+
+    def dns_spf(self, domain):
+        """Get the SPF record of the domain, records are cached by
+        domain.
+        """
+        domain = domain.lower()
+        record = self.policies.get(domain)
+        if record is None:
+            record = spf.query.dns_spf(self, domain)
+            # Domains without a SPF record are cached as well, failed
+            # lookups raise TempError and are never cached.
+            self.policies.set(domain, record or "")
+        return record or None
+
 
 class SpfPlugin(pad.plugins.base.BasePlugin):
     eval_rules = (
@@ -45,17 +136,51 @@ class SpfPlugin(pad.plugins.base.BasePlugin):
         "do_not_use_mail_spf": ("bool", False),
         "do_not_use_mail_spf_query": ("bool", False),
         "ignore_received_spf_header": ("bool", False),
-        "use_newest_received_spf_header": ("bool", False)
+        "use_newest_received_spf_header": ("bool", False),
+        "spf_cache_size": ("int", 10000),
+        "spf_cache_ttl": ("int", 300),
     }
 
-    def parsed_metadata(self, msg):
+    def finish_parsing_end(self, ruleset):
+        """Create the caches of the SPF results and records."""
+        super(SpfPlugin, self).finish_parsing_end(ruleset)
+        self["cache"] = pad.cache.TTLCache("spf", self["spf_cache_size"],
+                                           self["spf_cache_ttl"])
+        self["policy_cache"] = pad.cache.TTLCache(
+            "spf_policy", self["spf_cache_size"], self["spf_cache_ttl"])
+
+    def _get_cache(self):
+        """Get the cache of the SPF results."""
+        try:
+            return self["cache"]
+        except KeyError:
+            self["cache"] = pad.cache.TTLCache(
+                "spf", self["spf_cache_size"], self["spf_cache_ttl"])
+            return self["cache"]
+
+    def _get_policy_cache(self):
+        """Get the cache of the SPF records, by domain."""
+        try:
+            return self["policy_cache"]
+        except KeyError:
+            self["policy_cache"] = pad.cache.TTLCache(
+                "spf_policy", self["spf_cache_size"], self["spf_cache_ttl"])
+            return self["policy_cache"]
+
+    def match_start(self, ruleset, msg):
         if self.get_global("ignore_received_spf_header"):
             # The plugin will ignore the spf headers and will perform
-            # SPF check by itself by querying the dns
+            # SPF check by itself by querying the dns. The check is
+            # started now and runs while the other rules are checked.
+            if not msg.hostname_with_ip:
+                self.set_local(msg, 'spf_result', '')
+                return
             timeout = self.get_global('spf_timeout')
             mx, ip = msg.hostname_with_ip[0]
-            spf_result = self._query_spf(timeout, ip, mx, msg.sender_address)
-            self.set_local(msg, 'spf_result', spf_result)
+            pending = pad.pool.get_pool("spf", WORKERS).apply_async(
+                self._query_spf, (timeout, ip, mx, msg.sender_address))
+            self.set_local(msg, 'spf_pending',
+                           (pending, time.time() + timeout))
         else:
             # The plugin will try to use the SPF results found in any
             # Received-SPF headers it finds in the message that could only
@@ -64,47 +189,67 @@ class SpfPlugin(pad.plugins.base.BasePlugin):
                 msg, self.get_global("use_newest_received_spf_header"))
             self.set_local(msg, 'spf_result', result)
 
+    def _get_result(self, msg):
+        """Get the SPF result of the message, waiting for the check to
+        finish if it's still running.
+        """
+        try:
+            return self.get_local(msg, "spf_result")
+        except KeyError:
+            pass
+        try:
+            pending, deadline = self.get_local(msg, "spf_pending")
+        except KeyError:
+            return ""
+        try:
+            result = pending.get(max(0, deadline - time.time()))
+        except multiprocessing.TimeoutError:
+            self.ctxt.log.info("SPF::Plugin timeout while checking SPF")
+            result = "temperror"
+        self.set_local(msg, "spf_result", result)
+        return result
+
     def check_for_spf_pass(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "pass"
+        return self._get_result(msg) == "pass"
 
     def check_for_spf_neutral(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "neutral"
+        return self._get_result(msg) == "neutral"
 
     def check_for_spf_none(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "none"
+        return self._get_result(msg) == "none"
 
     def check_for_spf_fail(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "fail"
+        return self._get_result(msg) == "fail"
 
     def check_for_spf_softfail(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "softfail"
+        return self._get_result(msg) == "softfail"
 
     def check_for_spf_permerror(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "permerror"
+        return self._get_result(msg) == "permerror"
 
     def check_for_spf_temperror(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "temperror"
+        return self._get_result(msg) == "temperror"
 
     def check_for_spf_helo_pass(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "helo_pass"
+        return self._get_result(msg) == "helo_pass"
 
     def check_for_spf_helo_neutral(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "helo_neutral"
+        return self._get_result(msg) == "helo_neutral"
 
     def check_for_spf_helo_none(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "helo_none"
+        return self._get_result(msg) == "helo_none"
 
     def check_for_spf_helo_fail(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "helo_fail"
+        return self._get_result(msg) == "helo_fail"
 
     def check_for_spf_helo_softfail(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "helo_softfail"
+        return self._get_result(msg) == "helo_softfail"
 
     def check_for_spf_helo_permerror(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "helo_permerror"
+        return self._get_result(msg) == "helo_permerror"
 
     def check_for_spf_helo_temperror(self, msg, target=None):
-        return self.get_local(msg, "spf_result") == "helo_temperror"
+        return self._get_result(msg) == "helo_temperror"
 
     def check_for_spf_whitelist_from(self, msg, target=None):
         if msg.sender_address in self.get_global("whitelist_from_spf"):
@@ -166,9 +311,30 @@ class SpfPlugin(pad.plugins.base.BasePlugin):
         return result
 
     def _query_spf(self, timeout, ip, mx, sender_address):
+        """Check the SPF records for this relay and sender.
+
+        Results are cached by (ip, sender domain, helo) for
+        `spf_cache_ttl` seconds, except for temporary errors.
+        """
+        domain = (sender_address or "").rpartition("@")[2].lower()
+        key = (ip, domain, (mx or "").lower())
+        cache = self._get_cache()
+        result = cache.get(key)
+        if result is not None:
+            self.ctxt.log.debug("SPF::Plugin cached result for %s: %s",
+                                key, result)
+            return result
         self.ctxt.log.debug("SPF::Plugin %s",
                             "Querying the dns server(%s, %s, %s)..."
                             % (ip, mx, sender_address))
-        result, comment = spf.check2(i=ip, s=sender_address,
-                                     h=mx, timeout=timeout)
+        try:
+            query = SPFQuery(self.ctxt.dns, self._get_policy_cache(),
+                             i=ip, s=sender_address, h=mx, timeout=timeout,
+                             querytime=timeout)
+        except spf.PermError as e:
+            self.ctxt.log.info("SPF::Plugin invalid query: %s", e)
+            return ""
+        result, dummy, comment = query.check()
+        if result != "temperror":
+            cache.set(key, result)
         return result
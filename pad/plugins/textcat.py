@@ -10,17 +10,40 @@ ur vi zh-cn zh-tw
 
 from __future__ import absolute_import
 
+import pad.lazy
 import pad.errors
 
-try:
-    import langdetect
-except ImportError:
+if not pad.lazy.is_available("langdetect"):
     raise pad.errors.PluginLoadError(
             "TextCat not loaded. You must install langdetect to use this "
             "plugin")
 
 import pad.plugins.base
 
+# langdetect is only imported if the check_language rule is used.
+langdetect = pad.lazy.LazyModule("langdetect",
+                                 "langdetect.detector_factory",
+                                 "langdetect.lang_detect_exception")
+
+# The number of chunks taken from the text when it's larger than
+# the sample size.
+SAMPLE_PARTS = 4
+
+
+def get_sample(text, size):
+    """Get at most `size` characters from the text to detect the
+    language. The sample is made of chunks evenly spaced over the
+    whole text, so the result is always the same for the same text.
+    """
+    if size <= 0 or len(text) <= size:
+        return text
+    part_size = size // SAMPLE_PARTS
+    if not part_size:
+        return text[:size]
+    step = (len(text) - part_size) // (SAMPLE_PARTS - 1)
+    return " ".join(text[i * step:i * step + part_size]
+                    for i in range(SAMPLE_PARTS))
+
 
 class TextCatPlugin(pad.plugins.base.BasePlugin):
     """This plugin will detect the language of the
@@ -30,6 +53,7 @@ class TextCatPlugin(pad.plugins.base.BasePlugin):
         "ok_languages": ("list", "all"),
         "textcat_max_languages": ("int", 5),
         "textcat_acceptable_prob": ("float", 0.70),
+        "textcat_sample_size": ("int", 4096),
         # The rest of these are not used, and are
         # just here for backwards compatibility
         # XXX We should add a warning here if these
@@ -47,6 +71,39 @@ class TextCatPlugin(pad.plugins.base.BasePlugin):
         super(TextCatPlugin, self).set_list_option(global_key, value,
                                                    separator)
 
+    def finish_parsing_end(self, ruleset):
+        """Load the language profiles now, instead of while checking
+        the first message. Nothing is loaded if no rule uses
+        check_language.
+        """
+        super(TextCatPlugin, self).finish_parsing_end(ruleset)
+        if not self.eval_rules_used(ruleset):
+            return
+        langdetect.detector_factory.init_factory()
+        # langdetect uses random sampling, always get the same result
+        # for the same text.
+        langdetect.DetectorFactory.seed = 0
+
+    def _get_languages(self, msg):
+        """Detect the languages of the message, only once per
+        message.
+        """
+        try:
+            return self.get_local(msg, "languages")
+        except KeyError:
+            pass
+        prob = self["textcat_acceptable_prob"]
+        sample = get_sample(msg.text, self["textcat_sample_size"])
+        try:
+            results = langdetect.detect_langs(sample)
+        except langdetect.lang_detect_exception.LangDetectException as e:
+            self.ctxt.log.debug("TextCat unable to detect language: %s", e)
+            results = []
+        self.ctxt.log.debug("TextCat results: %s", results)
+        langs = [lang.lang for lang in results if lang.prob > prob]
+        self.set_local(msg, "languages", langs)
+        return langs
+
     def check_language(self, msg, target=None):
         """Check the language of the message.
 
@@ -54,13 +111,13 @@ class TextCatPlugin(pad.plugins.base.BasePlugin):
         rule if it is present in the config and the languages
         are not in the ok list.
 
+        At most `textcat_sample_size` characters of the text
+        are used to detect the language.
+
         :return True if the message language is unwanted and False
         otherwise
         """
-        prob = self["textcat_acceptable_prob"]
-        results = langdetect.detect_langs(msg.text)
-        self.ctxt.log.debug("TextCat results: %s", results)
-        langs = [lang.lang for lang in results if lang.prob > prob]
+        langs = self._get_languages(msg)
         if len(langs) > self["textcat_max_languages"]:
             self.ctxt.log.debug("Too many languages.")
             return False
@@ -5,6 +5,7 @@ from __future__ import absolute_import
 import re
 
 import pad.regex
+import pad.rules.eval_
 import pad.plugins.base
 
 
@@ -39,26 +40,44 @@ class WhiteListSubjectPlugin(pad.plugins.base.BasePlugin):
         self.options[key][1].append(value)
         self[key] = self.options[key][1]
 
+    def finish_parsing_end(self, ruleset):
+        """Compile the regular expressions of the subjects lists."""
+        super(WhiteListSubjectPlugin, self).finish_parsing_end(ruleset)
+        for key in ("whitelist_subject", "blacklist_subject"):
+            self[key + "_re"] = [re.compile(item)
+                                 for item in self.options[key][1]]
+
+    def _get_subject_list(self, key):
+        """Get the compiled regular expressions of this subjects
+        list.
+        """
+        try:
+            return self[key + "_re"]
+        except KeyError:
+            return self.options[key][1]
+
     def check_subject_in_whitelist(self, msg, target=None):
         """Check the subject in the blacklist subjects list
         """
-        return self._check_subject(msg, self.options["whitelist_subject"][1])
+        return self._check_subject(msg,
+                                   self._get_subject_list("whitelist_subject"))
 
     def check_subject_in_blacklist(self, msg, target=None):
         """Check the subject in the blacklist subjects list
         """
-        return self._check_subject(msg, self.options["blacklist_subject"][1])
+        return self._check_subject(msg,
+                                   self._get_subject_list("blacklist_subject"))
 
     def _check_subject(self, msg, option_list):
         """ Does the work for checking the subject in the whitelist/blacklist
         subjects list.
 
-        option_list is either self.options["whitelist_subject"] or
-        self.options["blacklist_subject"]
+        option_list is either the "whitelist_subject" or the
+        "blacklist_subject" regular expressions, compiled or not.
         """
         subject = msg.msg["subject"]
         for item in option_list:
-            mo = re.match(item, subject)
+            mo = pad.rules.eval_.regex_arg(item).match(subject)
             if mo:
                 return True
         return False
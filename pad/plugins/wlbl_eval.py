@@ -19,6 +19,75 @@ TO_HEADERS = ('To', 'Resent-To', 'Resent-Cc', 'Apparently-To', 'Delivered-To',
               'Cc')
 #TL_TLDS = ['com', 'co.uk', 'multi.surbl.org']
 
+# Matches regular expressions that only contain literal characters.
+LITERAL_RE = re.compile(r"^(?:\\.|[^.^$*+?{}\[\]|()\\])*$")
+UNESCAPE_RE = re.compile(r"\\(.)")
+
+
+class AddressMatcher(object):
+    """Match addresses against a list of regular expressions, as
+    returned by `WLBLEvalPlugin.parse_list`.
+
+    The expressions are combined in a single compiled pattern. The
+    ones that don't use any wildcards are also stored in a set, so
+    exact matches are found without running the pattern.
+    """
+
+    def __init__(self, regexes):
+        self.exact = set()
+        self._patterns = []
+        for regex in regexes:
+            if LITERAL_RE.match(regex):
+                self.exact.add(UNESCAPE_RE.sub(r"\1", regex))
+        regexes = list(regexes)
+        if not regexes:
+            return
+        try:
+            self._patterns.append(re.compile(
+                "|".join("(?:%s)" % regex for regex in regexes)))
+        except re.error:
+            # Keep the valid expressions.
+            for regex in regexes:
+                try:
+                    self._patterns.append(re.compile(regex))
+                except re.error:
+                    continue
+
+    def match(self, address):
+        """Check if any of the expressions matches the address."""
+        if address in self.exact:
+            return True
+        for pattern in self._patterns:
+            if pattern.search(address):
+                return True
+        return False
+
+
+class HostMatcher(object):
+    """Match hosts that end with any of the listed domains.
+
+    The domains are indexed by their length, so a lookup only needs
+    one set lookup for every distinct length in the list.
+    """
+
+    def __init__(self, domains):
+        suffixes = defaultdict(set)
+        for domain in domains:
+            suffixes[len(domain)].add(domain)
+        self.match_all = 0 in suffixes
+        self._suffixes = sorted(suffixes.items())
+
+    def match(self, host):
+        """Check if the host ends with any of the domains."""
+        if self.match_all:
+            return True
+        for length, domains in self._suffixes:
+            if length > len(host):
+                break
+            if host[-length:] in domains:
+                return True
+        return False
+
 
 class WLBLEvalPlugin(pad.plugins.base.BasePlugin):
     eval_rules = ("check_from_in_whitelist", "check_to_in_whitelist",
@@ -72,13 +141,12 @@ class WLBLEvalPlugin(pad.plugins.base.BasePlugin):
         "parsed_blacklist_uri_host": ("dict", {})
     }
 
-    def check_start(self, msg):
+    def finish_parsing_end(self, ruleset):
         """Parses all the required white and blacklists. Stores
-        the results in the the "parsed" versions.
+        the results in the the "parsed" versions, and prepares
+        the matchers used when checking the messages.
         """
-        self.set_local(msg, "from_in_whitelist", 0)
-        self.set_local(msg, "from_in_default_whitelist", 0)
-
+        super(WLBLEvalPlugin, self).finish_parsing_end(ruleset)
         self['parsed_whitelist_from'] = self.parse_list('whitelist_from')
         self['parsed_whitelist_to'] = self.parse_list('whitelist_to')
         self['parsed_blacklist_from'] = self.parse_list('blacklist_from')
@@ -100,6 +168,77 @@ class WLBLEvalPlugin(pad.plugins.base.BasePlugin):
             'blacklist_uri_host')
         self['parsed_enlist_uri_host'] = self.parse_list_uri('enlist_uri_host')
 
+        self["address_matchers"] = dict(
+            (list_name, AddressMatcher(self[list_name]))
+            for list_name, (list_type, dummy) in self.parsed_lists.items()
+            if list_type == "list"
+        )
+        self["rcvd_matchers"] = dict(
+            (list_name, self.compile_rcvd(self[list_name]))
+            for list_name in ("parsed_def_whitelist_from_rcvd",
+                              "parsed_whitelist_from_rcvd")
+        )
+        self["uri_host_matchers"] = self.compile_list_uri(
+            self['parsed_enlist_uri_host'])
+
+    def check_start(self, msg):
+        """Reset the whitelist results for this message."""
+        self.set_local(msg, "from_in_whitelist", 0)
+        self.set_local(msg, "from_in_default_whitelist", 0)
+
+    def compile_rcvd(self, parsed_list):
+        """Compile the regexes from a list parsed with `parse_input`.
+
+        :return: A list of (compiled regex, domains) tuples.
+        """
+        compiled = []
+        for white_addr, domains in parsed_list.items():
+            try:
+                regex = re.compile(white_addr.replace("*", ".*"))
+            except re.error as e:
+                self.ctxt.err("Invalid address %s: %s", white_addr, e)
+                regex = None
+            compiled.append((regex, domains))
+        return compiled
+
+    def compile_list_uri(self, parsed_list):
+        """Prepare the matchers for a list parsed with
+        `parse_list_uri`.
+
+        :return: A dictionary with the list name as key and a
+          (excluded hosts, `HostMatcher`) tuple as value.
+        """
+        compiled = defaultdict(lambda: (set(), HostMatcher(())))
+        for list_name, hosts in parsed_list.items():
+            compiled[list_name] = (set(hosts["not_in_list"]),
+                                   HostMatcher(hosts["in_list"]))
+        return compiled
+
+    def get_address_matcher(self, list_name):
+        """Get the matcher for this parsed list."""
+        try:
+            return self["address_matchers"][list_name]
+        except KeyError:
+            return AddressMatcher(self[list_name])
+
+    def get_rcvd_matcher(self, list_name):
+        """Get the compiled version of this parsed list."""
+        try:
+            return self["rcvd_matchers"][list_name]
+        except KeyError:
+            return self.compile_rcvd(self[list_name])
+
+    def get_uri_host_matcher(self, list_name):
+        """Get the excluded hosts and the matcher of this URI
+        host list.
+        """
+        try:
+            return self["uri_host_matchers"][list_name]
+        except KeyError:
+            return self.compile_list_uri(
+                {list_name: self['parsed_enlist_uri_host'][list_name]}
+            )[list_name]
+
     def check_input(self, address):
         characters = ["?", "@", ".", "*@"]
         return len([e for e in characters if e in address])
@@ -201,11 +340,14 @@ class WLBLEvalPlugin(pad.plugins.base.BasePlugin):
         "from_in_whitelist" msg value based on the list name
         """
         param = "from_in_whitelist"
+        addresses = list(addresses)
+        if not addresses:
+            return False
+        matcher = self.get_address_matcher(list_name)
         for address in addresses:
-            for regex in self[list_name]:
-                if re.search(regex, address):
-                    self.set_local(msg, param, 1)
-                    return True
+            if matcher.match(address):
+                self.set_local(msg, param, 1)
+                return True
             wh = self.check_whitelist_rcvd(msg, "parsed_whitelist_from_rcvd",
                                            address)
             if wh == 1:
@@ -218,10 +360,13 @@ class WLBLEvalPlugin(pad.plugins.base.BasePlugin):
     def check_address_in_list(self, addresses, list_name):
         """Check if addresses match the regexes from list_name.
         """
+        addresses = list(addresses)
+        if not addresses:
+            return False
+        matcher = self.get_address_matcher(list_name)
         for address in addresses:
-            for regex in self[list_name]:
-                if re.search(regex, address):
-                    return True
+            if matcher.match(address):
+                return True
         return False
 
     def check_in_default_whitelist(self, msg, addresses, list_name):
@@ -431,14 +576,15 @@ class WLBLEvalPlugin(pad.plugins.base.BasePlugin):
 
         address = address.lower()
         found_forged = 0
-        for white_addr in self[list_name]:
-            regexp = white_addr.replace("*", ".*")
-            for domain in self[list_name][white_addr]:
-                if re.search(regexp, address):
+        for regex, domains in self.get_rcvd_matcher(list_name):
+            if not domains:
+                continue
+            if regex is not None and regex.search(address):
+                for domain in domains:
                     match = self.check_rcvd(domain, relays)
                     if match == 1:
                         return 1
-                found_forged = -1
+            found_forged = -1
         found_forged = self.check_found_forged(address, found_forged)
         return found_forged
 
@@ -466,24 +612,22 @@ class WLBLEvalPlugin(pad.plugins.base.BasePlugin):
     def check_found_forged(self, address, found_forged):
         """If it is forged, check the address in list """
         if found_forged:
-            wlist = self['parsed_whitelist_allow_relays']
-            for addr in wlist:
-                if re.search(addr, address):
-                    found_forged = 0
-                    break
+            matcher = self.get_address_matcher(
+                'parsed_whitelist_allow_relays')
+            if matcher.match(address):
+                found_forged = 0
         return found_forged
 
     def check_uri_host_listed(self, msg, list_name, target=None):
         """Check if the message has URIs that are listed
         in the specified hostname
         """
-        parsed_list = 'parsed_enlist_uri_host'
+        excluded, matcher = self.get_uri_host_matcher(list_name)
         for uri in msg.uri_list:
-            if uri in self[parsed_list][list_name]['not_in_list']:
+            if uri in excluded:
                 continue
-            for _uri_list_name in self[parsed_list][list_name]['in_list']:
-                if uri.endswith(_uri_list_name):
-                    return True
+            if matcher.match(uri):
+                return True
         return False
 
     def check_uri_host_in_whitelist(self, msg, target=None):
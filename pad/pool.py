@@ -0,0 +1,55 @@
+"""Thread pools shared by the plugins of the current process."""
+
+from __future__ import absolute_import
+
+import os
+import threading
+import multiprocessing.pool
+
+# The pools by name, with the process that created them and their
+# number of workers. They are shared by all the plugin instances of
+# the current process (for example after the configuration is
+# reloaded).
+_pools = {}
+_lock = threading.Lock()
+
+
+def get_pool(name, workers):
+    """Get the thread pool with this name for the current process,
+    with the specified number of workers.
+
+    A pool inherited from the parent process is replaced, its
+    threads don't exist after the fork.
+
+    :param name: The name of the pool, usually the plugin using it.
+    :param workers: The number of threads of the pool.
+    :return: A `multiprocessing.pool.ThreadPool`.
+    """
+    key = (os.getpid(), workers)
+    with _lock:
+        try:
+            pool_key, pool = _pools[name]
+        except KeyError:
+            pass
+        else:
+            if pool_key == key:
+                return pool
+            if pool_key[0] == key[0]:
+                pool.close()
+        pool = multiprocessing.pool.ThreadPool(workers)
+        _pools[name] = (key, pool)
+        return pool
+
+
+def close_pools():
+    """Close all the pools of the current process and wait for the
+    tasks still running to finish.
+    """
+    pid = os.getpid()
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for (pool_pid, dummy), pool in pools:
+        if pool_pid == pid:
+            pool.close()
+            pool.join()
@@ -1,6 +1,7 @@
 """Base class for all protocol commands"""
 
 import zlib
+import time
 
 import pad
 import pad.errors
@@ -21,6 +22,11 @@ class BaseProtocol(object):
         self.rfile = rfile
         self.wfile = wfile
         self.server = server
+        # Statistics about the request, see pad.stats.ServerStats
+        self.timings = dict()
+        self.message_size = None
+        self.is_spam = None
+        self.msg = None
         # This is initialized with the default ruleset and it
         # will get changed later if a user is specified and
         # that option is allowed.
@@ -79,13 +85,19 @@ class BaseProtocol(object):
         message = None
         options = dict()
         try:
+            start = time.time()
             if self.has_options:
                 options = self.get_options()
             user = options.get("user")
             self.ruleset = self.server.get_user_ruleset(user)
             if self.has_message:
                 message = self.get_message(options)
+                self.message_size = len(message)
+                self.timings["read"] = time.time() - start
+                start = time.time()
                 message = pad.message.Message(self.ruleset.ctxt, message)
+                self.timings["parse"] = time.time() - start
+                self.msg = message
         except pad.errors.InvalidOption as e:
             error_line = ("SPAMD/%s 76 Bad header line: (%s)\r\n" %
                           (pad.__version__, e))
@@ -94,9 +106,13 @@ class BaseProtocol(object):
 
         ok_line = "SPAMD/%s 0 %s\r\n" % (pad.__version__, self.ok_code)
         self.wfile.write(ok_line.encode("utf8"))
+        write_time = 0
         for response in self.handle(message, options):
             self.log.debug("Writing response: %s", response)
+            start = time.time()
             self.wfile.write(response.encode("utf8"))
+            write_time += time.time() - start
+        self.timings["write"] = write_time
 
     def handle(self, msg, options):
         """Perform the actual command and return a response for
@@ -2,6 +2,8 @@
 
 from __future__ import absolute_import
 
+import time
+
 import pad.protocol
 import pad.protocol.base
 
@@ -12,11 +14,14 @@ class CheckCommand(pad.protocol.base.BaseProtocol):
     has_message = True
 
     def handle(self, msg, options):
+        start = time.time()
         self.ruleset.match(msg)
+        self.timings["match"] = time.time() - start
         if msg.score >= self.ruleset.conf["required_score"]:
             spam = True
         else:
             spam = False
+        self.is_spam = spam
         yield "Spam: %s ; %s / %s\r\n" % (spam, msg.score,
                                           self.ruleset.conf["required_score"])
         result = "".join(self.extra_details(msg, options))
@@ -0,0 +1,18 @@
+"""Implement the STATS command."""
+
+from __future__ import absolute_import
+
+import pad.stats
+import pad.protocol
+import pad.protocol.base
+
+
+class StatsCommand(pad.protocol.base.BaseProtocol):
+    """Return the statistics aggregated from all the workers in
+    the Prometheus text format.
+    """
+
+    def handle(self, msg, options):
+        result = pad.stats.format_prometheus(self.server.stats.collect())
+        yield "Content-length: %s\r\n\r\n" % len(result)
+        yield result
@@ -12,6 +12,19 @@ class TellCommand(pad.protocol.base.BaseProtocol):
     has_options = True
     has_message = True
 
+    def dispatch(self, action, msg, spam, local, remote, user=None):
+        """Report or revoke the message. If the report spool is
+        configured the message is only queued and the plugins get it
+        in the background, otherwise the hook is called right away.
+        """
+        spool = self.server.get_report_spool()
+        if spool is not None and spool.put(action, msg.raw_msg,
+                                           user) is not None:
+            self.server.start_dispatcher()
+            return
+        hook = getattr(self.ruleset.ctxt, "hook_%s" % action)
+        hook(msg, spam, local, remote)
+
     def handle(self, msg, options):
         spam = options.get("message-class", "spam").lower() == "spam"
         response = []
@@ -19,13 +32,15 @@ class TellCommand(pad.protocol.base.BaseProtocol):
             targets = options.get("set").split(",")
             local = "local" in targets
             remote = "remote" in targets
-            self.ruleset.ctxt.hook_report(msg, spam, local, remote)
+            self.dispatch("report", msg, spam, local, remote,
+                          options.get("user"))
             response.append("DidSet: %s\r\n" % options.get("set"))
         if "remove" in options:
             targets = options.get("remove").split(",")
             local = "local" in targets
             remote = "remote" in targets
-            self.ruleset.ctxt.hook_revoke(msg, spam, local, remote)
+            self.dispatch("revoke", msg, spam, local, remote,
+                          options.get("user"))
             response.append("DidRemove: %s\r\n" % options.get("remove"))
         for action in response:
             yield action
@@ -0,0 +1,340 @@
+"""Answer DNS list queries from local rbldnsd zone files.
+
+The ip4set, ip4trie and dnset formats used by rbldnsd are supported.
+The data is loaded in memory and reloaded whenever the file changes.
+"""
+
+from __future__ import absolute_import
+
+from builtins import str
+from builtins import dict
+from builtins import object
+
+import os
+import re
+import time
+import logging
+import ipaddress
+
+import pad.stats
+
+# The A value returned when none is specified in the zone file.
+DEFAULT_A = "127.0.0.2"
+
+# Split an entry from its value, for example:
+#   1.2.3.4 :127.0.0.3:Listed
+ENTRY_RE = re.compile(r"^(!?[^\s:]+)\s*(.*)$")
+
+_MISSING = object()
+
+
+def _parse_a(value):
+    """Parse the A value of an entry. A single number N can be
+    used instead of 127.0.0.N.
+    """
+    value = value.strip()
+    if value.isdigit():
+        value = "127.0.0.%s" % value
+    return str(ipaddress.IPv4Address(str(value)))
+
+
+def _parse_value(value, default):
+    """Parse the value of an entry and return the (A, TXT) tuple. The
+    values not specified are taken from the default.
+    """
+    value = value.strip()
+    if not value:
+        return default
+    if not value.startswith(":"):
+        return default[0], value
+    parts = value[1:].split(":", 1)
+    a = _parse_a(parts[0]) if parts[0].strip() else default[0]
+    txt = parts[1].strip() if len(parts) > 1 else default[1]
+    return a, txt
+
+
+def _parse_ip4(entry):
+    """Parse an IPv4 entry and return the list of networks that it
+    contains. The entry may be an abbreviated address (1.2.3 is the
+    same as 1.2.3.0/24), a CIDR network or a range of addresses.
+    """
+    if "-" in entry:
+        first, last = entry.split("-", 1)
+        first = ipaddress.IPv4Address(str(first))
+        parts = last.split(".")
+        if len(parts) > 4:
+            raise ValueError("Invalid range %s" % entry)
+        last = str(first).split(".")[:4 - len(parts)] + parts
+        last = ipaddress.IPv4Address(str(".".join(last)))
+        return list(ipaddress.summarize_address_range(first, last))
+    if "/" in entry:
+        address, prefixlen = entry.split("/", 1)
+    else:
+        address, prefixlen = entry, None
+    parts = address.split(".")
+    if len(parts) > 4:
+        raise ValueError("Invalid address %s" % entry)
+    if prefixlen is None:
+        prefixlen = 8 * len(parts)
+    parts.extend(["0"] * (4 - len(parts)))
+    return [ipaddress.IPv4Network(str("%s/%s" % (".".join(parts), prefixlen)),
+                                  strict=False)]
+
+
+class Dataset(object):
+    """Base class for the datasets loaded from a zone file."""
+    # Minimum number of seconds between two checks of the file
+    # modification time.
+    check_interval = 1.0
+
+    def __init__(self, path):
+        self.log = logging.getLogger("pad-logger")
+        self.path = path
+        self.mtime = None
+        self._last_check = 0
+        self.clear()
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def clear(self):
+        """Remove all the entries."""
+        raise NotImplementedError()
+
+    def add(self, entry, value):
+        """Add an entry with this value, None if the entry is
+        excluded.
+        """
+        raise NotImplementedError()
+
+    def finalize(self):
+        """Called after all the entries are added."""
+
+    def lookup(self, prefix):
+        """Get the (A, TXT) values for this query prefix, or None
+        if it's not listed.
+        """
+        raise NotImplementedError()
+
+    def check_reload(self):
+        """Reload the zone file if it was modified since it was
+        last loaded.
+
+        :return: True if the file was reloaded.
+        """
+        now = time.time()
+        if now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            if self.mtime is not None:
+                self.log.warning("Unable to check zone file %s: %s",
+                                 self.path, e)
+            return False
+        if mtime == self.mtime:
+            return False
+        return self.load()
+
+    def load(self):
+        """Load the entries from the zone file, replacing the ones
+        currently stored.
+
+        :return: True if the file was loaded.
+        """
+        start = time.time()
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path) as zone_file:
+                lines = zone_file.readlines()
+        except (IOError, OSError) as e:
+            self.log.error("Unable to load zone file %s: %s", self.path, e)
+            return False
+        self.clear()
+        self.parse(lines)
+        self.finalize()
+        self.mtime = mtime
+        self._last_check = start
+        self.log.info("Loaded %s entries from %s", len(self), self.path)
+        pad.stats.incr("rbl_zone_loads_total")
+        pad.stats.observe("rbl_zone_load_seconds", time.time() - start)
+        return True
+
+    def parse(self, lines):
+        """Parse the lines of a zone file."""
+        default = (DEFAULT_A, None)
+        for lineno, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith(("#", ";")):
+                continue
+            if line.startswith("$"):
+                # Directives like $TTL and $SOA are not relevant
+                # when answering locally.
+                continue
+            try:
+                if line.startswith(":"):
+                    default = _parse_value(line, default)
+                    continue
+                entry, value = ENTRY_RE.match(line).groups()
+                if entry.startswith("!"):
+                    self.add(entry[1:], None)
+                else:
+                    self.add(entry, _parse_value(value, default))
+            except ValueError as e:
+                self.log.warning("Invalid entry in %s:%s: %s", self.path,
+                                 lineno, e)
+
+
+class IP4Dataset(Dataset):
+    """Dataset of IPv4 addresses, networks and ranges (the ip4set
+    and ip4trie formats).
+
+    Networks are stored in one hash table for every prefix length,
+    the lookups check the longest prefixes first so the most specific
+    entry wins.
+    """
+
+    def __len__(self):
+        return sum(len(table) for table in self._networks.values())
+
+    def clear(self):
+        self._networks = {}
+        # List of (prefix length, {network: value}) sorted by the
+        # prefix length in descending order.
+        self._tables = []
+
+    def add(self, entry, value):
+        for network in _parse_ip4(entry):
+            prefixlen = network.prefixlen
+            table = self._networks.setdefault(prefixlen, {})
+            table[int(network.network_address) >> (32 - prefixlen)] = value
+
+    def finalize(self):
+        self._tables = sorted(self._networks.items(), reverse=True)
+
+    def lookup(self, prefix):
+        try:
+            address = ipaddress.IPv4Address(
+                str(".".join(reversed(prefix.split(".")))))
+        except ValueError:
+            return None
+        address_int = int(address)
+        for prefixlen, table in self._tables:
+            value = table.get(address_int >> (32 - prefixlen), _MISSING)
+            if value is _MISSING:
+                continue
+            if value is None:
+                # Excluded
+                return None
+            a, txt = value
+            if txt is not None:
+                txt = txt.replace("$", str(address))
+            return a, txt
+        return None
+
+
+class DomainDataset(Dataset):
+    """Dataset of domain names (the dnset format).
+
+    An entry like `.example.com` matches the domain and all its
+    subdomains, while `*.example.com` only matches the subdomains.
+    """
+
+    def __len__(self):
+        return len(self._exact) + len(self._wildcards)
+
+    def clear(self):
+        self._exact = {}
+        self._wildcards = {}
+
+    def add(self, entry, value):
+        entry = entry.lower().rstrip(".")
+        if entry.startswith("*."):
+            self._wildcards[entry[2:]] = value
+        elif entry.startswith("."):
+            self._exact[entry[1:]] = value
+            self._wildcards[entry[1:]] = value
+        else:
+            self._exact[entry] = value
+
+    def lookup(self, prefix):
+        name = prefix.lower().rstrip(".")
+        value = self._exact.get(name, _MISSING)
+        if value is _MISSING:
+            labels = name.split(".")
+            for i in range(1, len(labels)):
+                value = self._wildcards.get(".".join(labels[i:]), _MISSING)
+                if value is not _MISSING:
+                    break
+        if value is _MISSING or value is None:
+            return None
+        a, txt = value
+        if txt is not None:
+            txt = txt.replace("$", name)
+        return a, txt
+
+
+DATASET_TYPES = {
+    "ip4set": IP4Dataset,
+    "ip4trie": IP4Dataset,
+    "dnset": DomainDataset,
+}
+
+
+class Zone(object):
+    """A DNS list zone served from one or more local datasets."""
+
+    def __init__(self, name):
+        self.name = name.lower().strip(".")
+        self.datasets = []
+
+    def add_dataset(self, dataset_type, path):
+        """Add a dataset of this type loaded from the path."""
+        try:
+            dataset_class = DATASET_TYPES[dataset_type]
+        except KeyError:
+            raise ValueError("Unknown dataset type %s" % dataset_type)
+        dataset = dataset_class(path)
+        dataset.load()
+        self.datasets.append(dataset)
+        return dataset
+
+    def check_reload(self):
+        """Reload any of the datasets that were modified."""
+        for dataset in self.datasets:
+            dataset.check_reload()
+
+    def get_prefix(self, qname):
+        """Get the part of the query name before the zone name, or
+        None if the name is not in this zone.
+        """
+        qname = qname.lower().rstrip(".")
+        suffix = "." + self.name
+        if not qname.endswith(suffix):
+            return None
+        return qname[:-len(suffix)]
+
+    def query(self, prefix, qtype):
+        """Answer a query for this prefix, the results are the same
+        as the ones returned by the DNS server: the A addresses or the
+        quoted TXT records of all the datasets listing the prefix.
+        """
+        results = []
+        for dataset in self.datasets:
+            value = dataset.lookup(prefix)
+            if value is None:
+                continue
+            a, txt = value
+            if qtype == "A":
+                result = a
+            elif qtype == "TXT" and txt is not None:
+                result = '"%s"' % txt.replace("\\", "\\\\").replace(
+                    '"', '\\"')
+            else:
+                continue
+            if result not in results:
+                results.append(result)
+        pad.stats.incr("rbl_local_queries_total", zone=self.name,
+                       result="listed" if results else "not_listed")
+        return results
@@ -3,6 +3,7 @@
 from builtins import object
 
 import re
+import weakref
 import operator
 from functools import reduce
 
@@ -57,32 +58,62 @@ _CONVERTS = (
 )
 
 
+# The patterns created by `perl2re`, by (pattern, flags, match_op).
+# Rules with the same regex share a single pattern, the entries are
+# dropped when no rule uses them anymore.
+_PATTERNS = weakref.WeakValueDictionary()
+
+# Marks a pattern that didn't match any text yet.
+_NO_TEXT = object()
+
+
 class Pattern(object):
-    """Abstract class for rule regex matching."""
+    """Abstract class for rule regex matching.
+
+    The result for the last text is remembered, so when the same
+    pattern is used by multiple rules it is only searched once for
+    each text of the message (the body, the raw message, a header
+    value, etc.). Texts are compared by identity, which is cheap and
+    always correct since strings are immutable.
+    """
 
     def __init__(self, pattern):
         self._pattern = pattern
+        # Replaced as a tuple so that the text and result are always
+        # consistent, even if the pattern is shared between threads.
+        self._last = (_NO_TEXT, None)
 
     def match(self, text):
+        last_text, result = self._last
+        if text is not last_text:
+            result = self._match(text)
+            self._last = (text, result)
+        return result
+
+    def _match(self, text):
         raise NotImplementedError()
 
 
 class MatchPattern(Pattern):
     """This pattern does a search on the text and returns either 1 or 0."""
 
-    def match(self, text):
+    def _match(self, text):
         return 1 if self._pattern.search(text) else 0
 
 
 class NotMatchPattern(Pattern):
     """This pattern does a search on the text and returns either 1 or 0."""
 
-    def match(self, text):
+    def _match(self, text):
         return 0 if self._pattern.search(text) else 1
 
 
 def perl2re(pattern, match_op="=~"):
-    """Convert a Perl type regex to a Python one."""
+    """Convert a Perl type regex to a Python one.
+
+    Identical regular expressions, after the conversion, return the
+    same shared `Pattern` object.
+    """
     # We don't need to consider the pre-flags
     pattern = pattern.strip().lstrip("mgs")
     delim = pattern[0]
@@ -103,10 +134,26 @@ def perl2re(pattern, match_op="=~"):
 
     flags = reduce(operator.or_, (FLAGS.get(flag, 0) for flag in flags_str), 0)
 
+    key = (pattern, flags, match_op)
+    try:
+        return _PATTERNS[key]
+    except KeyError:
+        pass
     try:
         if match_op == "=~":
-            return MatchPattern(re.compile(pattern, flags))
+            result = MatchPattern(re.compile(pattern, flags))
         elif match_op == "!~":
-            return NotMatchPattern(re.compile(pattern, flags))
+            result = NotMatchPattern(re.compile(pattern, flags))
+        else:
+            return None
     except re.error as e:
         raise pad.errors.InvalidRegex("Invalid regex %r: %s" % (pattern, e))
+    _PATTERNS[key] = result
+    return result
+
+
+def shared_patterns():
+    """Return the number of distinct patterns currently used by the
+    rules.
+    """
+    return len(_PATTERNS)
@@ -0,0 +1,219 @@
+"""Generate a Python function that matches a message against all the
+checked rules of a ruleset.
+
+`pad.rules.ruleset.RuleSet.match` calls every rule in turn. The
+generated function does the same thing, but without the generic
+loop: the patterns of the body and full rules are called directly
+with the text they match, the meta rules are evaluated over the
+results of the rules already checked and nothing is logged.
+
+The source and the compiled code can be cached in a directory, so
+that the same ruleset is only compiled once.
+"""
+
+from __future__ import absolute_import
+
+from builtins import object
+
+import os
+import sys
+import types
+import marshal
+import hashlib
+import tempfile
+
+import pad.rules.body
+import pad.rules.full
+import pad.rules.meta
+
+# The message attribute used by the pattern of these rules.
+TARGETS = {
+    pad.rules.body.BodyRule: "text",
+    pad.rules.body.RawBodyRule: "raw_text",
+    pad.rules.full.FullRule: "raw_msg",
+}
+
+HEADER = """# Generated by pad.rules.compiler from a ruleset with %d
+# checked rules.
+
+
+def make_match(bound):
+"""
+
+MATCH_START = """
+    def match(msg):
+        rules_checked = msg.rules_checked
+"""
+
+RULE = """
+        # %(name)s
+        %(result)s = %(expression)s
+        rules_checked[%(name)r] = %(result)s
+        if %(result)s:
+            msg.score += %(score)r
+"""
+
+MATCH_END = """
+    return match
+"""
+
+try:
+    CACHE_TAG = sys.implementation.cache_tag
+except AttributeError:
+    CACHE_TAG = "cpython-%d%d" % sys.version_info[:2]
+
+
+class _Generator(object):
+    """Keep track of the objects bound in the generated function."""
+
+    def __init__(self, ruleset):
+        self.ruleset = ruleset
+        self.bound = []
+        self.lines = []
+        # Maps the names of the rules already checked to the local
+        # variables holding their result.
+        self.results = {}
+        # Maps the names of the other sub-rules to the local variables
+        # holding their match method.
+        self.matches = {}
+
+    def bind(self, prefix, value):
+        """Make the value available as a local variable."""
+        name = "%s%d" % (prefix, len(self.bound))
+        self.lines.append("    %s = bound[%d]\n" % (name, len(self.bound)))
+        self.bound.append(value)
+        return name
+
+    def _subrule(self, match):
+        name = match.group(1)
+        try:
+            return self.results[name]
+        except KeyError:
+            pass
+        # The sub-rule is not checked, or not checked yet.
+        if name not in self.matches:
+            rule = self.ruleset.get_rule(name)
+            self.matches[name] = self.bind("m", rule.match)
+        return "%s(msg)" % self.matches[name]
+
+    def expression(self, rule):
+        """Get the Python expression that checks this rule."""
+        target = TARGETS.get(type(rule))
+        if target is not None:
+            pattern = self.bind("p", rule._pattern.match)
+            return "True if %s(%s) else False" % (pattern, target)
+        if isinstance(rule, pad.rules.meta.MetaRule):
+            return "(%s)" % pad.rules.meta.convert_rule(rule.expression,
+                                                        self._subrule)
+        return "%s(msg)" % self.bind("m", rule.match)
+
+    def generate(self):
+        """Get the source of the module defining the `make_match`
+        factory.
+        """
+        targets = set()
+        body = []
+        for name, rule in self.ruleset.checked.items():
+            result = "r%d" % len(self.results)
+            body.append(RULE % {
+                "name": name,
+                "result": result,
+                "expression": self.expression(rule),
+                "score": rule.score,
+            })
+            targets.add(TARGETS.get(type(rule)))
+            self.results[name] = result
+        source = [HEADER % len(self.ruleset.checked)]
+        source.extend(self.lines)
+        source.append(MATCH_START)
+        for target in sorted(targets - {None}):
+            source.append("        %s = msg.%s\n" % (target, target))
+        source.extend(body)
+        source.append(MATCH_END)
+        return "".join(source)
+
+
+def generate_source(ruleset):
+    """Generate the source of the match function for the checked rules
+    of this ruleset.
+
+    :return: A tuple with the source and the list of objects that
+      must be passed to its `make_match` factory.
+    """
+    generator = _Generator(ruleset)
+    return generator.generate(), generator.bound
+
+
+def _load_code(path, log):
+    try:
+        with open(path, "rb") as codef:
+            code = marshal.load(codef)
+    except (IOError, OSError):
+        return None
+    except (EOFError, ValueError, TypeError) as e:
+        log.warning("Invalid compiled rules in %s: %s", path, e)
+        return None
+    if not isinstance(code, types.CodeType):
+        log.warning("Invalid compiled rules in %s", path)
+        return None
+    return code
+
+
+def _write_file(path, data):
+    """Write the file atomically, multiple processes may load the
+    same ruleset at the same time.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as tmpf:
+            tmpf.write(data)
+        os.rename(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _compile(source, cache_path, log):
+    """Compile the source, or load the code from the cache if the
+    same source was already compiled.
+    """
+    if not cache_path:
+        return compile(source, "<ruleset>", "exec")
+    digest = hashlib.sha1(source.encode("utf-8")).hexdigest()
+    source_path = os.path.join(cache_path, "%s.py" % digest)
+    code_path = os.path.join(cache_path, "%s.%s.code" % (digest, CACHE_TAG))
+    code = _load_code(code_path, log)
+    if code is not None:
+        log.debug("Loaded compiled rules from %s", code_path)
+        return code
+    code = compile(source, source_path, "exec")
+    try:
+        if not os.path.exists(source_path):
+            _write_file(source_path, source.encode("utf-8"))
+        _write_file(code_path, marshal.dumps(code))
+    except (IOError, OSError) as e:
+        log.warning("Unable to cache the compiled rules in %s: %s",
+                    cache_path, e)
+    return code
+
+
+def compile_match(ruleset, cache_path=None):
+    """Create the match function for the checked rules of this
+    ruleset. The function takes the message and updates its
+    `rules_checked` and `score`, like `RuleSet.match`.
+
+    :param cache_path: Directory where the generated source and the
+      compiled code are stored.
+    :return: The function, or None if the rules could not be
+      compiled.
+    """
+    log = ruleset.ctxt.log
+    source, bound = generate_source(ruleset)
+    try:
+        code = _compile(source, cache_path, log)
+    except (SyntaxError, ValueError, OverflowError) as e:
+        log.error("Unable to compile the rules: %s", e)
+        return None
+    namespace = {}
+    exec(code, namespace)
+    return namespace["make_match"](bound)
@@ -2,6 +2,7 @@
 
 import re
 
+import pad.regex
 import pad.errors
 import pad.rules.base
 
@@ -12,6 +13,25 @@ _EVAL_RULE_P = re.compile(r"""
 """, re.VERBOSE)
 
 
+def regex_arg(value):
+    """Argument converter that compiles a Python regular expression.
+    Values that are already compiled are returned unchanged.
+    """
+    if value is None or hasattr(value, "search"):
+        return value
+    return re.compile(value)
+
+
+def perl_regex_arg(value):
+    """Argument converter that compiles a Perl regular expression,
+    see `pad.regex.perl2re`. Values that are already compiled are
+    returned unchanged.
+    """
+    if value is None or hasattr(value, "match"):
+        return value
+    return pad.regex.perl2re(value)
+
+
 class EvalRule(pad.rules.base.BaseRule):
     """Evaluates a registered eval function."""
 
@@ -51,12 +71,38 @@ class EvalRule(pad.rules.base.BaseRule):
             raise pad.errors.InvalidRule(self.name, "Undefined eval rule "
                                                     "referenced: %s" %
                                          self.eval_rule_name)
+        converters = ruleset.ctxt.eval_rule_args.get(self.eval_rule_name)
+        eval_args = self.convert_args(converters)
 
         def new_method(msg):
-            return method(*((msg,) + self.eval_args), target=self.target)
+            return method(msg, *eval_args, target=self.target)
 
         self.eval_rule = new_method
 
+    def convert_args(self, converters):
+        """Convert the arguments with the converters declared by the
+        plugin for this eval rule, so that e.g. regular expressions
+        are only compiled once when the ruleset is loaded.
+
+        :param converters: A sequence with a callable for every
+          argument, or None to pass the argument unchanged.
+        :return: The tuple of converted arguments.
+        """
+        eval_args = list(self.eval_args)
+        for index, converter in enumerate(converters or ()):
+            if index >= len(eval_args):
+                break
+            if converter is None:
+                continue
+            try:
+                eval_args[index] = converter(eval_args[index])
+            except (ValueError, TypeError, re.error,
+                    pad.errors.InvalidRegex) as e:
+                raise pad.errors.InvalidRule(
+                    self.name, "Invalid argument %r for eval rule %s: %s" %
+                    (eval_args[index], self.eval_rule_name, e))
+        return tuple(eval_args)
+
     def match(self, msg):
         try:
             return self.eval_rule(msg)
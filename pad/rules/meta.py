@@ -20,6 +20,17 @@ MAX_RECURSION = 10
 _SUBRULE_P = re.compile(r"([_a-zA-Z]\w*)(?=\W|$)")
 
 
+def convert_rule(rule, repl=r"\1(msg)"):
+    """Convert the meta rule into a Python expression, the names of
+    the sub-rules are replaced with `repl` (a string or function as
+    accepted by `re.sub`).
+    """
+    rule = _SUBRULE_P.sub(repl, rule)
+    for operator, python_op in CONVERT:
+        rule = rule.replace(operator, python_op)
+    return rule
+
+
 class MetaRule(pad.rules.base.BaseRule):
     """These rules are boolean or arithmetic combinations of other rules."""
 
@@ -29,10 +40,8 @@ class MetaRule(pad.rules.base.BaseRule):
         super(MetaRule, self).__init__(name, score=score, desc=desc,
                                        priority=priority, tflags=tflags)
         self.subrules = set(_SUBRULE_P.findall(rule))
-        rule = _SUBRULE_P.sub(r"\1(msg)", rule)
-        for operator, repl in CONVERT:
-            rule = rule.replace(operator, repl)
-        self.rule = "match = lambda msg: %s" % rule
+        self.expression = rule
+        self.rule = "match = lambda msg: %s" % convert_rule(rule)
         self._location = dict()
         # XXX we should check for potentially unsafe code or run it in
         # XXX RestrictedPython.
@@ -15,6 +15,7 @@ from builtins import object
 
 import re
 import os
+import time
 import warnings
 import contextlib
 import collections
@@ -89,6 +90,62 @@ RULES = {
 _COMMENT_P = re.compile(r"((?<=[^\\])#.*)")
 
 
+def tokenize_line(line):
+    """Decode a line of a configuration file and split it in the
+    type and the value. This doesn't depend on the state of the
+    parser, so it can be done in advance.
+
+    :return: A (line, rtype, value) tuple, or None if the line is
+      empty or a comment. The conditional lines ("if can", "else"
+      and "endif") are returned with these as rtype. If the line
+      can't be decoded the rtype is None and the value is the error.
+    """
+    try:
+        line = line.decode("iso-8859-1").strip()
+    except UnicodeDecodeError as e:
+        return line, None, "Decoding Error: %s" % e
+    if line.startswith("if can"):
+        return line, "if can", ""
+    if line.startswith("endif"):
+        return line, "endif", ""
+    if line.startswith("else"):
+        return line, "else", ""
+    if line.startswith("require_version"):
+        # XXX We don't really have any use for this now
+        # XXX Just skip it.
+        return None
+    if not line or line.startswith("#"):
+        return None
+
+    # Remove any comments
+    line = _COMMENT_P.sub("", line).strip()
+
+    try:
+        rtype, value = line.split(None, 1)
+    except ValueError:
+        # Some plugin might know how to handle this line
+        rtype, value = line, ""
+    return line, rtype, value
+
+
+def tokenize_file(filename):
+    """Read a configuration file and tokenize its lines, see
+    `tokenize_line`.
+
+    :return: A list of (line_no, line, rtype, value) tuples, or
+      None if the file doesn't exist.
+    """
+    if not os.path.isfile(filename):
+        return None
+    statements = []
+    with open(filename, "rb") as rulef:
+        for line_no, line in enumerate(rulef):
+            statement = tokenize_line(line)
+            if statement is not None:
+                statements.append((line_no + 1,) + statement)
+    return statements
+
+
 class PADParser(object):
     """Parses PAD ruleset and extracts and combines the relevant data.
 
@@ -118,59 +175,52 @@ class PADParser(object):
         if _depth > MAX_RECURSION:
             raise pad.errors.MaxRecursionDepthExceeded()
         self.ctxt.log.debug("Parsing file: %s", filename)
-        if not os.path.isfile(filename):
+        statements = tokenize_file(filename)
+        if statements is None:
             self.ctxt.log.warn("Ignoring %s, not a file", filename)
             return
-        with open(filename, "rb") as rulef:
-            for line_no, line in enumerate(rulef):
-                try:
-                    with self._paranoid(pad.errors.InvalidSyntax):
-                        self._handle_line(filename, line, line_no + 1, _depth)
-                except pad.errors.PluginLoadError as e:
-                    warnings.warn(str(e))
-                    self.ctxt.log.warn("%s", e)
+        for line_no, line, rtype, value in statements:
+            try:
+                with self._paranoid(pad.errors.InvalidSyntax):
+                    self._handle_statement(filename, line_no, line, rtype,
+                                           value, _depth)
+            except pad.errors.PluginLoadError as e:
+                warnings.warn(str(e))
+                self.ctxt.log.warn("%s", e)
 
     def _handle_line(self, filename, line, line_no, _depth=0):
         """Handles a single line."""
-        try:
-            line = line.decode("iso-8859-1").strip()
-        except UnicodeDecodeError as e:
-            raise pad.errors.InvalidSyntax(filename, line_no, line,
-                                           "Decoding Error: %s" % e)
-        if line.startswith("if can"):
+        statement = tokenize_line(line)
+        if statement is not None:
+            line, rtype, value = statement
+            self._handle_statement(filename, line_no, line, rtype, value,
+                                   _depth)
+
+    def _handle_statement(self, filename, line_no, line, rtype, value,
+                          _depth=0):
+        """Handles a single tokenized line, see `tokenize_line`."""
+        if rtype is None:
+            raise pad.errors.InvalidSyntax(filename, line_no, line, value)
+        if rtype == "if can":
             # XXX We don't support for this check, simply
             # XXX skip everything for now.
             self._ignore = True
             return
 
-        if line.startswith("endif"):
+        if rtype == "endif":
             self._ignore = False
             return
 
-        if line.startswith("else"):
+        if rtype == "else":
             if self._ignore:
                 self._ignore = False
             else:
                 self._ignore = True
             return
 
-        if line.startswith("require_version"):
-            # XXX We don't really have any use for this now
-            # XXX Just skip it.
+        if self._ignore:
             return
 
-        if not line or line.startswith("#") or self._ignore:
-            return
-
-        # Remove any comments
-        line = _COMMENT_P.sub("", line).strip()
-
-        try:
-            rtype, value = line.split(None, 1)
-        except ValueError:
-            # Some plugin might know how to handle this line
-            rtype, value = line, ""
-
         if rtype == "include":
             self._handle_include(value, line, line_no, _depth)
         elif rtype == "ifplugin":
@@ -314,7 +364,9 @@ def parse_pad_rules(files, paranoid=False, ignore_unknown=True):
     Other options may be included such as "score", "describe".
     """
     parser = PADParser(paranoid=paranoid, ignore_unknown=ignore_unknown)
+    start = time.time()
     for filename in files:
         parser.parse_file(filename)
-
+    parser.ctxt.log.debug("Parsed %s files in %.3fs", len(files),
+                          time.time() - start)
     return parser
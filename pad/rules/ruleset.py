@@ -5,6 +5,7 @@ from builtins import object
 
 import re
 import socket
+import logging
 import email.utils
 import collections
 import email.message
@@ -15,6 +16,7 @@ from operator import itemgetter
 
 import pad
 import pad.errors
+import pad.rules.compiler
 
 _TAG_RE = re.compile(r"(_([A-Z_]*?)_)")
 
@@ -50,6 +52,9 @@ class RuleSet(object):
         }
         self.checked = collections.OrderedDict()
         self.not_checked = dict()
+        # Generated function that matches all the checked rules, see
+        # `pad.rules.compiler`.
+        self.compiled_match = None
         # XXX Hardcoded at the moment, should be loaded from configuration.
         self.autolearn = False
         self.use_bayes = True
@@ -315,15 +320,31 @@ class RuleSet(object):
         self.ctxt.dns.rotate = dns_options['rotate']
         self.ctxt.dns.edns = dns_options['edns']
 
+        if self.conf["compile_match"]:
+            self.compiled_match = pad.rules.compiler.compile_match(
+                self, self.conf["compile_match_path"])
+
+    def _match(self, msg):
+        for name, rule in self.checked.items():
+            result = rule.match(msg)
+            self.ctxt.log.debug("Checked rule %s: %s", rule, result)
+            msg.rules_checked[name] = result
+            if result:
+                msg.score += rule.score
+
     def match(self, msg):
-        """Match the message against all the rules in this ruleset."""
+        """Match the message against all the rules in this ruleset.
+
+        The compiled match function is used if available, except when
+        debugging since it doesn't log the result of every rule.
+        """
+        self.ctxt.hook_match_start(self, msg)
         try:
-            for name, rule in self.checked.items():
-                result = rule.match(msg)
-                self.ctxt.log.debug("Checked rule %s: %s", rule, result)
-                msg.rules_checked[name] = result
-                if result:
-                    msg.score += rule.score
+            if (self.compiled_match is not None and
+                    not self.ctxt.log.isEnabledFor(logging.DEBUG)):
+                self.compiled_match(msg)
+            else:
+                self._match(msg)
         except pad.errors.StopProcessing as e:
             self.ctxt.log.debug("Stop processing the messages as "
                                 "requested: %s", e)
@@ -5,16 +5,22 @@ from __future__ import absolute_import
 
 import os
 import copy
+import time
 
 import spoon.server
 
 import pad
+import pad.pool
+import pad.stats
+import pad.regex
+import pad.spool
 import pad.config
 import pad.protocol
 import pad.rules.parser
 
 import pad.protocol.noop
 import pad.protocol.tell
+import pad.protocol.stats
 import pad.protocol.check
 import pad.protocol.process
 
@@ -28,6 +34,7 @@ COMMANDS = {
     "REPORT_IFSPAM": pad.protocol.check.ReportIfSpamCommand,
     "PROCESS": pad.protocol.process.ProcessCommand,
     "HEADERS": pad.protocol.process.HeadersCommand,
+    "STATS": pad.protocol.stats.StatsCommand,
 }
 
 
@@ -40,13 +47,16 @@ class RequestHandler(spoon.server.Gulp):
         """
         line = self.rfile.readline().decode("utf8").strip()
         command, proto_version = line.split()
+        command = command.upper()
         try:
             # Run the command handler
-            COMMANDS[command.upper()](self.rfile, self.wfile, self.server)
+            handler = COMMANDS[command](self.rfile, self.wfile, self.server)
         except KeyError:
             error_line = ("SPAMD/%s 76 Bad header line: %s\r\n" %
                           (pad.__version__, line))
             self.wfile.write(error_line.encode("utf8"))
+            return
+        self.server.stats.record_request(command, handler)
 
 
 class Server(spoon.server.TCPSpoon):
@@ -57,7 +67,7 @@ class Server(spoon.server.TCPSpoon):
     handler_klass = RequestHandler
 
     def __init__(self, address, sitepath, configpath, paranoid=False,
-                 ignore_unknown=True):
+                 ignore_unknown=True, stats_file=None):
         self.paranoid = paranoid
         self.ignore_unknown = ignore_unknown
         self._ruleset = None
@@ -65,20 +75,151 @@ class Server(spoon.server.TCPSpoon):
         self._parser_results = None
         self.sitepath = sitepath
         self.configpath = configpath
+        self.stats = pad.stats.ServerStats(stats_file=stats_file)
+        self._report_spool = None
+        self._dispatcher = None
+        # The process that created the server, and the process
+        # handling requests, see `worker_started`.
+        self._parent_pid = os.getpid()
+        self._worker_pid = None
 
         super(Server, self).__init__(address)
 
     def load_config(self):
         """Reads the configuration files and reloads the ruleset."""
+        old_rulesets = self._get_rulesets()
         self._user_rulesets.clear()
+        start = time.time()
         parser = pad.rules.parser.parse_pad_rules(
             pad.config.get_config_files(self.configpath, self.sitepath),
             paranoid=self.paranoid, ignore_unknown=self.ignore_unknown
         )
         self._ruleset = parser.get_ruleset()
+        elapsed = time.time() - start
+        self.log.info("Configuration loaded in %.3fs", elapsed)
+        pad.stats.observe("ruleset_load_seconds", elapsed)
+        pad.stats.set_gauge("ruleset_patterns", pad.regex.shared_patterns())
         # Store a copy of the parser results to generate user
         # settings later
         self._parser_results = parser.results
+        self.stop_dispatcher()
+        spool_path = self._ruleset.conf["report_spool_path"]
+        if spool_path:
+            self._report_spool = pad.spool.ReportSpool(spool_path)
+        else:
+            self._report_spool = None
+        if self._worker_pid == os.getpid():
+            self.start_dispatcher()
+        self.finish_rulesets(old_rulesets)
+
+    def get_report_spool(self):
+        """Get the `pad.spool.ReportSpool` where the reported messages
+        are queued, or None if the reports are dispatched right away.
+        """
+        return self._report_spool
+
+    def start_dispatcher(self):
+        """Start the thread dispatching the reported messages in the
+        current process, if it's not already running.
+        """
+        if self._report_spool is None:
+            return None
+        dispatcher = self._dispatcher
+        if (dispatcher is not None and dispatcher.pid == os.getpid() and
+                dispatcher.is_alive()):
+            return dispatcher
+        conf = self._ruleset.conf
+        self._dispatcher = pad.spool.ReportDispatcher(
+            self._report_spool, self.get_user_ruleset,
+            batch_size=conf["report_spool_batch_size"],
+            max_attempts=conf["report_spool_max_attempts"],
+            retry_delay=conf["report_spool_retry_delay"],
+            on_batch=self.publish_stats,
+        )
+        self._dispatcher.start()
+        return self._dispatcher
+
+    def stop_dispatcher(self, timeout=10.0):
+        """Stop the thread dispatching the reported messages in the
+        current process, after the batch it's handling.
+        """
+        dispatcher = self._dispatcher
+        if dispatcher is not None and dispatcher.pid == os.getpid():
+            dispatcher.stop(timeout)
+        self._dispatcher = None
+
+    def publish_stats(self):
+        """Publish the statistics of the current process."""
+        self.stats.publish()
+
+    def worker_started(self):
+        """Called once in every process handling requests, before
+        the first request is handled. Starts the thread dispatching
+        the reported messages.
+
+        The statistics collected before the fork, like the time it
+        took to load the configuration, are inherited by all the
+        workers. They are only kept by the process that created the
+        server, so they are counted once.
+        """
+        self._worker_pid = os.getpid()
+        if self._worker_pid != self._parent_pid:
+            pad.stats.get_collector().clear(gauges=False)
+        self.start_dispatcher()
+
+    def _check_worker(self):
+        """Call `worker_started` if this is the first time the current
+        process handles requests.
+        """
+        if self._worker_pid != os.getpid():
+            self.worker_started()
+
+    def serve_forever(self, poll_interval=0.5):
+        """Handle requests until shutdown in the current process."""
+        self._check_worker()
+        super(Server, self).serve_forever(poll_interval=poll_interval)
+
+    def process_request(self, request, client_address):
+        """Handle the request, after setting up the current process
+        if it's the first one it handles.
+        """
+        self._check_worker()
+        super(Server, self).process_request(request, client_address)
+
+    def service_actions(self):
+        """Called by the server loop in every process handling
+        requests, only with Python 3. Restarts the dispatcher if
+        needed.
+        """
+        self._check_worker()
+        self.start_dispatcher()
+
+    def _get_rulesets(self):
+        """Get all the rulesets currently loaded."""
+        rulesets = list(self._user_rulesets.values())
+        if self._ruleset is not None:
+            rulesets.append(self._ruleset)
+        return rulesets
+
+    def finish_rulesets(self, rulesets):
+        """Let the plugins of these rulesets save any data they
+        still hold in memory.
+        """
+        for ruleset in rulesets:
+            try:
+                ruleset.ctxt.hook_finish()
+            except Exception as e:
+                self.log.error("Error while finishing ruleset: %s", e)
+
+    def shutdown(self):
+        """Finish the rulesets before stopping the server. This is
+        done first because the workers exit as soon as the server
+        loop stops.
+        """
+        self.stop_dispatcher()
+        self.finish_rulesets(self._get_rulesets())
+        super(Server, self).shutdown()
+        pad.pool.close_pools()
 
     def get_user_ruleset(self, user=None):
         """Get the corresponding ruleset for this user. If the
@@ -119,3 +260,17 @@ class PreForkServer(Server, spoon.server.TCPSpork):
 
     The parent process will then wait for all his child process to complete.
     """
+
+    def serve_forever(self, poll_interval=0.5):
+        """Prepare the shared statistics for all the children, fork
+        and wait for all of them to finish.
+
+        The children call `worker_started` from their server loop,
+        before handling the first request. The parent process
+        publishes the statistics collected before the fork in its
+        own slot.
+        """
+        self.stats = pad.stats.ServerStats(self.prefork + 1,
+                                           self.stats.stats_file)
+        self.stats.publish()
+        spoon.server.TCPSpork.serve_forever(self, poll_interval=poll_interval)
@@ -0,0 +1,314 @@
+"""Persistent queue of the messages reported with the TELL command.
+
+The reports are stored in a SQLite database and dispatched to the
+plugins in the background, so the clients don't have to wait for
+the remote services.
+"""
+
+from __future__ import absolute_import
+
+from builtins import object
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+import collections
+
+import pad.stats
+import pad.errors
+import pad.message
+
+ACTIONS = ("report", "revoke")
+
+Job = collections.namedtuple("Job", ("id", "action", "user", "message",
+                                     "created", "attempts", "pending"))
+
+
+class ReportSpool(object):
+    """A queue of report jobs stored in a SQLite database in WAL
+    mode, that can be shared by multiple processes.
+
+    Jobs are claimed for a limited time, so the jobs of a process that
+    died while dispatching them are picked up again by another one.
+    """
+
+    def __init__(self, path, timeout=5.0):
+        """
+        :param path: The path to the database file.
+        :param timeout: Seconds to wait for a locked database.
+        """
+        self.log = logging.getLogger("pad-logger")
+        self.path = path
+        self.timeout = timeout
+        self._conn = None
+        self._conn_pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Get the connection for the current process. Connections
+        cannot be shared after fork.
+        """
+        pid = os.getpid()
+        if self._conn is not None and self._conn_pid == pid:
+            return self._conn
+        conn = sqlite3.connect(self.path, timeout=self.timeout,
+                               isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                     "id INTEGER PRIMARY KEY AUTOINCREMENT, action TEXT, "
+                     "user TEXT, message TEXT, created REAL, "
+                     "attempts INTEGER, next_attempt REAL, "
+                     "claimed_until REAL, owner TEXT, pending TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_next_attempt "
+                     "ON jobs (next_attempt)")
+        self._conn = conn
+        self._conn_pid = pid
+        return conn
+
+    def _execute(self, *statements):
+        """Execute the (query, args) statements in a single transaction
+        and return the rows of the last one.
+        """
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for query, args in statements:
+                    cursor = conn.execute(query, args)
+                rows = cursor.fetchall()
+            except sqlite3.Error:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return rows, cursor
+
+    def __len__(self):
+        try:
+            rows, dummy = self._execute(("SELECT COUNT(*) FROM jobs", ()))
+        except sqlite3.Error as e:
+            self.log.warning("Unable to read spool %s: %s", self.path, e)
+            return 0
+        return rows[0][0]
+
+    def put(self, action, message, user=None):
+        """Add a job to the queue.
+
+        :param action: "report" or "revoke".
+        :param message: The raw message.
+        :param user: The user whose ruleset is used for the report.
+        :return: The id of the job, or None if it could not be
+          stored.
+        """
+        if action not in ACTIONS:
+            raise ValueError("Invalid report action: %s" % action)
+        now = time.time()
+        try:
+            dummy, cursor = self._execute((
+                "INSERT INTO jobs (action, user, message, created, "
+                "attempts, next_attempt) VALUES (?, ?, ?, ?, 0, ?)",
+                (action, user, message, now, now)))
+        except sqlite3.Error as e:
+            self.log.warning("Unable to write spool %s: %s", self.path, e)
+            return None
+        pad.stats.incr("report_jobs_queued_total", action=action)
+        return cursor.lastrowid
+
+    def claim(self, batch_size, lease=300.0):
+        """Claim the oldest jobs that are due for `lease` seconds.
+
+        :return: A list of `Job`.
+        """
+        now = time.time()
+        owner = "%s-%s" % (os.getpid(), uuid.uuid4().hex)
+        try:
+            rows, dummy = self._execute(
+                ("UPDATE jobs SET claimed_until = ?, owner = ? WHERE id IN "
+                 "(SELECT id FROM jobs WHERE next_attempt <= ? AND "
+                 "(claimed_until IS NULL OR claimed_until <= ?) "
+                 "ORDER BY id LIMIT ?)",
+                 (now + lease, owner, now, now, batch_size)),
+                ("SELECT id, action, user, message, created, attempts, "
+                 "pending FROM jobs WHERE owner = ? ORDER BY id", (owner,)),
+            )
+        except sqlite3.Error as e:
+            self.log.warning("Unable to read spool %s: %s", self.path, e)
+            return []
+        jobs = []
+        for row in rows:
+            pending = row[6]
+            if pending is not None:
+                pending = json.loads(pending)
+            jobs.append(Job(*(row[:6] + (pending,))))
+        return jobs
+
+    def complete(self, job_ids):
+        """Remove these jobs from the queue."""
+        job_ids = list(job_ids)
+        if not job_ids:
+            return
+        try:
+            self._execute(("DELETE FROM jobs WHERE id IN (%s)" %
+                           ", ".join("?" * len(job_ids)), job_ids))
+        except sqlite3.Error as e:
+            self.log.warning("Unable to write spool %s: %s", self.path, e)
+
+    def retry(self, job_id, pending, delay):
+        """Release the job, so that it's dispatched again after `delay`
+        seconds to the `pending` plugins only.
+        """
+        try:
+            self._execute((
+                "UPDATE jobs SET attempts = attempts + 1, next_attempt = ?, "
+                "claimed_until = NULL, pending = ? WHERE id = ?",
+                (time.time() + delay, json.dumps(sorted(pending)), job_id)))
+        except sqlite3.Error as e:
+            self.log.warning("Unable to write spool %s: %s", self.path, e)
+
+
+class ReportDispatcher(threading.Thread):
+    """Background thread that takes the jobs from the spool and passes
+    them to the plugins.
+
+    Every plugin is a separate destination. Jobs are claimed in
+    batches and grouped by user and action, and each plugin gets all
+    the messages of the group in turn. When a plugin fails, the rest
+    of the batch is not sent to it and the jobs are retried later for
+    that plugin only, with an exponential backoff.
+    """
+    # Seconds to wait when the queue is empty.
+    interval = 1.0
+    # Seconds before the jobs claimed by a dead process are
+    # dispatched again.
+    lease = 300.0
+    max_retry_delay = 3600.0
+
+    def __init__(self, spool, get_ruleset, batch_size=50, max_attempts=5,
+                 retry_delay=30.0, on_batch=None):
+        """
+        :param spool: The `ReportSpool`.
+        :param get_ruleset: Callable returning the ruleset of a user,
+          like `pad.server.Server.get_user_ruleset`.
+        :param batch_size: Maximum number of jobs claimed at once.
+        :param max_attempts: Number of times a job is retried before
+          it's discarded.
+        :param retry_delay: Seconds before the first retry, doubled
+          on every attempt.
+        :param on_batch: Optional callable run after every batch.
+        """
+        super(ReportDispatcher, self).__init__(name="pad-report-dispatcher")
+        self.daemon = True
+        self.log = logging.getLogger("pad-logger")
+        self.spool = spool
+        self.get_ruleset = get_ruleset
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.on_batch = on_batch
+        self.pid = os.getpid()
+        self._stopped = threading.Event()
+
+    def stop(self, timeout=None):
+        """Stop the thread after the current batch."""
+        self._stopped.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                count = self.dispatch_batch()
+            except Exception as e:
+                self.log.exception("Error while dispatching reports: %s", e)
+                count = 0
+            if count < self.batch_size:
+                self._stopped.wait(self.interval)
+
+    def dispatch_batch(self):
+        """Claim and dispatch a batch of jobs.
+
+        :return: The number of jobs claimed.
+        """
+        jobs = self.spool.claim(self.batch_size, self.lease)
+        groups = collections.OrderedDict()
+        for job in jobs:
+            groups.setdefault((job.user, job.action), []).append(job)
+        for (user, action), group in groups.items():
+            self._dispatch(self.get_ruleset(user), action, group)
+        pad.stats.set_gauge("report_queue_depth", len(self.spool),
+                            pid=os.getpid())
+        if jobs and self.on_batch is not None:
+            self.on_batch()
+        return len(jobs)
+
+    def _dispatch(self, ruleset, action, jobs):
+        """Pass the messages of these jobs to every plugin, then
+        complete or retry the jobs.
+        """
+        messages = {}
+        for job in jobs:
+            try:
+                messages[job.id] = pad.message.Message(ruleset.ctxt,
+                                                       job.message)
+            except Exception as e:
+                self.log.warning("Unable to parse reported message %s: %s",
+                                 job.id, e)
+        # The plugins that still have to handle each message.
+        pending = {}
+        for job in jobs:
+            if job.id not in messages:
+                pending[job.id] = set()
+            elif job.pending is None:
+                pending[job.id] = set(ruleset.ctxt.plugins)
+            else:
+                pending[job.id] = set(job.pending)
+
+        for name, plugin in ruleset.ctxt.plugins.items():
+            handler = getattr(plugin, "plugin_%s" % action)
+            for job in jobs:
+                if name not in pending[job.id]:
+                    continue
+                try:
+                    handler(messages[job.id])
+                except pad.errors.InhibitCallbacks:
+                    # The other plugins must not get this message.
+                    pending[job.id].clear()
+                    continue
+                except Exception as e:
+                    self.log.warning("Unable to %s message %s with %s: %s",
+                                     action, job.id, name, e)
+                    pad.stats.incr("report_dispatch_errors_total",
+                                   action=action, plugin=name)
+                    # Keep the rest of the batch for this plugin for
+                    # the next attempt.
+                    break
+                pending[job.id].discard(name)
+
+        done = []
+        now = time.time()
+        for job in jobs:
+            if job.id not in messages:
+                result = "failed"
+            elif pending[job.id] and job.attempts + 1 < self.max_attempts:
+                delay = min(self.retry_delay * 2 ** job.attempts,
+                            self.max_retry_delay)
+                self.spool.retry(job.id, pending[job.id], delay)
+                pad.stats.incr("report_jobs_total", action=action,
+                               result="retry")
+                continue
+            elif pending[job.id]:
+                self.log.warning("Discarding report %s after %s attempts, "
+                                 "not sent to %s", job.id, job.attempts + 1,
+                                 ", ".join(sorted(pending[job.id])))
+                result = "failed"
+            else:
+                result = "done"
+            done.append(job.id)
+            pad.stats.incr("report_jobs_total", action=action, result=result)
+            pad.stats.observe("report_queue_latency_seconds",
+                              now - job.created, action=action)
+        self.spool.complete(done)
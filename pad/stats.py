@@ -0,0 +1,404 @@
+"""Collect runtime statistics for the daemon.
+
+Every process keeps its own counters in a `Collector`. The server
+periodically publishes a snapshot of these counters in a shared memory
+region (see `SharedStats`) so that any worker can aggregate the data
+of all the pre-forked children when the STATS command is received.
+"""
+
+from __future__ import absolute_import
+
+from builtins import dict
+from builtins import object
+
+import os
+import json
+import mmap
+import time
+import struct
+import logging
+import resource
+import threading
+import contextlib
+import collections
+import multiprocessing
+
+# Upper bounds of the histograms buckets.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                16777216)
+
+# Slot header: pid, publish time and length of the JSON data
+_SLOT_HEADER = struct.Struct("<idI")
+
+
+def _key(name, labels):
+    """Get a hashable key for this metric."""
+    return name, tuple(sorted(labels.items()))
+
+
+class Collector(object):
+    """Store counters, gauges and histograms for the current
+    process. The data is also updated by the background threads of
+    the plugins, every access is done while holding the lock.
+    """
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.gauges = dict()
+        self.histograms = dict()
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1, **labels):
+        """Increment the counter with this name and labels."""
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] += value
+
+    def set(self, name, value, **labels):
+        """Set the value of the gauge with this name and labels."""
+        key = _key(name, labels)
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """Record the value in the histogram with this name and
+        labels.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            try:
+                histogram = self.histograms[key]
+            except KeyError:
+                histogram = {
+                    "buckets": list(buckets),
+                    "counts": [0] * len(buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+                self.histograms[key] = histogram
+            for i, bound in enumerate(histogram["buckets"]):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Record the time spent in this block in the histogram with
+        this name and labels.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def clear(self, gauges=True):
+        """Reset all the data stored. The gauges are kept if `gauges`
+        is False, they describe the current state instead of
+        accumulating values.
+        """
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            if gauges:
+                self.gauges.clear()
+
+    def snapshot(self):
+        """Return a JSON serializable copy of the data stored."""
+        with self._lock:
+            return {
+                "counters": [[name, dict(labels), value]
+                             for (name, labels), value
+                             in self.counters.items()],
+                "gauges": [[name, dict(labels), value]
+                           for (name, labels), value in self.gauges.items()],
+                "histograms": [[name, dict(labels),
+                                dict(histogram,
+                                     counts=list(histogram["counts"]))]
+                               for (name, labels), histogram
+                               in self.histograms.items()],
+            }
+
+
+# Statistics for the current process.
+_collector = Collector()
+
+
+def incr(name, value=1, **labels):
+    """Increment a counter for the current process."""
+    _collector.incr(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge for the current process."""
+    _collector.set(name, value, **labels)
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Record a value in a histogram for the current process."""
+    _collector.observe(name, value, buckets, **labels)
+
+
+def timer(name, **labels):
+    """Record the time spent in a block for the current process."""
+    return _collector.timer(name, **labels)
+
+
+def get_collector():
+    """Return the `Collector` of the current process."""
+    return _collector
+
+
+def get_rss():
+    """Get the resident set size of the current process in bytes."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * mmap.PAGESIZE
+    except (IOError, OSError, IndexError, ValueError):
+        # Not available, use the peak value instead.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def merge(snapshots):
+    """Aggregate a list of snapshots into a single one. Counters and
+    histograms are added, for gauges the largest value is used since
+    the same gauge can be reported by all the workers.
+    """
+    counters = collections.Counter()
+    gauges = dict()
+    histograms = dict()
+    for snapshot in snapshots:
+        for name, labels, value in snapshot["counters"]:
+            counters[_key(name, labels)] += value
+        for name, labels, value in snapshot["gauges"]:
+            key = _key(name, labels)
+            gauges[key] = max(gauges.get(key, value), value)
+        for name, labels, histogram in snapshot["histograms"]:
+            key = _key(name, labels)
+            try:
+                total = histograms[key]
+            except KeyError:
+                histograms[key] = {
+                    "buckets": list(histogram["buckets"]),
+                    "counts": list(histogram["counts"]),
+                    "sum": histogram["sum"],
+                    "count": histogram["count"],
+                }
+                continue
+            if total["buckets"] != histogram["buckets"]:
+                continue
+            total["counts"] = [a + b for a, b in zip(total["counts"],
+                                                     histogram["counts"])]
+            total["sum"] += histogram["sum"]
+            total["count"] += histogram["count"]
+    merged = Collector()
+    merged.counters = counters
+    merged.gauges = gauges
+    merged.histograms = histograms
+    return merged.snapshot()
+
+
+def _format_labels(labels, extra=None):
+    """Format the labels in the Prometheus text format."""
+    items = sorted(labels.items())
+    if extra:
+        items.extend(extra)
+    if not items:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in items
+    )
+
+
+def format_prometheus(snapshot, prefix="pad_"):
+    """Format the snapshot using the Prometheus text exposition
+    format.
+    """
+    lines = []
+    by_name = collections.defaultdict(list)
+    for name, labels, value in snapshot["counters"]:
+        by_name[("counter", name)].append((labels, value))
+    for name, labels, value in snapshot["gauges"]:
+        by_name[("gauge", name)].append((labels, value))
+    for name, labels, value in snapshot["histograms"]:
+        by_name[("histogram", name)].append((labels, value))
+
+    for (metric_type, name), values in sorted(by_name.items(),
+                                              key=lambda x: x[0][1]):
+        name = prefix + name
+        lines.append("# TYPE %s %s" % (name, metric_type))
+        for labels, value in sorted(values, key=lambda x: sorted(
+                x[0].items())):
+            if metric_type != "histogram":
+                lines.append("%s%s %s" % (name, _format_labels(labels),
+                                          value))
+                continue
+            for bound, count in zip(value["buckets"], value["counts"]):
+                lines.append("%s_bucket%s %s" % (
+                    name, _format_labels(labels, [("le", bound)]), count))
+            lines.append("%s_bucket%s %s" % (
+                name, _format_labels(labels, [("le", "+Inf")]),
+                value["count"]))
+            lines.append("%s_sum%s %s" % (name, _format_labels(labels),
+                                          value["sum"]))
+            lines.append("%s_count%s %s" % (name, _format_labels(labels),
+                                            value["count"]))
+    return "\n".join(lines) + "\n"
+
+
+class SharedStats(object):
+    """Share the statistics of multiple processes through an
+    anonymous shared memory map.
+
+    The memory is split in one slot per worker, each process claims
+    a free slot the first time it publishes data. The map must be
+    created before the workers are forked.
+    """
+    slot_size = 1024 * 1024
+
+    def __init__(self, workers=1, slot_size=None):
+        self.log = logging.getLogger("pad-logger")
+        if slot_size is not None:
+            self.slot_size = slot_size
+        self.workers = workers
+        self._lock = multiprocessing.Lock()
+        self._map = mmap.mmap(-1, self.workers * self.slot_size)
+        self._slot = None
+        self._slot_pid = None
+
+    def _read_header(self, slot):
+        offset = slot * self.slot_size
+        return _SLOT_HEADER.unpack_from(self._map, offset)
+
+    def _claim_slot(self):
+        """Find a slot for the current process. Slots belonging
+        to processes that no longer exist are reused if there are no
+        empty slots left.
+        """
+        pid = os.getpid()
+        if self._slot is not None and self._slot_pid == pid:
+            return self._slot
+        empty = dead = None
+        for slot in range(self.workers):
+            slot_pid = self._read_header(slot)[0]
+            if slot_pid == pid:
+                empty = slot
+                break
+            if not slot_pid:
+                if empty is None:
+                    empty = slot
+                continue
+            if dead is not None:
+                continue
+            try:
+                os.kill(slot_pid, 0)
+            except OSError:
+                dead = slot
+        free = empty if empty is not None else dead
+        if free is not None:
+            self._slot = free
+            self._slot_pid = pid
+        return free
+
+    def publish(self, collector):
+        """Write the snapshot of this collector in the slot of
+        the current process.
+        """
+        data = json.dumps(collector.snapshot()).encode("utf8")
+        if len(data) + _SLOT_HEADER.size > self.slot_size:
+            self.log.warning("Statistics too large to publish: %s bytes",
+                             len(data))
+            return False
+        with self._lock:
+            slot = self._claim_slot()
+            if slot is None:
+                self.log.warning("No free statistics slot for process %s",
+                                 os.getpid())
+                return False
+            offset = slot * self.slot_size
+            _SLOT_HEADER.pack_into(self._map, offset, os.getpid(),
+                                   time.time(), len(data))
+            start = offset + _SLOT_HEADER.size
+            self._map[start:start + len(data)] = data
+        return True
+
+    def collect(self):
+        """Read and aggregate the snapshots from all the slots."""
+        snapshots = []
+        with self._lock:
+            for slot in range(self.workers):
+                pid, dummy, length = self._read_header(slot)
+                if not pid or not length:
+                    continue
+                start = slot * self.slot_size + _SLOT_HEADER.size
+                data = self._map[start:start + length]
+                try:
+                    snapshots.append(json.loads(data.decode("utf8")))
+                except ValueError as e:
+                    self.log.warning("Invalid statistics in slot %s: %s",
+                                     slot, e)
+        return merge(snapshots)
+
+
+class ServerStats(object):
+    """Statistics of the PAD server.
+
+    Records data for every request handled and periodically publishes
+    it in the shared memory, and optionally writes the aggregated data
+    in a file using the Prometheus text format.
+    """
+    # Minimum number of seconds between two publishes.
+    publish_interval = 1.0
+
+    def __init__(self, workers=1, stats_file=None):
+        self.log = logging.getLogger("pad-logger")
+        self.shared = SharedStats(workers)
+        self.stats_file = stats_file
+        self._last_publish = 0
+
+    def record_request(self, command_name, command):
+        """Record the statistics for a request that was handled."""
+        collector = get_collector()
+        collector.incr("requests_total", command=command_name)
+        for phase, duration in command.timings.items():
+            collector.observe("request_phase_seconds", duration, phase=phase)
+        if command.message_size is not None:
+            collector.observe("message_size_bytes", command.message_size,
+                              buckets=SIZE_BUCKETS)
+        if command.is_spam is not None:
+            collector.incr("messages_total",
+                           result="spam" if command.is_spam else "ham")
+        if command.msg is not None and command.is_spam is not None:
+            for name, result in command.msg.rules_checked.items():
+                if result:
+                    collector.incr("rule_hits_total", rule=name)
+        if time.time() - self._last_publish >= self.publish_interval:
+            self.publish()
+
+    def publish(self):
+        """Publish the statistics of the current process."""
+        self._last_publish = time.time()
+        collector = get_collector()
+        collector.set("worker_rss_bytes", get_rss(), pid=os.getpid())
+        self.shared.publish(collector)
+        if self.stats_file:
+            self.write_file(self.stats_file)
+
+    def write_file(self, path):
+        """Atomically write the aggregated statistics to a file."""
+        tmp_path = "%s.%s.tmp" % (path, os.getpid())
+        try:
+            with open(tmp_path, "w") as stats_file:
+                stats_file.write(format_prometheus(self.shared.collect()))
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            self.log.warning("Unable to write statistics to %s: %s", path, e)
+
+    def collect(self):
+        """Get the aggregated statistics of all the workers."""
+        self.publish()
+        return self.shared.collect()
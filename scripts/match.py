@@ -13,11 +13,13 @@ import argparse
 
 import pad
 import pad.config
+import pad.pool
 import pad.errors
 import pad.message
 import pad.rules.parser
+import pad.rules.compiler
 
-from future.utils import PY3
+PY3 = sys.version_info[0] == 3
 
 class MessageList(argparse.FileType):
     def __call__(self, string):
@@ -85,6 +87,9 @@ def parse_arguments(args):
     parser.add_argument("-R", "--report-only", action="store_true",
                         default=False, help="Only print the report instead of "
                                             "the adjusted message.")
+    parser.add_argument("--dump-match", action="store_true", default=False,
+                        help="Print the source of the generated match "
+                             "function for the rules and exit")
     parser.add_argument("messages", type=MessageList(), nargs="*",
                         metavar="path", help="Paths to messages or "
                                              "directories containing messages",
@@ -115,28 +120,37 @@ def main():
         print(e, file=sys.stderr)
         sys.exit(1)
 
+    if options.dump_match:
+        print(pad.rules.compiler.generate_source(ruleset)[0])
+        return
+
     count = 0
-    for message_list in options.messages:
-        for msgf in message_list:
-            raw_msg = msgf.read()
-            if type(raw_msg) is bytes and PY3:
-                raw_msg = raw_msg.decode("utf-8", "ignore")
-            msgf.close()
-            msg = pad.message.Message(ruleset.ctxt, raw_msg)
-
-            if options.revoke:
-                ruleset.ctxt.hook_revoke(msg)
-            elif options.report:
-                ruleset.ctxt.hook_report(msg)
-            elif options.report_only:
-                ruleset.match(msg)
-                print(ruleset.get_report(msg))
-            else:
-                ruleset.match(msg)
-                print(ruleset.get_adjusted_message(msg))
-                if options.test_mode:
+    try:
+        for message_list in options.messages:
+            for msgf in message_list:
+                raw_msg = msgf.read()
+                if type(raw_msg) is bytes and PY3:
+                    raw_msg = raw_msg.decode("utf-8", "ignore")
+                msgf.close()
+                msg = pad.message.Message(ruleset.ctxt, raw_msg)
+
+                if options.revoke:
+                    ruleset.ctxt.hook_revoke(msg)
+                elif options.report:
+                    ruleset.ctxt.hook_report(msg)
+                elif options.report_only:
+                    ruleset.match(msg)
                     print(ruleset.get_report(msg))
-        count += 1
+                else:
+                    ruleset.match(msg)
+                    print(ruleset.get_adjusted_message(msg))
+                    if options.test_mode:
+                        print(ruleset.get_report(msg))
+            count += 1
+    finally:
+        # Let the plugins write any data they still hold in memory.
+        ruleset.ctxt.hook_finish()
+        pad.pool.close_pools()
     if options.revoke or options.report:
         print("%s message(s) examined" % count)
 
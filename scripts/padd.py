@@ -24,13 +24,13 @@ def run_daemon(args):
     if args.prefork is not None:
         server = pad.server.PreForkServer(
             address, args.sitepath, args.configpath, paranoid=args.paranoid,
-            ignore_unknown=not args.show_unknown
+            ignore_unknown=not args.show_unknown, stats_file=args.stats_file
         )
         server.prefork = args.prefork
     else:
         server = pad.server.Server(
             address, args.sitepath, args.configpath,paranoid=args.paranoid,
-            ignore_unknown=not args.show_unknown
+            ignore_unknown=not args.show_unknown, stats_file=args.stats_file
         )
     try:
         server.serve_forever()
@@ -74,6 +74,9 @@ def main():
     parser.add_argument("-r", "--pidfile", default="/var/run/padd.pid")
     parser.add_argument("--log-file", dest="log_file",
                         default="/var/log/padd.log")
+    parser.add_argument("--stats-file", dest="stats_file", default=None,
+                        help="Periodically write the statistics to this "
+                             "file in the Prometheus text format")
     # parser.add_argument("-4", "--ipv4-only", "--ipv4", default=False,
     #                     action="store_true", help="Use IPv4 where applicable, "
     #                                               "disables IPv6")
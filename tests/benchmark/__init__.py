@@ -0,0 +1,35 @@
+"""Package for benchmarks.
+
+These are not run with the unit and functional tests, run them
+with::
+
+    py.test -s tests/benchmark/
+"""
+
+import unittest
+
+
+def suite():
+    """Gather all the benchmarks from this package in a test suite."""
+    from tests.benchmark import test_compiler
+    from tests.benchmark import test_dns_cache
+    from tests.benchmark import test_import_time
+    from tests.benchmark import test_parser
+    from tests.benchmark import test_rbl_zone
+    from tests.benchmark import test_regex
+    from tests.benchmark import test_relay_country
+    from tests.benchmark import test_textcat
+
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(test_compiler.suite())
+    test_suite.addTest(test_dns_cache.suite())
+    test_suite.addTest(test_import_time.suite())
+    test_suite.addTest(test_parser.suite())
+    test_suite.addTest(test_rbl_zone.suite())
+    test_suite.addTest(test_regex.suite())
+    test_suite.addTest(test_relay_country.suite())
+    test_suite.addTest(test_textcat.suite())
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
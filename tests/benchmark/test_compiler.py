@@ -0,0 +1,103 @@
+"""Compare the time it takes to match messages against a large rule set
+with the generic loop and with the generated match function.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import time
+import random
+import shutil
+import logging
+import tempfile
+import unittest
+
+import pad.message
+import pad.rules.parser
+import pad.rules.compiler
+
+RULES = 2000
+MESSAGES = 50
+WORDS = ("viagra", "money", "offer", "free", "click", "here", "meeting",
+         "report", "invoice", "unsubscribe", "winner", "account")
+
+MESSAGE = """Subject: %s
+From: sender@example.com
+To: recipient@example.com
+
+%s
+"""
+
+
+def write_rules(path, rand):
+    with open(path, "w") as rulef:
+        for i in range(RULES):
+            name = "TEST_RULE_%s" % i
+            rtype = rand.choice(("body", "rawbody", "full", "header",
+                                 "meta" if i else "body"))
+            word = rand.choice(WORDS)
+            if rtype == "header":
+                value = "Subject =~ /%s %s/i" % (word, i % 10)
+            elif rtype == "meta":
+                value = "TEST_RULE_%s && !TEST_RULE_%s" % (
+                    rand.randrange(i), rand.randrange(i))
+            else:
+                value = r"/\b%s %s\b/i" % (word, i % 10)
+            rulef.write("%s %s %s\n" % (rtype, name, value))
+            rulef.write("score %s %.3f\n" % (name, rand.random()))
+
+
+class BenchmarkCompiler(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("pad-logger").handlers = [logging.NullHandler()]
+        self.tmpdir = tempfile.mkdtemp()
+        self.rules = os.path.join(self.tmpdir, "test.cf")
+        rand = random.Random(0)
+        write_rules(self.rules, rand)
+        self.raw_messages = [
+            MESSAGE % (" ".join(rand.choice(WORDS) for dummy in range(5)),
+                       " ".join("%s %s" % (rand.choice(WORDS),
+                                           rand.randrange(10))
+                                for dummy in range(500)))
+            for dummy in range(MESSAGES)
+        ]
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+
+    def check(self, ruleset):
+        messages = [pad.message.Message(ruleset.ctxt, raw_msg)
+                    for raw_msg in self.raw_messages]
+        start = time.time()
+        for msg in messages:
+            ruleset.match(msg)
+        elapsed = time.time() - start
+        return elapsed, [(msg.rules_checked, msg.score) for msg in messages]
+
+    def test_compiled(self):
+        ruleset = pad.rules.parser.parse_pad_rules(
+            [self.rules]).get_ruleset()
+        print()
+        print("%d rules, %d messages" % (len(ruleset.checked), MESSAGES))
+        elapsed, expected = self.check(ruleset)
+        print("Generic loop: %.3fs" % elapsed)
+
+        start = time.time()
+        ruleset.compiled_match = pad.rules.compiler.compile_match(ruleset)
+        print("Compiled in %.3fs" % (time.time() - start))
+        elapsed, results = self.check(ruleset)
+        print("Compiled match: %.3fs" % elapsed)
+        self.assertEqual(results, expected)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(BenchmarkCompiler, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,119 @@
+"""Compare the per-worker and the shared DNS caches."""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import time
+import random
+import shutil
+import logging
+import tempfile
+import unittest
+import multiprocessing
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import dns.rdata
+import dns.rdatatype
+import dns.rdataclass
+
+import pad.cache
+import pad.dns_interface
+
+WORKERS = 4
+QUERIES = 2000
+NAMES = 1000
+# Simulated latency of a DNS query
+LATENCY = 0.001
+
+
+def _resolve(self, qname, qtype):
+    """Fake resolver that records each query."""
+    time.sleep(LATENCY)
+    rdata = dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.A,
+                                "127.0.0.2")
+    return [rdata], 300
+
+
+def _worker(dns_interface, seed, queue):
+    """Perform the queries and report the number of queries that
+    reached the resolver and the time spent.
+    """
+    rand = random.Random(seed)
+    # Campaigns hit the same relays and domains, use a skewed
+    # distribution of names.
+    names = ["%s.example.com" % int(rand.paretovariate(1.2) % NAMES)
+             for dummy in range(QUERIES)]
+    resolved = []
+
+    def counting_resolve(qname, qtype):
+        resolved.append(qname)
+        return _resolve(dns_interface, qname, qtype)
+
+    dns_interface._resolve = counting_resolve
+    start = time.time()
+    for name in names:
+        dns_interface.query(name, "A")
+    queue.put((len(resolved), time.time() - start))
+
+
+class BenchmarkDNSCache(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("pad-logger").handlers = [logging.NullHandler()]
+        self.tmpdir = tempfile.mkdtemp()
+        patch("pad.dns_interface.dns.resolver.Resolver").start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+        patch.stopall()
+
+    def run_workers(self, dns_interface):
+        queue = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_worker,
+                                           args=(dns_interface, seed, queue))
+                   for seed in range(WORKERS)]
+        for worker in workers:
+            worker.start()
+        results = [queue.get() for dummy in workers]
+        for worker in workers:
+            worker.join()
+        resolved = sum(result[0] for result in results)
+        elapsed = sum(result[1] for result in results)
+        total = WORKERS * QUERIES
+        hit_rate = 1 - resolved / total
+        latency = elapsed / total * 1000
+        return hit_rate, latency
+
+    def test_per_worker_vs_shared(self):
+        local = pad.dns_interface.DNSInterface()
+        local_hit_rate, local_latency = self.run_workers(local)
+
+        shared = pad.dns_interface.DNSInterface()
+        shared.shared_cache = pad.cache.SQLiteCache(
+            "dns_shared", os.path.join(self.tmpdir, "dns.db"))
+        shared_hit_rate, shared_latency = self.run_workers(shared)
+
+        print()
+        print("%d workers, %d queries each, %.1fms per DNS query" %
+              (WORKERS, QUERIES, LATENCY * 1000))
+        print("per-worker cache: hit rate %.2f%%, %.3fms per query" %
+              (local_hit_rate * 100, local_latency))
+        print("shared cache:     hit rate %.2f%%, %.3fms per query" %
+              (shared_hit_rate * 100, shared_latency))
+        self.assertGreaterEqual(shared_hit_rate, local_hit_rate)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(BenchmarkDNSCache, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
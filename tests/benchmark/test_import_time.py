@@ -0,0 +1,98 @@
+"""Report the time spent importing the PAD modules, in the same way
+as `python -X importtime`.
+
+The check that the heavy dependencies are only imported when a rule
+needs them is in `tests.unit.test_lazy`.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import pad
+
+from tests.unit.test_lazy import CORE_MODULES, PLUGINS, PARSE_SCRIPT
+
+# The number of modules shown in the report.
+TOP_MODULES = 15
+
+
+def import_time(code, *args):
+    """Run the code in a new interpreter with `-X importtime`.
+
+    :return: A tuple with the list of (cumulative microseconds, module)
+      of the imports and the output of the code.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(pad.__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    proc = subprocess.Popen((sys.executable, "-X", "importtime", "-c",
+                             code) + args, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, env=env,
+                            universal_newlines=True)
+    stdout, stderr = proc.communicate()
+    if proc.returncode:
+        raise AssertionError(stderr)
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            dummy, cumulative, module = line.split("|")
+            # Drop the separator, nested imports are indented.
+            timings.append((int(cumulative), module[1:].rstrip()))
+        except ValueError:
+            # The header line.
+            continue
+    return timings, stdout
+
+
+def print_report(title, timings):
+    """Print the modules that took the longest to import."""
+    top_level = [(usec, module) for usec, module in timings
+                 if not module.startswith(" ")]
+    print()
+    print("%s: %.1fms" % (title, sum(usec for usec, dummy in top_level) /
+                          1000))
+    for usec, module in sorted(timings, reverse=True)[:TOP_MODULES]:
+        print("%10.1fms | %s" % (usec / 1000, module))
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "-X importtime requires 3.7")
+class BenchmarkImportTime(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = os.path.join(self.tmpdir, "test.cf")
+        with open(self.config, "w") as config:
+            for plugin in PLUGINS:
+                config.write("loadplugin %s\n" % plugin)
+            config.write("body TEST_RULE /test/\n")
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+
+    def test_core_modules(self):
+        timings, dummy = import_time("import %s" % ", ".join(CORE_MODULES))
+        print_report("Importing %s" % ", ".join(CORE_MODULES), timings)
+
+    def test_unused_plugins(self):
+        timings, dummy = import_time(PARSE_SCRIPT, self.config)
+        print_report("Parsing the rules with %d plugins" % len(PLUGINS),
+                     timings)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(BenchmarkImportTime, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,71 @@
+"""Report the time it takes to parse a large rule set."""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import time
+import random
+import shutil
+import logging
+import tempfile
+import unittest
+
+import pad.rules.parser
+
+FILES = 40
+# About the size of a full SpamAssassin rule set.
+LINES = 80000
+
+
+def write_rules(path, rand, count):
+    """Write a rule file with `count` lines, like the ones from the
+    SpamAssassin rule set.
+    """
+    with open(path, "w") as rulef:
+        for i in range(count // 4):
+            name = "TEST_RULE_%s_%s" % (os.path.basename(path)[:-3], i)
+            rtype = rand.choice(("body", "header", "rawbody", "uri"))
+            if rtype == "header":
+                value = "Subject =~ /test %s/i" % i
+            else:
+                value = "/\\btest\\s+%s\\b/i" % i
+            rulef.write("# Rule number %s\n" % i)
+            rulef.write("%s %s %s # comment\n" % (rtype, name, value))
+            rulef.write("describe %s Test rule %s\n" % (name, i))
+            rulef.write("score %s %.3f\n" % (name, rand.random()))
+
+
+class BenchmarkParser(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("pad-logger").handlers = [logging.NullHandler()]
+        self.tmpdir = tempfile.mkdtemp()
+        rand = random.Random(0)
+        self.files = []
+        for i in range(FILES):
+            path = os.path.join(self.tmpdir, "%02d.cf" % i)
+            write_rules(path, rand, LINES // FILES)
+            self.files.append(path)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+
+    def test_parse(self):
+        print()
+        print("%d lines in %d files" % (LINES, FILES))
+        start = time.time()
+        parser = pad.rules.parser.parse_pad_rules(self.files)
+        print("Parsed in %.3fs" % (time.time() - start))
+        self.assertEqual(len(parser.results), LINES // 4)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(BenchmarkParser, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,112 @@
+"""Compare the lookups in local zone files with the DNS lookups."""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import time
+import random
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+import unittest
+
+import dns.message
+import dns.rrset
+
+import pad.rbldnsd
+import pad.dns_interface
+
+ENTRIES = 100000
+QUERIES = 2000
+ZONE = "bl.example.com"
+
+
+class DNSResponder(threading.Thread):
+    """Minimal DNS server on the loopback interface that lists
+    every address.
+    """
+
+    def __init__(self):
+        super(DNSResponder, self).__init__()
+        self.daemon = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(4096)
+            except socket.error:
+                return
+            query = dns.message.from_wire(data)
+            response = dns.message.make_response(query)
+            question = query.question[0]
+            response.answer.append(dns.rrset.from_text(
+                question.name, 300, "IN", "A", "127.0.0.2"))
+            self.sock.sendto(response.to_wire(), address)
+
+
+class BenchmarkRBLZone(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("pad-logger").handlers = [logging.NullHandler()]
+        self.tmpdir = tempfile.mkdtemp()
+        self.rand = random.Random(0)
+        self.path = os.path.join(self.tmpdir, "zone")
+        with open(self.path, "w") as zone_file:
+            zone_file.write(":127.0.0.2:Listed, see http://example.com/$\n")
+            for dummy in range(ENTRIES):
+                zone_file.write("%s\n" % self.random_ip())
+        self.responder = DNSResponder()
+        self.responder.start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.responder.sock.close()
+        shutil.rmtree(self.tmpdir)
+
+    def random_ip(self):
+        return ".".join(str(self.rand.randint(1, 254)) for dummy in range(4))
+
+    def test_local_vs_dns(self):
+        qnames = ["%s.%s" % (".".join(reversed(self.random_ip().split("."))),
+                             ZONE) for dummy in range(QUERIES)]
+
+        start = time.time()
+        zone = pad.rbldnsd.Zone(ZONE)
+        zone.add_dataset("ip4set", self.path)
+        load_time = time.time() - start
+
+        start = time.time()
+        for qname in qnames:
+            zone.query(zone.get_prefix(qname), "A")
+        local_latency = (time.time() - start) / QUERIES * 1000
+
+        dns_interface = pad.dns_interface.DNSInterface()
+        dns_interface.cache.max_size = 0
+        dns_interface._resolver.nameservers = ["127.0.0.1"]
+        dns_interface.port = self.responder.port
+        start = time.time()
+        for qname in qnames:
+            dns_interface.query(qname, "A")
+        dns_latency = (time.time() - start) / QUERIES * 1000
+
+        print()
+        print("Loaded %d entries in %.3fs" % (ENTRIES, load_time))
+        print("local zone: %.4fms per query" % local_latency)
+        print("DNS (loopback server): %.4fms per query" % dns_latency)
+        self.assertLess(local_latency, dns_latency)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(BenchmarkRBLZone, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
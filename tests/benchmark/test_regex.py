@@ -0,0 +1,93 @@
+"""Compare the time it takes to match body rules when the rules with
+the same regular expression share their pattern and when each rule
+has its own.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import time
+import random
+import unittest
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import pad.regex
+import pad.rules.body
+
+# The number of distinct regular expressions, and how many rules
+# use each one of them.
+PATTERNS = 500
+RULES_PER_PATTERN = 4
+MESSAGES = 10
+WORDS = ("viagra", "money", "offer", "free", "click", "here", "meeting",
+         "report", "invoice", "unsubscribe", "winner", "account")
+
+
+class NotShared(dict):
+    """Pattern table that never stores anything."""
+
+    def __setitem__(self, key, value):
+        pass
+
+
+def make_rules():
+    rules = []
+    for i in range(PATTERNS):
+        value = r"/\b%s %s\b/i" % (WORDS[i % len(WORDS)], i)
+        for j in range(RULES_PER_PATTERN):
+            kwargs = pad.rules.body.BodyRule.get_rule_kwargs(
+                {"value": value})
+            rules.append(pad.rules.body.BodyRule("TEST_%s_%s" % (i, j),
+                                                 **kwargs))
+    return rules
+
+
+def make_messages(rand):
+    messages = []
+    for dummy in range(MESSAGES):
+        text = " ".join(rand.choice(WORDS) for dummy in range(5000))
+        messages.append(Mock(text=text))
+    return messages
+
+
+class BenchmarkSharedPatterns(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.messages = make_messages(random.Random(0))
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def check(self, rules):
+        start = time.time()
+        results = [[rule.match(msg) for rule in rules]
+                   for msg in self.messages]
+        return time.time() - start, results
+
+    def test_shared(self):
+        print()
+        print("%d rules with %d patterns, %d messages" %
+              (PATTERNS * RULES_PER_PATTERN, PATTERNS, MESSAGES))
+        with patch("pad.regex._PATTERNS", NotShared()):
+            elapsed, expected = self.check(make_rules())
+        print("Not shared: %.3fs" % elapsed)
+        with patch("pad.regex._PATTERNS", {}):
+            elapsed, results = self.check(make_rules())
+            print("Shared: %.3fs (%d patterns)" %
+                  (elapsed, pad.regex.shared_patterns()))
+        self.assertEqual(results, expected)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(BenchmarkSharedPatterns, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
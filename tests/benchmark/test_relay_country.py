@@ -0,0 +1,117 @@
+"""Compare the GeoIP lookups with the different database modes and
+with the per-IP cache.
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import os
+import time
+import struct
+import random
+import shutil
+import logging
+import tempfile
+import unittest
+
+import ipaddress
+
+try:
+    from unittest.mock import MagicMock
+except ImportError:
+    from mock import MagicMock
+
+import pygeoip
+import pygeoip.const
+
+import pad.plugins.relay_country
+
+LOOKUPS = 20000
+# The number of different relays, most messages are received from
+# the same servers.
+RELAYS = 2000
+# The depth of the generated database tree, every /16 network gets
+# a country.
+DEPTH = 16
+
+
+def write_database(path):
+    """Write a GeoIP country database where every /16 network is
+    assigned to a random country.
+    """
+    rand = random.Random(0)
+    countries = len(pygeoip.const.COUNTRY_CODES)
+    with open(path, "wb") as database:
+        for node in range(2 ** DEPTH - 1):
+            depth = (node + 1).bit_length() - 1
+            records = []
+            for child in (2 * node + 1, 2 * node + 2):
+                if depth == DEPTH - 1:
+                    # Skip the unknown (--) country.
+                    value = (pygeoip.const.COUNTRY_BEGIN +
+                             rand.randint(1, countries - 1))
+                else:
+                    value = child
+                records.append(struct.pack("<I", value)[:3])
+            database.write(b"".join(records))
+
+
+class BenchmarkRelayCountry(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("pad-logger").handlers = [logging.NullHandler()]
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "GeoIP.dat")
+        write_database(self.path)
+        rand = random.Random(0)
+        relays = [ipaddress.ip_address(rand.randint(0x01000000, 0xDFFFFFFF))
+                  for dummy in range(RELAYS)]
+        self.ips = [rand.choice(relays) for dummy in range(LOOKUPS)]
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+
+    def get_plugin(self, mode, cache_size):
+        global_data = {}
+        mock_ctxt = MagicMock(**{
+            "get_plugin_data.side_effect": lambda p, k: global_data[k],
+            "set_plugin_data.side_effect":
+                lambda p, k, v: global_data.__setitem__(k, v),
+        })
+        plugin = pad.plugins.relay_country.RelayCountryPlugin(mock_ctxt)
+        plugin["geodb_cache_size"] = cache_size
+        # Don't reuse the instance opened with another mode.
+        flags = pad.plugins.relay_country.GEODB_MODES[mode]
+        plugin["ipv4"] = pygeoip.GeoIP(self.path, flags, cache=False)
+        plugin["ipv6"] = None
+        return plugin
+
+    def lookup(self, plugin):
+        start = time.time()
+        for ipaddr in self.ips:
+            plugin.get_country(ipaddr)
+        return LOOKUPS / (time.time() - start)
+
+    def test_modes(self):
+        print()
+        print("%d lookups of %d different IPs" % (LOOKUPS, RELAYS))
+        results = {}
+        for mode in ("standard", "mmap", "memory"):
+            for cache_size in (0, RELAYS):
+                plugin = self.get_plugin(mode, cache_size)
+                results[mode, cache_size] = self.lookup(plugin)
+                print("%-8s %-8s: %10.0f lookups/s" % (
+                    mode, "cache" if cache_size else "no cache",
+                    results[mode, cache_size]))
+        self.assertLess(results["standard", 0], results["memory", RELAYS])
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(BenchmarkRelayCountry, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
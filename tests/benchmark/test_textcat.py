@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Compare the accuracy and the speed of the language detection with
+different sample sizes.
+"""
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+import time
+import random
+import unittest
+
+import langdetect
+import langdetect.detector_factory
+
+import pad.plugins.textcat
+
+DOCUMENTS = 20
+SENTENCES = 400
+# The size of the english text added at the end of every document,
+# relative to the main text.
+QUOTED = 0.4
+SAMPLE_SIZES = (256, 1024, 4096, 16384, 0)
+
+SENTENCES_BY_LANG = {
+    "en": [
+        "The meeting has been moved to next Tuesday afternoon.",
+        "Please send me the updated report before the end of the week.",
+        "We are happy to announce that our new store is now open.",
+        "Thank you for your order, it will be shipped tomorrow morning.",
+        "The weather was much better than we expected during the trip.",
+        "Could you check whether the invoice was paid last month?",
+    ],
+    "fr": [
+        "La réunion a été déplacée à mardi prochain dans l'après-midi.",
+        "Merci de m'envoyer le rapport mis à jour avant la fin de la "
+        "semaine.",
+        "Nous sommes heureux d'annoncer l'ouverture de notre nouveau "
+        "magasin.",
+        "Merci pour votre commande, elle sera expédiée demain matin.",
+        "Le temps était bien meilleur que prévu pendant le voyage.",
+        "Pourriez-vous vérifier si la facture a été payée le mois dernier ?",
+    ],
+    "de": [
+        "Die Besprechung wurde auf nächsten Dienstagnachmittag verschoben.",
+        "Bitte schicken Sie mir den aktualisierten Bericht bis Ende der "
+        "Woche.",
+        "Wir freuen uns, die Eröffnung unseres neuen Geschäfts bekannt zu "
+        "geben.",
+        "Vielen Dank für Ihre Bestellung, sie wird morgen früh versandt.",
+        "Das Wetter war während der Reise viel besser als erwartet.",
+        "Könnten Sie prüfen, ob die Rechnung letzten Monat bezahlt wurde?",
+    ],
+    "es": [
+        "La reunión se ha trasladado al próximo martes por la tarde.",
+        "Por favor envíeme el informe actualizado antes del fin de semana.",
+        "Nos complace anunciar que nuestra nueva tienda ya está abierta.",
+        "Gracias por su pedido, será enviado mañana por la mañana.",
+        "El tiempo fue mucho mejor de lo que esperábamos durante el viaje.",
+        "¿Podría comprobar si la factura se pagó el mes pasado?",
+    ],
+    "it": [
+        "La riunione è stata spostata a martedì prossimo pomeriggio.",
+        "Per favore inviami il rapporto aggiornato entro la fine della "
+        "settimana.",
+        "Siamo lieti di annunciare che il nostro nuovo negozio è aperto.",
+        "Grazie per il tuo ordine, verrà spedito domani mattina.",
+        "Il tempo è stato molto migliore del previsto durante il viaggio.",
+        "Potresti controllare se la fattura è stata pagata il mese scorso?",
+    ],
+}
+
+
+class BenchmarkTextCat(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        langdetect.detector_factory.init_factory()
+        langdetect.DetectorFactory.seed = 0
+        rand = random.Random(0)
+        self.documents = []
+        for lang in sorted(SENTENCES_BY_LANG):
+            sentences = SENTENCES_BY_LANG[lang]
+            for dummy in range(DOCUMENTS):
+                text = " ".join(rand.choice(sentences)
+                                for dummy in range(SENTENCES))
+                # Most messages end with a quoted reply or a footer,
+                # often in another language.
+                text += "\n\n" + " ".join(
+                    rand.choice(SENTENCES_BY_LANG["en"])
+                    for dummy in range(int(SENTENCES * QUOTED)))
+                self.documents.append((lang, text))
+
+    def test_sample_size(self):
+        print()
+        print("%d documents of about %d characters" %
+              (len(self.documents),
+               sum(len(text) for dummy, text in self.documents) //
+               len(self.documents)))
+        timings = {}
+        for size in SAMPLE_SIZES:
+            correct = 0
+            start = time.time()
+            for lang, text in self.documents:
+                sample = pad.plugins.textcat.get_sample(text, size)
+                results = langdetect.detect_langs(sample)
+                if results and results[0].lang == lang:
+                    correct += 1
+            timings[size] = (time.time() - start) / len(self.documents)
+            print("sample size %6s: %5.1f%% correct, %.2fms per document" %
+                  (size or "full", correct / len(self.documents) * 100,
+                   timings[size] * 1000))
+        self.assertLess(timings[4096], timings[0])
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(BenchmarkTextCat, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
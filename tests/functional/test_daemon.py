@@ -8,6 +8,7 @@ import email
 import socket
 import shutil
 import signal
+import sqlite3
 import getpass
 import unittest
 import platform
@@ -662,12 +663,40 @@ class TestDaemonReload(TestDaemonBase):
         self.assertEqual(result, expected)
 
 
+class TestDaemonReportSpool(TestDaemonBase):
+    spool_path = os.path.join(TestDaemonBase.test_conf, "reports.sqlite")
+    pre_config = PRE_CONFIG + "report_spool_path %s\n" % spool_path
+
+    def get_queue_depth(self):
+        conn = sqlite3.connect(self.spool_path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_tell_spooled(self):
+        command = ("TELL SPAMC/1.2\r\n"
+                   "Message-class: spam\r\n"
+                   "Set: local,remote\r\n"
+                   "Content-length: %s\r\n\r\n%s\r\n" %
+                   (self.content_len, GTUBE_MSG))
+        result = self.send_to_proc(command)
+        self.assertEqual(result, u"0 EX_OK\r\nDidSet: local,remote\r\n")
+        # The dispatcher runs in the background.
+        for dummy in range(50):
+            if not self.get_queue_depth():
+                break
+            time.sleep(0.1)
+        self.assertEqual(self.get_queue_depth(), 0)
+
+
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestDaemon, "test"))
     test_suite.addTest(unittest.makeSuite(TestUserConfigDaemon, "test"))
     test_suite.addTest(unittest.makeSuite(TestDaemonReload, "test"))
+    test_suite.addTest(unittest.makeSuite(TestDaemonReportSpool, "test"))
     return test_suite
 
 
@@ -0,0 +1,45 @@
+"""Tests the rules with the compiled match function."""
+from __future__ import absolute_import
+
+import tests.util
+
+
+class TestCompiledRules(tests.util.TestBase):
+
+    def test_body_rules_match(self):
+        config = ("compile_match 1\n"
+                  "body TEST_RULE1 /abcd/\n"
+                  "rawbody TEST_RULE2 /dcba/\n"
+                  "full TEST_RULE3 /^Subject: test/m\n"
+                  "score TEST_RULE3 2.5")
+        self.check_symbols("Subject: test\n\nTest dcba abcd test.",
+                           config=config, score=4.5,
+                           symbols=["TEST_RULE1", "TEST_RULE2", "TEST_RULE3"])
+
+    def test_body_rules_no_match(self):
+        config = ("compile_match 1\n"
+                  "body TEST_RULE1 /abcd/\n"
+                  "rawbody TEST_RULE2 /dcba/")
+        self.check_symbols("Subject: test\n\nTest dcb abc test.",
+                           config=config, score=0.0, symbols=[])
+
+    def test_meta_rule_match(self):
+        config = ("compile_match 1\n"
+                  "header __TEST_SUBJECT Subject =~ /test/\n"
+                  "body TEST_BODY /abcd/\n"
+                  "body TEST_OTHER /dcba/\n"
+                  "meta TEST_META TEST_BODY && !TEST_OTHER && __TEST_SUBJECT\n"
+                  "score TEST_META 3.0")
+        self.check_symbols("Subject: test\n\nTest abcd test.",
+                           config=config, score=4.0,
+                           symbols=["TEST_BODY", "TEST_META"])
+
+    def test_meta_rule_no_match(self):
+        config = ("compile_match 1\n"
+                  "header __TEST_SUBJECT Subject =~ /test/\n"
+                  "body TEST_BODY /abcd/\n"
+                  "meta TEST_META TEST_BODY && !__TEST_SUBJECT\n"
+                  "score TEST_META 3.0")
+        self.check_symbols("Subject: test\n\nTest abcd test.",
+                           config=config, score=1.0,
+                           symbols=["TEST_BODY"])
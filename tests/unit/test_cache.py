@@ -0,0 +1,210 @@
+"""Tests for pad.cache"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import pad.stats
+import pad.cache
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        pad.stats.get_collector().clear()
+        self.mock_time = patch("pad.cache.time.time",
+                               return_value=1000).start()
+        self.cache = pad.cache.TTLCache("test", max_size=2, ttl=10)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        pad.stats.get_collector().clear()
+        patch.stopall()
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_get_default(self):
+        self.assertEqual(self.cache.get("key", "default"), "default")
+
+    def test_set_get(self):
+        self.cache.set("key", "value")
+        self.assertEqual(self.cache.get("key"), "value")
+
+    def test_expired(self):
+        self.cache.set("key", "value")
+        self.mock_time.return_value = 1010
+        self.assertIsNone(self.cache.get("key"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_custom_ttl(self):
+        self.cache.set("key", "value", ttl=20)
+        self.mock_time.return_value = 1015
+        self.assertEqual(self.cache.get("key"), "value")
+
+    def test_zero_ttl(self):
+        self.cache.set("key", "value", ttl=0)
+        self.assertNotIn("key", self.cache)
+
+    def test_no_expiration(self):
+        cache = pad.cache.TTLCache("test")
+        cache.set("key", "value")
+        self.mock_time.return_value = 10 ** 10
+        self.assertIn("key", cache)
+
+    def test_evict_lru(self):
+        self.cache.set("key1", "value1")
+        self.cache.set("key2", "value2")
+        self.cache.get("key1")
+        self.cache.set("key3", "value3")
+        self.assertIn("key1", self.cache)
+        self.assertNotIn("key2", self.cache)
+        self.assertIn("key3", self.cache)
+
+    def test_disabled(self):
+        self.cache.max_size = 0
+        self.cache.set("key", "value")
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate(self):
+        self.cache.set("key", "value")
+        self.cache.invalidate("key")
+        self.assertNotIn("key", self.cache)
+
+    def test_clear(self):
+        self.cache.set("key", "value")
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_stats(self):
+        self.cache.set("key", "value")
+        self.cache.get("key")
+        self.cache.get("other")
+        counters = pad.stats.get_collector().counters
+        self.assertEqual(counters[("cache_requests_total",
+                                   (("cache", "test"), ("result", "hit")))],
+                         1)
+        self.assertEqual(counters[("cache_requests_total",
+                                   (("cache", "test"), ("result", "miss")))],
+                         1)
+
+
+class TestSQLiteCache(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tmpdir = tempfile.mkdtemp()
+        self.mock_time = patch("pad.cache.time.time",
+                               return_value=1000).start()
+        self.cache = pad.cache.SQLiteCache(
+            "test", os.path.join(self.tmpdir, "cache.db"), max_size=2, ttl=10)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+        patch.stopall()
+
+    def test_get_missing(self):
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_set_get(self):
+        self.cache.set(["qname", "A"], {"records": [1, 2]})
+        self.assertEqual(self.cache.get(["qname", "A"]), {"records": [1, 2]})
+
+    def test_expired(self):
+        self.cache.set("key", "value")
+        self.mock_time.return_value = 1010
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_no_expiration(self):
+        self.cache.ttl = None
+        self.cache.set("key", "value")
+        self.mock_time.return_value = 10 ** 10
+        self.assertIn("key", self.cache)
+
+    def test_shared(self):
+        self.cache.set("key", "value")
+        other = pad.cache.SQLiteCache("test", self.cache.path)
+        self.assertEqual(other.get("key"), "value")
+
+    def test_shared_after_fork(self):
+        self.cache.get("key")
+        pid = os.fork()
+        if not pid:
+            self.cache.set("key", "value")
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertEqual(self.cache.get("key"), "value")
+
+    def test_prune(self):
+        self.cache.set("key1", "value1", ttl=10)
+        self.cache.set("key2", "value2", ttl=30)
+        self.cache.set("key3", "value3", ttl=20)
+        self.cache.prune()
+        self.assertEqual(len(self.cache), 2)
+        self.assertNotIn("key1", self.cache)
+
+    def test_prune_expired(self):
+        self.cache.set("key1", "value1", ttl=10)
+        self.mock_time.return_value = 1020
+        self.cache.prune()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_disabled(self):
+        self.cache.max_size = 0
+        self.cache.set("key", "value")
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate(self):
+        self.cache.set("key", "value")
+        self.cache.invalidate("key")
+        self.assertNotIn("key", self.cache)
+
+    def test_clear(self):
+        self.cache.set("key", "value")
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_error(self):
+        cache = pad.cache.SQLiteCache(
+            "test", os.path.join(self.tmpdir, "missing", "cache.db"))
+        cache.set("key", "value")
+        self.assertIsNone(cache.get("key"))
+
+
+class TestBodyKey(unittest.TestCase):
+    def get_msg(self, raw_msg, headers=None):
+        return Mock(raw_msg=raw_msg, msg=headers or {})
+
+    def test_same_body(self):
+        self.assertEqual(
+            pad.cache.get_body_key(self.get_msg(u"Subject: 1\n\nBody")),
+            pad.cache.get_body_key(self.get_msg(u"Subject: 2\n\nBody")))
+
+    def test_different_body(self):
+        self.assertNotEqual(
+            pad.cache.get_body_key(self.get_msg(u"Subject: 1\n\nBody")),
+            pad.cache.get_body_key(self.get_msg(u"Subject: 1\n\nOther")))
+
+    def test_different_encoding(self):
+        self.assertNotEqual(
+            pad.cache.get_body_key(self.get_msg(u"\n\nBody")),
+            pad.cache.get_body_key(self.get_msg(
+                u"\n\nBody", {"Content-Transfer-Encoding": "base64"})))
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestTTLCache, "test"))
+    test_suite.addTest(unittest.makeSuite(TestSQLiteCache, "test"))
+    test_suite.addTest(unittest.makeSuite(TestBodyKey, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
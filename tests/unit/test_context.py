@@ -10,6 +10,7 @@ except ImportError:
 
 import pad.errors
 import pad.context
+import pad.plugins.base
 
 
 class TestContext(unittest.TestCase):
@@ -150,6 +151,17 @@ class TestGlobalContextLoadPlugin(unittest.TestCase):
         self.assertEqual(ctxt.eval_rules["test_eval_rule"],
                          plugin_obj.test_eval_rule)
 
+    def test_load_plugin_register_rule_args(self):
+        converters = (None, Mock())
+        plugin_obj = self.mock_module.TestPlugin.return_value
+        plugin_obj.eval_rules = ("test_eval_rule",)
+        plugin_obj.eval_rule_args = {"test_eval_rule": converters}
+        ctxt = pad.context.GlobalContext()
+        ctxt.load_plugin("TestPlugin", "/etc/pad/plugins/test_plugins.py")
+
+        self.assertEqual(ctxt.eval_rule_args,
+                         {"test_eval_rule": converters})
+
     def test_load_plugin_register_rules_redefined(self):
         plugin_obj = self.mock_module.TestPlugin.return_value
         plugin_obj.eval_rules = ("test_eval_rule",)
@@ -243,6 +255,22 @@ class TestGlobalContextUnloadPlugin(unittest.TestCase):
         ctxt.unload_plugin("TestPlugin")
         self.assertNotIn("TestPlugin", ctxt.plugins)
 
+    def test_unload_finish(self):
+        ctxt = pad.context.GlobalContext()
+        plugin = MagicMock()
+        ctxt.plugins["TestPlugin"] = plugin
+
+        ctxt.unload_plugin("TestPlugin")
+        plugin.finish.assert_called_with()
+
+    def test_hook_finish(self):
+        ctxt = pad.context.GlobalContext()
+        plugin = MagicMock()
+        ctxt.plugins["TestPlugin"] = plugin
+
+        ctxt.hook_finish()
+        plugin.finish.assert_called_with()
+
     def test_unload_not_loaded(self):
         ctxt = pad.context.GlobalContext()
         self.assertRaises(pad.errors.PluginLoadError, ctxt.unload_plugin,
@@ -256,6 +284,14 @@ class TestGlobalContextUnloadPlugin(unittest.TestCase):
         ctxt.unload_plugin("TestPlugin")
         self.assertEqual(ctxt.eval_rules, {})
 
+    def test_unload_delete_eval_rule_args(self):
+        ctxt = pad.context.GlobalContext()
+        ctxt.plugins["TestPlugin"] = MagicMock(eval_rules=["test_eval_rule"])
+        ctxt.eval_rule_args["test_eval_rule"] = (None,)
+
+        ctxt.unload_plugin("TestPlugin")
+        self.assertEqual(ctxt.eval_rule_args, {})
+
     def test_unload_delete_cmd_rules(self):
         ctxt = pad.context.GlobalContext()
         ctxt.plugins["TestPlugin"] = MagicMock(cmds={"new_rtype": Mock()})
@@ -274,6 +310,135 @@ class TestGlobalContextUnloadPlugin(unittest.TestCase):
         self.assertEqual(ctxt.plugin_data, {})
 
 
+class HookPlugin(pad.plugins.base.BasePlugin):
+    eval_rules = ("check_hook",)
+    hook_eval_rules = ("check_hook",)
+
+    def check_start(self, msg):
+        pass
+
+    def extract_metadata(self, msg, payload, text, part):
+        pass
+
+    def check_hook(self, msg, target=None):
+        return True
+
+
+class NoopPlugin(pad.plugins.base.BasePlugin):
+    pass
+
+
+class DBPlugin(pad.plugins.base.BasePlugin):
+    dsn_name = "test"
+    options = {}
+
+
+class TestGlobalContextHooks(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("pad-logger").handlers = [logging.NullHandler()]
+        self.ctxt = pad.context.GlobalContext()
+        self.ruleset = MagicMock(checked={}, not_checked={})
+        self.ruleset.get_rule.side_effect = self.get_rule
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def get_rule(self, name):
+        try:
+            return self.ruleset.checked[name]
+        except KeyError:
+            return self.ruleset.not_checked[name]
+
+    def add_plugin(self, plugin_class):
+        plugin = plugin_class(self.ctxt)
+        self.ctxt.plugins[plugin_class.__name__] = plugin
+        return plugin
+
+    def add_eval_rule(self, name, eval_rule_name, checked=True):
+        rule = Mock(eval_rule_name=eval_rule_name, subrules=())
+        rule.name = name
+        if checked:
+            self.ruleset.checked[name] = rule
+        else:
+            self.ruleset.not_checked[name] = rule
+
+    def add_meta_rule(self, name, subrules):
+        rule = Mock(spec=["name", "subrules"], subrules=set(subrules))
+        rule.name = name
+        self.ruleset.checked[name] = rule
+
+    def test_get_hooks_not_built(self):
+        plugin = self.add_plugin(NoopPlugin)
+        self.assertEqual(self.ctxt.get_hooks("check_start"),
+                         (plugin.check_start,))
+
+    def test_noop_hooks_skipped(self):
+        self.add_plugin(NoopPlugin)
+        self.ctxt.hook_parsing_end(self.ruleset)
+        for hook_name in pad.context.MESSAGE_HOOKS:
+            self.assertEqual(self.ctxt.get_hooks(hook_name), ())
+
+    def test_overridden_hooks(self):
+        self.add_eval_rule("TEST_RULE", "check_hook")
+        plugin = self.add_plugin(HookPlugin)
+        self.ctxt.hook_parsing_end(self.ruleset)
+        self.assertEqual(self.ctxt.get_hooks("check_start"),
+                         (plugin.check_start,))
+        self.assertEqual(self.ctxt.get_hooks("extract_metadata"),
+                         (plugin.extract_metadata,))
+        self.assertEqual(self.ctxt.get_hooks("parsed_metadata"), ())
+
+    def test_database_check_end(self):
+        plugin = self.add_plugin(DBPlugin)
+        self.ctxt.hook_parsing_end(self.ruleset)
+        self.assertEqual(self.ctxt.get_hooks("check_end"),
+                         (plugin.check_end,))
+
+    def test_unused_eval_rules(self):
+        self.add_eval_rule("OTHER_RULE", "check_other")
+        self.add_plugin(HookPlugin)
+        self.ctxt.hook_parsing_end(self.ruleset)
+        self.assertEqual(self.ctxt.get_hooks("check_start"), ())
+        self.assertEqual(self.ctxt.get_hooks("extract_metadata"), ())
+
+    def test_not_checked_eval_rule(self):
+        self.add_eval_rule("__TEST_RULE", "check_hook", checked=False)
+        self.add_plugin(HookPlugin)
+        self.ctxt.hook_parsing_end(self.ruleset)
+        self.assertEqual(self.ctxt.get_hooks("check_start"), ())
+
+    def test_meta_eval_rule(self):
+        self.add_eval_rule("__TEST_RULE", "check_hook", checked=False)
+        self.add_meta_rule("TEST_META", ["__TEST_RULE", "__MISSING"])
+        plugin = self.add_plugin(HookPlugin)
+        self.ctxt.hook_parsing_end(self.ruleset)
+        self.assertEqual(self.ctxt.get_hooks("check_start"),
+                         (plugin.check_start,))
+
+    def test_message_hooks(self):
+        check_start = Mock()
+        self.ctxt.hooks["check_start"] = (check_start,)
+        msg = pad.context.MessageContext(self.ctxt)
+        msg._hook_check_start()
+        check_start.assert_called_with(msg)
+
+    def test_match_start_hook(self):
+        match_start = Mock()
+        self.ctxt.hooks["match_start"] = (match_start,)
+        msg = Mock()
+        self.ctxt.hook_match_start(self.ruleset, msg)
+        match_start.assert_called_with(self.ruleset, msg)
+
+    def test_unload_plugin_resets_hooks(self):
+        plugin = self.add_plugin(NoopPlugin)
+        self.ctxt.hook_parsing_end(self.ruleset)
+        self.ctxt.unload_plugin("NoopPlugin")
+        self.assertEqual(self.ctxt.hooks, {})
+        self.assertEqual(self.ctxt.get_hooks("check_start"), ())
+
+
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
@@ -281,6 +446,7 @@ def suite():
     test_suite.addTest(unittest.makeSuite(TestGlobalContextLoadPlugin, "test"))
     test_suite.addTest(unittest.makeSuite(TestGlobalContextLoadModule, "test"))
     test_suite.addTest(unittest.makeSuite(TestGlobalContextUnloadPlugin, "test"))
+    test_suite.addTest(unittest.makeSuite(TestGlobalContextHooks, "test"))
     return test_suite
 
 if __name__ == '__main__':
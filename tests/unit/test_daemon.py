@@ -34,7 +34,7 @@ class TestDaemon(unittest.TestCase):
         self.mock_s.assert_called_with(
             ("0.0.0.0", 783), '/etc/mail/spamassassin',
             '/etc/mail/spamassassin', paranoid=False,
-            ignore_unknown=True,
+            ignore_unknown=True, stats_file=None,
         )
         self.mock_s.return_value.serve_forever.assert_called_with()
 
@@ -44,12 +44,11 @@ class TestDaemon(unittest.TestCase):
         self.mock_pfs.assert_called_with(
             ("0.0.0.0", 783), '/etc/mail/spamassassin',
             '/etc/mail/spamassassin', paranoid=False,
-            ignore_unknown=True
+            ignore_unknown=True, stats_file=None,
         )
         self.assertEqual(self.mock_pfs.return_value.prefork, 6)
         self.mock_pfs.return_value.serve_forever.assert_called_with()
 
-
 class TestAction(unittest.TestCase):
     def setUp(self):
         unittest.TestCase.setUp(self)
@@ -0,0 +1,108 @@
+"""Tests for pad.db"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest.mock import patch, MagicMock
+except ImportError:
+    from mock import patch, MagicMock
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+import pad.db
+import pad.stats
+
+
+class TestDatabase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tmpdir = tempfile.mkdtemp()
+        self.url = "sqlite:///%s" % os.path.join(self.tmpdir, "test.db")
+        self.collector = pad.stats.Collector()
+        patch("pad.stats._collector", self.collector).start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+        patch.stopall()
+
+    def get_counter(self, name):
+        return self.collector.counters[pad.stats._key(name, {"dsn": "test"})]
+
+    def get_histogram(self, name):
+        return self.collector.histograms[
+            pad.stats._key(name, {"dsn": "test"})]
+
+    def test_pool_options(self):
+        mock_create_engine = patch("pad.db.sqlalchemy.create_engine").start()
+        patch("pad.db.sqlalchemy.event").start()
+        database = pad.db.Database("test", "mysql://localhost/test",
+                                   pool_size=2, max_overflow=3,
+                                   pool_recycle=60, pool_timeout=5)
+        database.engine
+        mock_create_engine.assert_called_with(
+            "mysql://localhost/test", pool_size=2, max_overflow=3,
+            pool_recycle=60, pool_timeout=5)
+
+    def test_pool_options_not_supported(self):
+        database = pad.db.Database("test", self.url)
+        result = database.get_session().execute(text("SELECT 1")).scalar()
+        self.assertEqual(result, 1)
+
+    def test_engine_per_process(self):
+        database = pad.db.Database("test", self.url)
+        engine = database.engine
+        self.assertIs(database.engine, engine)
+        with patch("pad.db.os.getpid", return_value=-1):
+            self.assertIsNot(database.engine, engine)
+
+    def test_session_scoped(self):
+        database = pad.db.Database("test", self.url)
+        session = database.get_session()
+        self.assertIs(database.get_session(), session)
+        database.remove_session()
+        self.assertIsNot(database.get_session(), session)
+
+    def test_session_per_process(self):
+        database = pad.db.Database("test", self.url)
+        session = database.get_session()
+        with patch("pad.db.os.getpid", return_value=-1):
+            self.assertIsNot(database.get_session(), session)
+
+    def test_remove_session_no_engine(self):
+        database = pad.db.Database("test", self.url)
+        database.remove_session()
+
+    def test_stats_connect(self):
+        database = pad.db.Database("test", self.url)
+        database.get_session().execute(text("SELECT 1"))
+        self.assertEqual(self.get_counter("db_connections_total"), 1)
+        self.assertEqual(self.get_histogram("db_connect_seconds")["count"], 1)
+
+    def test_stats_query(self):
+        database = pad.db.Database("test", self.url)
+        session = database.get_session()
+        session.execute(text("SELECT 1"))
+        session.execute(text("SELECT 2"))
+        self.assertEqual(self.get_histogram("db_query_seconds")["count"], 2)
+
+    def test_stats_error(self):
+        database = pad.db.Database("test", self.url)
+        session = database.get_session()
+        self.assertRaises(SQLAlchemyError, session.execute,
+                          text("SELECT * FROM missing"))
+        self.assertEqual(self.get_counter("db_errors_total"), 1)
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestDatabase, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
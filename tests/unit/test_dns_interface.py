@@ -1,17 +1,30 @@
 """Tests for pad.dns_interface """
 
+import os
+import shutil
 import logging
 import datetime
+import tempfile
 import unittest
 import ipaddress
 
 try:
-    from unittest.mock import patch
+    from unittest.mock import patch, Mock
 except ImportError:
-    from mock import patch
+    from mock import patch, Mock
 
 from builtins import str
 
+import dns.rdata
+import dns.resolver
+import dns.rdatatype
+import dns.rdataclass
+
+import pad.stats
+import pad.cache
+import pad.errors
+import pad.dns_interface
+
 from pad.dns_interface import DNSInterface
 
 
@@ -68,19 +81,98 @@ class TestDNSInterface(unittest.TestCase):
         self.assertFalse(self.dns.available)
 
     def test_dns_available_test(self):
-        patch("pad.dns_interface.DNSInterface._query").start()
+        mock_start = patch("pad.dns_interface.DNSInterface."
+                           "_start_prober").start()
         self.dns.available = "test"
         self.assertTrue(self.dns.available)
+        mock_start.assert_called_with()
+
+    def test_dns_available_test_no_query(self):
+        mock_query = patch("pad.dns_interface.DNSInterface._query").start()
+        patch("pad.dns_interface.DNSInterface._start_prober").start()
+        self.dns.available = "test"
+        self.assertTrue(self.dns.available)
+        mock_query.assert_not_called()
 
     def test_dns_available_test_fail(self):
         patch("pad.dns_interface.DNSInterface._query", return_value=[]).start()
+        patch("pad.dns_interface.DNSInterface._start_prober").start()
         self.dns.available = "test"
+        self.assertFalse(self.dns.probe())
         self.assertFalse(self.dns.available)
 
     def test_dns_available_test_custom_dns(self):
-        patch("pad.dns_interface.DNSInterface._query", return_value=[]).start()
+        mock_query = patch("pad.dns_interface.DNSInterface._query",
+                           return_value=[]).start()
         self.dns.available = "test: example.com 1.example.com 2.example.com"
-        self.assertFalse(self.dns.available)
+        self.assertFalse(self.dns.probe())
+        self.assertEqual(
+            set(call[0][0] for call in mock_query.call_args_list),
+            {"example.com", "1.example.com", "2.example.com"})
+
+    def test_dns_available_test_duplicates(self):
+        mock_query = patch("pad.dns_interface.DNSInterface._query",
+                           return_value=[]).start()
+        self.dns.available = "test: example.com example.com"
+        self.assertFalse(self.dns.probe())
+        mock_query.assert_called_once_with("example.com", "A")
+
+    def test_probe_recovers(self):
+        patch("pad.dns_interface.DNSInterface._query",
+              side_effect=[[], [], [], ["127.0.0.1"]]).start()
+        self.dns.available = "test"
+        self.assertFalse(self.dns.probe())
+        self.assertTrue(self.dns.probe())
+        self.assertTrue(self.dns.available)
+
+    def test_probe_unavailable_time(self):
+        pad.stats.get_collector().clear()
+        patch("pad.dns_interface.DNSInterface._query",
+              side_effect=[[], [], [], ["127.0.0.1"]]).start()
+        mock_time = patch("pad.dns_interface.time.time",
+                          return_value=1000).start()
+        self.dns.available = "test"
+        self.dns.probe()
+        mock_time.return_value = 1060
+        self.dns.probe()
+        counters = pad.stats.get_collector().counters
+        self.assertEqual(
+            counters[("dns_unavailable_seconds_total", ())], 60)
+        self.assertEqual(
+            counters[("dns_probes_total", (("result", "unavailable"),))], 1)
+        self.assertEqual(
+            counters[("dns_probes_total", (("result", "available"),))], 1)
+
+    def test_probe_if_due(self):
+        mock_probe = patch("pad.dns_interface.DNSInterface.probe").start()
+        self.dns.test_interval = "60"
+        self.assertTrue(self.dns.probe_if_due())
+        self.assertFalse(self.dns.probe_if_due())
+        self.assertEqual(mock_probe.call_count, 1)
+
+    def test_probe_if_due_interval_passed(self):
+        mock_probe = patch("pad.dns_interface.DNSInterface.probe").start()
+        mock_time = patch("pad.dns_interface.time.time",
+                          return_value=1000).start()
+        self.dns.test_interval = "60"
+        self.dns.probe_if_due()
+        mock_time.return_value = 1061
+        self.assertTrue(self.dns.probe_if_due())
+        self.assertEqual(mock_probe.call_count, 2)
+
+    def test_start_prober_once(self):
+        mock_thread = patch("pad.dns_interface.threading.Thread").start()
+        self.dns._start_prober()
+        self.dns._start_prober()
+        mock_thread.return_value.start.assert_called_once_with()
+
+    def test_probe_loop_stops(self):
+        patch("pad.dns_interface.time.sleep").start()
+        ref = Mock(side_effect=[self.dns, None])
+        mock_probe = patch("pad.dns_interface.DNSInterface."
+                           "probe_if_due").start()
+        pad.dns_interface._probe_loop(ref)
+        mock_probe.assert_called_once_with()
 
     def test_is_query_restricted_empty(self):
         """Test a domain that when no restrictions apply"""
@@ -137,6 +229,148 @@ class TestDNSInterface(unittest.TestCase):
     def test_query_error(self):
         pass
 
+    def test_query_cached(self):
+        self.resolver.query.return_value = Mock(rrset=Mock(ttl=60))
+        first = self.dns.query("example.com", "A")
+        second = self.dns.query("example.com", "A")
+        self.assertEqual(first, second)
+        self.assertEqual(self.resolver.query.call_count, 1)
+
+    def test_query_cached_qtype(self):
+        self.resolver.query.return_value = Mock(rrset=Mock(ttl=60))
+        self.dns.query("example.com", "A")
+        self.dns.query("example.com", "MX")
+        self.assertEqual(self.resolver.query.call_count, 2)
+
+    def test_query_cached_expired(self):
+        self.resolver.query.return_value = Mock(rrset=Mock(ttl=60))
+        with patch("pad.cache.time.time", return_value=1000):
+            self.dns.query("example.com", "A")
+        with patch("pad.cache.time.time", return_value=1061):
+            self.dns.query("example.com", "A")
+        self.assertEqual(self.resolver.query.call_count, 2)
+
+    def test_query_cached_max_ttl(self):
+        self.dns.cache_max_ttl = 10
+        self.resolver.query.return_value = Mock(rrset=Mock(ttl=60))
+        with patch("pad.cache.time.time", return_value=1000):
+            self.dns.query("example.com", "A")
+        with patch("pad.cache.time.time", return_value=1011):
+            self.dns.query("example.com", "A")
+        self.assertEqual(self.resolver.query.call_count, 2)
+
+    def test_query_cached_min_ttl(self):
+        self.dns.cache_min_ttl = 120
+        self.resolver.query.return_value = Mock(rrset=Mock(ttl=60))
+        with patch("pad.cache.time.time", return_value=1000):
+            self.dns.query("example.com", "A")
+        with patch("pad.cache.time.time", return_value=1100):
+            self.dns.query("example.com", "A")
+        self.assertEqual(self.resolver.query.call_count, 1)
+
+    def test_query_cache_disabled(self):
+        self.dns.cache.max_size = 0
+        self.resolver.query.return_value = Mock(rrset=Mock(ttl=60))
+        self.dns.query("example.com", "A")
+        self.dns.query("example.com", "A")
+        self.assertEqual(self.resolver.query.call_count, 2)
+
+    def test_query_timeout(self):
+        self.resolver.query.side_effect = dns.exception.Timeout()
+        self.assertEqual(self.dns.query("example.com", "A"), [])
+
+    def test_query_timeout_strict(self):
+        self.resolver.query.side_effect = dns.exception.Timeout()
+        self.assertRaises(pad.errors.DNSError, self.dns.query,
+                          "example.com", "A", strict=True)
+
+    def test_query_no_nameservers_strict(self):
+        self.resolver.query.side_effect = dns.resolver.NoNameservers()
+        self.assertRaises(pad.errors.DNSError, self.dns.query,
+                          "example.com", "A", strict=True)
+
+    def test_query_nxdomain_strict(self):
+        self.resolver.query.side_effect = dns.resolver.NXDOMAIN()
+        self.assertEqual(self.dns.query("example.com", "A", strict=True), [])
+
+    def test_query_restricted_strict(self):
+        self.dns.query_restrictions = {"example.com": True}
+        self.assertRaises(pad.errors.DNSError, self.dns.query,
+                          "example.com", "A", strict=True)
+        self.assertFalse(self.resolver.query.called)
+
+    def test_query_unavailable_strict(self):
+        self.dns.available = "no"
+        self.assertRaises(pad.errors.DNSError, self.dns.query,
+                          "example.com", "A", strict=True)
+
+    def test_query_restricted_not_cached(self):
+        self.resolver.query.return_value = Mock(rrset=Mock(ttl=60))
+        self.dns.query("example.com", "A")
+        self.dns.query_restrictions = {"example.com": True}
+        result = self.dns.query("example.com", "A")
+        self.assertEqual(result, [])
+
+    def test_query_negative_cached(self):
+        self.resolver.query.side_effect = dns.resolver.NXDOMAIN()
+        self.assertEqual(self.dns.query("example.com", "A"), [])
+        self.assertEqual(self.dns.query("example.com", "A"), [])
+        self.assertEqual(self.resolver.query.call_count, 1)
+
+    def test_query_negative_soa_ttl(self):
+        soa = Mock(rdtype=dns.rdatatype.SOA, ttl=3600)
+        soa.__getitem__ = Mock(return_value=Mock(minimum=30))
+        error = dns.resolver.NoAnswer()
+        error.kwargs = {"response": Mock(authority=[soa])}
+        self.resolver.query.side_effect = error
+        with patch("pad.cache.time.time", return_value=1000):
+            self.dns.query("example.com", "A")
+        with patch("pad.cache.time.time", return_value=1029):
+            self.dns.query("example.com", "A")
+        self.assertEqual(self.resolver.query.call_count, 1)
+        with patch("pad.cache.time.time", return_value=1031):
+            self.dns.query("example.com", "A")
+        self.assertEqual(self.resolver.query.call_count, 2)
+
+    def get_shared_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        return pad.cache.SQLiteCache("test", os.path.join(tmpdir, "dns.db"))
+
+    def test_query_shared_cache(self):
+        self.dns.shared_cache = self.get_shared_cache()
+        answer = Mock(rrset=Mock(ttl=60))
+        answer.__iter__ = Mock(return_value=iter([
+            dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.MX,
+                                "10 mx.example.com.")
+        ]))
+        self.resolver.query.return_value = answer
+        self.dns.query("example.com", "MX")
+
+        other = DNSInterface()
+        other.shared_cache = self.dns.shared_cache
+        result = other.query("example.com", "MX")
+        self.assertEqual(self.resolver.query.call_count, 1)
+        self.assertEqual([rdata.to_text() for rdata in result],
+                         ["10 mx.example.com."])
+        self.assertIn(("example.com", "MX"), other.cache)
+
+    def test_query_shared_cache_negative(self):
+        self.dns.shared_cache = self.get_shared_cache()
+        self.resolver.query.side_effect = dns.resolver.NXDOMAIN()
+        self.dns.query("example.com", "A")
+
+        other = DNSInterface()
+        other.shared_cache = self.dns.shared_cache
+        self.assertEqual(other.query("example.com", "A"), [])
+        self.assertEqual(self.resolver.query.call_count, 1)
+
+    def test_query_timeout_not_cached(self):
+        self.resolver.query.side_effect = dns.exception.Timeout()
+        self.dns.query("example.com", "A")
+        self.dns.query("example.com", "A")
+        self.assertEqual(self.resolver.query.call_count, 2)
+
     def test_reverse_ip(self):
         result = self.dns.reverse_ip(ipaddress.ip_address(str("127.0.0.1")))
         self.assertEqual("1.0.0.127", result)
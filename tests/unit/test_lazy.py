@@ -0,0 +1,158 @@
+"""Tests for pad.lazy"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import pad
+import pad.lazy
+
+# The modules imported by every command.
+CORE_MODULES = ("pad.message", "pad.rules.parser")
+PLUGINS = (
+    "Mail::SpamAssassin::Plugin::PDFInfo pad.plugins.pdf_info.PDFInfoPlugin",
+    "Mail::SpamAssassin::Plugin::TextCat",
+    "Mail::SpamAssassin::Plugin::Pyzor",
+    "Mail::SpamAssassin::Plugin::BodyEval",
+)
+# The modules that must not be imported when none of the rules of
+# the plugins above are used.
+HEAVY_MODULES = ("sqlalchemy", "PyPDF2", "langdetect", "pyzor")
+
+PARSE_SCRIPT = """
+import sys
+import pad.rules.parser
+pad.rules.parser.parse_pad_rules([sys.argv[1]]).get_ruleset()
+print(" ".join(sorted(sys.modules)))
+"""
+
+
+def imported_modules(code, *args):
+    """Run the code in a new interpreter and return its output split
+    in words.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(pad.__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    proc = subprocess.Popen((sys.executable, "-c", code) + args,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            env=env, universal_newlines=True)
+    stdout, stderr = proc.communicate()
+    if proc.returncode:
+        raise AssertionError(stderr)
+    return set(stdout.split())
+
+
+class TestIsAvailable(unittest.TestCase):
+    def test_available(self):
+        self.assertTrue(pad.lazy.is_available("json"))
+
+    def test_not_available(self):
+        self.assertFalse(pad.lazy.is_available("pad_missing_module"))
+
+    def test_not_imported(self):
+        with patch("pad.lazy.importlib.import_module") as mock_import:
+            pad.lazy.is_available("pad_missing_module")
+        self.assertFalse(mock_import.called)
+
+
+class TestLazyModule(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.mock_module = Mock()
+        self.mock_import = patch("pad.lazy.importlib.import_module",
+                                 return_value=self.mock_module).start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_not_loaded(self):
+        module = pad.lazy.LazyModule("test")
+        self.assertFalse(module.loaded)
+        self.assertFalse(self.mock_import.called)
+
+    def test_load_on_attribute(self):
+        module = pad.lazy.LazyModule("test")
+        self.assertEqual(module.value, self.mock_module.value)
+        self.assertTrue(module.loaded)
+        self.mock_import.assert_called_once_with("test")
+
+    def test_load_once(self):
+        module = pad.lazy.LazyModule("test")
+        module.load()
+        module.load()
+        self.assertEqual(self.mock_import.call_count, 1)
+
+    def test_load_submodules(self):
+        module = pad.lazy.LazyModule("test", "test.sub")
+        self.assertIs(module.load(), self.mock_module)
+        self.mock_import.assert_called_with("test.sub")
+
+    def test_load_error(self):
+        self.mock_import.side_effect = ImportError()
+        module = pad.lazy.LazyModule("test")
+        self.assertRaises(ImportError, getattr, module, "value")
+        self.assertFalse(module.loaded)
+
+    def test_special_attribute(self):
+        module = pad.lazy.LazyModule("test")
+        self.assertFalse(hasattr(module, "__wrapped__"))
+        self.assertFalse(self.mock_import.called)
+
+    def test_real_module(self):
+        patch.stopall()
+        module = pad.lazy.LazyModule("json", "json.decoder")
+        self.assertEqual(module.loads("[1]"), [1])
+        self.assertTrue(module.decoder.JSONDecodeError)
+
+
+class TestImportedModules(unittest.TestCase):
+    """Check that the heavy dependencies are only imported when a rule
+    needs them.
+    """
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = os.path.join(self.tmpdir, "test.cf")
+        with open(self.config, "w") as config:
+            for plugin in PLUGINS:
+                config.write("loadplugin %s\n" % plugin)
+            config.write("body TEST_RULE /test/\n")
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+
+    @unittest.skipIf(sys.version_info < (3,),
+                     "The builtins backport requires future")
+    def test_core_modules(self):
+        modules = imported_modules(
+            "import sys, %s; print(' '.join(sys.modules))" %
+            ", ".join(CORE_MODULES))
+        self.assertNotIn("future.utils", modules)
+
+    def test_unused_plugins(self):
+        modules = imported_modules(PARSE_SCRIPT, self.config)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, modules)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestIsAvailable, "test"))
+    test_suite.addTest(unittest.makeSuite(TestLazyModule, "test"))
+    test_suite.addTest(unittest.makeSuite(TestImportedModules, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -24,6 +24,8 @@ class TestRevokeReport(unittest.TestCase):
                         "parser.parse_pad_rules").start()
         self.ctxt = ruleset.return_value.get_ruleset.return_value.ctxt
         patch("scripts.match.MessageList").start()
+        self.mock_close_pools = patch("scripts.match.pad.pool."
+                                      "close_pools").start()
         self.mock_get_configs = patch("pad.config.get_config_files").start()
         msg_class = patch("scripts.match.pad.message.Message").start()
         self.messages = [msg_class(self.ctxt, x) for x in self.raw_messages]
@@ -44,6 +46,28 @@ class TestRevokeReport(unittest.TestCase):
         self.ctxt.hook_report.assert_has_calls(calls)
         self.ctxt.hook_revoke.assert_not_called()
 
+    def test_finish(self):
+        options = scripts.match.parse_arguments(["--report",
+                                                 "--siteconfigpath", ".",
+                                                 "--configpath", "."])
+        options.messages = [[StringIO(x) for x in self.raw_messages]]
+        patch("scripts.match.parse_arguments",
+              return_value=options).start()
+        scripts.match.main()
+        self.ctxt.hook_finish.assert_called_once_with()
+        self.mock_close_pools.assert_called_once_with()
+
+    def test_finish_error(self):
+        options = scripts.match.parse_arguments(["--report",
+                                                 "--siteconfigpath", ".",
+                                                 "--configpath", "."])
+        options.messages = [[StringIO(x) for x in self.raw_messages]]
+        patch("scripts.match.parse_arguments",
+              return_value=options).start()
+        self.ctxt.hook_report.side_effect = ValueError()
+        self.assertRaises(ValueError, scripts.match.main)
+        self.ctxt.hook_finish.assert_called_once_with()
+
     def test_report_user_prefs(self):
         options = scripts.match.parse_arguments(["--report",
                                                  "--siteconfigpath", ".",
@@ -110,6 +134,23 @@ class TestRevokeReport(unittest.TestCase):
         with self.assertRaises(SystemExit):
             scripts.match.main()
 
+    def test_dump_match(self):
+        options = scripts.match.parse_arguments(["--dump-match",
+                                                 "--siteconfigpath", ".",
+                                                 "--configpath", "."])
+        options.messages = [[StringIO(x) for x in self.raw_messages]]
+        patch("scripts.match.parse_arguments",
+              return_value=options).start()
+        mock_generate = patch("scripts.match.pad.rules.compiler."
+                              "generate_source",
+                              return_value=("def make_match(bound):", [])
+                              ).start()
+        with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+            scripts.match.main()
+        self.assertTrue(mock_generate.called)
+        self.assertIn("def make_match(bound):", mock_stdout.getvalue())
+        self.ctxt.hook_report.assert_not_called()
+
     def test_both(self):
         with self.assertRaises(SystemExit):
             with patch("sys.stderr"):
@@ -88,7 +88,8 @@ class TestParseMessage(unittest.TestCase):
             "envelope_sender_header": [],
             "always_trust_envelope_sender": "0"
         }
-        self.mock_ctxt = Mock(plugins={}, conf=self.conf)
+        self.mock_ctxt = Mock(plugins={}, conf=self.conf,
+                              **{"get_hooks.return_value": ()})
 
     def tearDown(self):
         unittest.TestCase.tearDown(self)
@@ -240,7 +241,8 @@ class TestMessageVarious(unittest.TestCase):
             "originating_ip_headers": [],
             "always_trust_envelope_sender": "0"
         }
-        self.mock_ctxt = Mock(plugins={}, conf=self.conf)
+        self.mock_ctxt = Mock(plugins={}, conf=self.conf,
+                              **{"get_hooks.return_value": ()})
 
     def tearDown(self):
         unittest.TestCase.tearDown(self)
@@ -299,7 +301,8 @@ class TestGetHeaders(unittest.TestCase):
             "always_trust_envelope_sender": "0",
             "envelope_sender_header": []
         }
-        self.mock_ctxt = Mock(plugins={}, conf=self.conf)
+        self.mock_ctxt = Mock(plugins={}, conf=self.conf,
+                              **{"get_hooks.return_value": ()})
         self.msg = pad.message.Message(self.mock_ctxt, "Subject: test\n\n")
 
     def tearDown(self):
@@ -394,7 +397,8 @@ class TestParseRelays(unittest.TestCase):
             "always_trust_envelope_sender": "0",
             "envelope_sender_header": []
         }
-        self.mock_ctxt = Mock(plugins={}, conf=self.conf)
+        self.mock_ctxt = Mock(plugins={}, conf=self.conf,
+                              **{"get_hooks.return_value": ()})
         self.msg = pad.message.Message(self.mock_ctxt, "Subject: test\n\n")
 
     def tearDown(self):
@@ -1,3 +1,4 @@
+import time
 import unittest
 import ipaddress
 
@@ -9,6 +10,7 @@ except ImportError:
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import SQLAlchemyError
 
 import pad.plugins
 from pad.plugins import awl
@@ -33,6 +35,7 @@ class TestAWLBase(unittest.TestCase):
             "side_effect": lambda p, k, v: self.msg_data.setdefault(k, v),
         })
         self.mock_msg.msg = None
+        patch("pad.plugins.awl.threading.Timer").start()
         get_session = patch("pad.plugins.awl.AutoWhiteListPlugin.get_session").start()
         engine = create_engine("sqlite://")
         awl.Base.metadata.create_all(engine)
@@ -99,6 +102,7 @@ class TestAWLBase(unittest.TestCase):
 
         self.plugin.check_from_in_auto_whitelist(self.mock_msg,
                                                  target="header")
+        self.plugin.flush()
 
         self.assertEqual(self.mock_msg.score, 5)
         self.check_db(**data)
@@ -121,6 +125,302 @@ class TestAWLBase(unittest.TestCase):
                               ipaddress.IPv4Address(u"8.8.8.8"))
         self.plugin.check_from_in_auto_whitelist(self.mock_msg,
                                                  target="header")
+        self.plugin.flush()
         data.update({"totscore":15, "count":2})
         self.check_db(**data)
         self.assertEqual(self.mock_msg.score, 7.5)
+
+    def test_get_entry_prefers_ip(self):
+        self.session.add(awl.AWL(email="test@example.com", username="test",
+                                 signedby="", totscore=5, ip="none",
+                                 count=1))
+        self.session.add(awl.AWL(email="test@example.com", username="test",
+                                 signedby="", totscore=20, ip="8.8",
+                                 count=2))
+        self.session.commit()
+        entry = self.plugin.get_entry("test@example.com", "8.8", "")
+        self.assertEqual(entry.totscore, 20)
+        self.assertEqual(entry.count, 2)
+
+    def test_get_entry_missing(self):
+        entry = self.plugin.get_entry("test@example.com", "8.8", "")
+        self.assertEqual(entry.totscore, 0)
+        self.assertEqual(entry.count, 0)
+        self.assertEqual(entry.ip, "8.8")
+
+
+class TestAWLCache(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.global_data = {}
+        self.mock_ctxt = MagicMock(**{
+            "get_plugin_data.side_effect": lambda p, k: self.global_data[k],
+            "set_plugin_data.side_effect": lambda p, k, v: self.global_data.__setitem__(k, v),
+            "username": "test",
+        })
+        get_session = patch("pad.plugins.awl.AutoWhiteListPlugin."
+                            "get_session").start()
+        engine = create_engine("sqlite://")
+        awl.Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        get_session.return_value = self.session
+        self.plugin = pad.plugins.awl.AutoWhiteListPlugin(self.mock_ctxt)
+        self.plugin.finish_parsing_end(MagicMock())
+        self.mock_timer = patch("pad.plugins.awl.threading.Timer").start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def add_entry(self, ip="8.8", count=1, totscore=5):
+        self.session.add(awl.AWL(email="test@example.com", username="test",
+                                 signedby="", ip=ip, count=count,
+                                 totscore=totscore))
+        self.session.commit()
+
+    def get_db(self, ip="8.8"):
+        result = self.session.query(awl.AWL).filter(
+            awl.AWL.username == "test",
+            awl.AWL.email == "test@example.com",
+            awl.AWL.signedby == "",
+            awl.AWL.ip == ip).first()
+        if result is None:
+            return None
+        return result.count, result.totscore
+
+    def test_get_scores(self):
+        self.add_entry()
+        self.assertEqual(self.plugin.get_scores("test@example.com", "8.8",
+                                                ""), (1, 5))
+
+    def test_get_scores_cached(self):
+        self.add_entry()
+        self.plugin.get_scores("test@example.com", "8.8", "")
+        with patch.object(self.plugin, "get_entry") as mock_get_entry:
+            result = self.plugin.get_scores("test@example.com", "8.8", "")
+        self.assertEqual(result, (1, 5))
+        self.assertFalse(mock_get_entry.called)
+
+    def test_get_scores_expired(self):
+        self.global_data["cache"].ttl = 0.001
+        self.add_entry()
+        self.plugin.get_scores("test@example.com", "8.8", "")
+        self.session.query(awl.AWL).update({awl.AWL.count: 3})
+        self.session.commit()
+        patch("pad.cache.time.time", return_value=time.time() + 1).start()
+        self.assertEqual(self.plugin.get_scores("test@example.com", "8.8",
+                                                ""), (3, 5))
+
+    def test_get_scores_includes_pending(self):
+        self.add_entry()
+        self.plugin.update_scores("test@example.com", "8.8", "", 3)
+        self.global_data["cache"].clear()
+        self.assertEqual(self.plugin.get_scores("test@example.com", "8.8",
+                                                ""), (2, 8))
+
+    def test_update_scores_cached(self):
+        self.add_entry()
+        self.plugin.get_scores("test@example.com", "8.8", "")
+        self.plugin.update_scores("test@example.com", "8.8", "", 3)
+        self.assertEqual(self.plugin.get_scores("test@example.com", "8.8",
+                                                ""), (2, 8))
+        self.assertEqual(self.get_db(), (1, 5))
+
+    def test_update_scores_coalesced(self):
+        self.add_entry()
+        for dummy in range(3):
+            self.plugin.update_scores("test@example.com", "8.8", "", 2)
+        self.assertEqual(len(self.global_data["buffer"]), 1)
+        self.plugin.flush()
+        self.assertEqual(self.get_db(), (4, 11))
+        self.assertEqual(len(self.global_data["buffer"]), 0)
+
+    def test_update_scores_flush_size(self):
+        self.global_data["buffer"].max_size = 2
+        self.plugin.update_scores("test@example.com", "8.8", "", 2)
+        self.assertIsNone(self.get_db())
+        self.plugin.update_scores("test2@example.com", "8.8", "", 2)
+        self.assertEqual(self.get_db(), (1, 2))
+
+    def test_update_scores_flush_interval(self):
+        self.global_data["buffer"].interval = 0
+        self.plugin.update_scores("test@example.com", "8.8", "", 2)
+        self.assertEqual(self.get_db(), (1, 2))
+
+    def test_flush_new_entry_from_none(self):
+        self.add_entry(ip="none", count=2, totscore=4)
+        self.plugin.update_scores("test@example.com", "8.8", "", 3)
+        self.plugin.flush()
+        self.assertEqual(self.get_db(), (3, 7))
+        self.assertEqual(self.get_db("none"), (2, 4))
+
+    def test_flush_error(self):
+        self.plugin.update_scores("test@example.com", "8.8", "", 3)
+        with patch.object(self.session, "commit",
+                          side_effect=SQLAlchemyError("error")):
+            self.plugin.flush()
+        self.assertEqual(len(self.global_data["buffer"]), 1)
+        self.plugin.flush()
+        self.assertEqual(self.get_db(), (1, 3))
+
+    def fail_address(self, address):
+        write = self.plugin._write
+
+        def _write(session, key, count, totscore):
+            if key[1] == address:
+                raise SQLAlchemyError("error")
+            return write(session, key, count, totscore)
+        patch.object(self.plugin, "_write", side_effect=_write).start()
+
+    def test_flush_error_entry(self):
+        self.fail_address("bad@example.com")
+        self.plugin.update_scores("bad@example.com", "8.8", "", 3)
+        self.plugin.update_scores("test@example.com", "8.8", "", 3)
+        self.plugin.flush()
+        self.assertEqual(self.get_db(), (1, 3))
+        self.assertEqual(len(self.global_data["buffer"]), 1)
+
+    def test_flush_error_dropped(self):
+        self.fail_address("bad@example.com")
+        self.plugin.update_scores("bad@example.com", "8.8", "", 3)
+        for dummy in range(3):
+            self.plugin.flush()
+        self.assertEqual(len(self.global_data["buffer"]), 0)
+        self.assertTrue(self.mock_ctxt.log.error.called)
+        self.plugin.update_scores("test@example.com", "8.8", "", 3)
+        self.plugin.flush()
+        self.assertEqual(self.get_db(), (1, 3))
+
+    def test_update_scores_buffer_full(self):
+        self.global_data["buffer"].max_pending = 1
+        self.plugin.update_scores("test@example.com", "8.8", "", 2)
+        self.plugin.update_scores("test2@example.com", "8.8", "", 2)
+        self.assertEqual(len(self.global_data["buffer"]), 1)
+
+    def test_update_scores_flush_timer(self):
+        self.plugin.update_scores("test@example.com", "8.8", "", 2)
+        self.assertIsNone(self.get_db())
+        self.mock_timer.assert_called_once_with(10.0, self.plugin.flush)
+        self.mock_timer.return_value.start.assert_called_once_with()
+        flush = self.mock_timer.call_args[0][1]
+        flush()
+        self.assertEqual(self.get_db(), (1, 2))
+
+    def test_flush_error_timer(self):
+        self.plugin.update_scores("test@example.com", "8.8", "", 3)
+        self.mock_timer.return_value.is_alive.return_value = False
+        with patch.object(self.session, "commit",
+                          side_effect=SQLAlchemyError("error")):
+            self.plugin.flush()
+        self.assertEqual(self.mock_timer.call_count, 2)
+
+    def test_finish(self):
+        self.plugin.update_scores("test@example.com", "8.8", "", 3)
+        self.plugin.finish()
+        self.mock_timer.return_value.cancel.assert_called_with()
+        self.assertEqual(self.get_db(), (1, 3))
+        self.plugin.update_scores("test@example.com", "8.8", "", 3)
+        self.assertEqual(self.get_db(), (2, 6))
+
+
+class TestUpdateBuffer(unittest.TestCase):
+
+    def test_add(self):
+        update_buffer = awl.UpdateBuffer()
+        update_buffer.add("key", 1, 2.0)
+        update_buffer.add("key", 1, 3.0)
+        self.assertEqual(update_buffer.get("key"), (2, 5.0))
+
+    def test_add_full(self):
+        update_buffer = awl.UpdateBuffer(max_pending=1)
+        self.assertTrue(update_buffer.add("key1", 1, 2.0))
+        self.assertTrue(update_buffer.add("key1", 1, 2.0))
+        self.assertFalse(update_buffer.add("key2", 1, 2.0))
+        self.assertEqual(update_buffer.get("key2"), (0, 0.0))
+
+    def test_retry(self):
+        update_buffer = awl.UpdateBuffer(max_attempts=3)
+        self.assertTrue(update_buffer.retry("key", 1, 2.0))
+        self.assertTrue(update_buffer.retry("key", 1, 2.0))
+        self.assertEqual(update_buffer.get("key"), (2, 4.0))
+        update_buffer.pop_all()
+        self.assertFalse(update_buffer.retry("key", 1, 2.0))
+        self.assertEqual(len(update_buffer), 0)
+
+    def test_retry_written(self):
+        update_buffer = awl.UpdateBuffer(max_attempts=2)
+        self.assertTrue(update_buffer.retry("key", 1, 2.0))
+        update_buffer.written(["key"])
+        self.assertTrue(update_buffer.retry("key", 1, 2.0))
+
+    def test_retry_full(self):
+        update_buffer = awl.UpdateBuffer(max_pending=1)
+        update_buffer.add("key1", 1, 2.0)
+        self.assertFalse(update_buffer.retry("key2", 1, 2.0))
+
+    def test_schedule(self):
+        update_buffer = awl.UpdateBuffer(interval=0.01)
+        flush = Mock()
+        update_buffer.schedule(flush)
+        update_buffer._timer.join()
+        flush.assert_called_once_with()
+
+    def test_schedule_once(self):
+        update_buffer = awl.UpdateBuffer(interval=60)
+        self.addCleanup(update_buffer.cancel)
+        update_buffer.schedule(Mock())
+        timer = update_buffer._timer
+        update_buffer.schedule(Mock())
+        self.assertIs(update_buffer._timer, timer)
+
+    def test_cancel(self):
+        update_buffer = awl.UpdateBuffer(interval=60)
+        flush = Mock()
+        update_buffer.schedule(flush)
+        timer = update_buffer._timer
+        update_buffer.cancel()
+        timer.join()
+        self.assertFalse(flush.called)
+
+    def test_get_missing(self):
+        update_buffer = awl.UpdateBuffer()
+        self.assertEqual(update_buffer.get("key"), (0, 0.0))
+
+    def test_is_due_empty(self):
+        update_buffer = awl.UpdateBuffer(max_size=0, interval=0)
+        self.assertFalse(update_buffer.is_due())
+
+    def test_is_due_size(self):
+        update_buffer = awl.UpdateBuffer(max_size=2, interval=60)
+        update_buffer.add("key1", 1, 2.0)
+        self.assertFalse(update_buffer.is_due())
+        update_buffer.add("key2", 1, 2.0)
+        self.assertTrue(update_buffer.is_due())
+
+    def test_is_due_interval(self):
+        update_buffer = awl.UpdateBuffer(max_size=100, interval=60)
+        update_buffer.add("key1", 1, 2.0)
+        patch("pad.plugins.awl.time.time",
+              return_value=time.time() + 61).start()
+        self.addCleanup(patch.stopall)
+        self.assertTrue(update_buffer.is_due())
+
+    def test_pop_all(self):
+        update_buffer = awl.UpdateBuffer()
+        update_buffer.add("key", 1, 2.0)
+        self.assertEqual(update_buffer.pop_all(), {"key": [1, 2.0]})
+        self.assertEqual(len(update_buffer), 0)
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestAWLBase, "test"))
+    test_suite.addTest(unittest.makeSuite(TestAWLCache, "test"))
+    test_suite.addTest(unittest.makeSuite(TestUpdateBuffer, "test"))
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
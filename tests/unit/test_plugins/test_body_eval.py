@@ -1,5 +1,9 @@
 """Tests for pad.plugins.replace_tags."""
 
+import os
+import shutil
+import logging
+import tempfile
 import unittest
 import collections
 
@@ -8,6 +12,8 @@ try:
 except ImportError:
     from mock import patch, Mock, MagicMock, call
 
+import pad.message
+import pad.rules.parser
 import pad.plugins.body_eval
 
 
@@ -289,10 +295,41 @@ class TestBodyEval(unittest.TestCase):
         self.assertFalse(result)
 
 
+class TestBodyEvalHooks(unittest.TestCase):
+    """Load a ruleset that only uses one eval rule of the plugin, the
+    message hooks it needs must not be skipped.
+    """
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("pad-logger").handlers = [logging.NullHandler()]
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+
+    def check_rule(self, rule, raw_msg):
+        path = os.path.join(self.tmpdir, "test.cf")
+        with open(path, "w") as rulef:
+            rulef.write("loadplugin Mail::SpamAssassin::Plugin::BodyEval\n")
+            rulef.write("body TEST_RULE %s\n" % rule)
+        ruleset = pad.rules.parser.parse_pad_rules([path]).get_ruleset()
+        msg = pad.message.Message(ruleset.ctxt, raw_msg)
+        ruleset.match(msg)
+        return msg.rules_checked["TEST_RULE"], msg.score
+
+    def test_check_blank_line_ratio_only(self):
+        result = self.check_rule("eval:check_blank_line_ratio(0, 100, 1)",
+                                 "Subject: test\n\nline 1\n\nline 2\n")
+        self.assertEqual(result, (True, 1.0))
+
+
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestBodyEval, "test"))
+    test_suite.addTest(unittest.makeSuite(TestBodyEvalHooks, "test"))
     return test_suite
 
 if __name__ == '__main__':
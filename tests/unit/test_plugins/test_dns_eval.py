@@ -1,4 +1,6 @@
 """Test DNSEval"""
+import re
+import time
 import unittest
 import pad.dns_interface
 import collections
@@ -32,6 +34,7 @@ class TestDNSEval(unittest.TestCase):
         self.plugin.get_local = lambda m, k: self.local_data.__getitem__(k)
         self.plugin.set_global = self.global_data.__setitem__
         self.plugin.get_global = self.global_data.__getitem__
+        self.global_data["rbl_local_zone"] = []
         self.mock_ruleset = MagicMock(checked={}, not_checked={})
 
     def test_finish_parsing_end(self):
@@ -227,11 +230,163 @@ class TestDNSEval(unittest.TestCase):
         self.mock_ctxt.skip_rbl_checks = True
 
         self.plugin._check_rbl_addr(
-            ['test@example.com'], "example_ser" 
+            self.mock_msg, ['test@example.com'], "example_ser"
         )
 
         self.mock_ctxt.dns.query.assert_not_called()
 
+    def test_finish_parsing_end_lookups(self):
+        rules = {
+            "check_rbl": ("set", "rbl.example.com"),
+            "check_rbl_txt": ("set", "txt.example.com"),
+            "check_rbl_envfrom": ("set", "envfrom.example.com"),
+            "check_rbl_from_host": ("set", "from.example.com"),
+            "check_dns_sender": (),
+        }
+        for name, args in rules.items():
+            eval_rule = MagicMock(eval_rule_name=name, eval_args=args)
+            self.mock_ruleset.checked[name] = eval_rule
+        patch("pad.plugins.dns_eval.isinstance", return_value=True,
+              create=True).start()
+
+        self.plugin.finish_parsing_end(self.mock_ruleset)
+        self.assertEqual(self.plugin["lookups"], {
+            ("ip", "rbl.example.com", "A"),
+            ("ip", "txt.example.com", "TXT"),
+            ("envfrom", "envfrom.example.com", "A"),
+            ("from", "from.example.com", "A"),
+            ("sender", None, "A"),
+            ("sender", None, "MX"),
+        })
+
+    def get_prefetched(self, lookups):
+        self.global_data["lookups"] = lookups
+        self.global_data["rbl_timeout"] = 15
+        self.global_data["rbl_prefetch_workers"] = 4
+        self.mock_msg.get_addr_header.return_value = ["from@example.net"]
+        self.mock_ctxt.dns.query.side_effect = lambda qname, qtype: [qname]
+        self.plugin.match_start(self.mock_ruleset, self.mock_msg)
+        return self.local_data["results"]
+
+    def test_match_start_prefetch(self):
+        result = self.get_prefetched({
+            ("ip", "rbl.example.com", "A"),
+            ("ip", "rbl.example.com", "TXT"),
+            ("envfrom", "envfrom.example.com", "A"),
+            ("from", "from.example.com", "A"),
+            ("sender", None, "MX"),
+        })
+        self.assertEqual(result, {
+            ("1.0.0.127.rbl.example.com", "A"):
+                ["1.0.0.127.rbl.example.com"],
+            ("1.0.0.127.rbl.example.com", "TXT"):
+                ["1.0.0.127.rbl.example.com"],
+            ("example.com.envfrom.example.com", "A"):
+                ["example.com.envfrom.example.com"],
+            ("example.net.from.example.com", "A"):
+                ["example.net.from.example.com"],
+            ("example.com", "MX"): ["example.com"],
+        })
+
+    def test_match_start_prefetch_skip_rbl_checks(self):
+        self.mock_ctxt.skip_rbl_checks = True
+        result = self.get_prefetched({
+            ("ip", "rbl.example.com", "A"),
+            ("sender", None, "A"),
+        })
+        self.assertEqual(result, {("example.com", "A"): ["example.com"]})
+
+    def test_match_start_prefetch_timeout(self):
+        self.global_data["rbl_timeout"] = 0
+        self.global_data["lookups"] = {("ip", "rbl.example.com", "A")}
+        self.global_data["rbl_prefetch_workers"] = 1
+        self.mock_ctxt.dns.query.side_effect = lambda qname, qtype: (
+            time.sleep(0.2))
+        self.plugin.match_start(self.mock_ruleset, self.mock_msg)
+        self.assertEqual(self.local_data["results"],
+                         {("1.0.0.127.rbl.example.com", "A"): []})
+
+    def test_match_start_no_lookups(self):
+        self.global_data["lookups"] = set()
+        self.plugin.match_start(self.mock_ruleset, self.mock_msg)
+        self.assertNotIn("results", self.local_data)
+        self.mock_ctxt.dns.query.assert_not_called()
+
+    def test_check_rbl_prefetched(self):
+        self.local_data["results"] = {
+            ("1.0.0.127.example.com", "A"): ["127.0.0.2"]
+        }
+        result = self.plugin.check_rbl(self.mock_msg, "example",
+                                       "example.com")
+        self.assertTrue(result)
+        self.mock_ctxt.dns.query.assert_not_called()
+
+    def test_check_rbl_prefetched_not_listed(self):
+        self.local_data["results"] = {
+            ("1.0.0.127.example.com", "A"): []
+        }
+        result = self.plugin.check_rbl(self.mock_msg, "example",
+                                       "example.com")
+        self.assertFalse(result)
+        self.mock_ctxt.dns.query.assert_not_called()
+
+    def test_check_dns_sender_prefetched(self):
+        self.local_data["results"] = {
+            ("example.com", "A"): [],
+            ("example.com", "MX"): [],
+        }
+        self.assertTrue(self.plugin.check_dns_sender(self.mock_msg))
+        self.mock_ctxt.dns.query.assert_not_called()
+
+    def test_check_rbl_shared_query(self):
+        self.mock_ctxt.dns.query.return_value = ["127.0.0.2"]
+        self.plugin.check_rbl(self.mock_msg, "example", "example.com")
+        self.plugin.check_rbl(self.mock_msg, "example", "example.com",
+                              "127.0.0.2")
+        self.plugin.check_rbl_sub(self.mock_msg, "example", "2")
+        self.assertEqual(self.mock_ctxt.dns.query.call_count, 1)
+
+    def test_check_rbl_reversed_ips_once(self):
+        self.plugin.check_rbl(self.mock_msg, "example", "example.com")
+        self.plugin.check_rbl(self.mock_msg, "example", "example.net")
+        self.assertEqual(self.mock_msg.get_untrusted_ips.call_count, 1)
+        self.assertEqual(self.local_data["reversed_ips"], ["1.0.0.127"])
+
+    def test_mask_arg(self):
+        self.assertEqual(pad.plugins.dns_eval.mask_arg("8"), 8)
+        self.assertEqual(pad.plugins.dns_eval.mask_arg("127.0.0.4"),
+                         2130706436)
+        self.assertEqual(pad.plugins.dns_eval.mask_arg(8), 8)
+
+    def test_mask_arg_invalid(self):
+        self.assertRaises(ValueError, pad.plugins.dns_eval.mask_arg,
+                          "invalid")
+
+    def test_check_rbl_precompiled_subtest(self):
+        self.mock_ctxt.dns.query.return_value = ["127.0.0.3"]
+        result = self.plugin.check_rbl(self.mock_msg, "example",
+                                       "example.com", re.compile("127"))
+        self.assertTrue(result)
+
+    def test_check_rbl_sub_converted_mask(self):
+        self.global_data["zones"] = {"example": "example.com"}
+        self.mock_ctxt.dns.query.return_value = ["127.0.0.3"]
+        result = self.plugin.check_rbl_sub(self.mock_msg, "example", 2)
+        self.assertTrue(result)
+
+    def test_check_rbl_invalid_subtest(self):
+        self.mock_ctxt.dns.query.return_value = ["127.0.0.3"]
+        result = self.plugin.check_rbl(self.mock_msg, "example",
+                                       "example.com", "(127")
+        self.assertFalse(result)
+
+    def test_check_rbl_sub_invalid_mask(self):
+        self.global_data["zones"] = {"example": "example.com"}
+        self.mock_ctxt.dns.query.return_value = ["127.0.0.3"]
+        result = self.plugin.check_rbl_sub(self.mock_msg, "example",
+                                           "invalid")
+        self.assertFalse(result)
+
     def test_check_multi_rbl_skip_rbl_check(self):
         """Test the check_rbl method with skip_rbl_checks True."""
         self.mock_ctxt.skip_rbl_checks = True
@@ -241,3 +396,62 @@ class TestDNSEval(unittest.TestCase):
         )
 
         self.mock_ctxt.dns.query.assert_not_called()
+
+    def test_finish_parsing_end_local_zones(self):
+        self.global_data["rbl_local_zone"] = [
+            "rbl.example.com. ip4set:/tmp/zone1",
+            "rbl.example.com. dnset:/tmp/zone2",
+            "other.example.com ip4trie:/tmp/zone3",
+        ]
+        mock_zone = patch("pad.plugins.dns_eval.pad.rbldnsd.Zone").start()
+        self.plugin.finish_parsing_end(self.mock_ruleset)
+        self.assertEqual(len(self.plugin["local_zones"]), 2)
+        mock_zone.return_value.add_dataset.assert_has_calls([
+            call("ip4set", "/tmp/zone1"),
+            call("dnset", "/tmp/zone2"),
+            call("ip4trie", "/tmp/zone3"),
+        ])
+
+    def test_finish_parsing_end_local_zones_invalid(self):
+        self.global_data["rbl_local_zone"] = ["rbl.example.com"]
+        self.plugin.finish_parsing_end(self.mock_ruleset)
+        self.assertEqual(self.plugin["local_zones"], {})
+        self.assertTrue(self.mock_ctxt.err.called)
+
+    def test_check_rbl_local_zone(self):
+        zone = MagicMock()
+        zone.get_prefix.return_value = "1.0.0.127"
+        zone.query.return_value = ["127.0.0.2"]
+        self.global_data["local_zones"] = {"example.com": zone}
+        result = self.plugin.check_rbl(self.mock_msg, "example",
+                                       "example.com")
+        self.assertTrue(result)
+        zone.query.assert_called_with("1.0.0.127", "A")
+        self.mock_ctxt.dns.query.assert_not_called()
+
+    def test_check_rbl_local_other_zone(self):
+        zone = MagicMock()
+        zone.get_prefix.return_value = None
+        self.global_data["local_zones"] = {"example.net": zone}
+        self.plugin.check_rbl(self.mock_msg, "example", "example.com")
+        self.mock_ctxt.dns.query.assert_called_with(
+            "1.0.0.127.example.com", "A")
+
+    def test_match_start_local_zone(self):
+        zone = MagicMock()
+        zone.get_prefix.side_effect = lambda qname: (
+            "1.0.0.127" if qname.endswith("local.example.com") else None)
+        zone.query.return_value = ["127.0.0.2"]
+        self.global_data["local_zones"] = {"local.example.com": zone}
+        result = self.get_prefetched({
+            ("ip", "local.example.com", "A"),
+            ("ip", "rbl.example.com", "A"),
+        })
+        self.assertEqual(result, {
+            ("1.0.0.127.local.example.com", "A"): ["127.0.0.2"],
+            ("1.0.0.127.rbl.example.com", "A"):
+                ["1.0.0.127.rbl.example.com"],
+        })
+        zone.check_reload.assert_called_with()
+        self.mock_ctxt.dns.query.assert_called_once_with(
+            "1.0.0.127.rbl.example.com", "A")
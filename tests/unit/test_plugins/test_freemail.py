@@ -36,39 +36,102 @@ class TestFreeMailBase(unittest.TestCase):
         patch.stopall()
 
 
-class TestCheckStart(TestFreeMailBase):
+class TestFinishParsingEnd(TestFreeMailBase):
 
-    def test_check_start(self):
-        """Test if global_data is filled in the start"""
-        self.plugin.check_start(self.mock_msg)
+    def test_finish_parsing_end(self):
+        """Test if global_data is filled after parsing"""
+        self.plugin.finish_parsing_end(self.mock_ruleset)
         self.assertTrue("email_re" in self.global_data.keys())
-        self.assertTrue("body_emails" in self.global_data.keys())
-        self.assertTrue("check_if_parsed" in self.global_data.keys())
+        self.assertTrue("freemail_exact_domains" in self.global_data.keys())
 
-    def test_check_start_valid_freemail_domains(self):
+    def test_finish_parsing_end_valid_freemail_domains(self):
         """Test if bad domains are removed from freemail_domains"""
         expected_length = len(self.global_data["freemail_domains"])
         self.global_data["freemail_domains"].append("inv*&&a_lidq.com")
-        self.plugin.check_start(self.mock_msg)
+        self.plugin.finish_parsing_end(self.mock_ruleset)
         self.assertEqual(expected_length,
                          len(self.global_data["freemail_domains"]))
 
-    def test_check_start_wild_domains(self):
+    def test_finish_parsing_end_consecutive_invalid_domains(self):
+        """Test if all the bad domains are removed"""
+        self.global_data["freemail_domains"].extend(["inv&.com", "inv&.net"])
+        self.plugin.finish_parsing_end(self.mock_ruleset)
+        self.assertEqual(self.global_data["freemail_domains"],
+                         ["freemail.example.com", "freemail2.example.com"])
+
+    def test_finish_parsing_end_wild_domains(self):
         """Test if wildcard appears in domain"""
         self.global_data["freemail_domains"].append("*.example.org")
-        self.plugin.check_start(self.mock_msg)
-        self.assertTrue("freemail_domains_re" in self.global_data.keys())
+        self.plugin.finish_parsing_end(self.mock_ruleset)
+        self.assertEqual(self.global_data["freemail_wildcard_parents"],
+                         {"example.org"})
+        self.assertIsNone(self.global_data["freemail_domains_re"])
 
-    def test_check_start_regexes(self):
+    def test_finish_parsing_end_exact_domains(self):
+        self.plugin.finish_parsing_end(self.mock_ruleset)
+        self.assertEqual(self.global_data["freemail_exact_domains"],
+                         {"freemail.example.com", "freemail2.example.com"})
+
+    def test_finish_parsing_end_regexes(self):
         """Test if regexes are compiled corectly"""
-        self.global_data["freemail_domains"].append("*.example.org")
-        self.plugin.check_start(self.mock_msg)
+        self.global_data["freemail_domains"].append("mail?.example.*")
+        self.plugin.finish_parsing_end(self.mock_ruleset)
         self.assertIsNotNone(self.global_data['email_re'].search("email@test.com"))
         self.assertIsNone(self.global_data['email_re'].search("email@test.co.za"))
-        self.assertIsNotNone(self.global_data['freemail_domains_re'].search("test@anything.example.org"))
+        self.assertIsNotNone(self.global_data['freemail_domains_re'].search("test@mail1.example.org"))
         self.assertIsNone(self.global_data['freemail_domains_re'].search("test@anything.example.com"))
 
 
+class TestCheckStart(TestFreeMailBase):
+
+    def test_check_start(self):
+        """Test if the local data is reset for every message"""
+        self.plugin.check_start(self.mock_msg)
+        self.assertEqual(self.local_data["body_emails"], set())
+        self.assertFalse(self.local_data["check_if_parsed"])
+
+
+class TestExtractMetadata(TestFreeMailBase):
+
+    def setUp(self):
+        super(TestExtractMetadata, self).setUp()
+        self.global_data["freemail_max_body_emails"] = 2
+        self.plugin.finish_parsing_end(self.mock_ruleset)
+        self.plugin.check_start(self.mock_msg)
+        self.mock_part = MagicMock()
+        self.mock_part.get_content_type.return_value = "text/plain"
+
+    def test_extract_metadata(self):
+        self.mock_part.get_payload.return_value = "Write to test@example.com"
+        self.plugin.extract_metadata(self.mock_msg, None, None,
+                                     self.mock_part)
+        self.assertEqual(self.local_data["body_emails"], {"test@example.com"})
+
+    def test_extract_metadata_max_emails(self):
+        self.mock_part.get_payload.return_value = (
+            "a@example.com b@example.com c@example.com")
+        self.plugin.extract_metadata(self.mock_msg, None, None,
+                                     self.mock_part)
+        self.assertEqual(self.local_data["body_emails"],
+                         {"a@example.com", "b@example.com"})
+
+    def test_extract_metadata_max_emails_parts(self):
+        self.mock_part.get_payload.return_value = (
+            "a@example.com b@example.com")
+        self.plugin.extract_metadata(self.mock_msg, None, None,
+                                     self.mock_part)
+        self.plugin.extract_metadata(self.mock_msg, None, None,
+                                     self.mock_part)
+        self.assertEqual(self.mock_part.get_payload.call_count, 1)
+
+    def test_extract_metadata_per_message(self):
+        self.mock_part.get_payload.return_value = "Write to test@example.com"
+        self.plugin.extract_metadata(self.mock_msg, None, None,
+                                     self.mock_part)
+        self.plugin.check_start(self.mock_msg)
+        self.assertEqual(self.local_data["body_emails"], set())
+
+
 class TestEvalRules(TestFreeMailBase):
     """Test the eval rules
         * check_freemail_replyto
@@ -78,6 +141,7 @@ class TestEvalRules(TestFreeMailBase):
 
     def setUp(self):
         super(TestEvalRules, self).setUp()
+        self.plugin.finish_parsing_end(self.mock_ruleset)
         self.plugin.check_start(self.mock_msg)
 
     def test_freemail_replyto_invalid_option(self):
@@ -134,7 +198,7 @@ class TestEvalRules(TestFreeMailBase):
     def test_freemail_replyto_with_parse_body_true(self):
         patch("pad.plugins.free_mail.FreeMail._parse_body", return_value=True).start()
         self.global_data['freemail_skip_bulk_envfrom'] = False
-        self.global_data['freemail_body_emails'] = ["test@freemail.example.com"]
+        self.local_data['freemail_body_emails'] = ["test@freemail.example.com"]
         self.mock_msg.msg["Reply-To"] = "test@freemail2.example.com"
         self.mock_msg.msg["From"] = "test2@paidomain.com"
         result = self.plugin.check_freemail_replyto(self.mock_msg)
@@ -143,7 +207,7 @@ class TestEvalRules(TestFreeMailBase):
     def test_freemail_replyto_with_parse_body_true_false(self):
         patch("pad.plugins.free_mail.FreeMail._parse_body", return_value=True).start()
         self.global_data['freemail_skip_bulk_envfrom'] = False
-        self.global_data['freemail_body_emails'] = ["test@freemail.example.com"]
+        self.local_data['freemail_body_emails'] = ["test@freemail.example.com"]
         self.mock_msg.msg["Reply-To"] = "test@freemail.example.com"
         self.mock_msg.msg["From"] = "test2@paidomain.com"
         result = self.plugin.check_freemail_replyto(self.mock_msg)
@@ -239,20 +303,20 @@ class TestEvalRules(TestFreeMailBase):
 
     def test_freemail_body_parsed(self):
         patch("pad.plugins.free_mail.FreeMail._parse_body", return_value=True).start()
-        self.global_data["body_emails"] = ["body@example.com",
+        self.local_data["body_emails"] = ["body@example.com",
                                            "body@freemail.example.com",
                                            "body2@freemail2.example.com"]
-        self.global_data["freemail_body_emails"] = ["body@freemail.example.com",
+        self.local_data["freemail_body_emails"] = ["body@freemail.example.com",
                                                     "body2@freemail2.example.com"]
         result = self.plugin.check_freemail_body(self.mock_msg)
         self.assertTrue(result)
 
     def test_freemail_body_parsed_regex(self):
         patch("pad.plugins.free_mail.FreeMail._parse_body", return_value=True).start()
-        self.global_data["body_emails"] = ["body@example.com",
+        self.local_data["body_emails"] = ["body@example.com",
                                            "body@freemail.example.com",
                                            "body2@freemail2.example.com"]
-        self.global_data["freemail_body_emails"] = ["body@freemail.example.com",
+        self.local_data["freemail_body_emails"] = ["body@freemail.example.com",
                                                     "body2@freemail2.example.com"]
         result = self.plugin.check_freemail_body(self.mock_msg, regex=r"^.*\d@")
         self.assertTrue(result)
@@ -262,12 +326,12 @@ class TestIsFreemail(TestFreeMailBase):
     """Test _is_freemail(email) method"""
 
     def test_with_no_email(self):
-        self.plugin.check_start(self.mock_msg)
+        self.plugin.finish_parsing_end(self.mock_ruleset)
         result = self.plugin._is_freemail(email=None)
         self.assertFalse(result)
 
     def test_freemail_whitelist(self):
-        self.plugin.check_start(self.mock_msg)
+        self.plugin.finish_parsing_end(self.mock_ruleset)
         whitelist_domain = self.global_data['freemail_whitelist'][0]
         email = "test@" + whitelist_domain
         result = self.plugin._is_freemail(email=email)
@@ -275,20 +339,33 @@ class TestIsFreemail(TestFreeMailBase):
 
     def test_freemail_whitelist_with_re(self):
         self.global_data['freemail_domains'].append("*.test.example.com")
-        self.plugin.check_start(self.mock_msg)
+        self.plugin.finish_parsing_end(self.mock_ruleset)
         email = "test@anything.test.example.com"
         result = self.plugin._is_freemail(email=email)
         self.assertTrue(result)
 
+    def test_freemail_wildcard_one_label(self):
+        self.global_data['freemail_domains'].append("*.test.example.com")
+        self.plugin.finish_parsing_end(self.mock_ruleset)
+        email = "test@sub.anything.test.example.com"
+        result = self.plugin._is_freemail(email=email)
+        self.assertFalse(result)
+
+    def test_freemail_wildcard_regex(self):
+        self.global_data['freemail_domains'].append("mail?.example.org")
+        self.plugin.finish_parsing_end(self.mock_ruleset)
+        self.assertTrue(self.plugin._is_freemail("test@mail1.example.org"))
+        self.assertFalse(self.plugin._is_freemail("test@mail12.example.org"))
+
     def test_freemail_domains(self):
-        self.plugin.check_start(self.mock_msg)
+        self.plugin.finish_parsing_end(self.mock_ruleset)
         freemail_domain = self.global_data['freemail_domains'][0]
         email = "test@" + freemail_domain
         result = self.plugin._is_freemail(email=email)
         self.assertTrue(result)
 
     def test_email_whitelist_re(self):
-        self.plugin.check_start(self.mock_msg)
+        self.plugin.finish_parsing_end(self.mock_ruleset)
         email = "support@example.com"
         result = self.plugin._is_freemail(email=email)
         self.assertFalse(result)
@@ -299,44 +376,45 @@ class TestParseBody(TestFreeMailBase):
 
     def setUp(self):
         super(TestParseBody, self).setUp()
+        self.plugin.finish_parsing_end(self.mock_ruleset)
         self.plugin.check_start(self.mock_msg)
 
     def test_parse_body_already_parsed(self):
-        self.global_data["check_if_parsed"] = True
-        result = self.plugin._parse_body()
+        self.local_data["check_if_parsed"] = True
+        result = self.plugin._parse_body(self.mock_msg)
         self.assertTrue(result)
 
     def test_parse_body_no_body_emails_skip(self):
         self.global_data["freemail_max_body_emails"] = 5
         self.global_data["freemail_skip_when_over_max"] = True
-        result = self.plugin._parse_body()
+        result = self.plugin._parse_body(self.mock_msg)
         self.assertTrue(result)
 
     def test_parse_body_with_emails(self):
-        self.global_data["body_emails"] = ["body@example.com",
+        self.local_data["body_emails"] = ["body@example.com",
                                            "body2@example.com",
                                            "body3@example.com"]
         self.global_data["freemail_max_body_emails"] = 2
         self.global_data["freemail_skip_when_over_max"] = True
-        result = self.plugin._parse_body()
+        result = self.plugin._parse_body(self.mock_msg)
         self.assertFalse(result)
 
     def test_parse_body_with_freemail(self):
-        self.global_data["body_emails"] = ["body@freemail.example.com",
+        self.local_data["body_emails"] = ["body@freemail.example.com",
                                            "body2@freemail2.example.com"]
         self.global_data["freemail_max_body_emails"] = 5
         self.global_data["freemail_skip_when_over_max"] = True
         self.global_data["freemail_max_body_freemails"] = 3
-        result = self.plugin._parse_body()
+        result = self.plugin._parse_body(self.mock_msg)
         self.assertTrue(result)
-        self.assertEqual(self.global_data["body_emails"],
-                         self.global_data["freemail_body_emails"])
+        self.assertEqual(self.local_data["body_emails"],
+                         self.local_data["freemail_body_emails"])
 
     def test_parse_body_with_freemail_limit(self):
-        self.global_data["body_emails"] = ["body@freemail.example.com",
+        self.local_data["body_emails"] = ["body@freemail.example.com",
                                            "body2@freemail2.example.com"]
         self.global_data["freemail_max_body_emails"] = 5
         self.global_data["freemail_skip_when_over_max"] = True
         self.global_data["freemail_max_body_freemails"] = 1
-        result = self.plugin._parse_body()
+        result = self.plugin._parse_body(self.mock_msg)
         self.assertFalse(result)
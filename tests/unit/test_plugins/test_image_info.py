@@ -79,6 +79,45 @@ class TestImageInfoPlugin(TestImageInfoBase):
         self.assertDictEqual(self.plugin._get_image_sizes(image),
                              sizes)
 
+    def test_get_image_sizes_unknown(self):
+        patch("pad.plugins.image_info.get_image_size",
+              return_value=None).start()
+        pil_size = patch("pad.plugins.image_info._get_pil_size",
+                         return_value=(3, 4)).start()
+        self.assertDictEqual(self.plugin._get_image_sizes(b"data"),
+                             {"width": 3, "height": 4})
+        pil_size.assert_called_with(b"data")
+
+    def test_get_image_sizes_invalid(self):
+        self.assertRaises(image_info.BadImageFile,
+                          self.plugin._get_image_sizes, b"\x89PNG\r\n\x1a\n")
+
+    def test_get_image_sizes_too_large(self):
+        patch("pad.plugins.image_info.get_image_size",
+              return_value=(10000, 10000)).start()
+        self.assertRaises(image_info.BadImageFile,
+                          self.plugin._get_image_sizes, b"data")
+
+    def test_save_stats_cached(self):
+        image = new_image_string((2, 2), mode="RGB")
+        other_msg = MagicMock(**{
+            "get_plugin_data.side_effect": KeyError,
+        })
+        self.plugin._save_stats(self.mock_msg, image, "jpg")
+        with patch("pad.plugins.image_info.ImageInfoPlugin."
+                   "_get_image_sizes") as mock_sizes:
+            self.plugin._save_stats(other_msg, image, "jpg")
+        self.assertFalse(mock_sizes.called)
+
+    def test_save_stats_invalid_cached(self):
+        image = b"\x89PNG\r\n\x1a\n"
+        self.plugin._save_stats(self.mock_msg, image, "png")
+        with patch("pad.plugins.image_info.ImageInfoPlugin."
+                   "_get_image_sizes") as mock_sizes:
+            self.plugin._save_stats(self.mock_msg, image, "png")
+        self.assertFalse(mock_sizes.called)
+        self.assertEqual(self.plugin._get_invalid_count(self.mock_msg), 2)
+
     def test_get_image_names(self):
         self.plugin.set_local(self.mock_msg, "names",
                               ["test1.jpg", "test2.jpg"])
@@ -376,11 +415,70 @@ class TestImageToTextRatio(TestImageInfoBase):
         self.assertFalse(self.plugin.image_to_text_ratio(self.mock_msg, "all",
                                                          1, 2, target="body"))
 
+class TestGetImageSize(unittest.TestCase):
+    """Test reading the image size from the header."""
+
+    def get_image(self, size, fmt, **kwargs):
+        import PIL.Image
+        from io import BytesIO
+        image = PIL.Image.new("RGB", size)
+        img_io = BytesIO()
+        image.save(img_io, format=fmt, **kwargs)
+        return img_io.getvalue()
+
+    def check_size(self, fmt, **kwargs):
+        data = self.get_image((300, 7), fmt, **kwargs)
+        self.assertEqual(image_info.get_image_size(data), (300, 7))
+
+    def test_gif(self):
+        self.check_size("GIF")
+
+    def test_png(self):
+        self.check_size("PNG")
+
+    def test_jpeg(self):
+        self.check_size("JPEG")
+
+    def test_jpeg_progressive(self):
+        self.check_size("JPEG", progressive=True)
+
+    def test_bmp(self):
+        self.check_size("BMP")
+
+    def test_webp_lossy(self):
+        self.check_size("WEBP")
+
+    def test_webp_lossless(self):
+        self.check_size("WEBP", lossless=True)
+
+    def test_webp_extended(self):
+        # 70000x7 canvas, the sizes are stored as 24 bits minus one.
+        data = (b"RIFF\x16\x00\x00\x00WEBPVP8X\x0a\x00\x00\x00"
+                b"\x00\x00\x00\x00\x6f\x11\x01\x06\x00\x00")
+        self.assertEqual(image_info.get_image_size(data), (70000, 7))
+
+    def test_unknown(self):
+        data = self.get_image((3, 2), "TIFF")
+        self.assertIsNone(image_info.get_image_size(data))
+
+    def test_truncated(self):
+        data = self.get_image((3, 2), "PNG")[:18]
+        self.assertRaises(ValueError, image_info.get_image_size, data)
+
+    def test_jpeg_no_frame(self):
+        self.assertRaises(ValueError, image_info.get_image_size,
+                          b"\xff\xd8\xff\xda\x00\x02")
+
+    def test_pil_fallback(self):
+        data = self.get_image((3, 2), "TIFF")
+        self.assertEqual(image_info._get_pil_size(data), (3, 2))
+
 
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestImageInfoPlugin, "test"))
+    test_suite.addTest(unittest.makeSuite(TestGetImageSize, "test"))
     test_suite.addTest(unittest.makeSuite(TestImageCount, "test"))
     test_suite.addTest(unittest.makeSuite(TestImageNamed, "test"))
     test_suite.addTest(unittest.makeSuite(TestPixelCoverage, "test"))
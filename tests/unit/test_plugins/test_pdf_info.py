@@ -13,6 +13,7 @@ except ImportError:
     from mock import patch, Mock, MagicMock, call
 
 import pad.plugins
+import pad.plugins.pdf_info
 
 
 class PDFInfoBase(unittest.TestCase):
@@ -21,7 +22,7 @@ class PDFInfoBase(unittest.TestCase):
 
     def setUp(self):
         unittest.TestCase.setUp(self)
-        self.options = {}
+        self.options = dict(pad.plugins.pdf_info.PDFInfoPlugin.options)
         self.global_data = {}
         self.msg_data = {}
         patch("pad.plugins.pdf_info.PDFInfoPlugin.options",
@@ -122,6 +123,7 @@ class TestPDFInfo(PDFInfoBase):
             if payload is None:
                 continue
             self.plugin._save_stats(self.mock_msg, payload)
+        self.plugin._analyze(self.mock_msg)
 
         self.plugin._update_details.assert_has_calls(update_details_calls)
         self.plugin._update_image_counts.assert_has_calls(
@@ -158,6 +160,7 @@ class TestPDFInfo(PDFInfoBase):
             if payload is None:
                 continue
             self.plugin._save_stats(self.mock_msg, payload)
+        self.plugin._analyze(self.mock_msg)
 
         self.plugin._update_details.assert_has_calls(update_details_calls)
 
@@ -183,6 +186,7 @@ class TestPDFInfo(PDFInfoBase):
             if payload is None:
                 continue
             results.append(self.plugin._save_stats(self.mock_msg, payload))
+        self.plugin._analyze(self.mock_msg)
 
         self.plugin._update_details.assert_not_called()
         self.plugin._update_image_counts.assert_not_called()
@@ -190,6 +194,72 @@ class TestPDFInfo(PDFInfoBase):
         self.assertEqual(results, [None])
 
 
+    def get_payload(self, path="tests/data/pdftest.pdf"):
+        with open(path, "rb") as pdf_file:
+            return pdf_file.read()
+
+    def test_save_stats_lazy(self):
+        """The PDF is only parsed when a rule needs the details"""
+        reader = patch("pad.plugins.pdf_info.PyPDF2.PdfFileReader").start()
+        payload = self.get_payload()
+        self.plugin._save_stats(self.mock_msg, payload)
+        self.assertFalse(reader.called)
+        self.assertEqual(self.plugin._get_pdf_hashes(self.mock_msg),
+                         {md5(payload).hexdigest()})
+        self.assertTrue(self.plugin.pdf_is_empty_body(self.mock_msg,
+                                                      len(payload)))
+        self.assertFalse(reader.called)
+
+    def test_analyze_kind(self):
+        payload = self.get_payload()
+        self.plugin._save_stats(self.mock_msg, payload)
+        self.assertEqual(self.plugin._get_image_count(self.mock_msg), 1)
+        self.assertEqual(self.plugin.get_local(self.mock_msg, "analyzed"),
+                         {"images"})
+        self.assertRaises(KeyError, self.plugin.get_local, self.mock_msg,
+                          "details")
+
+    def test_analyze_once(self):
+        payload = self.get_payload()
+        self.plugin._save_stats(self.mock_msg, payload)
+        self.plugin._get_image_count(self.mock_msg)
+        self.assertEqual(self.plugin._get_image_count(self.mock_msg), 1)
+        self.assertEqual(self.plugin._get_pixel_coverage(self.mock_msg),
+                         360800)
+
+    def test_analyze_cached(self):
+        payload = self.get_payload()
+        self.plugin._save_stats(self.mock_msg, payload)
+        self.plugin._analyze(self.mock_msg)
+        for key in ("pdfs", "analyzed", "readers", "image_counts",
+                    "pixel_coverage", "md5hashes", "pdf_bytes"):
+            self.msg_data.pop(key, None)
+        reader = patch("pad.plugins.pdf_info.PyPDF2.PdfFileReader").start()
+        self.plugin._save_stats(self.mock_msg, payload)
+        self.assertEqual(self.plugin._get_image_count(self.mock_msg), 1)
+        self.assertFalse(reader.called)
+
+    def test_analyze_duplicate(self):
+        payload = self.get_payload()
+        self.plugin._save_stats(self.mock_msg, payload)
+        self.plugin._save_stats(self.mock_msg, payload)
+        self.assertEqual(self.plugin._get_image_count(self.mock_msg), 1)
+
+    def test_analyze_max_pages(self):
+        self.msg_data["pdf_max_pages"] = 0
+        self.plugin._save_stats(self.mock_msg, self.get_payload())
+        self.assertEqual(self.plugin._get_image_count(self.mock_msg), 0)
+
+    def test_analyze_timeout(self):
+        self.msg_data["pdf_timeout"] = -1
+        self.plugin._save_stats(self.mock_msg, self.get_payload())
+        self.assertEqual(self.plugin._get_image_count(self.mock_msg), 0)
+
+    def test_analyze_invalid(self):
+        self.plugin._save_stats(self.mock_msg, b"%PDF-1.4 invalid")
+        self.assertEqual(self.plugin._get_image_count(self.mock_msg), 0)
+        self.assertFalse(self.plugin.pdf_is_encrypted(self.mock_msg))
+
 
 class TestPDFCount(PDFInfoBase):
     """Tests for counting the PDF files in the message """
@@ -1,5 +1,6 @@
 """Tests for pad.plugins.base."""
 
+import time
 import unittest
 
 try:
@@ -7,6 +8,8 @@ try:
 except ImportError:
     from mock import patch, Mock, MagicMock
 
+import pyzor
+
 import pad.plugins.pyzor
 
 
@@ -26,6 +29,8 @@ class TestPyzorCheck(unittest.TestCase):
             "get_plugin_data.side_effect": lambda p, k: self.msg_data[k],
             "set_plugin_data.side_effect": lambda p, k, v: self.msg_data.setdefault(k, v),
             })
+        self.mock_msg.raw_msg = "Subject: test\n\nTest body\n"
+        self.mock_msg.msg = {"Content-Type": "text/plain"}
         self.mock_ctxt = MagicMock(**{
             "get_plugin_data.side_effect": lambda p, k: self.global_data[k],
             "set_plugin_data.side_effect": lambda p, k, v: self.global_data.setdefault(k, v)}
@@ -38,11 +43,29 @@ class TestPyzorCheck(unittest.TestCase):
         patch.stopall()
 
     def test_finish_parsing(self):
+        self.mock_ctxt.get_used_eval_rules.return_value = {"check_pyzor"}
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+        plugin.finish_parsing_end(self.mock_ruleset)
+
+        self.mock_pyzor.assert_called_with(timeout=3.5)
+        self.assertEqual(self.global_data["client"],
+                         self.mock_pyzor.return_value)
+        self.assertEqual(self.global_data["cache"].ttl, 60.0)
+        self.assertEqual(self.global_data["digest_cache"].max_size, 10000)
+
+    def test_finish_parsing_unused(self):
+        self.mock_ctxt.get_used_eval_rules.return_value = set()
         plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
         plugin.finish_parsing_end(self.mock_ruleset)
-        expected = ("PyzorPlugin", "client", self.mock_pyzor(timeout=3.5))
 
-        self.mock_ctxt.set_plugin_data.assert_called_with(*expected)
+        self.assertFalse(self.mock_pyzor.called)
+        self.assertNotIn("client", self.global_data)
+
+    def test_get_client(self):
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+        self.assertEqual(plugin._get_client(), self.mock_pyzor.return_value)
+        self.assertEqual(plugin._get_client(), self.mock_pyzor.return_value)
+        self.mock_pyzor.assert_called_once_with(timeout=3.5)
 
     def test_check_pyzor_set_digest(self):
         self.global_data["client"] = self.mock_client
@@ -99,6 +122,121 @@ class TestPyzorCheck(unittest.TestCase):
         result = plugin.check_pyzor(self.mock_msg)
         self.assertEqual(result, False)
 
+    def test_check_pyzor_multiple_servers(self):
+        self.global_data["client"] = self.mock_client
+        self.global_data["pyzor_servers"] = ["pyzor1:24441", "pyzor2:24441"]
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+        responses = {"pyzor1": {"Count": 1, "WL-Count": 0},
+                     "pyzor2": {"Count": 6, "WL-Count": 0}}
+        self.mock_client.check.side_effect = lambda d, a: responses[a[0]]
+
+        result = plugin.check_pyzor(self.mock_msg)
+        self.assertEqual(result, True)
+        self.assertEqual(self.mock_client.check.call_count, 2)
+
+    def test_check_pyzor_concurrent(self):
+        self.global_data["client"] = self.mock_client
+        self.global_data["pyzor_servers"] = ["pyzor1:24441", "pyzor2:24441",
+                                             "pyzor3:24441"]
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+
+        def check(digest, address):
+            time.sleep(0.2)
+            return {"Count": 1, "WL-Count": 0}
+        self.mock_client.check.side_effect = check
+
+        start = time.time()
+        plugin.check_pyzor(self.mock_msg)
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(self.mock_client.check.call_count, 3)
+
+    def test_check_pyzor_timeout(self):
+        self.global_data["client"] = self.mock_client
+        self.global_data["pyzor_servers"] = ["pyzor1:24441", "pyzor2:24441"]
+        self.global_data["pyzor_timeout"] = 0.1
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+
+        def check(digest, address):
+            if address[0] == "pyzor1":
+                time.sleep(0.5)
+            return {"Count": 6, "WL-Count": 0}
+        self.mock_client.check.side_effect = check
+
+        start = time.time()
+        result = plugin.check_pyzor(self.mock_msg)
+        self.assertLess(time.time() - start, 0.4)
+        self.assertEqual(result, True)
+
+    def test_check_pyzor_error(self):
+        self.global_data["client"] = self.mock_client
+        self.global_data["pyzor_servers"] = ["pyzor1:24441", "pyzor2:24441"]
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+
+        def check(digest, address):
+            if address[0] == "pyzor1":
+                raise pyzor.TimeoutError()
+            return {"Count": 6, "WL-Count": 0}
+        self.mock_client.check.side_effect = check
+
+        result = plugin.check_pyzor(self.mock_msg)
+        self.assertEqual(result, True)
+
+    def test_check_pyzor_no_servers(self):
+        self.global_data["client"] = self.mock_client
+        self.global_data["pyzor_servers"] = []
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+
+        result = plugin.check_pyzor(self.mock_msg)
+        self.assertEqual(result, False)
+        self.assertFalse(self.mock_client.check.called)
+
+    def test_check_pyzor_cached(self):
+        self.global_data["client"] = self.mock_client
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+        self.mock_client.check.return_value = {"Count": 6, "WL-Count": 0}
+
+        plugin.check_pyzor(self.mock_msg)
+        result = plugin.check_pyzor(self.mock_msg)
+        self.assertEqual(result, True)
+        self.assertEqual(self.mock_client.check.call_count, 1)
+
+    def test_check_pyzor_cache_expired(self):
+        self.global_data["client"] = self.mock_client
+        self.global_data["pyzor_cache_ttl"] = 0.01
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+        self.mock_client.check.return_value = {"Count": 6, "WL-Count": 0}
+
+        plugin.check_pyzor(self.mock_msg)
+        time.sleep(0.02)
+        plugin.check_pyzor(self.mock_msg)
+        self.assertEqual(self.mock_client.check.call_count, 2)
+
+    def test_check_pyzor_digest_cached(self):
+        self.global_data["client"] = self.mock_client
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+
+        plugin.check_pyzor(self.mock_msg)
+        plugin.check_pyzor(self.mock_msg)
+        self.assertEqual(self.mock_digester.call_count, 1)
+
+    def test_check_pyzor_digest_other_body(self):
+        self.global_data["client"] = self.mock_client
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+
+        plugin.check_pyzor(self.mock_msg)
+        self.mock_msg.raw_msg = "Subject: test\n\nOther body\n"
+        plugin.check_pyzor(self.mock_msg)
+        self.assertEqual(self.mock_digester.call_count, 2)
+
+    def test_check_pyzor_digest_other_content_type(self):
+        self.global_data["client"] = self.mock_client
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+
+        plugin.check_pyzor(self.mock_msg)
+        self.mock_msg.msg = {"Content-Type": "text/html"}
+        plugin.check_pyzor(self.mock_msg)
+        self.assertEqual(self.mock_digester.call_count, 2)
+
 
 class TestPyzorReport(unittest.TestCase):
     digest = "da39a3ee5e6b4b0d3255bfef95601890afd80709"
@@ -116,6 +254,8 @@ class TestPyzorReport(unittest.TestCase):
             "get_plugin_data.side_effect": lambda p, k: self.msg_data[k],
             "set_plugin_data.side_effect": lambda p, k, v: self.msg_data.setdefault(k, v),
             })
+        self.mock_msg.raw_msg = "Subject: test\n\nTest body\n"
+        self.mock_msg.msg = {"Content-Type": "text/plain"}
         self.mock_ctxt = MagicMock(**{
             "get_plugin_data.side_effect": lambda p, k: self.global_data[k],
             "set_plugin_data.side_effect": lambda p, k, v: self.global_data.setdefault(k, v)}
@@ -165,6 +305,26 @@ class TestPyzorReport(unittest.TestCase):
 
         self.assertFalse(self.mock_client.report.called)
 
+    def test_report_invalidates_cache(self):
+        self.global_data["client"] = self.mock_client
+        self.msg_data["digest"] = self.digest
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+        cache = plugin._get_cache()
+        cache.set(("public.pyzor.org:24441", self.digest), (1, 0))
+
+        plugin.plugin_report(self.mock_msg)
+        self.assertNotIn(("public.pyzor.org:24441", self.digest), cache)
+
+    def test_revoke_invalidates_cache(self):
+        self.global_data["client"] = self.mock_client
+        self.msg_data["digest"] = self.digest
+        plugin = pad.plugins.pyzor.PyzorPlugin(self.mock_ctxt)
+        cache = plugin._get_cache()
+        cache.set(("public.pyzor.org:24441", self.digest), (1, 0))
+
+        plugin.plugin_revoke(self.mock_msg)
+        self.assertNotIn(("public.pyzor.org:24441", self.digest), cache)
+
 
 def suite():
     """Gather all the tests from this package in a test suite."""
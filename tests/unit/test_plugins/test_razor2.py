@@ -1,12 +1,16 @@
+import os
 import unittest
 import subprocess
 import time
+import multiprocessing
 
 try:
     from unittest.mock import patch, Mock, MagicMock, call
 except ImportError:
     from mock import patch, Mock, MagicMock, call
 
+import pad.cache
+import pad.rules.eval_
 import pad.plugins.razor2
 
 class TestRazor2(unittest.TestCase):
@@ -203,9 +207,185 @@ class TestReportRevoke(unittest.TestCase):
         self.plug.plugin_revoke(self.mock_msg)
         self.mock_launch_subprocess.assert_called_with(self.mock_msg, "razor-revoke")
 
+
+class TestRazor2Prefetch(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.global_data = {}
+        self.msg_data = {}
+
+        self.mock_ctxt = MagicMock(**{
+            "get_plugin_data.side_effect": lambda p, k: self.global_data[k],
+            "set_plugin_data.side_effect": lambda p, k, v: self.global_data.
+                                   __setitem__(k, v)}
+        )
+        self.mock_msg = MagicMock(**{
+            "get_plugin_data.side_effect": lambda p, k: self.msg_data[k],
+            "set_plugin_data.side_effect": lambda p, k, v: self.msg_data.
+                                  __setitem__(k, v),
+        })
+        self.mock_msg.raw_msg = "Subject: test\n\ntestmessage"
+        self.mock_msg.msg = {}
+
+        self.mock_subprocess_Popen = patch(
+            "pad.plugins.razor2.subprocess.Popen").start()
+        self.proc = self.mock_subprocess_Popen.return_value
+        self.proc.returncode = 0
+
+        rule = MagicMock(spec=pad.rules.eval_.EvalRule,
+                         eval_rule_name="check_razor2")
+        self.mock_ruleset = MagicMock(checked={"RAZOR2_CHECK": rule},
+                                      not_checked={})
+        self.plug = pad.plugins.razor2.Razor2Plugin(self.mock_ctxt)
+        self.plug.finish_parsing_end(self.mock_ruleset)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_finish_parsing_prefetch(self):
+        self.assertTrue(self.global_data["prefetch"])
+
+    def test_finish_parsing_no_prefetch(self):
+        self.mock_ruleset.checked = {}
+        self.plug.finish_parsing_end(self.mock_ruleset)
+        self.assertFalse(self.global_data["prefetch"])
+
+    def test_match_start_prefetch(self):
+        self.plug.match_start(self.mock_ruleset, self.mock_msg)
+        self.assertIn("razor2_pending", self.msg_data)
+        result = self.plug.check_razor2(self.mock_msg)
+        self.assertEqual(result, True)
+        self.assertEqual(self.mock_subprocess_Popen.call_count, 1)
+
+    def test_match_start_no_prefetch(self):
+        self.global_data["prefetch"] = False
+        self.plug.match_start(self.mock_ruleset, self.mock_msg)
+        self.assertNotIn("razor2_pending", self.msg_data)
+        self.assertFalse(self.mock_subprocess_Popen.called)
+
+    def test_match_start_no_use(self):
+        self.global_data["use_razor2"] = False
+        self.plug.match_start(self.mock_ruleset, self.mock_msg)
+        self.assertFalse(self.mock_subprocess_Popen.called)
+
+    def test_match_start_cached(self):
+        self.global_data["cache"].set(
+            pad.cache.get_body_key(self.mock_msg), True)
+        self.plug.match_start(self.mock_ruleset, self.mock_msg)
+        self.assertEqual(self.msg_data["razor2_result"], True)
+        self.assertFalse(self.mock_subprocess_Popen.called)
+
+    def test_prefetch_timeout(self):
+        self.global_data["razor_timeout"] = 0
+        self.plug.set_local(self.mock_msg, "razor2_pending",
+                            (MagicMock(**{"get.side_effect":
+                                          multiprocessing.TimeoutError}),
+                             time.time()))
+        result = self.plug.check_razor2(self.mock_msg)
+        self.assertEqual(result, False)
+
+    def test_check_cached(self):
+        self.plug.check_razor2(self.mock_msg)
+        self.msg_data.clear()
+        result = self.plug.check_razor2(self.mock_msg)
+        self.assertEqual(result, True)
+        self.assertEqual(self.mock_subprocess_Popen.call_count, 1)
+
+    def test_check_not_cached_other_body(self):
+        self.plug.check_razor2(self.mock_msg)
+        self.msg_data.clear()
+        self.mock_msg.raw_msg = "Subject: test\n\nother message"
+        self.plug.check_razor2(self.mock_msg)
+        self.assertEqual(self.mock_subprocess_Popen.call_count, 2)
+
+    def test_check_error_not_cached(self):
+        self.proc.returncode = -9
+        result = self.plug.check_razor2(self.mock_msg)
+        self.assertEqual(result, False)
+        self.msg_data.clear()
+        self.plug.check_razor2(self.mock_msg)
+        self.assertEqual(self.mock_subprocess_Popen.call_count, 2)
+
+    def test_report_invalidates_cache(self):
+        self.plug.check_razor2(self.mock_msg)
+        self.plug.plugin_report(self.mock_msg)
+        self.assertNotIn(pad.cache.get_body_key(self.mock_msg),
+                         self.global_data["cache"])
+
+    def test_revoke_invalidates_cache(self):
+        self.plug.check_razor2(self.mock_msg)
+        self.plug.plugin_revoke(self.mock_msg)
+        self.assertNotIn(pad.cache.get_body_key(self.mock_msg),
+                         self.global_data["cache"])
+
+    def test_max_processes(self):
+        patch("pad.plugins.razor2.Razor2Plugin._get_processes",
+              return_value=MagicMock(
+                  **{"acquire.return_value": False})).start()
+        result = self.plug.launch_subprocess(self.mock_msg, "razor-check")
+        self.assertEqual(result, False)
+        self.assertFalse(self.mock_subprocess_Popen.called)
+
+    def test_process_released(self):
+        processes = MagicMock(**{"acquire.return_value": True})
+        patch("pad.plugins.razor2.Razor2Plugin._get_processes",
+              return_value=processes).start()
+        self.plug.launch_subprocess(self.mock_msg, "razor-check")
+        processes.release.assert_called_with()
+
+    def test_process_released_error(self):
+        processes = MagicMock(**{"acquire.return_value": True})
+        patch("pad.plugins.razor2.Razor2Plugin._get_processes",
+              return_value=processes).start()
+        self.mock_subprocess_Popen.side_effect = OSError
+        self.plug.launch_subprocess(self.mock_msg, "razor-check")
+        processes.release.assert_called_with()
+
+
+class TestProcesses(unittest.TestCase):
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_same_process(self):
+        self.assertIs(pad.plugins.razor2._get_processes(4),
+                      pad.plugins.razor2._get_processes(4))
+
+    def test_limit(self):
+        processes = pad.plugins.razor2._get_processes(2)
+        self.assertTrue(processes.acquire(False))
+        self.assertTrue(processes.acquire(False))
+        self.assertFalse(processes.acquire(False))
+        processes.release()
+        processes.release()
+
+    def test_other_limit(self):
+        processes = pad.plugins.razor2._get_processes(4)
+        self.assertIsNot(pad.plugins.razor2._get_processes(2), processes)
+
+    def test_after_fork(self):
+        processes = pad.plugins.razor2._get_processes(4)
+        patch("pad.plugins.razor2.os.getpid",
+              return_value=os.getpid() + 1).start()
+        self.assertIsNot(pad.plugins.razor2._get_processes(4), processes)
+
+    def test_plugin_shared(self):
+        first = pad.plugins.razor2.Razor2Plugin(MagicMock())
+        second = pad.plugins.razor2.Razor2Plugin(MagicMock())
+        for plugin in (first, second):
+            plugin.get_global = {"razor_max_processes": 3}.__getitem__
+        self.assertIs(first._get_processes(), second._get_processes())
+
+
+
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestRazor2, "test"))
+    test_suite.addTest(unittest.makeSuite(TestReportRevoke, "test"))
+    test_suite.addTest(unittest.makeSuite(TestProcesses, "test"))
+    test_suite.addTest(unittest.makeSuite(TestRazor2Prefetch, "test"))
     return test_suite
 
 
@@ -6,6 +6,8 @@ try:
 except ImportError:
     from mock import patch, MagicMock
 
+import ipaddress
+
 import pad.context
 import pad.message
 import pad.plugins.relay_country
@@ -101,7 +103,8 @@ class TestRelayCountry(unittest.TestCase):
 
     def setUp(self):
         unittest.TestCase.setUp(self)
-        self.options = {}
+        self.options = dict(
+            pad.plugins.relay_country.RelayCountryPlugin.options)
         self.global_data = {"ipv4": MockGeoIP(),
                             "ipv6": MockGeoIP()}
         patch("pad.plugins.relay_country.RelayCountryPlugin.options",
@@ -141,6 +144,48 @@ class TestRelayCountry(unittest.TestCase):
         expected_result = ["XX"]
         self.assertEqual(message.headers["X-Relay-Countries"], expected_result)
 
+    def test_reserved(self):
+        """Reserved addresses are not searched in the database"""
+        reader = MagicMock()
+        self.global_data["ipv4"] = reader
+        for address in ("10.0.0.1", "127.0.0.1", "169.254.1.1",
+                        "224.0.0.1", "240.0.0.1", "0.0.0.0"):
+            ipaddr = ipaddress.ip_address(u"%s" % address)
+            self.assertEqual(self.plugin.get_country(ipaddr), "**")
+        self.assertFalse(reader.country_code_by_addr.called)
+
+    def test_cached(self):
+        """The country of an IP address is only searched once"""
+        reader = MagicMock(**{"country_code_by_addr.return_value": "GB"})
+        self.global_data["ipv4"] = reader
+        ipaddr = ipaddress.ip_address(u"178.62.26.182")
+        self.assertEqual(self.plugin.get_country(ipaddr), "GB")
+        self.assertEqual(self.plugin.get_country(ipaddr), "GB")
+        self.assertEqual(reader.country_code_by_addr.call_count, 1)
+
+    def test_not_loaded(self):
+        """Nothing is cached when the database is not loaded"""
+        self.global_data["ipv4"] = None
+        ipaddr = ipaddress.ip_address(u"178.62.26.182")
+        self.assertEqual(self.plugin.get_country(ipaddr), "XX")
+        self.assertNotIn(ipaddr, self.plugin._get_cache())
+
+    def test_load_database_mode(self):
+        """The database is opened with the flags of geodb_mode"""
+        mock_geoip = patch("pad.plugins.relay_country.pygeoip.GeoIP").start()
+        self.global_data["geodb_mode"] = "mmap"
+        self.plugin.load_database()
+        mock_geoip.assert_called_with(
+            "GeoIP.dat", pad.plugins.relay_country.pygeoip.MMAP_CACHE)
+
+    def test_load_database_invalid_mode(self):
+        """Invalid modes fall back to the standard mode"""
+        mock_geoip = patch("pad.plugins.relay_country.pygeoip.GeoIP").start()
+        self.global_data["geodb_mode"] = "invalid"
+        self.plugin.load_database()
+        mock_geoip.assert_called_with(
+            "GeoIP.dat", pad.plugins.relay_country.pygeoip.STANDARD)
+
 
 def suite():
     """Gather all the tests from this package in a test suite."""
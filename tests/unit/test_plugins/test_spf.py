@@ -8,6 +8,16 @@ try:
 except ImportError:
     from mock import patch, Mock, MagicMock, call
 
+import time
+
+import dns.rdata
+import dns.exception
+import dns.rdatatype
+import dns.rdataclass
+
+import pad.cache
+import pad.errors
+import pad.dns_interface
 import pad.plugins.spf
 
 
@@ -16,9 +26,10 @@ class TestSpf(unittest.TestCase):
         unittest.TestCase.setUp(self)
         self.hostname_with_ip = []
         self.local_data = {}
-        self.global_data = {
-            "spf_timeout": 10
-        }
+        self.global_data = dict(
+            (key, value) for key, (dummy, value)
+            in pad.plugins.spf.SpfPlugin.options.items())
+        self.global_data["spf_timeout"] = 10
         self.mock_ctxt = MagicMock()
         self.mock_msg = MagicMock(hostname_with_ip=self.hostname_with_ip,
                                   msg={})
@@ -34,20 +45,44 @@ class TestSpf(unittest.TestCase):
         unittest.TestCase.tearDown(self)
         patch.stopall()
 
-    def test_parsed_metadata_with_headers(self):
+    def test_match_start_with_headers(self):
         self.plugin._query_spf = Mock()
         self.hostname_with_ip.append(("example.com", "127.0.0.1"))
         self.global_data["ignore_received_spf_header"] = True
-        self.plugin.parsed_metadata(self.mock_msg)
+        self.plugin.match_start(self.mock_ruleset, self.mock_msg)
+        self.plugin._get_result(self.mock_msg)
         self.plugin._query_spf.assert_called_with(
             10, "127.0.0.1", "example.com", self.mock_msg.sender_address
         )
 
-    def test_parsed_metadata_with_query(self):
+    def test_match_start_no_relays(self):
+        self.plugin._query_spf = Mock()
+        self.global_data["ignore_received_spf_header"] = True
+        self.plugin.match_start(self.mock_ruleset, self.mock_msg)
+        self.assertEqual(self.plugin._get_result(self.mock_msg), "")
+        self.assertFalse(self.plugin._query_spf.called)
+
+    def test_match_start_result(self):
+        self.plugin._query_spf = Mock(return_value="pass")
+        self.hostname_with_ip.append(("example.com", "127.0.0.1"))
+        self.global_data["ignore_received_spf_header"] = True
+        self.plugin.match_start(self.mock_ruleset, self.mock_msg)
+        self.assertTrue(self.plugin.check_for_spf_pass(self.mock_msg))
+        self.assertEqual(self.local_data["spf_result"], "pass")
+
+    def test_match_start_timeout(self):
+        self.plugin._query_spf = lambda *args: time.sleep(1)
+        self.hostname_with_ip.append(("example.com", "127.0.0.1"))
+        self.global_data["ignore_received_spf_header"] = True
+        self.global_data["spf_timeout"] = 0
+        self.plugin.match_start(self.mock_ruleset, self.mock_msg)
+        self.assertTrue(self.plugin.check_for_spf_temperror(self.mock_msg))
+
+    def test_match_start_with_query(self):
         self.plugin._check_spf_header = Mock()
         self.global_data["ignore_received_spf_header"] = False
         self.global_data["use_newest_received_spf_header"] = False
-        self.plugin.parsed_metadata(self.mock_msg)
+        self.plugin.match_start(self.mock_ruleset, self.mock_msg)
         self.plugin._check_spf_header.assert_called_with(
             self.mock_msg, self.global_data["use_newest_received_spf_header"]
         )
@@ -167,13 +202,52 @@ class TestSpf(unittest.TestCase):
             self.plugin.check_for_spf_helo_temperror(self.mock_msg))
 
     def test_query_spf(self):
-        mockspf_check = patch("pad.plugins.spf.spf.check2", return_value=(
-        'pass', 'sender SPF authorized')).start()
+        mock_query = patch("pad.plugins.spf.SPFQuery").start()
+        mock_query.return_value.check.return_value = (
+            'pass', 250, 'sender SPF authorized')
+        result = self.plugin._query_spf(10, "127.0.0.1", "example.com",
+                                        "test@example.com")
+        self.assertEqual(result, "pass")
+        mock_query.assert_called_with(
+            self.mock_ctxt.dns, self.plugin._get_policy_cache(),
+            i="127.0.0.1", s="test@example.com", h="example.com",
+            timeout=10, querytime=10)
+
+    def test_query_spf_cached(self):
+        mock_query = patch("pad.plugins.spf.SPFQuery").start()
+        mock_query.return_value.check.return_value = (
+            'pass', 250, 'sender SPF authorized')
+        self.plugin._query_spf(10, "127.0.0.1", "example.com",
+                               "test@example.com")
+        result = self.plugin._query_spf(10, "127.0.0.1", "Example.com",
+                                        "other@EXAMPLE.com")
+        self.assertEqual(result, "pass")
+        self.assertEqual(mock_query.call_count, 1)
+
+    def test_query_spf_temperror_not_cached(self):
+        mock_query = patch("pad.plugins.spf.SPFQuery").start()
+        mock_query.return_value.check.return_value = (
+            'temperror', 451, 'SPF Temporary Error')
+        self.plugin._query_spf(10, "127.0.0.1", "example.com",
+                               "test@example.com")
         self.plugin._query_spf(10, "127.0.0.1", "example.com",
-                               self.mock_msg.sender_address)
-        mockspf_check.assert_called_with(i="127.0.0.1",
-                                         s=self.mock_msg.sender_address,
-                                         h="example.com", timeout=10)
+                               "test@example.com")
+        self.assertEqual(mock_query.call_count, 2)
+
+    def test_query_spf_dns_timeout(self):
+        patch("pad.dns_interface.dns.resolver.Resolver.query",
+              side_effect=dns.exception.Timeout()).start()
+        self.mock_ctxt.dns = pad.dns_interface.DNSInterface()
+        result = self.plugin._query_spf(10, "127.0.0.1", "example.com",
+                                        "test@example.com")
+        self.assertEqual(result, "temperror")
+        self.assertEqual(len(self.plugin._get_cache()), 0)
+        self.assertEqual(len(self.plugin._get_policy_cache()), 0)
+
+    def test_query_spf_invalid(self):
+        result = self.plugin._query_spf(10, "1.2.3333.4", "example.com",
+                                        "test@example.com")
+        self.assertEqual(result, "")
 
     def test_check_spf_header_no_headers(self):
         self.global_data["use_newest_received_spf_header"] = False
@@ -335,3 +409,75 @@ class TestSpf(unittest.TestCase):
         result = self.plugin._check_spf_header(self.mock_msg, self.global_data[
             "use_newest_received_spf_header"])
         self.assertEqual(result, 'pass')
+
+
+class TestSPFQuery(unittest.TestCase):
+    records = {
+        ("example.com", "TXT"): ['"v=spf1 include:inc.example.com -all"'],
+        ("inc.example.com", "TXT"): ['"v=spf1 mx ~all"'],
+        ("inc.example.com", "MX"): ["10 mx.example.com."],
+        ("mx.example.com", "A"): ["192.0.2.1"],
+        ("192.0.2.1", "PTR"): ["mx.example.com."],
+    }
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.mock_resolver = MagicMock(**{"query.side_effect": self.query})
+        self.policies = pad.cache.TTLCache("spf_policy")
+
+    def query(self, qname, qtype, strict=False):
+        return [dns.rdata.from_text(dns.rdataclass.IN,
+                                    dns.rdatatype.from_text(qtype), value)
+                for value in self.records.get((qname, qtype), [])]
+
+    def get_query(self, ip):
+        return pad.plugins.spf.SPFQuery(
+            self.mock_resolver, self.policies, i=ip, s="test@example.com",
+            h="example.com", timeout=5)
+
+    def test_pass(self):
+        self.assertEqual(self.get_query("192.0.2.1").check()[0], "pass")
+
+    def test_fail(self):
+        self.assertEqual(self.get_query("192.0.2.2").check()[0], "fail")
+
+    def test_policy_cached(self):
+        self.get_query("192.0.2.1").check()
+        self.get_query("192.0.2.2").check()
+        self.assertEqual(self.mock_resolver.query.call_args_list.count(
+            call("example.com", "TXT", strict=True)), 1)
+        self.assertIn("example.com", self.policies)
+
+    def test_ptr(self):
+        query = self.get_query("192.0.2.1")
+        self.assertEqual(query.dns("1.2.0.192.in-addr.arpa", "PTR"),
+                         ["mx.example.com"])
+        self.mock_resolver.query.assert_called_with("192.0.2.1", "PTR",
+                                                    strict=True)
+
+    def test_temperror(self):
+        self.mock_resolver.query.side_effect = pad.errors.DNSError("error")
+        self.assertEqual(self.get_query("192.0.2.1").check()[0],
+                         "temperror")
+        self.assertNotIn("example.com", self.policies)
+
+    def test_temperror_include(self):
+        def query(qname, qtype, strict=False):
+            if qname == "inc.example.com":
+                raise pad.errors.DNSError("error")
+            return self.query(qname, qtype)
+        self.mock_resolver.query.side_effect = query
+        self.assertEqual(self.get_query("192.0.2.1").check()[0],
+                         "temperror")
+        self.assertNotIn("inc.example.com", self.policies)
+
+    def test_resolver_timeout(self):
+        patch("pad.dns_interface.dns.resolver.Resolver.query",
+              side_effect=dns.exception.Timeout()).start()
+        self.addCleanup(patch.stopall)
+        resolver = pad.dns_interface.DNSInterface()
+        query = pad.plugins.spf.SPFQuery(
+            resolver, self.policies, i="192.0.2.1", s="test@example.com",
+            h="example.com", timeout=5)
+        self.assertEqual(query.check()[0], "temperror")
+        self.assertNotIn("example.com", self.policies)
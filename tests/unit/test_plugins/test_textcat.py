@@ -103,6 +103,49 @@ class TestTextCat(unittest.TestCase):
         result = plugin.check_language(self.mock_msg)
         self.assertEqual(result, False)
 
+    def test_detect_once(self):
+        self.mock_detect_langs.return_value = [Mock(lang="en", prob=0.99)]
+        plugin = pad.plugins.textcat.TextCatPlugin(self.mock_ctxt)
+        plugin.check_language(self.mock_msg)
+        plugin.check_language(self.mock_msg)
+        self.assertEqual(self.mock_detect_langs.call_count, 1)
+        self.assertEqual(self.msg_data["languages"], ["en"])
+
+    def test_detect_sample(self):
+        self.mock_detect_langs.return_value = [Mock(lang="en", prob=0.99)]
+        self.global_data["textcat_sample_size"] = 100
+        self.mock_msg.text = "a" * 1000
+        plugin = pad.plugins.textcat.TextCatPlugin(self.mock_ctxt)
+        plugin.check_language(self.mock_msg)
+        sample = self.mock_detect_langs.call_args[0][0]
+        self.assertLessEqual(len(sample.replace(" ", "")), 100)
+
+    def test_detect_error(self):
+        self.mock_detect_langs.side_effect = \
+            pad.plugins.textcat.langdetect.lang_detect_exception.\
+            LangDetectException(0, "No features in text.")
+        self.global_data["ok_languages"] = ["en"]
+        plugin = pad.plugins.textcat.TextCatPlugin(self.mock_ctxt)
+        result = plugin.check_language(self.mock_msg)
+        self.assertEqual(result, False)
+
+    def test_finish_parsing_end(self):
+        mock_init = patch("pad.plugins.textcat.langdetect.detector_factory."
+                          "init_factory").start()
+        patch("pad.plugins.textcat.langdetect.DetectorFactory").start()
+        self.mock_ctxt.get_used_eval_rules.return_value = {"check_language"}
+        plugin = pad.plugins.textcat.TextCatPlugin(self.mock_ctxt)
+        plugin.finish_parsing_end(self.mock_ruleset)
+        mock_init.assert_called_with()
+
+    def test_finish_parsing_end_unused(self):
+        mock_init = patch("pad.plugins.textcat.langdetect.detector_factory."
+                          "init_factory").start()
+        self.mock_ctxt.get_used_eval_rules.return_value = set()
+        plugin = pad.plugins.textcat.TextCatPlugin(self.mock_ctxt)
+        plugin.finish_parsing_end(self.mock_ruleset)
+        self.assertFalse(mock_init.called)
+
     def test_set_list_option(self):
         plugin = pad.plugins.textcat.TextCatPlugin(self.mock_ctxt)
         plugin.set_list_option("my_key", "test1 test2 test3")
@@ -112,10 +155,37 @@ class TestTextCat(unittest.TestCase):
         )
 
 
+class TestGetSample(unittest.TestCase):
+    def test_short(self):
+        self.assertEqual(pad.plugins.textcat.get_sample("test", 10), "test")
+
+    def test_no_limit(self):
+        text = "a" * 100
+        self.assertEqual(pad.plugins.textcat.get_sample(text, 0), text)
+
+    def test_long(self):
+        text = "".join(str(i % 10) for i in range(1000))
+        sample = pad.plugins.textcat.get_sample(text, 100)
+        parts = sample.split(" ")
+        self.assertEqual(len(parts), pad.plugins.textcat.SAMPLE_PARTS)
+        self.assertEqual(len("".join(parts)), 100)
+        self.assertTrue(text.startswith(parts[0]))
+        self.assertTrue(text.endswith(parts[-1]))
+
+    def test_deterministic(self):
+        text = "".join(chr(97 + i % 26) for i in range(1000))
+        self.assertEqual(pad.plugins.textcat.get_sample(text, 100),
+                         pad.plugins.textcat.get_sample(text, 100))
+
+    def test_tiny_size(self):
+        self.assertEqual(pad.plugins.textcat.get_sample("abcdef", 2), "ab")
+
+
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestTextCat, "test"))
+    test_suite.addTest(unittest.makeSuite(TestGetSample, "test"))
     return test_suite
 
 
@@ -1,4 +1,5 @@
 """Tests for pad.plugins.whitelist_subject."""
+import re
 import email
 
 import unittest
@@ -128,6 +129,24 @@ class TestWhitelistSubject(unittest.TestCase):
         plugin.parse_config("whitelist", new_option)
         self.assertEqual(self.options["whitelist_subject"], ('list', ['[a-zA-Z]+']))
 
+    def test_finish_parsing_end_compiles(self):
+        self.options["whitelist_subject"] = ("list", [r"[a-zA-Z]+"])
+        self.options["blacklist_subject"] = ("list", [r"^\d.*"])
+        plugin = pad.plugins.whitelist_subject.WhiteListSubjectPlugin(self.mock_ctxt)
+        plugin.finish_parsing_end(MagicMock())
+        self.assertEqual(self.global_data["whitelist_subject_re"],
+                         [re.compile(r"[a-zA-Z]+")])
+        self.assertEqual(self.global_data["blacklist_subject_re"],
+                         [re.compile(r"^\d.*")])
+
+    def test_check_subject_in_whitelist_compiled(self):
+        self.options["whitelist_subject"] = ("list", [])
+        self.global_data["whitelist_subject_re"] = [re.compile(r"Test")]
+        self.mock_msg.msg = email.message_from_string(
+            MESSAGE.format("Test subject"))
+        plugin = pad.plugins.whitelist_subject.WhiteListSubjectPlugin(self.mock_ctxt)
+        self.assertTrue(plugin.check_subject_in_whitelist(self.mock_msg))
+
 
 def suite():
     """Gather all the tests from this package in a test suite."""
@@ -1288,6 +1288,122 @@ class TestCheckWhitelistRcvd(unittest.TestCase):
 
 
 
+class TestAddressMatcher(unittest.TestCase):
+    def test_exact(self):
+        matcher = pad.plugins.wlbl_eval.AddressMatcher(
+            [r"user\@example\.com", r".*\@example\.net"])
+        self.assertEqual(matcher.exact, {"user@example.com"})
+        self.assertTrue(matcher.match("user@example.com"))
+
+    def test_wildcard(self):
+        matcher = pad.plugins.wlbl_eval.AddressMatcher(
+            [r"user\@example\.com", r".*\@example\.net"])
+        self.assertTrue(matcher.match("other@example.net"))
+        self.assertFalse(matcher.match("other@example.com"))
+
+    def test_search(self):
+        matcher = pad.plugins.wlbl_eval.AddressMatcher([r"user\@example\.com"])
+        self.assertTrue(matcher.match("otheruser@example.com"))
+
+    def test_empty(self):
+        matcher = pad.plugins.wlbl_eval.AddressMatcher([])
+        self.assertFalse(matcher.match("user@example.com"))
+
+    def test_invalid_regex(self):
+        matcher = pad.plugins.wlbl_eval.AddressMatcher(
+            ["(", r".*\@example\.net"])
+        self.assertTrue(matcher.match("user@example.net"))
+        self.assertFalse(matcher.match("user@example.com"))
+
+
+class TestHostMatcher(unittest.TestCase):
+    def test_match(self):
+        matcher = pad.plugins.wlbl_eval.HostMatcher(["example.com",
+                                                     "example.net"])
+        self.assertTrue(matcher.match("example.com"))
+        self.assertTrue(matcher.match("sub.example.net"))
+
+    def test_no_match(self):
+        matcher = pad.plugins.wlbl_eval.HostMatcher(["example.com"])
+        self.assertFalse(matcher.match("example.org"))
+        self.assertFalse(matcher.match("com"))
+
+    def test_empty_domain(self):
+        matcher = pad.plugins.wlbl_eval.HostMatcher([""])
+        self.assertTrue(matcher.match("example.org"))
+
+
+class TestFinishParsing(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.global_data = {}
+        self.msg_data = {}
+        self.mock_ctxt = MagicMock(**{
+            "get_plugin_data.side_effect": lambda p, k: self.global_data[k],
+            "set_plugin_data.side_effect":
+                lambda p, k, v: self.global_data.__setitem__(k, v)}
+        )
+        self.mock_msg = MagicMock(**{
+            "get_plugin_data.side_effect": lambda p, k: self.msg_data[k],
+            "set_plugin_data.side_effect":
+                lambda p, k, v: self.msg_data.__setitem__(k, v),
+        })
+        self.plug = pad.plugins.wlbl_eval.WLBLEvalPlugin(self.mock_ctxt)
+        for name, (dummy, default) in self.plug.options.items():
+            self.global_data[name] = type(default)()
+        self.global_data["whitelist_from"] = ["user@example.com",
+                                              "*@example.net"]
+        self.global_data["whitelist_from_rcvd"] = [
+            "*@example.org example.org"]
+        self.global_data["enlist_uri_host"] = [
+            "(MYLIST) example.com !sub.example.com"]
+        self.plug.finish_parsing_end(MagicMock())
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_address_matchers(self):
+        matcher = self.global_data["address_matchers"][
+            "parsed_whitelist_from"]
+        self.assertTrue(matcher.match("user@example.com"))
+        self.assertTrue(matcher.match("other@example.net"))
+        self.assertFalse(matcher.match("other@example.com"))
+
+    def test_rcvd_matchers(self):
+        matchers = self.global_data["rcvd_matchers"][
+            "parsed_whitelist_from_rcvd"]
+        self.assertEqual(len(matchers), 1)
+        regex, domains = matchers[0]
+        self.assertTrue(regex.search("user@example.org"))
+        self.assertEqual(domains, ["example.org"])
+
+    def test_uri_host_matchers(self):
+        excluded, matcher = self.global_data["uri_host_matchers"]["MYLIST"]
+        self.assertEqual(excluded, {"sub.example.com"})
+        self.assertTrue(matcher.match("www.example.com"))
+
+    def test_check_start_no_parsing(self):
+        patch("pad.plugins.wlbl_eval.WLBLEvalPlugin.parse_list").start()
+        self.plug.check_start(self.mock_msg)
+        self.assertEqual(self.msg_data["from_in_whitelist"], 0)
+        self.plug.parse_list.assert_not_called()
+
+    def test_check_uri_host_listed(self):
+        self.mock_msg.uri_list = ["www.example.com"]
+        self.assertTrue(self.plug.check_uri_host_listed(self.mock_msg,
+                                                        "MYLIST"))
+
+    def test_check_uri_host_listed_excluded(self):
+        self.mock_msg.uri_list = ["sub.example.com"]
+        self.assertFalse(self.plug.check_uri_host_listed(self.mock_msg,
+                                                         "MYLIST"))
+
+    def test_check_uri_host_listed_unknown_list(self):
+        self.mock_msg.uri_list = ["www.example.com"]
+        self.assertFalse(self.plug.check_uri_host_listed(self.mock_msg,
+                                                         "OTHER"))
+
 
 def suite():
     """Gather all the tests from this package in a test suite."""
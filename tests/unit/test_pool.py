@@ -0,0 +1,72 @@
+"""Tests for pad.pool"""
+
+import unittest
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import pad.pool
+
+
+class TestPool(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.mock_getpid = patch("pad.pool.os.getpid",
+                                 return_value=100).start()
+        self.mock_pool = patch("pad.pool.multiprocessing.pool."
+                               "ThreadPool",
+                               side_effect=lambda workers: Mock()).start()
+        patch.dict(pad.pool._pools, clear=True).start()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_get_pool(self):
+        pool = pad.pool.get_pool("test", 4)
+        self.mock_pool.assert_called_with(4)
+        self.assertIs(pad.pool.get_pool("test", 4), pool)
+        self.assertEqual(self.mock_pool.call_count, 1)
+
+    def test_get_pool_by_name(self):
+        pool = pad.pool.get_pool("test", 4)
+        self.assertIsNot(pad.pool.get_pool("other", 4), pool)
+        self.assertFalse(pool.close.called)
+
+    def test_get_pool_workers_changed(self):
+        pool = pad.pool.get_pool("test", 4)
+        self.assertIsNot(pad.pool.get_pool("test", 2), pool)
+        self.mock_pool.assert_called_with(2)
+        pool.close.assert_called_with()
+
+    def test_get_pool_forked(self):
+        pool = pad.pool.get_pool("test", 4)
+        self.mock_getpid.return_value = 101
+        self.assertIsNot(pad.pool.get_pool("test", 4), pool)
+        self.assertFalse(pool.close.called)
+
+    def test_close_pools(self):
+        pool = pad.pool.get_pool("test", 4)
+        pad.pool.close_pools()
+        pool.close.assert_called_with()
+        pool.join.assert_called_with()
+        self.assertIsNot(pad.pool.get_pool("test", 4), pool)
+
+    def test_close_pools_forked(self):
+        pool = pad.pool.get_pool("test", 4)
+        self.mock_getpid.return_value = 101
+        pad.pool.close_pools()
+        self.assertFalse(pool.close.called)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestPool, "test"))
+    return test_suite
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
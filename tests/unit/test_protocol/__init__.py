@@ -13,6 +13,7 @@ def suite():
     import tests.unit.test_protocol.test_noop as test_noop
     import tests.unit.test_protocol.test_check as test_check
     import tests.unit.test_protocol.test_process as test_process
+    import tests.unit.test_protocol.test_stats as test_stats
 
     test_suite = unittest.TestSuite()
     test_suite.addTest(test_tell.suite())
@@ -20,6 +21,7 @@ def suite():
     test_suite.addTest(test_noop.suite())
     test_suite.addTest(test_check.suite())
     test_suite.addTest(test_process.suite())
+    test_suite.addTest(test_stats.suite())
     return test_suite
 
 if __name__ == '__main__':
@@ -0,0 +1,49 @@
+"""Tests for pad.protocol.stats"""
+
+import unittest
+
+try:
+    from unittest.mock import patch, Mock, call
+except ImportError:
+    from mock import patch, Mock, call
+
+import pad
+import pad.stats
+import pad.protocol.stats
+
+
+class TestStatsCommand(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.mockr = Mock()
+        self.mockw = Mock()
+        self.mockserver = Mock()
+        collector = pad.stats.Collector()
+        collector.incr("requests_total", command="CHECK")
+        self.mockserver.stats.collect.return_value = collector.snapshot()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_stats(self):
+        pad.protocol.stats.StatsCommand(self.mockr, self.mockw,
+                                        self.mockserver)
+        result = ("# TYPE pad_requests_total counter\n"
+                  'pad_requests_total{command="CHECK"} 1\n')
+        calls = [
+            call(("SPAMD/%s 0 EX_OK\r\n" % pad.__version__).encode("utf8")),
+            call(("Content-length: %s\r\n\r\n" % len(result)).encode("utf8")),
+            call(result.encode("utf8")),
+        ]
+        self.mockw.write.assert_has_calls(calls)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestStatsCommand, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
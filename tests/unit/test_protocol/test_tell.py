@@ -19,6 +19,7 @@ class TestTellCommand(unittest.TestCase):
         self.mockserver = Mock()
         self.mockrules = Mock()
         self.mockserver.get_user_ruleset.return_value = self.mockrules
+        self.mockserver.get_report_spool.return_value = None
         for klass in ("TellCommand",):
             patch("pad.protocol.tell.%s.get_and_handle" % klass).start()
         self.msg = Mock(score=0)
@@ -144,6 +145,52 @@ class TestTellCommand(unittest.TestCase):
         )
         self.assertEqual(result, expected)
 
+    def test_tell_set_spooled(self):
+        options = {
+            "message-class": "spam",
+            "set": "local,remote",
+            "user": "alex",
+        }
+        spool = self.mockserver.get_report_spool.return_value = Mock()
+        cmd = pad.protocol.tell.TellCommand(self.mockr, self.mockw,
+                                            self.mockserver)
+        result = list(cmd.handle(self.msg, options))
+        spool.put.assert_called_with("report", self.msg.raw_msg, "alex")
+        self.mockserver.start_dispatcher.assert_called_with()
+        self.assertFalse(self.mockrules.ctxt.hook_report.called)
+        self.assertEqual(result, ["DidSet: local,remote\r\n"])
+
+    def test_tell_remove_spooled(self):
+        options = {
+            "message-class": "ham",
+            "remove": "local",
+        }
+        spool = self.mockserver.get_report_spool.return_value = Mock()
+        cmd = pad.protocol.tell.TellCommand(self.mockr, self.mockw,
+                                            self.mockserver)
+        result = list(cmd.handle(self.msg, options))
+        spool.put.assert_called_with("revoke", self.msg.raw_msg, None)
+        self.assertFalse(self.mockrules.ctxt.hook_revoke.called)
+        self.assertEqual(result, ["DidRemove: local\r\n"])
+
+    def test_tell_spool_error(self):
+        """If the job cannot be queued the message is reported
+        right away.
+        """
+        options = {
+            "message-class": "spam",
+            "set": "remote",
+        }
+        spool = self.mockserver.get_report_spool.return_value = Mock()
+        spool.put.return_value = None
+        cmd = pad.protocol.tell.TellCommand(self.mockr, self.mockw,
+                                            self.mockserver)
+        list(cmd.handle(self.msg, options))
+        self.mockrules.ctxt.hook_report.assert_called_with(
+            self.msg, True, False, True
+        )
+        self.assertFalse(self.mockserver.start_dispatcher.called)
+
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
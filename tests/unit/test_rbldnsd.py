@@ -0,0 +1,185 @@
+"""Tests for pad.rbldnsd"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+import pad.rbldnsd
+
+
+class TestZoneBase(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "zone")
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir)
+        patch.stopall()
+
+    def write_zone(self, data):
+        with open(self.path, "w") as zone_file:
+            zone_file.write(data)
+
+    def get_zone(self, dataset_type, data):
+        self.write_zone(data)
+        zone = pad.rbldnsd.Zone("rbl.example.com.")
+        zone.add_dataset(dataset_type, self.path)
+        return zone
+
+
+class TestIP4Dataset(TestZoneBase):
+    def test_address(self):
+        zone = self.get_zone("ip4set", "1.2.3.4\n")
+        self.assertEqual(zone.query("4.3.2.1", "A"), ["127.0.0.2"])
+        self.assertEqual(zone.query("5.3.2.1", "A"), [])
+
+    def test_abbreviated(self):
+        zone = self.get_zone("ip4set", "10.20\n")
+        self.assertEqual(zone.query("4.3.20.10", "A"), ["127.0.0.2"])
+        self.assertEqual(zone.query("4.3.21.10", "A"), [])
+
+    def test_cidr(self):
+        zone = self.get_zone("ip4trie", "10.0.0.0/30\n")
+        self.assertEqual(zone.query("3.0.0.10", "A"), ["127.0.0.2"])
+        self.assertEqual(zone.query("4.0.0.10", "A"), [])
+
+    def test_range(self):
+        zone = self.get_zone("ip4set", "10.0.0.5-10\n")
+        self.assertEqual(zone.query("4.0.0.10", "A"), [])
+        self.assertEqual(zone.query("5.0.0.10", "A"), ["127.0.0.2"])
+        self.assertEqual(zone.query("10.0.0.10", "A"), ["127.0.0.2"])
+        self.assertEqual(zone.query("11.0.0.10", "A"), [])
+
+    def test_exclusion(self):
+        zone = self.get_zone("ip4trie", "10.0.0.0/8\n!10.1.0.0/16\n")
+        self.assertEqual(zone.query("1.0.2.10", "A"), ["127.0.0.2"])
+        self.assertEqual(zone.query("1.0.1.10", "A"), [])
+
+    def test_most_specific(self):
+        zone = self.get_zone("ip4trie", "10.0.0.0/8 :3:\n10.1.0.0/16 :4:\n")
+        self.assertEqual(zone.query("1.0.2.10", "A"), ["127.0.0.3"])
+        self.assertEqual(zone.query("1.0.1.10", "A"), ["127.0.0.4"])
+
+    def test_default_value(self):
+        zone = self.get_zone("ip4set", ":127.0.0.5:Listed $\n1.2.3.4\n")
+        self.assertEqual(zone.query("4.3.2.1", "A"), ["127.0.0.5"])
+        self.assertEqual(zone.query("4.3.2.1", "TXT"), ['"Listed 1.2.3.4"'])
+
+    def test_entry_value(self):
+        zone = self.get_zone("ip4set", "1.2.3.4 :127.0.0.6:Spam source\n")
+        self.assertEqual(zone.query("4.3.2.1", "A"), ["127.0.0.6"])
+        self.assertEqual(zone.query("4.3.2.1", "TXT"), ['"Spam source"'])
+
+    def test_no_txt(self):
+        zone = self.get_zone("ip4set", "1.2.3.4\n")
+        self.assertEqual(zone.query("4.3.2.1", "TXT"), [])
+
+    def test_comments_and_directives(self):
+        zone = self.get_zone("ip4set", "# comment\n; comment\n$TTL 300\n"
+                                       "\n1.2.3.4\n")
+        self.assertEqual(len(zone.datasets[0]), 1)
+
+    def test_invalid_entry(self):
+        zone = self.get_zone("ip4set", "1.2.3.400\n1.2.3.4\n")
+        self.assertEqual(len(zone.datasets[0]), 1)
+        self.assertEqual(zone.query("4.3.2.1", "A"), ["127.0.0.2"])
+
+    def test_invalid_query(self):
+        zone = self.get_zone("ip4set", "1.2.3.4\n")
+        self.assertEqual(zone.query("1.0.0.0.0.0.0.0.0.0.0.0.8.b.d.0.1.0.0."
+                                    "2", "A"), [])
+
+
+class TestDomainDataset(TestZoneBase):
+    def test_exact(self):
+        zone = self.get_zone("dnset", "example.net\n")
+        self.assertEqual(zone.query("example.net", "A"), ["127.0.0.2"])
+        self.assertEqual(zone.query("sub.example.net", "A"), [])
+
+    def test_wildcard(self):
+        zone = self.get_zone("dnset", "*.example.net\n")
+        self.assertEqual(zone.query("example.net", "A"), [])
+        self.assertEqual(zone.query("a.sub.example.net", "A"), ["127.0.0.2"])
+
+    def test_domain_and_subdomains(self):
+        zone = self.get_zone("dnset", ".example.net\n")
+        self.assertEqual(zone.query("example.net", "A"), ["127.0.0.2"])
+        self.assertEqual(zone.query("sub.example.net", "A"), ["127.0.0.2"])
+
+    def test_exclusion(self):
+        zone = self.get_zone("dnset", ".example.net\n!good.example.net\n")
+        self.assertEqual(zone.query("good.example.net", "A"), [])
+        self.assertEqual(zone.query("bad.example.net", "A"), ["127.0.0.2"])
+
+    def test_txt(self):
+        zone = self.get_zone("dnset", "example.net :3:See $\n")
+        self.assertEqual(zone.query("Example.NET", "TXT"),
+                         ['"See example.net"'])
+
+
+class TestZone(TestZoneBase):
+    def test_get_prefix(self):
+        zone = pad.rbldnsd.Zone("rbl.example.com.")
+        self.assertEqual(zone.get_prefix("4.3.2.1.RBL.example.com."),
+                         "4.3.2.1")
+
+    def test_get_prefix_other_zone(self):
+        zone = pad.rbldnsd.Zone("rbl.example.com.")
+        self.assertIsNone(zone.get_prefix("4.3.2.1.example.com"))
+
+    def test_invalid_type(self):
+        zone = pad.rbldnsd.Zone("rbl.example.com")
+        self.assertRaises(ValueError, zone.add_dataset, "combined", self.path)
+
+    def test_multiple_datasets(self):
+        zone = self.get_zone("ip4set", "1.2.3.4 :3:\n")
+        self.write_zone("1.2.3.0/24 :4:\n")
+        zone.add_dataset("ip4trie", self.path)
+        self.assertEqual(zone.query("4.3.2.1", "A"),
+                         ["127.0.0.3", "127.0.0.4"])
+
+    def test_missing_file(self):
+        zone = pad.rbldnsd.Zone("rbl.example.com")
+        zone.add_dataset("ip4set", self.path)
+        self.assertEqual(zone.query("4.3.2.1", "A"), [])
+
+    def test_reload(self):
+        zone = self.get_zone("ip4set", "1.2.3.4\n")
+        self.write_zone("1.2.3.5\n")
+        os.utime(self.path, (1, 1))
+        zone.datasets[0]._last_check = 0
+        zone.check_reload()
+        self.assertEqual(zone.query("4.3.2.1", "A"), [])
+        self.assertEqual(zone.query("5.3.2.1", "A"), ["127.0.0.2"])
+
+    def test_reload_not_modified(self):
+        zone = self.get_zone("ip4set", "1.2.3.4\n")
+        zone.datasets[0]._last_check = 0
+        self.assertFalse(zone.datasets[0].check_reload())
+
+    def test_reload_interval(self):
+        zone = self.get_zone("ip4set", "1.2.3.4\n")
+        self.write_zone("1.2.3.5\n")
+        os.utime(self.path, (1, 1))
+        zone.check_reload()
+        self.assertEqual(zone.query("4.3.2.1", "A"), ["127.0.0.2"])
+
+
+def suite():
+    """Gather all the tests from this module in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestIP4Dataset, "test"))
+    test_suite.addTest(unittest.makeSuite(TestDomainDataset, "test"))
+    test_suite.addTest(unittest.makeSuite(TestZone, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
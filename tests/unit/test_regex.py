@@ -1,6 +1,7 @@
 """Tests for pad.regex"""
 
 import re
+import gc
 import unittest
 
 try:
@@ -17,6 +18,7 @@ class TestPerl2Re(unittest.TestCase):
         self.mock_compile = patch("pad.regex.re.compile").start()
         self.mock_match_pattern = patch("pad.regex.MatchPattern").start()
         self.mock_notmatch_pattern = patch("pad.regex.NotMatchPattern").start()
+        patch("pad.regex._PATTERNS", {}).start()
 
     def tearDown(self):
         unittest.TestCase.tearDown(self)
@@ -55,6 +57,40 @@ class TestPerl2Re(unittest.TestCase):
         pattern = self.mock_compile("test", 0)
         self.assertEqual(result, self.mock_notmatch_pattern(pattern))
 
+    def test_shared_pattern(self):
+        result = pad.regex.perl2re("/test/i")
+        self.assertIs(pad.regex.perl2re("m{test}i"), result)
+        self.assertEqual(self.mock_match_pattern.call_count, 1)
+        self.assertEqual(pad.regex.shared_patterns(), 1)
+
+    def test_shared_pattern_flags(self):
+        pad.regex.perl2re("/test/i")
+        pad.regex.perl2re("/test/")
+        self.assertEqual(self.mock_match_pattern.call_count, 2)
+
+    def test_shared_pattern_match_op(self):
+        pad.regex.perl2re("/test/", "=~")
+        pad.regex.perl2re("/test/", "!~")
+        self.assertEqual(self.mock_match_pattern.call_count, 1)
+        self.assertEqual(self.mock_notmatch_pattern.call_count, 1)
+
+    def test_shared_pattern_converted(self):
+        result = pad.regex.perl2re("/(?i:test)/")
+        self.assertIs(pad.regex.perl2re("/(?:test)/"), result)
+
+
+class TestSharedPatterns(unittest.TestCase):
+    def test_released(self):
+        pad.regex.perl2re("/pad shared pattern test/")
+        gc.collect()
+        self.assertNotIn(("pad shared pattern test", 0, "=~"),
+                         pad.regex._PATTERNS)
+
+    def test_kept(self):
+        pattern = pad.regex.perl2re("/pad shared pattern test/")
+        self.assertIs(pad.regex._PATTERNS[("pad shared pattern test", 0,
+                                           "=~")], pattern)
+
 
 class TestPattern(unittest.TestCase):
     def test_pattern(self):
@@ -81,11 +117,37 @@ class TestPattern(unittest.TestCase):
         result = p.match("test")
         self.assertEqual(result, 1)
 
+    def test_match_same_text_once(self):
+        mock_re = Mock(**{"search.return_value": True})
+        p = pad.regex.MatchPattern(mock_re)
+        text = "test text"
+        p.match(text)
+        result = p.match(text)
+        self.assertEqual(result, 1)
+        mock_re.search.assert_called_once_with(text)
+
+    def test_match_different_text(self):
+        mock_re = Mock(**{"search.return_value": True})
+        p = pad.regex.MatchPattern(mock_re)
+        p.match("test text")
+        mock_re.search.return_value = False
+        result = p.match("other text")
+        self.assertEqual(result, 0)
+        self.assertEqual(mock_re.search.call_count, 2)
+
+    def test_match_none(self):
+        mock_re = Mock(**{"search.return_value": False})
+        p = pad.regex.NotMatchPattern(mock_re)
+        result = p.match(None)
+        self.assertEqual(result, 1)
+        mock_re.search.assert_called_once_with(None)
+
 
 def suite():
     """Gather all the tests from this package in a test suite."""
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestPerl2Re, "test"))
+    test_suite.addTest(unittest.makeSuite(TestSharedPatterns, "test"))
     test_suite.addTest(unittest.makeSuite(TestPattern, "test"))
     return test_suite
 
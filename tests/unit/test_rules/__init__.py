@@ -18,6 +18,7 @@ def suite():
 
     import tests.unit.test_rules.test_parser as test_parser
     import tests.unit.test_rules.test_ruleset as test_ruleset
+    import tests.unit.test_rules.test_compiler as test_compiler
 
     test_suite = unittest.TestSuite()
     test_suite.addTests(test_uri.suite())
@@ -30,6 +31,7 @@ def suite():
 
     test_suite.addTests(test_parser.suite())
     test_suite.addTests(test_ruleset.suite())
+    test_suite.addTests(test_compiler.suite())
     return test_suite
 
 if __name__ == '__main__':
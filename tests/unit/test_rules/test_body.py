@@ -41,6 +41,20 @@ class TestBodyRule(unittest.TestCase):
         mock_perl2re.assert_called_with("/test/")
         self.assertEqual(kwargs, expected)
 
+    def test_shared_pattern(self):
+        mock_re = Mock(**{"search.return_value": True})
+        patch("pad.regex.re.compile", return_value=mock_re).start()
+        patch("pad.regex._PATTERNS", {}).start()
+        rules = [
+            pad.rules.body.BodyRule(
+                name, **pad.rules.body.BodyRule.get_rule_kwargs(
+                    {"value": "/test/i"}))
+            for name in ("TEST1", "TEST2", "TEST3")
+        ]
+        results = [rule.match(self.mock_msg) for rule in rules]
+        self.assertEqual(results, [True, True, True])
+        mock_re.search.assert_called_once_with(self.mock_msg.text)
+
 
 class TestRawBodyRule(unittest.TestCase):
     def setUp(self):
@@ -0,0 +1,209 @@
+"""Tests for pad.rules.compiler"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import collections
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import pad.errors
+import pad.rules.body
+import pad.rules.full
+import pad.rules.meta
+import pad.rules.compiler
+
+
+class TestCompileMatch(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.rules = {}
+        self.ruleset = Mock(checked=collections.OrderedDict())
+        self.ruleset.get_rule.side_effect = self.rules.__getitem__
+        self.mock_msg = Mock(rules_checked={}, score=0, text="body text",
+                             raw_text="raw text", raw_msg="raw message")
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def add_rule(self, rule, checked=True):
+        self.rules[rule.name] = rule
+        if checked:
+            self.ruleset.checked[rule.name] = rule
+        return rule
+
+    def add_mock_rule(self, name, checked=True, **kwargs):
+        rule = Mock(score=1.0, **kwargs)
+        rule.name = name
+        return self.add_rule(rule, checked)
+
+    def add_pattern_rule(self, cls, name, result=1, score=None):
+        pattern = Mock(**{"match.return_value": result})
+        self.add_rule(cls(name, pattern, score=score))
+        return pattern
+
+    def match(self):
+        match = pad.rules.compiler.compile_match(self.ruleset)
+        match(self.mock_msg)
+        return self.mock_msg.rules_checked
+
+    def test_body(self):
+        pattern = self.add_pattern_rule(pad.rules.body.BodyRule, "TEST")
+        self.assertEqual(self.match(), {"TEST": True})
+        pattern.match.assert_called_once_with("body text")
+
+    def test_raw_body(self):
+        pattern = self.add_pattern_rule(pad.rules.body.RawBodyRule, "TEST")
+        self.assertEqual(self.match(), {"TEST": True})
+        pattern.match.assert_called_once_with("raw text")
+
+    def test_full(self):
+        pattern = self.add_pattern_rule(pad.rules.full.FullRule, "TEST")
+        self.assertEqual(self.match(), {"TEST": True})
+        pattern.match.assert_called_once_with("raw message")
+
+    def test_not_matched(self):
+        self.add_pattern_rule(pad.rules.body.BodyRule, "TEST", result=0)
+        self.assertEqual(self.match(), {"TEST": False})
+        self.assertEqual(self.mock_msg.score, 0)
+
+    def test_score(self):
+        self.add_pattern_rule(pad.rules.body.BodyRule, "TEST1", score=[1.5])
+        self.add_pattern_rule(pad.rules.body.BodyRule, "TEST2", score=[2.0])
+        self.add_pattern_rule(pad.rules.body.BodyRule, "TEST3", result=0)
+        self.match()
+        self.assertEqual(self.mock_msg.score, 3.5)
+
+    def test_order(self):
+        for name in ("TEST3", "TEST1", "TEST2"):
+            self.add_pattern_rule(pad.rules.body.BodyRule, name)
+        self.mock_msg.rules_checked = collections.OrderedDict()
+        self.assertEqual(list(self.match()), ["TEST3", "TEST1", "TEST2"])
+
+    def test_other_rule(self):
+        rule = self.add_mock_rule("TEST", **{"match.return_value": 3})
+        self.assertEqual(self.match(), {"TEST": 3})
+        rule.match.assert_called_once_with(self.mock_msg)
+
+    def test_meta(self):
+        pattern = self.add_pattern_rule(pad.rules.body.BodyRule, "TEST1")
+        self.add_pattern_rule(pad.rules.full.FullRule, "TEST2", result=0)
+        self.add_rule(pad.rules.meta.MetaRule("TEST_META",
+                                              "TEST1 && !TEST2"))
+        self.assertEqual(self.match()["TEST_META"], True)
+        self.assertEqual(pattern.match.call_count, 1)
+
+    def test_meta_arithmetic(self):
+        self.add_pattern_rule(pad.rules.body.BodyRule, "TEST1")
+        self.add_pattern_rule(pad.rules.full.FullRule, "TEST2")
+        self.add_rule(pad.rules.meta.MetaRule("TEST_META",
+                                              "(TEST1 + TEST2) > 1"))
+        self.assertEqual(self.match()["TEST_META"], True)
+
+    def test_meta_not_checked(self):
+        rule = self.add_mock_rule("__TEST", checked=False,
+                                  **{"match.return_value": False})
+        self.add_rule(pad.rules.meta.MetaRule("TEST_META",
+                                              "!__TEST || __TEST"))
+        self.assertEqual(self.match(), {"TEST_META": True})
+        rule.match.assert_called_with(self.mock_msg)
+        source, bound = pad.rules.compiler.generate_source(self.ruleset)
+        self.assertEqual(bound, [rule.match])
+
+    def test_meta_checked_later(self):
+        self.add_rule(pad.rules.meta.MetaRule("TEST_META", "TEST"))
+        pattern = self.add_pattern_rule(pad.rules.body.BodyRule, "TEST")
+        self.assertEqual(self.match(), {"TEST_META": True, "TEST": True})
+        self.assertEqual(pattern.match.call_count, 2)
+
+    def test_stop_processing(self):
+        self.add_pattern_rule(pad.rules.body.BodyRule, "TEST1")
+        self.add_mock_rule("TEST2", **{
+            "match.side_effect": pad.errors.StopProcessing()})
+        self.add_pattern_rule(pad.rules.body.BodyRule, "TEST3")
+        self.assertRaises(pad.errors.StopProcessing, self.match)
+        self.assertEqual(self.mock_msg.rules_checked, {"TEST1": True})
+        self.assertEqual(self.mock_msg.score, 1.0)
+
+    def test_no_rules(self):
+        self.assertEqual(self.match(), {})
+
+    def test_compile_error(self):
+        patch("pad.rules.compiler.generate_source",
+              return_value=("def make_match(:\n", [])).start()
+        result = pad.rules.compiler.compile_match(self.ruleset)
+        self.assertIsNone(result)
+        self.assertTrue(self.ruleset.ctxt.log.error.called)
+
+
+class TestCompileCache(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.tmpdir = tempfile.mkdtemp()
+        self.ruleset = Mock(checked=collections.OrderedDict())
+        pattern = Mock(**{"match.return_value": 1})
+        self.ruleset.checked["TEST"] = pad.rules.body.BodyRule("TEST",
+                                                               pattern)
+        self.mock_msg = Mock(rules_checked={}, score=0, text="body text")
+        source, dummy = pad.rules.compiler.generate_source(self.ruleset)
+        self.source = source
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+        shutil.rmtree(self.tmpdir)
+
+    def get_files(self):
+        return sorted(os.listdir(self.tmpdir))
+
+    def test_write(self):
+        pad.rules.compiler.compile_match(self.ruleset, self.tmpdir)
+        files = self.get_files()
+        self.assertEqual(len(files), 2)
+        code_file, source_file = files
+        self.assertTrue(code_file.endswith(
+            ".%s.code" % pad.rules.compiler.CACHE_TAG))
+        with open(os.path.join(self.tmpdir, source_file)) as sourcef:
+            self.assertEqual(sourcef.read(), self.source)
+
+    def test_load(self):
+        pad.rules.compiler.compile_match(self.ruleset, self.tmpdir)
+        mock_compile = patch("pad.rules.compiler.compile",
+                             create=True).start()
+        match = pad.rules.compiler.compile_match(self.ruleset, self.tmpdir)
+        self.assertFalse(mock_compile.called)
+        match(self.mock_msg)
+        self.assertEqual(self.mock_msg.rules_checked, {"TEST": True})
+
+    def test_load_invalid(self):
+        pad.rules.compiler.compile_match(self.ruleset, self.tmpdir)
+        code_file = self.get_files()[0]
+        with open(os.path.join(self.tmpdir, code_file), "wb") as codef:
+            codef.write(b"invalid")
+        match = pad.rules.compiler.compile_match(self.ruleset, self.tmpdir)
+        self.assertTrue(self.ruleset.ctxt.log.warning.called)
+        match(self.mock_msg)
+        self.assertEqual(self.mock_msg.rules_checked, {"TEST": True})
+
+    def test_write_error(self):
+        path = os.path.join(self.tmpdir, "missing")
+        match = pad.rules.compiler.compile_match(self.ruleset, path)
+        self.assertTrue(self.ruleset.ctxt.log.warning.called)
+        match(self.mock_msg)
+        self.assertEqual(self.mock_msg.rules_checked, {"TEST": True})
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestCompileMatch, "test"))
+    test_suite.addTest(unittest.makeSuite(TestCompileCache, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -16,7 +16,10 @@ class TestEvalRule(unittest.TestCase):
         unittest.TestCase.setUp(self)
         self.mock_msg = Mock()
         self.eval_rules = {}
-        self.mock_ruleset = Mock(**{"ctxt.eval_rules": self.eval_rules})
+        self.eval_rule_args = {}
+        self.mock_ruleset = Mock(**{"ctxt.eval_rules": self.eval_rules,
+                                    "ctxt.eval_rule_args":
+                                        self.eval_rule_args})
 
     def tearDown(self):
         unittest.TestCase.tearDown(self)
@@ -73,6 +76,58 @@ class TestEvalRule(unittest.TestCase):
         rule.match(self.mock_msg)
         mock_eval.assert_called_with(self.mock_msg, 1, '2', target="body")
 
+    def test_preprocess_convert_args(self):
+        mock_eval = Mock()
+        self.eval_rules["test_rule"] = mock_eval
+        self.eval_rule_args["test_rule"] = (None, int)
+        rule = pad.rules.eval_.EvalRule("TEST", "test_rule('1', '2')")
+        rule.preprocess(self.mock_ruleset)
+
+        rule.match(self.mock_msg)
+        mock_eval.assert_called_with(self.mock_msg, '1', 2, target=None)
+        self.assertEqual(rule.eval_args, ('1', '2'))
+
+    def test_preprocess_convert_missing_args(self):
+        mock_eval = Mock()
+        self.eval_rules["test_rule"] = mock_eval
+        self.eval_rule_args["test_rule"] = (int, int)
+        rule = pad.rules.eval_.EvalRule("TEST", "test_rule('1')")
+        rule.preprocess(self.mock_ruleset)
+
+        rule.match(self.mock_msg)
+        mock_eval.assert_called_with(self.mock_msg, 1, target=None)
+
+    def test_preprocess_convert_regex(self):
+        mock_eval = Mock()
+        self.eval_rules["test_rule"] = mock_eval
+        self.eval_rule_args["test_rule"] = (pad.rules.eval_.regex_arg,)
+        rule = pad.rules.eval_.EvalRule("TEST", r"test_rule('^a\d')")
+        rule.preprocess(self.mock_ruleset)
+
+        rule.match(self.mock_msg)
+        regex = mock_eval.call_args[0][1]
+        self.assertTrue(regex.match("a1"))
+
+    def test_preprocess_convert_invalid(self):
+        self.eval_rules["test_rule"] = Mock()
+        self.eval_rule_args["test_rule"] = (pad.rules.eval_.regex_arg,)
+        rule = pad.rules.eval_.EvalRule("TEST", "test_rule('(')")
+        self.assertRaises(pad.errors.InvalidRule,
+                          rule.preprocess, self.mock_ruleset)
+
+    def test_regex_arg_compiled(self):
+        regex = pad.rules.eval_.regex_arg("a")
+        self.assertIs(pad.rules.eval_.regex_arg(regex), regex)
+
+    def test_perl_regex_arg(self):
+        regex = pad.rules.eval_.perl_regex_arg("/^test/i")
+        self.assertTrue(regex.match("TEST.pdf"))
+        self.assertIs(pad.rules.eval_.perl_regex_arg(regex), regex)
+
+    def test_perl_regex_arg_invalid(self):
+        self.assertRaises(pad.errors.InvalidRegex,
+                          pad.rules.eval_.perl_regex_arg, "test")
+
     def test_preprocess_missing_rule(self):
         rule = pad.rules.eval_.EvalRule("TEST", "test_rule(1, '2')")
         self.assertRaises(pad.errors.InvalidRule,
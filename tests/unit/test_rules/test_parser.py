@@ -428,6 +428,35 @@ class TestParsePADLine(unittest.TestCase):
         self.check_parse(rules, expected)
 
 
+class TestTokenize(unittest.TestCase):
+    def test_tokenize_line(self):
+        self.assertEqual(pad.rules.parser.tokenize_line(
+            b" body TEST_RULE /test/ # comment\n"),
+            ("body TEST_RULE /test/", "body", "TEST_RULE /test/"))
+
+    def test_tokenize_line_single_word(self):
+        self.assertEqual(pad.rules.parser.tokenize_line(b"test_option"),
+                         ("test_option", "test_option", ""))
+
+    def test_tokenize_line_skip(self):
+        for line in (b"", b"  ", b"# comment", b"require_version 3.004"):
+            self.assertIsNone(pad.rules.parser.tokenize_line(line))
+
+    def test_tokenize_line_conditional(self):
+        for line, rtype in ((b"if can(Mail::SpamAssassin::Conf)", "if can"),
+                            (b"else", "else"), (b"endif # comment", "endif")):
+            self.assertEqual(pad.rules.parser.tokenize_line(line)[1], rtype)
+
+    def test_tokenize_line_decoding_error(self):
+        line = Mock(**{"decode.side_effect":
+                       UnicodeDecodeError("iso-8859-1", b"", 0, 1, "test")})
+        result = pad.rules.parser.tokenize_line(line)
+        self.assertEqual(result[:2], (line, None))
+
+    def test_tokenize_file_missing(self):
+        self.assertIsNone(pad.rules.parser.tokenize_file("/missing/file.cf"))
+
+
 class TestParsePADRules(unittest.TestCase):
     def setUp(self):
         unittest.TestCase.setUp(self)
@@ -458,6 +487,7 @@ def suite():
     test_suite = unittest.TestSuite()
     test_suite.addTest(unittest.makeSuite(TestParseGetRuleset, "test"))
     test_suite.addTest(unittest.makeSuite(TestParsePADLine, "test"))
+    test_suite.addTest(unittest.makeSuite(TestTokenize, "test"))
     test_suite.addTest(unittest.makeSuite(TestParsePADRules, "test"))
     return test_suite
 
@@ -24,6 +24,8 @@ class TestRuleSet(unittest.TestCase):
             "report_safe": 1,
             "dns_query_restriction": [],
             "dns_options": "",
+            "compile_match": False,
+            "compile_match_path": "",
         })
 
     def tearDown(self):
@@ -60,6 +62,47 @@ class TestRuleSet(unittest.TestCase):
         ruleset.match(mock_msg)
         self.assertEqual(mock_msg.score, 0)
 
+    def test_match_compiled(self):
+        mock_msg = MagicMock(rules_checked={}, score=0)
+        mock_rule = MagicMock()
+        self.mock_ctxt.log.isEnabledFor.return_value = False
+        ruleset = pad.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = {"TEST_RULE": mock_rule}
+        ruleset.compiled_match = Mock()
+
+        ruleset.match(mock_msg)
+        ruleset.compiled_match.assert_called_with(mock_msg)
+        self.assertFalse(mock_rule.match.called)
+        self.mock_ctxt.hook_check_end.assert_called_with(ruleset, mock_msg)
+
+    def test_match_start_hook(self):
+        mock_msg = MagicMock(rules_checked={}, score=0)
+        ruleset = pad.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.match(mock_msg)
+        self.mock_ctxt.hook_match_start.assert_called_with(ruleset, mock_msg)
+
+    def test_match_compiled_stop(self):
+        mock_msg = MagicMock(rules_checked={}, score=0)
+        self.mock_ctxt.log.isEnabledFor.return_value = False
+        ruleset = pad.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.compiled_match = Mock(
+            side_effect=pad.errors.StopProcessing())
+
+        ruleset.match(mock_msg)
+        self.mock_ctxt.hook_check_end.assert_called_with(ruleset, mock_msg)
+
+    def test_match_compiled_debug(self):
+        mock_msg = MagicMock(rules_checked={}, score=0)
+        mock_rule = MagicMock()
+        self.mock_ctxt.log.isEnabledFor.return_value = True
+        ruleset = pad.rules.ruleset.RuleSet(self.mock_ctxt)
+        ruleset.checked = {"TEST_RULE": mock_rule}
+        ruleset.compiled_match = Mock()
+
+        ruleset.match(mock_msg)
+        self.assertFalse(ruleset.compiled_match.called)
+        mock_rule.match.assert_called_with(mock_msg)
+
     def test_get_rule(self):
         mock_rule = Mock()
         ruleset = pad.rules.ruleset.RuleSet(self.mock_ctxt)
@@ -123,6 +166,18 @@ class TestRuleSet(unittest.TestCase):
 
         ruleset.post_parsing()
         mock_rule.postparsing.assert_called_with(ruleset)
+        self.assertIsNone(ruleset.compiled_match)
+
+    def test_post_parsing_compile_match(self):
+        mock_compile = patch("pad.rules.ruleset.pad.rules.compiler."
+                             "compile_match").start()
+        self.mock_ctxt.conf["compile_match"] = True
+        self.mock_ctxt.conf["compile_match_path"] = "/var/cache/pad"
+        ruleset = pad.rules.ruleset.RuleSet(self.mock_ctxt)
+
+        ruleset.post_parsing()
+        mock_compile.assert_called_with(ruleset, "/var/cache/pad")
+        self.assertEqual(ruleset.compiled_match, mock_compile.return_value)
 
     def test_post_parsing_invalid_rule(self):
         mock_rule = Mock(**{"postparsing.side_effect":
@@ -1,5 +1,6 @@
 """Unittest for scripts.padd"""
 
+import os
 import signal
 import logging
 import unittest
@@ -33,7 +34,11 @@ class TestServer(unittest.TestCase):
                                 "pad.rules.parser.parse_pad_rules").start()
         self.mainset = self.mock_rules.return_value.get_ruleset.return_value
         self.conf = {
-            "allow_user_rules": False
+            "allow_user_rules": False,
+            "report_spool_path": "",
+            "report_spool_batch_size": 50,
+            "report_spool_max_attempts": 5,
+            "report_spool_retry_delay": 30.0,
         }
         self.mainset.conf = self.conf
 
@@ -118,6 +123,245 @@ class TestServer(unittest.TestCase):
         result = server.get_user_ruleset(user="alex")
         self.assertEqual(result, cached_result)
 
+    def test_load_config_finish(self):
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        user_ruleset = Mock()
+        server._user_rulesets["alex"] = user_ruleset
+        server.load_config()
+        self.mainset.ctxt.hook_finish.assert_called_with()
+        user_ruleset.ctxt.hook_finish.assert_called_with()
+        self.assertEqual(server._user_rulesets, {})
+
+    def test_load_config_timing(self):
+        mock_observe = patch("pad.server.pad.stats.observe").start()
+        pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                          "/etc/spamassassin/")
+        self.assertEqual(mock_observe.call_args[0][0],
+                         "ruleset_load_seconds")
+
+    def test_load_config_shared_patterns(self):
+        mock_gauge = patch("pad.server.pad.stats.set_gauge").start()
+        patch("pad.server.pad.regex.shared_patterns",
+              return_value=10).start()
+        pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                          "/etc/spamassassin/")
+        mock_gauge.assert_any_call("ruleset_patterns", 10)
+
+    def test_shutdown_finish(self):
+        mock_shutdown = patch.object(pad.server.Server.__mro__[1],
+                                     "shutdown").start()
+        mock_close_pools = patch("pad.server.pad.pool.close_pools").start()
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        server.shutdown()
+        self.mainset.ctxt.hook_finish.assert_called_with()
+        mock_shutdown.assert_called_with()
+        mock_close_pools.assert_called_with()
+
+    def test_shutdown_finish_error(self):
+        mock_shutdown = patch.object(pad.server.Server.__mro__[1],
+                                     "shutdown").start()
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        self.mainset.ctxt.hook_finish.side_effect = ValueError()
+        server.shutdown()
+        mock_shutdown.assert_called_with()
+
+    def test_no_report_spool(self):
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        self.assertIsNone(server.get_report_spool())
+        self.assertIsNone(server.start_dispatcher())
+
+    def test_report_spool(self):
+        mock_spool = patch("pad.server.pad.spool.ReportSpool").start()
+        self.conf["report_spool_path"] = "/tmp/pad-spool.db"
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        mock_spool.assert_called_with("/tmp/pad-spool.db")
+        self.assertEqual(server.get_report_spool(), mock_spool.return_value)
+
+    def test_start_dispatcher(self):
+        patch("pad.server.pad.spool.ReportSpool").start()
+        mock_dispatcher = patch("pad.server.pad.spool."
+                                "ReportDispatcher").start()
+        mock_dispatcher.return_value.pid = os.getpid()
+        self.conf["report_spool_path"] = "/tmp/pad-spool.db"
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        server.service_actions()
+        server.service_actions()
+        self.assertEqual(mock_dispatcher.call_count, 1)
+        mock_dispatcher.return_value.start.assert_called_once_with()
+
+    def test_start_dispatcher_after_fork(self):
+        patch("pad.server.pad.spool.ReportSpool").start()
+        mock_dispatcher = patch("pad.server.pad.spool."
+                                "ReportDispatcher").start()
+        mock_dispatcher.return_value.pid = os.getpid() + 1
+        self.conf["report_spool_path"] = "/tmp/pad-spool.db"
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        server.start_dispatcher()
+        server.start_dispatcher()
+        self.assertEqual(mock_dispatcher.call_count, 2)
+
+    def test_reload_stops_dispatcher(self):
+        patch("pad.server.pad.spool.ReportSpool").start()
+        mock_dispatcher = patch("pad.server.pad.spool."
+                                "ReportDispatcher").start()
+        mock_dispatcher.return_value.pid = os.getpid()
+        self.conf["report_spool_path"] = "/tmp/pad-spool.db"
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        server.start_dispatcher()
+        server.load_config()
+        mock_dispatcher.return_value.stop.assert_called_with(10.0)
+        self.assertIsNone(server._dispatcher)
+
+    def test_shutdown_stops_dispatcher(self):
+        patch.object(pad.server.Server.__mro__[1], "shutdown").start()
+        patch("pad.server.pad.spool.ReportSpool").start()
+        mock_dispatcher = patch("pad.server.pad.spool."
+                                "ReportDispatcher").start()
+        mock_dispatcher.return_value.pid = os.getpid()
+        self.conf["report_spool_path"] = "/tmp/pad-spool.db"
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        server.start_dispatcher()
+        server.shutdown()
+        mock_dispatcher.return_value.stop.assert_called_with(10.0)
+
+    def test_worker_started_dispatcher(self):
+        patch("pad.server.pad.spool.ReportSpool").start()
+        mock_dispatcher = patch("pad.server.pad.spool."
+                                "ReportDispatcher").start()
+        mock_dispatcher.return_value.pid = os.getpid()
+        self.conf["report_spool_path"] = "/tmp/pad-spool.db"
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        self.assertFalse(mock_dispatcher.called)
+        server.worker_started()
+        mock_dispatcher.return_value.start.assert_called_once_with()
+
+    def test_worker_reload_restarts_dispatcher(self):
+        patch("pad.server.pad.spool.ReportSpool").start()
+        mock_dispatcher = patch("pad.server.pad.spool."
+                                "ReportDispatcher").start()
+        mock_dispatcher.return_value.pid = os.getpid()
+        self.conf["report_spool_path"] = "/tmp/pad-spool.db"
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        server.worker_started()
+        server.load_config()
+        mock_dispatcher.return_value.stop.assert_called_with(10.0)
+        self.assertEqual(mock_dispatcher.return_value.start.call_count, 2)
+        self.assertEqual(server._dispatcher, mock_dispatcher.return_value)
+
+    def test_serve_forever(self):
+        mock_serve = patch.object(pad.server.Server.__mro__[1],
+                                  "serve_forever").start()
+        mock_started = patch("pad.server.Server.worker_started").start()
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        server.serve_forever()
+        mock_started.assert_called_with()
+        mock_serve.assert_called_with(poll_interval=0.5)
+
+    def test_worker_started_keeps_stats(self):
+        mock_collector = patch("pad.server.pad.stats.get_collector").start()
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        server.worker_started()
+        self.assertFalse(mock_collector.return_value.clear.called)
+
+    def test_worker_started_clears_stats(self):
+        mock_collector = patch("pad.server.pad.stats.get_collector").start()
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        patch("pad.server.os.getpid",
+              return_value=server._parent_pid + 1).start()
+        server.worker_started()
+        mock_collector.return_value.clear.assert_called_with(gauges=False)
+
+    def test_process_request_worker_started(self):
+        mock_process = patch.object(pad.server.Server.__mro__[1],
+                                    "process_request", create=True).start()
+        mock_started = patch("pad.server.Server.worker_started").start()
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        server.process_request("request", "address")
+        mock_started.assert_called_once_with()
+        mock_process.assert_called_with("request", "address")
+
+    def test_process_request_worker_already_started(self):
+        patch.object(pad.server.Server.__mro__[1], "process_request",
+                     create=True).start()
+        server = pad.server.Server(("0.0.0.0", 783), "/dev/null",
+                                   "/etc/spamassassin/")
+        server.worker_started()
+        mock_started = patch("pad.server.Server.worker_started").start()
+        server.process_request("request", "address")
+        server.service_actions()
+        self.assertFalse(mock_started.called)
+
+
+class TestPreForkServer(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("pad-logger").handlers = [logging.NullHandler()]
+        patch("pad.server.pad.config.get_config_files").start()
+        patch("pad.server.Server.server_bind").start()
+        patch("pad.server.Server.server_activate").start()
+        mock_rules = patch("pad.server."
+                           "pad.rules.parser.parse_pad_rules").start()
+        mainset = mock_rules.return_value.get_ruleset.return_value
+        mainset.conf = {"report_spool_path": ""}
+        self.mock_fork = patch("pad.server.os.fork").start()
+        self.mock_exit = patch("pad.server.os._exit").start()
+        self.mock_wait = patch("pad.server.os.waitpid").start()
+        self.mock_serve = patch.object(pad.server.spoon.server._TCPServer,
+                                       "serve_forever", create=True).start()
+        self.mock_started = patch("pad.server.PreForkServer."
+                                  "worker_started").start()
+        self.server = pad.server.PreForkServer(("127.0.0.1", 0), "/dev/null",
+                                               "/etc/spamassassin/")
+        self.server.prefork = 2
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.server.socket.close()
+        patch.stopall()
+
+    def test_children(self):
+        self.mock_fork.return_value = 0
+        self.server.serve_forever()
+        self.mock_serve.assert_called_with(poll_interval=0.5)
+        self.assertEqual(self.mock_serve.call_count, 2)
+        self.mock_exit.assert_called_with(0)
+
+    def test_children_worker_started(self):
+        self.mock_fork.return_value = 0
+        self.mock_serve.side_effect = lambda poll_interval: (
+            self.server.service_actions())
+        with patch("pad.server.os.getpid",
+                   return_value=self.server._parent_pid + 1):
+            self.server.serve_forever()
+        self.assertEqual(self.mock_started.call_count, 2)
+
+    def test_parent(self):
+        self.mock_fork.side_effect = [100, 101]
+        self.server.serve_forever()
+        self.assertEqual(self.server.pids, [100, 101])
+        self.mock_wait.assert_has_calls([call(100, 0), call(101, 0)])
+        self.assertFalse(self.mock_started.called)
+        self.assertFalse(self.mock_serve.called)
+
+    def test_shared_stats(self):
+        self.mock_fork.return_value = 100
+        self.server.serve_forever()
+        self.assertEqual(self.server.stats.shared.workers, 3)
 
 
 def suite():
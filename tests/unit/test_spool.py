@@ -0,0 +1,251 @@
+"""Tests for pad.spool"""
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+import collections
+
+try:
+    from unittest.mock import patch, Mock, MagicMock
+except ImportError:
+    from mock import patch, Mock, MagicMock
+
+import pad.stats
+import pad.spool
+import pad.errors
+
+
+class TestReportSpool(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("pad-logger").handlers = [logging.NullHandler()]
+        pad.stats.get_collector().clear()
+        self.tmpdir = tempfile.mkdtemp()
+        self.mock_time = patch("pad.spool.time.time",
+                               return_value=1000).start()
+        self.spool = pad.spool.ReportSpool(
+            os.path.join(self.tmpdir, "spool.db"))
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        pad.stats.get_collector().clear()
+        shutil.rmtree(self.tmpdir)
+        patch.stopall()
+
+    def test_put_claim(self):
+        self.spool.put("report", "Subject: test\n\nBody", "alex")
+        jobs = self.spool.claim(10)
+        self.assertEqual(jobs, [pad.spool.Job(1, "report", "alex",
+                                              "Subject: test\n\nBody",
+                                              1000, 0, None)])
+
+    def test_put_invalid_action(self):
+        self.assertRaises(ValueError, self.spool.put, "learn", "")
+
+    def test_put_error(self):
+        spool = pad.spool.ReportSpool(
+            os.path.join(self.tmpdir, "missing", "spool.db"))
+        self.assertIsNone(spool.put("report", ""))
+
+    def test_len(self):
+        self.spool.put("report", "")
+        self.spool.put("revoke", "")
+        self.assertEqual(len(self.spool), 2)
+
+    def test_claim_batch_size(self):
+        for dummy in range(3):
+            self.spool.put("report", "")
+        self.assertEqual([job.id for job in self.spool.claim(2)], [1, 2])
+        self.assertEqual([job.id for job in self.spool.claim(2)], [3])
+
+    def test_claimed(self):
+        self.spool.put("report", "")
+        self.spool.claim(10)
+        self.assertEqual(self.spool.claim(10), [])
+
+    def test_claim_expired_lease(self):
+        self.spool.put("report", "")
+        self.spool.claim(10, lease=60)
+        self.mock_time.return_value = 1060
+        self.assertEqual(len(self.spool.claim(10)), 1)
+
+    def test_claim_shared(self):
+        self.spool.put("report", "")
+        other = pad.spool.ReportSpool(self.spool.path)
+        self.assertEqual(len(other.claim(10)), 1)
+        self.assertEqual(self.spool.claim(10), [])
+
+    def test_complete(self):
+        self.spool.put("report", "")
+        self.spool.put("report", "")
+        self.spool.complete([1])
+        self.assertEqual(len(self.spool), 1)
+
+    def test_retry(self):
+        self.spool.put("report", "")
+        self.spool.claim(10)
+        self.spool.retry(1, {"PyzorPlugin"}, 30)
+        self.assertEqual(self.spool.claim(10), [])
+        self.mock_time.return_value = 1030
+        job, = self.spool.claim(10)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.pending, ["PyzorPlugin"])
+
+    def test_stats(self):
+        self.spool.put("report", "")
+        counters = pad.stats.get_collector().counters
+        self.assertEqual(counters[("report_jobs_queued_total",
+                                   (("action", "report"),))], 1)
+
+
+class TestReportDispatcher(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        logging.getLogger("pad-logger").handlers = [logging.NullHandler()]
+        pad.stats.get_collector().clear()
+        self.mock_msg = patch("pad.spool.pad.message.Message").start()
+        patch("pad.spool.time.time", return_value=1000).start()
+        self.spool = Mock()
+        self.spool.__len__ = Mock(return_value=0)
+        self.ruleset = MagicMock()
+        self.plugins = collections.OrderedDict()
+        self.ruleset.ctxt.plugins = self.plugins
+        self.get_ruleset = Mock(return_value=self.ruleset)
+        self.dispatcher = pad.spool.ReportDispatcher(
+            self.spool, self.get_ruleset, batch_size=10, max_attempts=3,
+            retry_delay=30)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        pad.stats.get_collector().clear()
+        patch.stopall()
+
+    def add_plugin(self, name):
+        self.plugins[name] = Mock()
+        return self.plugins[name]
+
+    def get_job(self, job_id, action="report", user=None, attempts=0,
+                pending=None):
+        return pad.spool.Job(job_id, action, user, "message %s" % job_id,
+                             990, attempts, pending)
+
+    def test_dispatch(self):
+        plugin = self.add_plugin("PyzorPlugin")
+        self.spool.claim.return_value = [self.get_job(1), self.get_job(2)]
+        self.assertEqual(self.dispatcher.dispatch_batch(), 2)
+        self.assertEqual(plugin.plugin_report.call_count, 2)
+        plugin.plugin_report.assert_called_with(self.mock_msg.return_value)
+        self.mock_msg.assert_called_with(self.ruleset.ctxt, "message 2")
+        self.spool.complete.assert_called_with([1, 2])
+
+    def test_dispatch_revoke(self):
+        plugin = self.add_plugin("PyzorPlugin")
+        self.spool.claim.return_value = [self.get_job(1, "revoke")]
+        self.dispatcher.dispatch_batch()
+        plugin.plugin_revoke.assert_called_with(self.mock_msg.return_value)
+        self.assertFalse(plugin.plugin_report.called)
+
+    def test_dispatch_user_ruleset(self):
+        self.spool.claim.return_value = [self.get_job(1, user="alex")]
+        self.dispatcher.dispatch_batch()
+        self.get_ruleset.assert_called_with("alex")
+
+    def test_dispatch_pending(self):
+        pyzor = self.add_plugin("PyzorPlugin")
+        razor = self.add_plugin("Razor2Plugin")
+        self.spool.claim.return_value = [
+            self.get_job(1, attempts=1, pending=["Razor2Plugin"])]
+        self.dispatcher.dispatch_batch()
+        self.assertFalse(pyzor.plugin_report.called)
+        self.assertTrue(razor.plugin_report.called)
+
+    def test_dispatch_error_retry(self):
+        pyzor = self.add_plugin("PyzorPlugin")
+        razor = self.add_plugin("Razor2Plugin")
+        pyzor.plugin_report.side_effect = IOError()
+        self.spool.claim.return_value = [self.get_job(1), self.get_job(2)]
+        self.dispatcher.dispatch_batch()
+        # The rest of the batch is not sent to the failing plugin.
+        self.assertEqual(pyzor.plugin_report.call_count, 1)
+        self.assertEqual(razor.plugin_report.call_count, 2)
+        self.spool.retry.assert_any_call(1, {"PyzorPlugin"}, 30)
+        self.spool.retry.assert_any_call(2, {"PyzorPlugin"}, 30)
+        self.spool.complete.assert_called_with([])
+
+    def test_dispatch_error_backoff(self):
+        pyzor = self.add_plugin("PyzorPlugin")
+        pyzor.plugin_report.side_effect = IOError()
+        self.spool.claim.return_value = [self.get_job(1, attempts=1)]
+        self.dispatcher.dispatch_batch()
+        self.spool.retry.assert_called_with(1, {"PyzorPlugin"}, 60)
+
+    def test_dispatch_error_max_attempts(self):
+        pyzor = self.add_plugin("PyzorPlugin")
+        pyzor.plugin_report.side_effect = IOError()
+        self.spool.claim.return_value = [self.get_job(1, attempts=2)]
+        self.dispatcher.dispatch_batch()
+        self.assertFalse(self.spool.retry.called)
+        self.spool.complete.assert_called_with([1])
+        counters = pad.stats.get_collector().counters
+        self.assertEqual(counters[("report_jobs_total",
+                                   (("action", "report"),
+                                    ("result", "failed")))], 1)
+
+    def test_dispatch_inhibit(self):
+        pyzor = self.add_plugin("PyzorPlugin")
+        razor = self.add_plugin("Razor2Plugin")
+        pyzor.plugin_report.side_effect = pad.errors.InhibitCallbacks()
+        self.spool.claim.return_value = [self.get_job(1)]
+        self.dispatcher.dispatch_batch()
+        self.assertFalse(razor.plugin_report.called)
+        self.spool.complete.assert_called_with([1])
+
+    def test_dispatch_invalid_message(self):
+        pyzor = self.add_plugin("PyzorPlugin")
+        self.mock_msg.side_effect = ValueError()
+        self.spool.claim.return_value = [self.get_job(1)]
+        self.dispatcher.dispatch_batch()
+        self.assertFalse(pyzor.plugin_report.called)
+        self.spool.complete.assert_called_with([1])
+
+    def test_dispatch_stats(self):
+        self.add_plugin("PyzorPlugin")
+        self.spool.__len__.return_value = 7
+        self.spool.claim.return_value = [self.get_job(1)]
+        self.dispatcher.dispatch_batch()
+        collector = pad.stats.get_collector()
+        self.assertEqual(collector.gauges[("report_queue_depth",
+                                           (("pid", os.getpid()),))], 7)
+        histogram = collector.histograms[("report_queue_latency_seconds",
+                                          (("action", "report"),))]
+        self.assertEqual(histogram["sum"], 10)
+
+    def test_on_batch(self):
+        self.dispatcher.on_batch = Mock()
+        self.spool.claim.return_value = []
+        self.dispatcher.dispatch_batch()
+        self.assertFalse(self.dispatcher.on_batch.called)
+        self.spool.claim.return_value = [self.get_job(1)]
+        self.dispatcher.dispatch_batch()
+        self.dispatcher.on_batch.assert_called_with()
+
+    def test_run(self):
+        self.spool.claim.return_value = []
+        self.dispatcher.interval = 0.01
+        self.dispatcher.start()
+        self.dispatcher.stop(1)
+        self.assertFalse(self.dispatcher.is_alive())
+        self.assertTrue(self.spool.claim.called)
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestReportSpool, "test"))
+    test_suite.addTest(unittest.makeSuite(TestReportDispatcher, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
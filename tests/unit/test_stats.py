@@ -0,0 +1,261 @@
+"""Tests for pad.stats"""
+
+import os
+import unittest
+import threading
+
+try:
+    from unittest.mock import patch, Mock
+except ImportError:
+    from mock import patch, Mock
+
+import pad.stats
+
+
+class TestCollector(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.collector = pad.stats.Collector()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_incr(self):
+        self.collector.incr("requests", command="CHECK")
+        self.collector.incr("requests", 2, command="CHECK")
+        self.assertEqual(self.collector.snapshot()["counters"],
+                         [["requests", {"command": "CHECK"}, 3]])
+
+    def test_set(self):
+        self.collector.set("rss", 10)
+        self.collector.set("rss", 20)
+        self.assertEqual(self.collector.snapshot()["gauges"],
+                         [["rss", {}, 20]])
+
+    def test_observe(self):
+        self.collector.observe("size", 5, buckets=(1, 10, 100))
+        self.collector.observe("size", 50, buckets=(1, 10, 100))
+        name, labels, histogram = self.collector.snapshot()["histograms"][0]
+        self.assertEqual(histogram["counts"], [0, 1, 2])
+        self.assertEqual(histogram["count"], 2)
+        self.assertEqual(histogram["sum"], 55)
+
+    def test_timer(self):
+        with self.collector.timer("match"):
+            pass
+        name, labels, histogram = self.collector.snapshot()["histograms"][0]
+        self.assertEqual(name, "match")
+        self.assertEqual(histogram["count"], 1)
+
+    def test_clear(self):
+        self.collector.incr("requests")
+        self.collector.clear()
+        self.assertEqual(self.collector.snapshot()["counters"], [])
+
+    def test_clear_keep_gauges(self):
+        self.collector.incr("requests")
+        self.collector.set("patterns", 10)
+        self.collector.observe("size", 5, buckets=(1, 10))
+        self.collector.clear(gauges=False)
+        snapshot = self.collector.snapshot()
+        self.assertEqual(snapshot["counters"], [])
+        self.assertEqual(snapshot["histograms"], [])
+        self.assertEqual(snapshot["gauges"], [["patterns", {}, 10]])
+
+    def test_snapshot_copy(self):
+        self.collector.observe("size", 5, buckets=(1, 10))
+        snapshot = self.collector.snapshot()
+        self.collector.observe("size", 5, buckets=(1, 10))
+        histogram = snapshot["histograms"][0][2]
+        self.assertEqual(histogram["counts"], [0, 1])
+        self.assertEqual(histogram["count"], 1)
+
+    def test_threads(self):
+        def worker():
+            for dummy in range(1000):
+                self.collector.incr("requests")
+                self.collector.observe("size", 5, buckets=(1, 10))
+        threads = [threading.Thread(target=worker) for dummy in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        snapshot = self.collector.snapshot()
+        self.assertEqual(snapshot["counters"], [["requests", {}, 4000]])
+        self.assertEqual(snapshot["histograms"][0][2]["count"], 4000)
+
+
+class TestMerge(unittest.TestCase):
+    def test_merge(self):
+        first = pad.stats.Collector()
+        first.incr("requests", command="CHECK")
+        first.set("rss", 10, pid=1)
+        first.observe("size", 5, buckets=(1, 10))
+        second = pad.stats.Collector()
+        second.incr("requests", command="CHECK")
+        second.set("rss", 20, pid=2)
+        second.observe("size", 0.5, buckets=(1, 10))
+
+        result = pad.stats.merge([first.snapshot(), second.snapshot()])
+        self.assertEqual(result["counters"],
+                         [["requests", {"command": "CHECK"}, 2]])
+        self.assertEqual(sorted(value for _, _, value in result["gauges"]),
+                         [10, 20])
+        histogram = result["histograms"][0][2]
+        self.assertEqual(histogram["counts"], [1, 2])
+        self.assertEqual(histogram["count"], 2)
+
+    def test_merge_gauges(self):
+        first = pad.stats.Collector()
+        first.set("patterns", 10)
+        second = pad.stats.Collector()
+        second.set("patterns", 12)
+        merged = pad.stats.merge([first.snapshot(), second.snapshot(),
+                                  first.snapshot()])
+        self.assertEqual(merged["gauges"], [["patterns", {}, 12]])
+
+
+class TestFormatPrometheus(unittest.TestCase):
+    def test_format(self):
+        collector = pad.stats.Collector()
+        collector.incr("requests_total", command="CHECK")
+        collector.observe("message_size_bytes", 5, buckets=(1, 10))
+        result = pad.stats.format_prometheus(collector.snapshot())
+        self.assertEqual(result.splitlines(), [
+            "# TYPE pad_message_size_bytes histogram",
+            'pad_message_size_bytes_bucket{le="1"} 0',
+            'pad_message_size_bytes_bucket{le="10"} 1',
+            'pad_message_size_bytes_bucket{le="+Inf"} 1',
+            "pad_message_size_bytes_sum 5.0",
+            "pad_message_size_bytes_count 1",
+            "# TYPE pad_requests_total counter",
+            'pad_requests_total{command="CHECK"} 1',
+        ])
+
+    def test_format_escape(self):
+        collector = pad.stats.Collector()
+        collector.incr("rule_hits_total", rule='A"B')
+        result = pad.stats.format_prometheus(collector.snapshot())
+        self.assertIn('pad_rule_hits_total{rule="A\\"B"} 1', result)
+
+
+class TestSharedStats(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        self.shared = pad.stats.SharedStats(2, slot_size=4096)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        patch.stopall()
+
+    def test_publish_collect(self):
+        collector = pad.stats.Collector()
+        collector.incr("requests")
+        self.assertTrue(self.shared.publish(collector))
+        self.assertEqual(self.shared.collect()["counters"],
+                         [["requests", {}, 1]])
+
+    def test_publish_same_slot(self):
+        collector = pad.stats.Collector()
+        collector.incr("requests")
+        self.shared.publish(collector)
+        self.shared.publish(collector)
+        self.assertEqual(self.shared.collect()["counters"],
+                         [["requests", {}, 1]])
+
+    def test_publish_too_large(self):
+        collector = pad.stats.Collector()
+        for i in range(1000):
+            collector.incr("rule_hits_total", rule="RULE_%s" % i)
+        self.assertFalse(self.shared.publish(collector))
+
+    def test_publish_across_fork(self):
+        collector = pad.stats.Collector()
+        collector.incr("requests")
+        pid = os.fork()
+        if not pid:
+            self.shared.publish(collector)
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.shared.publish(collector)
+        self.assertEqual(self.shared.collect()["counters"],
+                         [["requests", {}, 2]])
+
+    def test_no_free_slot(self):
+        collector = pad.stats.Collector()
+        patch("pad.stats.os.kill").start()
+        self.shared.publish(collector)
+        self.shared._slot = None
+        with patch("pad.stats.os.getpid", return_value=1):
+            self.shared.publish(collector)
+        with patch("pad.stats.os.getpid", return_value=2):
+            self.assertFalse(self.shared.publish(collector))
+
+
+class TestServerStats(unittest.TestCase):
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        pad.stats.get_collector().clear()
+        self.stats = pad.stats.ServerStats(1)
+        self.command = Mock(timings={"read": 0.1}, message_size=100,
+                            is_spam=True)
+        self.command.msg.rules_checked = {"TEST_RULE": True,
+                                          "OTHER_RULE": False}
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        pad.stats.get_collector().clear()
+        patch.stopall()
+
+    def get_counters(self):
+        return dict(((name, tuple(sorted(labels.items()))), value)
+                    for name, labels, value
+                    in self.stats.collect()["counters"])
+
+    def test_record_request(self):
+        self.stats.record_request("CHECK", self.command)
+        counters = self.get_counters()
+        self.assertEqual(counters[("requests_total",
+                                   (("command", "CHECK"),))], 1)
+        self.assertEqual(counters[("messages_total",
+                                   (("result", "spam"),))], 1)
+        self.assertEqual(counters[("rule_hits_total",
+                                   (("rule", "TEST_RULE"),))], 1)
+        self.assertNotIn(("rule_hits_total", (("rule", "OTHER_RULE"),)),
+                         counters)
+
+    def test_record_request_no_message(self):
+        self.command.is_spam = None
+        self.command.message_size = None
+        self.stats.record_request("PING", self.command)
+        counters = self.get_counters()
+        self.assertEqual(list(counters),
+                         [("requests_total", (("command", "PING"),))])
+
+    def test_rss(self):
+        gauges = self.stats.collect()["gauges"]
+        self.assertEqual(gauges[0][0], "worker_rss_bytes")
+        self.assertEqual(gauges[0][1], {"pid": os.getpid()})
+
+    def test_write_file(self):
+        self.stats.stats_file = "/tmp/pad-test-stats.prom"
+        self.addCleanup(os.remove, self.stats.stats_file)
+        self.stats.record_request("CHECK", self.command)
+        with open(self.stats.stats_file) as stats_file:
+            self.assertIn('pad_requests_total{command="CHECK"} 1',
+                          stats_file.read())
+
+
+def suite():
+    """Gather all the tests from this package in a test suite."""
+    test_suite = unittest.TestSuite()
+    test_suite.addTest(unittest.makeSuite(TestCollector, "test"))
+    test_suite.addTest(unittest.makeSuite(TestMerge, "test"))
+    test_suite.addTest(unittest.makeSuite(TestFormatPrometheus, "test"))
+    test_suite.addTest(unittest.makeSuite(TestSharedStats, "test"))
+    test_suite.addTest(unittest.makeSuite(TestServerStats, "test"))
+    return test_suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')